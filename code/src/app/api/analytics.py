@@ -1,25 +1,181 @@
-from fastapi import APIRouter, HTTPException
-from typing import List
+from fastapi import APIRouter, HTTPException, Query, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import Any, Dict, List, Literal, Optional, Tuple
 from ..schemas.analytics import Analytics, analytics_collection
 from ..schemas.analytics import DuplicateAnalytics, duplicate_analytics_collection
+from ..schemas.analytics import AnalyticsSummary, stored_timestamp
+from ..services.analytics_rollups import analytics_rollups
+from bson import ObjectId
+from bson.errors import InvalidId
+from datetime import datetime
+import base64
+import json
 import pymongo
 
 router = APIRouter()
 
-@router.get("/analytics", response_model=List[Analytics])
-async def get_all_analytics():
-    analytics = []
-    async for analytic in analytics_collection.find().sort('timestamp', pymongo.DESCENDING):
-        analytics.append(Analytics(**analytic))
-    if not analytics:
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+# Fields that may be requested with `fields`; the defaults are the response models' fields
+ANALYTICS_FIELDS = set(Analytics.model_fields)
+DUPLICATE_ANALYTICS_FIELDS = set(DuplicateAnalytics.model_fields)
+
+
+def _encode_cursor(doc: Dict[str, Any]) -> str:
+    payload = json.dumps({"timestamp": doc.get("timestamp"), "id": str(doc["_id"])})
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> Tuple[Optional[str], Any]:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        doc_id = payload["id"]
+        return payload["timestamp"], ObjectId(doc_id) if ObjectId.is_valid(doc_id) else doc_id
+    except (ValueError, KeyError, TypeError, InvalidId):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _build_query(start: Optional[datetime],
+                 end: Optional[datetime],
+                 cursor: Optional[str] = None,
+                 **equals: Optional[str]) -> Dict[str, Any]:
+    """
+    Build the filter for a time range (timestamps are stored as naive local ISO
+    strings, so the bounds are formatted the same way to compare in time order)
+    and, for later pages, the position after the cursor
+    """
+    query: Dict[str, Any] = {k: v for k, v in equals.items() if v is not None}
+    time_range = {}
+    if start:
+        time_range["$gte"] = stored_timestamp(start)
+    if end:
+        time_range["$lt"] = stored_timestamp(end)
+    if time_range:
+        query["timestamp"] = time_range
+    if cursor:
+        # Newest first, ties on timestamp broken by _id
+        timestamp, doc_id = _decode_cursor(cursor)
+        query["$or"] = [
+            {"timestamp": {"$lt": timestamp}},
+            {"timestamp": timestamp, "_id": {"$lt": doc_id}}
+        ]
+    return query
+
+
+def _build_projection(fields: Optional[str], allowed: set, default: set) -> Dict[str, int]:
+    requested = {f.strip() for f in fields.split(",") if f.strip()} if fields else default
+    unknown = requested - allowed
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    # _id is always read for the cursor and removed from the output
+    return {**{f: 1 for f in requested}, "_id": 1}
+
+
+async def _read_page(collection, query: Dict[str, Any], projection: Dict[str, int], limit: int) -> Tuple[List[dict], Optional[str]]:
+    docs = await collection.find(query, projection).sort(
+        [("timestamp", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)]
+    ).limit(limit + 1).to_list(length=limit + 1)
+    next_cursor = _encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+    docs = docs[:limit]
+    for doc in docs:
+        doc.pop("_id", None)
+    return docs, next_cursor
+
+
+def _page_response(docs: List[dict], next_cursor: Optional[str]) -> Response:
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    return JSONResponse(content=docs, headers=headers)
+
+
+async def _stream_ndjson(collection, query: Dict[str, Any], projection: Dict[str, int]):
+    cursor = collection.find(query, projection).sort(
+        [("timestamp", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)]
+    )
+    async for doc in cursor:
+        doc.pop("_id", None)
+        yield json.dumps(doc, default=str) + "\n"
+
+
+@router.get("/analytics")
+async def get_all_analytics(limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                            cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
+                            start: Optional[datetime] = Query(None, description="Earliest timestamp (inclusive)"),
+                            end: Optional[datetime] = Query(None, description="Latest timestamp (exclusive)"),
+                            request_type: Optional[str] = None,
+                            fields: Optional[str] = Query(None, description="Comma-separated fields to return")):
+    """
+    Get analytics newest first, one page at a time
+
+    Returns a list of analytics records (the `fields` requested, by default all
+    fields of Analytics). When more results exist, the response has an
+    X-Next-Cursor header to pass as `cursor` for the next page.
+    """
+    docs, next_cursor = await _read_page(
+        analytics_collection,
+        _build_query(start, end, cursor, request_type=request_type),
+        _build_projection(fields, ANALYTICS_FIELDS, set(Analytics.model_fields)),
+        limit
+    )
+    if not docs and not cursor:
         raise HTTPException(status_code=404, detail="No analytics found")
-    return analytics
-
-@router.get("/duplicate-analytics", response_model=List[DuplicateAnalytics])
-async def get_all_duplicate_analytics():
-    duplicate_analytics = []
-    async for duplicate_analytic in duplicate_analytics_collection.find():
-        duplicate_analytics.append(DuplicateAnalytics(**duplicate_analytic))
-    if not duplicate_analytics:
+    return _page_response(docs, next_cursor)
+
+@router.get("/analytics/summary", response_model=AnalyticsSummary)
+async def get_analytics_summary(period: Optional[Literal["day", "hour"]] = Query(None, description="Include a timeline with one entry per day or hour"),
+                                start: Optional[datetime] = Query(None, description="First day/hour to include"),
+                                end: Optional[datetime] = Query(None, description="Day/hour to stop before"),
+                                buckets: int = Query(30, ge=1, le=2000, description="Timeline length when no start is given")):
+    """
+    Counts, average confidence, duplicate rate and per-field extraction confidence,
+    overall and by request type, sub-request type and support group
+
+    Served from pre-aggregated rollups, so the cost does not grow with the history.
+    Without start/end the figures cover all time.
+    """
+    return await analytics_rollups.summary(period, start, end, buckets)
+
+@router.get("/analytics/export")
+async def export_analytics(start: Optional[datetime] = Query(None, description="Earliest timestamp (inclusive)"),
+                           end: Optional[datetime] = Query(None, description="Latest timestamp (exclusive)"),
+                           request_type: Optional[str] = None,
+                           fields: Optional[str] = Query(None, description="Comma-separated fields to return")):
+    """Stream matching analytics as newline-delimited JSON, newest first"""
+    return StreamingResponse(
+        _stream_ndjson(
+            analytics_collection,
+            _build_query(start, end, request_type=request_type),
+            _build_projection(fields, ANALYTICS_FIELDS, ANALYTICS_FIELDS)
+        ),
+        media_type="application/x-ndjson"
+    )
+
+@router.get("/duplicate-analytics")
+async def get_all_duplicate_analytics(limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                                      cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
+                                      start: Optional[datetime] = Query(None, description="Earliest timestamp (inclusive)"),
+                                      end: Optional[datetime] = Query(None, description="Latest timestamp (exclusive)")):
+    """
+    Get duplicate analytics newest first, one page at a time (see /analytics)
+    """
+    docs, next_cursor = await _read_page(
+        duplicate_analytics_collection,
+        _build_query(start, end, cursor),
+        _build_projection(None, DUPLICATE_ANALYTICS_FIELDS, DUPLICATE_ANALYTICS_FIELDS),
+        limit
+    )
+    if not docs and not cursor:
         raise HTTPException(status_code=404, detail="No duplicate analytics found")
-    return duplicate_analytics
\ No newline at end of file
+    return _page_response(docs, next_cursor)
+
+@router.get("/duplicate-analytics/export")
+async def export_duplicate_analytics(start: Optional[datetime] = Query(None, description="Earliest timestamp (inclusive)"),
+                                     end: Optional[datetime] = Query(None, description="Latest timestamp (exclusive)")):
+    """Stream matching duplicate analytics as newline-delimited JSON, newest first"""
+    return StreamingResponse(
+        _stream_ndjson(
+            duplicate_analytics_collection,
+            _build_query(start, end),
+            _build_projection(None, DUPLICATE_ANALYTICS_FIELDS, DUPLICATE_ANALYTICS_FIELDS)
+        ),
+        media_type="application/x-ndjson"
+    )
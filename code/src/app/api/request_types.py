@@ -2,12 +2,14 @@ from fastapi import APIRouter, HTTPException, status
 
 from ..models.request_types import RequestTypeModel
 from ..schemas.request_types import RequestType
+from ..services.request_type_catalog import request_type_catalog
 
 router = APIRouter()
 
 @router.post("/request-types", response_model=dict)
 async def create_request_type(request_type: RequestType):
     request_type_id = await RequestTypeModel.create_request_type(request_type.dict())
+    await request_type_catalog.bump_version()
     return {"request_type_id": request_type_id}
 
 @router.get("/request-types/{request_type_id}", response_model=RequestType)
@@ -36,6 +38,7 @@ async def update_request_type(request_type_id: str, update_data: RequestType):
     success = await RequestTypeModel.update_request_type(request_type_id, update_data.dict())
     if not success:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Request type not found")
+    await request_type_catalog.bump_version()
     return {"success": success}
 
 @router.delete("/request-types/{request_type_id}", response_model=dict)
@@ -43,6 +46,7 @@ async def delete_request_type(request_type_id: str):
     success = await RequestTypeModel.delete_request_type(request_type_id)
     if not success:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Request type not found")
+    await request_type_catalog.bump_version()
     return {"success": success}
 
 @router.post("/request-types/{request_type_id}/sub-request-types", response_model=dict)
@@ -50,6 +54,7 @@ async def add_subrequest_type(request_type_id: str, subrequest_type_data: dict):
     success = await RequestTypeModel.add_subrequest_type(request_type_id, subrequest_type_data)
     if not success:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Request type not found")
+    await request_type_catalog.bump_version()
     return {"success": success}
 
 @router.delete("/request-types/{request_type_id}/sub-request-types/{subrequest_type_id}", response_model=dict)
@@ -57,6 +62,7 @@ async def remove_subrequest_type(request_type_id: str, subrequest_type_id: str):
     success = await RequestTypeModel.remove_subrequest_type(request_type_id, subrequest_type_id)
     if not success:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Request type or subrequest type not found")
+    await request_type_catalog.bump_version()
     return {"success": success}
 
 @router.put("/request-types/{request_type_id}/sub-request-types/{subrequest_type_id}", response_model=dict)
@@ -64,5 +70,6 @@ async def update_subrequest_type(request_type_id: str, subrequest_type_id: str,
     success = await RequestTypeModel.update_subrequest_type(request_type_id, subrequest_type_id, update_data)
     if not success:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Request type or subrequest type not found")
+    await request_type_catalog.bump_version()
     return {"success": success}
 
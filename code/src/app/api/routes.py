@@ -1,5 +1,7 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Depends
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Depends, Query
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from typing import List, Optional
+import json
 import logging
 import time
 
@@ -7,6 +9,9 @@ from app.models.response_models import ClassificationResponse
 from app.services.classification_service import ClassificationService
 from app.config import get_settings
 from app.services.IntelligentDuplicateDetector import LRUCache
+from app.services.batch_service import BatchLimitError, expand_uploads, get_batch_processor
+from app.services.job_queue import job_queue, KIND_EML, KIND_EMAIL_CHAIN
+from app.services.warmup import warmup
 
 # Initialize logger
 logger = logging.getLogger(__name__)
@@ -16,20 +21,20 @@ router = APIRouter()
 
 # Get settings
 settings = get_settings()
-lru_cache = LRUCache(capacity=settings.duplicate_cache_size)
+lru_cache = LRUCache(capacity=settings.duplicate_cache_size, embedding_precision=settings.duplicate_embedding_precision)
 
 # Create a function to get a ClassificationService instance
 def get_classification_service():
     # Import dependencies here to avoid circular imports
-    from app.core.llm_handler import LLMHandler
-    from app.core.api_manager import ApiManager
+    from app.core.llm_handler import get_llm_handler
     from app.services.email_processor import EmailProcessor
     from app.services.IntelligentDuplicateDetector import IntelligentDuplicateDetector
     from app.services.data_extractor import DataExtractor
+    from app.services.pre_classifier import get_pre_classifier
+    from app.services.thread_state import thread_state_store
     
     # Create service dependencies
-    api_manager = ApiManager()
-    llm_handler = LLMHandler(api_manager=api_manager)
+    llm_handler = get_llm_handler()
     email_processor = EmailProcessor(max_attachment_size_mb=settings.max_attachment_size_mb)
     
     # Initialize the IntelligentDuplicateDetector with appropriate settings
@@ -51,7 +56,12 @@ def get_classification_service():
         llm_handler=llm_handler,
         email_processor=email_processor,
         duplicate_detector=duplicate_detector,
-        data_extractor=data_extractor
+        data_extractor=data_extractor,
+        pre_classifier=get_pre_classifier(),
+        attachment_concurrency=settings.attachment_parse_concurrency,
+        speculative_classification=settings.speculative_classification,
+        thread_state_store=thread_state_store if settings.thread_incremental else None,
+        thread_min_coverage=settings.thread_min_coverage
     )
 
 
@@ -60,11 +70,45 @@ async def root():
     """Root endpoint to check if API is running"""
     return {"message": "Email Classification API is running", "version": "1.0.0"}
 
+@router.get("/health/live", tags=["Status"])
+async def health_live():
+    """Liveness: the process is up and its event loop is answering"""
+    return {"status": "alive"}
+
+@router.get("/health/ready", tags=["Status"])
+async def health_ready():
+    """Readiness: passes (200) once the startup warm-up has finished, 503 before that and while shutting down"""
+    return JSONResponse(content=warmup.status(), status_code=200 if warmup.ready else 503)
+
+@router.get("/fast-path/stats", tags=["Status"])
+async def fast_path_stats():
+    """Agreement statistics for the local pre-classifier fast path"""
+    from app.services.pre_classifier import get_pre_classifier
+    return get_pre_classifier().get_stats()
+
+@router.get("/llm/stats", tags=["Status"])
+async def llm_stats():
+    """LLM routing latency, circuit breaker state and JSON repair rates per model"""
+    from app.core.llm_handler import get_llm_handler
+    from app.core.json_stream import parse_metrics
+    return {
+        "routing": get_llm_handler().router.get_stats(),
+        "parsing": parse_metrics.get_stats()
+    }
+
+@router.get("/metrics", response_class=PlainTextResponse, tags=["Status"])
+async def prometheus_metrics():
+    """Pipeline stage latency histograms and token/cache counters in Prometheus text format"""
+    from app.core.tracing import metrics
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
 @router.post("/classify-email-chain", response_model=ClassificationResponse, tags=["Classification"])
 async def classify_email_chain(
     email_chain_file: UploadFile = File(...),
     attachments: List[UploadFile] = File(None),
     thread_id: Optional[str] = Form(None),
+    async_mode: bool = Form(False),
+    timings: bool = Query(False),
     classification_service: ClassificationService = Depends(get_classification_service)
 ):
     """
@@ -73,6 +117,8 @@ async def classify_email_chain(
     - **email_chain_file**: PDF file containing the email chain
     - **attachments**: Optional list of file attachments
     - **thread_id**: Optional thread ID for duplicate detection
+    - **async_mode**: Queue the email and return 202 with a job ID instead of waiting for the result
+    - **timings**: Include a per-stage timing breakdown in the response
     """
     try:
         # Read and process the email chain file
@@ -89,13 +135,25 @@ async def classify_email_chain(
                     "content": content
                 })
         
+        if async_mode:
+            job_id = await job_queue.submit(
+                KIND_EMAIL_CHAIN,
+                email_chain_content,
+                filename=email_chain_file.filename,
+                content_type=email_chain_file.content_type,
+                attachments=processed_attachments,
+                thread_id=thread_id
+            )
+            return JSONResponse(status_code=202, content={"job_id": job_id, "status": "queued"})
+        
         # Process the email chain - file size check moved to the service layer
         result = await classification_service.process_email_chain(
             email_chain_file=email_chain_content,
             email_chain_filename=email_chain_file.filename,
             email_chain_content_type=email_chain_file.content_type,
             attachments=processed_attachments,
-            thread_id=thread_id
+            thread_id=thread_id,
+            include_timings=timings
         )
         
         return result
@@ -108,6 +166,8 @@ async def classify_email_chain(
 async def classify_eml(
     eml_file: UploadFile = File(...),
     thread_id: Optional[str] = Form(None),
+    async_mode: bool = Form(False),
+    timings: bool = Query(False),
     classification_service: ClassificationService = Depends(get_classification_service)
 ):
     """
@@ -115,19 +175,123 @@ async def classify_eml(
     
     - **eml_file**: EML file containing the email with attachments
     - **thread_id**: Optional thread ID for duplicate detection
+    - **async_mode**: Queue the email and return 202 with a job ID instead of waiting for the result
+    - **timings**: Include a per-stage timing breakdown in the response
     """
     try:
         # Read and process the EML file
         eml_content = await eml_file.read()
         
+        if async_mode:
+            job_id = await job_queue.submit(
+                KIND_EML,
+                eml_content,
+                filename=eml_file.filename,
+                content_type=eml_file.content_type,
+                thread_id=thread_id
+            )
+            return JSONResponse(status_code=202, content={"job_id": job_id, "status": "queued"})
+        
         # Process the EML file - file size check moved to the service layer
         result = await classification_service.process_eml(
             eml_content=eml_content,
-            thread_id=thread_id
+            thread_id=thread_id,
+            include_timings=timings
         )
         
         return result
         
     except Exception as e:
         logger.error(f"Error processing EML: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/classify-batch", status_code=202, tags=["Classification"])
+async def classify_batch(
+    files: List[UploadFile] = File(...),
+    thread_id: Optional[str] = Form(None),
+    classification_service: ClassificationService = Depends(get_classification_service)
+):
+    """
+    Submit a batch of emails for classification, e.g. for a mailbox backfill.
+    
+    - **files**: EML and/or PDF email chain files, or zip archives containing them
+    - **thread_id**: Optional thread ID applied to every email for duplicate detection
+    
+    Returns a job ID; stream per-email results from `/classify-batch/{job_id}/results`.
+    """
+    try:
+        uploads = [(f.filename, f.content_type, await f.read()) for f in files]
+        items = expand_uploads(
+            uploads,
+            max_files=settings.batch_max_files,
+            max_file_bytes=settings.batch_max_file_mb * 1024 * 1024,
+            max_total_bytes=settings.batch_max_total_mb * 1024 * 1024,
+            max_compression_ratio=settings.batch_max_compression_ratio
+        )
+    except BatchLimitError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error reading batch upload: {str(e)}")
+        raise HTTPException(status_code=400, detail=f"Could not read batch upload: {str(e)}")
+    
+    if not items:
+        raise HTTPException(status_code=400, detail="No EML or PDF files found in upload")
+    
+    job = get_batch_processor().submit(items, classification_service, thread_id=thread_id)
+    return JSONResponse(status_code=202, content=job.get_status())
+
+@router.get("/classify-batch/{job_id}", tags=["Classification"])
+async def get_batch_status(job_id: str):
+    """Progress of a batch classification job"""
+    job = get_batch_processor().get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    return job.get_status()
+
+@router.get("/classify-batch/{job_id}/results", tags=["Classification"])
+async def stream_batch_results(
+    job_id: str,
+    format: str = Query("ndjson", pattern="^(ndjson|sse)$")
+):
+    """
+    Stream per-email results of a batch job as they finish.
+    
+    - **format**: `ndjson` (one JSON object per line) or `sse` (server-sent events,
+      one `result` event per email followed by a `done` event)
+    """
+    job = get_batch_processor().get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    
+    async def ndjson():
+        async for item in job.stream_results():
+            yield json.dumps(item.to_dict(job.job_id), default=str) + "\n"
+    
+    async def sse():
+        async for item in job.stream_results():
+            yield f"event: result\ndata: {json.dumps(item.to_dict(job.job_id), default=str)}\n\n"
+        yield f"event: done\ndata: {json.dumps(job.get_status())}\n\n"
+    
+    if format == "sse":
+        return StreamingResponse(sse(), media_type="text/event-stream")
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+
+@router.get("/jobs/{job_id}", tags=["Classification"])
+async def get_job(
+    job_id: str,
+    wait: float = Query(0, ge=0, description="Seconds to long-poll for the job to finish")
+):
+    """
+    Status and, once finished, the `ClassificationResponse` of a job submitted with `async_mode`.
+    
+    - **wait**: Hold the request open until the job finishes or this many seconds pass
+      (capped by `job_max_wait_seconds`)
+    """
+    if wait > 0:
+        job = await job_queue.wait_for_job(job_id, min(wait, settings.job_max_wait_seconds))
+    else:
+        job = await job_queue.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JSONResponse(content=json.loads(json.dumps(job, default=str)))
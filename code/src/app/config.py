@@ -18,10 +18,16 @@ class Settings(BaseSettings):
     # Server settings
     port: int = Field(default=8000, env="PORT")
     log_level: str = Field(default="INFO", env="LOG_LEVEL")
+    # Per-module overrides, e.g. "app.services.IntelligentDuplicateDetector=DEBUG,httpx=WARNING"
+    log_levels: str = Field(default="", env="LOG_LEVELS")
+    # "text" or "json"
+    log_format: str = Field(default="text", env="LOG_FORMAT")
     
     # Application settings
     duplicate_cache_days: int = Field(default=14, env="DUPLICATE_CACHE_DAYS")
     duplicate_cache_size: int = Field(default=10000, env="DUPLICATE_CACHE_SIZE")
+    # Storage of cached embeddings: "float32", "float16" or "int8" (with a scale per vector)
+    duplicate_embedding_precision: str = Field(default="float16", env="DUPLICATE_EMBEDDING_PRECISION")
     max_attachment_size_mb: int = Field(default=10, env="MAX_ATTACHMENT_SIZE_MB")
     
     # IntelligentDuplicateDetector settings
@@ -33,6 +39,71 @@ class Settings(BaseSettings):
     
     # Optional settings for embedding provider if using SentenceTransformers
     embedding_model: str = Field(default="all-MiniLM-L6-v2", env="EMBEDDING_MODEL")
+    # "torch", "torch-int8", "onnx" or "onnx-int8" (onnx backends need sentence-transformers[onnx])
+    embedding_backend: str = Field(default="torch", env="EMBEDDING_BACKEND")
+    # Quantized export in the model repository used by the onnx-int8 backend
+    embedding_onnx_file: str = Field(default="onnx/model_quint8_avx2.onnx", env="EMBEDDING_ONNX_FILE")
+    # Which part of long texts is embedded: "head", "head_tail" or "chunks" (pooled with "mean" or "max")
+    embedding_strategy: str = Field(default="head", env="EMBEDDING_STRATEGY")
+    embedding_max_tokens: int = Field(default=256, env="EMBEDDING_MAX_TOKENS")
+    embedding_head_share: float = Field(default=0.5, env="EMBEDDING_HEAD_SHARE")
+    embedding_max_chunks: int = Field(default=8, env="EMBEDDING_MAX_CHUNKS")
+    embedding_chunk_pooling: str = Field(default="mean", env="EMBEDDING_CHUNK_POOLING")
+    
+    # Seconds between request type catalog version checks when change streams are unavailable
+    catalog_poll_seconds: float = Field(default=5.0, env="CATALOG_POLL_SECONDS")
+    
+    # Local pre-classifier fast path ("off", "shadow" or "enforce"); shadow and enforce store email excerpts
+    fast_path_mode: str = Field(default="off", env="FAST_PATH_MODE")
+    fast_path_threshold: float = Field(default=0.9, env="FAST_PATH_THRESHOLD")
+    fast_path_refresh_minutes: int = Field(default=60, env="FAST_PATH_REFRESH_MINUTES")
+    # Days the LLM-labelled training examples of the fast path are kept
+    fast_path_training_retention_days: int = Field(default=30, env="FAST_PATH_TRAINING_RETENTION_DAYS")
+    
+    # Batch classification pipeline
+    batch_parse_concurrency: int = Field(default=4, env="BATCH_PARSE_CONCURRENCY")
+    batch_llm_concurrency: int = Field(default=4, env="BATCH_LLM_CONCURRENCY")
+    batch_embedding_batch_size: int = Field(default=32, env="BATCH_EMBEDDING_BATCH_SIZE")
+    batch_max_files: int = Field(default=1000, env="BATCH_MAX_FILES")
+    # Zip bomb guards: decompressed size per archive member and per batch, and member compression ratio
+    batch_max_file_mb: int = Field(default=25, env="BATCH_MAX_FILE_MB")
+    batch_max_total_mb: int = Field(default=500, env="BATCH_MAX_TOTAL_MB")
+    batch_max_compression_ratio: int = Field(default=100, env="BATCH_MAX_COMPRESSION_RATIO")
+    batch_job_retention_minutes: int = Field(default=60, env="BATCH_JOB_RETENTION_MINUTES")
+    
+    # Per-email pipeline: attachments extracted concurrently, analytics written in the background
+    attachment_parse_concurrency: int = Field(default=4, env="ATTACHMENT_PARSE_CONCURRENCY")
+    analytics_queue_size: int = Field(default=10000, env="ANALYTICS_QUEUE_SIZE")
+    analytics_batch_size: int = Field(default=100, env="ANALYTICS_BATCH_SIZE")
+    analytics_flush_seconds: float = Field(default=1.0, env="ANALYTICS_FLUSH_SECONDS")
+    analytics_submit_timeout_seconds: float = Field(default=5.0, env="ANALYTICS_SUBMIT_TIMEOUT_SECONDS")
+    # Analytics that could not be written to MongoDB are kept here until they can be ("" to drop them)
+    analytics_spill_path: str = Field(default="analytics_spill.ndjson", env="ANALYTICS_SPILL_PATH")
+    # Start request type classification while the duplicate check runs, cancelling it for duplicates
+    speculative_classification: bool = Field(default=False, env="SPECULATIVE_CLASSIFICATION")
+    # Classify only the new message of replies to threads already classified
+    thread_incremental: bool = Field(default=True, env="THREAD_INCREMENTAL")
+    thread_min_coverage: float = Field(default=0.8, env="THREAD_MIN_COVERAGE")
+    thread_state_ttl_days: int = Field(default=30, env="THREAD_STATE_TTL_DAYS")
+    
+    # Asynchronous job queue
+    job_workers: int = Field(default=2, env="JOB_WORKERS")
+    job_lease_seconds: int = Field(default=300, env="JOB_LEASE_SECONDS")
+    job_max_attempts: int = Field(default=3, env="JOB_MAX_ATTEMPTS")
+    job_poll_seconds: float = Field(default=2.0, env="JOB_POLL_SECONDS")
+    job_retention_days: int = Field(default=7, env="JOB_RETENTION_DAYS")
+    job_max_wait_seconds: int = Field(default=60, env="JOB_MAX_WAIT_SECONDS")
+    
+    # Startup warm-up; /health/ready passes once it has finished
+    warmup_enabled: bool = Field(default=True, env="WARMUP_ENABLED")
+    warmup_embeddings: bool = Field(default=True, env="WARMUP_EMBEDDINGS")
+    warmup_ocr: bool = Field(default=False, env="WARMUP_OCR")
+    
+    # Worker processes started by `python -m app.main`, and how they share the models:
+    # "prefork" (loaded once before forking), "sidecar" (one model process over a Unix socket) or "none"
+    workers: int = Field(default=1, env="WORKERS")
+    model_sharing: str = Field(default="prefork", env="MODEL_SHARING")
+    model_sidecar_socket: str = Field(default="/tmp/email-models.sock", env="MODEL_SIDECAR_SOCKET")
     
     class Config:
         env_file = ".env"
@@ -0,0 +1,318 @@
+import json
+import logging
+import re
+import time
+from collections import defaultdict
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_CODE_FENCE = re.compile(r"```(?:json|JSON)?\s*(.*?)```", re.DOTALL)
+_TRAILING_COMMA = re.compile(r",\s*([\]}])")
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+
+class IncrementalJsonArrayParser:
+    """
+    Incrementally parses a streamed top-level JSON array and returns each element
+    as soon as it is complete.
+
+    Leading prose or code fences before the first "[" are skipped, and each element
+    is parsed on its own, so a trailing comma or junk after the last element does
+    not lose the elements already seen. `parsed_indices` holds the array position
+    of each element returned, so a later repair of the whole text can tell which
+    elements were already seen. Elements that cannot be repaired on their own are
+    skipped and counted in `items_skipped`.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.started = False
+        self.finished = False
+        self.element_start: Optional[int] = None
+        # Position in the array of the element being read (top-level commas so far)
+        self.element_index = 0
+        self.parsed_indices: List[int] = []
+        self.items_parsed = 0
+        self.items_repaired = 0
+        self.items_skipped = 0
+
+    def feed(self, chunk: str) -> List[Any]:
+        """
+        Feed the next chunk of text
+
+        Returns:
+            Elements completed by this chunk
+        """
+        items = []
+        self.buffer += chunk
+
+        while self.pos < len(self.buffer) and not self.finished:
+            ch = self.buffer[self.pos]
+
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+            elif not self.started:
+                if ch == "[":
+                    self.started = True
+                    self.depth = 1
+            elif ch == '"':
+                self.in_string = True
+            elif ch == "," and self.depth == 1:
+                self.element_index += 1
+            elif ch in "{[":
+                if self.depth == 1:
+                    self.element_start = self.pos
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 1 and self.element_start is not None:
+                    item = self._parse_element(self.buffer[self.element_start:self.pos + 1])
+                    if item is not None:
+                        items.append(item)
+                    self.element_start = None
+                elif self.depth == 0:
+                    self.finished = True
+
+            self.pos += 1
+
+        return items
+
+    def _parse_element(self, text: str) -> Optional[Any]:
+        try:
+            item = json.loads(text)
+        except json.JSONDecodeError:
+            try:
+                item = repair_json(text)
+                self.items_repaired += 1
+            except ValueError:
+                logger.warning(f"Skipping unparseable array element: {text[:200]}")
+                self.items_skipped += 1
+                return None
+        self.items_parsed += 1
+        self.parsed_indices.append(self.element_index)
+        return item
+
+
+def _replace_python_literals(text: str) -> str:
+    """Replace True/False/None outside of strings"""
+    out = []
+    in_string = False
+    escaped = False
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            out.append(ch)
+            i += 1
+            continue
+        if ch == '"':
+            in_string = True
+            out.append(ch)
+            i += 1
+            continue
+        for literal, replacement in _PY_LITERALS.items():
+            if text.startswith(literal, i) and not (i > 0 and (text[i - 1].isalnum() or text[i - 1] == "_")):
+                out.append(replacement)
+                i += len(literal)
+                break
+        else:
+            out.append(ch)
+            i += 1
+    return "".join(out)
+
+
+def _close_truncated(text: str) -> str:
+    """Close any brackets left open by a truncated completion"""
+    stack = []
+    in_string = False
+    escaped = False
+    for ch in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]" and stack:
+            stack.pop()
+    if in_string:
+        text += '"'
+    return text.rstrip().rstrip(",") + "".join(reversed(stack))
+
+
+def repair_json(text: str) -> Any:
+    """
+    Tolerantly parse JSON produced by an LLM without another LLM round trip.
+
+    Strips code fences and surrounding prose, removes trailing commas, converts
+    Python literals and closes brackets left open by truncation.
+
+    Raises:
+        ValueError: If the text cannot be repaired
+    """
+    if not text or not text.strip():
+        raise ValueError("Empty response")
+
+    candidate = text.strip()
+    fenced = _CODE_FENCE.search(candidate)
+    if fenced:
+        candidate = fenced.group(1).strip()
+
+    # Drop prose around the JSON payload
+    starts = [i for i in (candidate.find("["), candidate.find("{")) if i >= 0]
+    if not starts:
+        raise ValueError("No JSON payload found")
+    start = min(starts)
+    end = max(candidate.rfind("]"), candidate.rfind("}"))
+    candidate = candidate[start:end + 1] if end > start else candidate[start:]
+
+    attempts = []
+    cleaned = _TRAILING_COMMA.sub(r"\1", _replace_python_literals(candidate))
+    attempts.append(cleaned)
+    attempts.append(_TRAILING_COMMA.sub(r"\1", _close_truncated(cleaned)))
+
+    for attempt in attempts:
+        try:
+            return json.loads(attempt)
+        except json.JSONDecodeError:
+            continue
+    raise ValueError("Could not repair JSON")
+
+
+class ParseMetrics:
+    """
+    Per-model counters for how LLM JSON output was recovered, and the extra
+    latency spent on repairs
+    """
+    OUTCOMES = ("clean", "local_repair", "llm_repair", "failed")
+
+    def __init__(self):
+        self.counts: Dict[str, Dict[str, int]] = defaultdict(lambda: {o: 0 for o in self.OUTCOMES})
+        self.extra_latency_ms: Dict[str, float] = defaultdict(float)
+
+    def record(self, model: str, outcome: str, extra_latency_ms: float = 0.0) -> None:
+        self.counts[model][outcome] += 1
+        self.extra_latency_ms[model] += extra_latency_ms
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = {}
+        for model, counts in self.counts.items():
+            total = sum(counts.values())
+            repaired = counts["local_repair"] + counts["llm_repair"]
+            stats[model] = {
+                **counts,
+                "total": total,
+                "repair_rate": repaired / total if total else 0.0,
+                "extra_latency_ms": self.extra_latency_ms[model],
+                "avg_extra_latency_ms": self.extra_latency_ms[model] / repaired if repaired else 0.0
+            }
+        return stats
+
+
+parse_metrics = ParseMetrics()
+
+
+async def stream_json_array(llm_handler, task_type: str, messages: List[Any]) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Stream a completion for a task and yield JSON array elements as they complete.
+
+    If the streamed text does not contain a parseable array, or an element of it
+    could not be parsed, fall back to local repair of the full text, and only then
+    to a corrective LLM call.
+
+    Args:
+        llm_handler: LLMHandler used to stream and, as a last resort, fix the output
+        task_type: Task type to route
+        messages: LangChain messages to send
+
+    Yields:
+        Parsed array elements (dicts)
+    """
+    parser = IncrementalJsonArrayParser()
+    stream = llm_handler.astream(task_type, messages)
+    # Array positions and values of the elements already yielded
+    yielded_indices = set()
+    yielded_items = []
+
+    async for chunk in stream:
+        items = parser.feed(chunk)
+        for index, item in zip(parser.parsed_indices[len(parser.parsed_indices) - len(items):], items):
+            if isinstance(item, dict):
+                yielded_indices.add(index)
+                yielded_items.append(item)
+                yield item
+
+    model = stream.model or task_type
+    if parser.finished and not parser.items_skipped:
+        parse_metrics.record(model, "local_repair" if parser.items_repaired else "clean")
+        return
+
+    # Streamed text was not a clean array, or lost an element: try a local repair of the full text
+    full_text = parser.buffer
+    repair_start = time.perf_counter()
+    try:
+        repaired = repair_json(full_text)
+        outcome = "local_repair"
+    except ValueError as e:
+        logger.error(f"Error parsing LLM response: {str(e)}")
+        logger.debug(f"Raw response: {full_text}")
+        if not full_text.strip():
+            parse_metrics.record(model, "failed")
+            return
+
+        # Last resort: corrective LLM call
+        from langchain.output_parsers import OutputFixingParser
+        from langchain_core.output_parsers import JsonOutputParser
+
+        fixing_parser = OutputFixingParser.from_llm(
+            llm=llm_handler.get_llm(task_type),
+            parser=JsonOutputParser()
+        )
+        try:
+            repaired = await fixing_parser.aparse(full_text)
+            outcome = "llm_repair"
+        except Exception as e2:
+            logger.error(f"Error fixing JSON: {str(e2)}")
+            parse_metrics.record(model, "failed", (time.perf_counter() - repair_start) * 1000)
+            return
+
+    parse_metrics.record(model, outcome, (time.perf_counter() - repair_start) * 1000)
+
+    if isinstance(repaired, dict):
+        repaired = [repaired]
+    if not isinstance(repaired, list):
+        logger.error(f"Fixed JSON is not a list: {repaired}")
+        return
+
+    # Skip elements the incremental parser already yielded. A local repair keeps the
+    # array's positions; the corrective LLM call may not, so its elements are matched by value
+    for index, item in enumerate(repaired):
+        if not isinstance(item, dict):
+            continue
+        if outcome == "local_repair" and index in yielded_indices:
+            continue
+        if outcome == "llm_repair" and item in yielded_items:
+            yielded_items.remove(item)
+            continue
+        yield item
@@ -1,54 +1,80 @@
 import json
 import os
 import logging
-from typing import Dict, Optional
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Type
 
-from langchain.callbacks.manager import CallbackManager
-from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
-
-# Import LLM providers
-from langchain_anthropic import ChatAnthropic
-from langchain_openai import ChatOpenAI
-from langchain_community.chat_models.openai import ChatOpenAI as BaseChatOpenAI
+from pydantic import BaseModel
 
 from app.core.api_manager import ApiManager
+from app.core.json_stream import repair_json
+from app.core.llm_router import OUTPUT_ERRORS, LLMRouter, StructuredOutputError
 
 logger = logging.getLogger(__name__)
 
-class OpenRouterLLM(BaseChatOpenAI):
-    """
-    Custom LLM class for OpenRouter integration (DeepSeek R1, etc).
-    """
-    openrouter_headers: Optional[Dict[str, str]] = None
-    
-    def __init__(
-        self,
-        model_name: str = "google/gemma-2-9b-it:free",  # Changed from model to model_name
-        openai_api_key: str = None,
-        temperature: float = 0.7,
-        openrouter_headers: Optional[Dict[str, str]] = None,
-        callbacks = None,
-        **kwargs
-    ):
-        # We need to set model_name as self.model before calling super().__init__
-        # to ensure it's available during initialization
-        super().__init__(
-            model_name=model_name,  # Pass model_name instead of model
-            openai_api_key=openai_api_key,
-            openai_api_base="https://openrouter.ai/api/v1",
-            temperature=temperature,
-            callbacks=callbacks,
-            **kwargs
-        )
-        # Set openrouter_headers after super().__init__
-        self.openrouter_headers = openrouter_headers or {}
+# Provider-native structured output methods, in llm-config.json "capabilities"
+# or a per-entry "structured_output" override
+STRUCTURED_OUTPUT_METHODS = ("json_schema", "json_mode", "tool_calling")
+
+
+# Provider packages are imported when an LLM of that class is first built, so
+# starting the app does not pay for SDKs that the configuration never uses
+
+@lru_cache()
+def _chat_anthropic_class():
+    from langchain_anthropic import ChatAnthropic
+    return ChatAnthropic
+
+
+@lru_cache()
+def _chat_openai_class():
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI
+
+
+@lru_cache()
+def _openrouter_llm_class():
+    """Define OpenRouterLLM, whose base class lives in langchain_community"""
+    from langchain_community.chat_models.openai import ChatOpenAI as BaseChatOpenAI
+
+    class OpenRouterLLM(BaseChatOpenAI):
+        """
+        Custom LLM class for OpenRouter integration (DeepSeek R1, etc).
+        """
+        openrouter_headers: Optional[Dict[str, str]] = None
         
-    def _create_params(self, **kwargs):
-        params = super()._create_params(**kwargs)
-        if self.openrouter_headers:
-            # Add OpenRouter specific headers
-            params["extra_headers"] = self.openrouter_headers
-        return params
+        def __init__(
+            self,
+            model_name: str = "google/gemma-2-9b-it:free",  # Changed from model to model_name
+            openai_api_key: str = None,
+            temperature: float = 0.7,
+            openrouter_headers: Optional[Dict[str, str]] = None,
+            callbacks = None,
+            openai_api_base: str = "https://openrouter.ai/api/v1",
+            **kwargs
+        ):
+            # We need to set model_name as self.model before calling super().__init__
+            # to ensure it's available during initialization
+            super().__init__(
+                model_name=model_name,  # Pass model_name instead of model
+                openai_api_key=openai_api_key,
+                openai_api_base=openai_api_base,
+                temperature=temperature,
+                callbacks=callbacks,
+                **kwargs
+            )
+            # Set openrouter_headers after super().__init__
+            self.openrouter_headers = openrouter_headers or {}
+            
+        def _create_params(self, **kwargs):
+            params = super()._create_params(**kwargs)
+            if self.openrouter_headers:
+                # Add OpenRouter specific headers
+                params["extra_headers"] = self.openrouter_headers
+            return params
+
+    return OpenRouterLLM
+
 
 class LLMHandler:
     """
@@ -77,12 +103,15 @@ class LLMHandler:
             logger.error(f"Error loading LLM configuration: {str(e)}")
             self.llm_config = {}
         
-        # Map LLM class names to actual classes
+        # Map LLM class names to functions that import and return the classes
         self.llm_class_mapping = {
-            "ChatAnthropic": ChatAnthropic,
-            "ChatOpenAI": ChatOpenAI,
-            "OpenRouterLLM": OpenRouterLLM,
+            "ChatAnthropic": _chat_anthropic_class,
+            "ChatOpenAI": _chat_openai_class,
+            "OpenRouterLLM": _openrouter_llm_class,
         }
+        
+        # Router for multi-candidate tasks (hedging, circuit breakers, latency tracking)
+        self.router = LLMRouter(self, self.llm_config.get("routing", {}))
 
     def get_llm(self, task_type: str):
         """
@@ -107,12 +136,156 @@ class LLMHandler:
                 raise ValueError(f"No LLM configuration found for task type: {task_type}")
             logger.info(f"Using fallback LLM for task type: {task_type}")
         
+        return self._build_llm(config)
+    
+    def get_llm_for_config(self, config_name: str, schema: Optional[Type[BaseModel]] = None):
+        """
+        Get an LLM instance for a named entry in the LLM configuration
+        
+        Args:
+            config_name: Name of the configuration entry (e.g. "fallback")
+            schema: Optional pydantic model; when given, returns a runnable whose
+                output is an instance of the model, using the provider-native method
+            
+        Returns:
+            LangChain LLM instance (or structured-output runnable)
+            
+        Raises:
+            ValueError: If no configuration entry has that name, or the entry
+                does not support structured output
+        """
+        config = self.llm_config.get(config_name)
+        if not config:
+            raise ValueError(f"No LLM configuration named: {config_name}")
+        llm = self._build_llm(config)
+        if schema is None:
+            return llm
+        return self._with_structured_output(llm, self.get_structured_output_method(config_name), schema)
+    
+    def get_structured_output_method(self, config_name: str) -> Optional[str]:
+        """
+        Get the structured output method supported by a configuration entry
+        
+        Returns:
+            "json_schema", "json_mode", "tool_calling", or None for prompt-only
+        """
+        config = self.llm_config.get(config_name, {})
+        method = config.get("structured_output")
+        if method is None:
+            capabilities = self.llm_config.get("capabilities", {})
+            method = capabilities.get(config.get("model"), {}).get("structured_output")
+        return method if method in STRUCTURED_OUTPUT_METHODS else None
+    
+    def _with_structured_output(self, llm, method: Optional[str], schema: Type[BaseModel]):
+        """Wrap an LLM so its output is parsed into the schema using the given method"""
+        if method == "tool_calling":
+            return llm.with_structured_output(schema, method="function_calling")
+        
+        if method == "json_schema":
+            response_format = {
+                "type": "json_schema",
+                "json_schema": {"name": schema.__name__, "schema": schema.model_json_schema()}
+            }
+        elif method == "json_mode":
+            response_format = {"type": "json_object"}
+        else:
+            raise ValueError(f"Structured output not supported (method: {method})")
+        
+        from langchain_core.runnables import RunnableLambda
+        
+        def parse(message):
+            try:
+                data = repair_json(message.content)
+                if isinstance(data, list):
+                    # Some models return the bare array instead of the wrapper object
+                    data = {next(iter(schema.model_fields)): data}
+                return schema.model_validate(data)
+            except ValueError as e:
+                # Also covers pydantic's ValidationError; keep the output for a repair prompt
+                raise StructuredOutputError(str(e), raw=message.content) from e
+        
+        return llm.bind(response_format=response_format) | RunnableLambda(parse)
+    
+    async def ainvoke(self, task_type: str, messages: List[Any], **kwargs):
+        """
+        Invoke the LLM for a task through the router, with hedging and fallback
+        across the candidates configured for the task
+        
+        Args:
+            task_type: Type of task (must match config or routing.tasks)
+            messages: LangChain messages to send
+            
+        Returns:
+            LLM response message
+        """
+        return await self.router.ainvoke(task_type, messages, **kwargs)
+    
+    async def ainvoke_structured(self,
+                                 task_type: str,
+                                 messages: List[Any],
+                                 schema: Type[BaseModel]) -> Optional[BaseModel]:
+        """
+        Invoke the LLM for a task with provider-native structured output
+        
+        Only candidates whose model supports structured output are used. Returns
+        None when no candidate supports it, so callers can fall back to prompt-only
+        JSON parsing. Output that does not match the schema is sent back once with
+        the validation error for the model to correct.
+        
+        Args:
+            task_type: Type of task (must match config or routing.tasks)
+            messages: LangChain messages to send
+            schema: Pydantic model describing the expected output
+            
+        Returns:
+            Instance of schema, or None if structured output is unavailable
+        """
+        candidates = [
+            c for c in self.router.get_candidates(task_type)
+            if self.get_structured_output_method(c)
+        ]
+        if not candidates:
+            return None
+        try:
+            return await self.router.ainvoke(task_type, messages, schema=schema, candidates=candidates)
+        except OUTPUT_ERRORS as e:
+            from langchain_core.messages import AIMessage, HumanMessage
+            
+            logger.warning(f"Structured output for {task_type} did not match {schema.__name__}, asking for a repair: {e}")
+            raw = getattr(e, "raw", None) or getattr(e, "llm_output", None)
+            repair = list(messages)
+            if raw:
+                repair.append(AIMessage(content=raw))
+            repair.append(HumanMessage(content=(
+                f"That answer does not match the required schema: {e}\n"
+                f"Answer again with only a JSON object matching this schema:\n{json.dumps(schema.model_json_schema())}"
+            )))
+            return await self.router.ainvoke(task_type, repair, schema=schema, candidates=candidates)
+    
+    def astream(self, task_type: str, messages: List[Any], **kwargs):
+        """
+        Stream the completion for a task through the router
+        
+        Args:
+            task_type: Type of task (must match config or routing.tasks)
+            messages: LangChain messages to send
+            
+        Returns:
+            LLMStream async iterator of text chunks (with .model set once streaming starts)
+        """
+        return self.router.astream(task_type, messages, **kwargs)
+    
+    def _build_llm(self, config: Dict[str, Any]):
+        """
+        Build an LLM instance from a single configuration entry
+        """
         # Get LLM class
         llm_class_name = config["llm"]
-        llm_class = self.llm_class_mapping.get(llm_class_name)
-        if not llm_class:
+        load_llm_class = self.llm_class_mapping.get(llm_class_name)
+        if not load_llm_class:
             logger.error(f"Unknown LLM class: {llm_class_name}")
             raise ValueError(f"Unknown or unsupported LLM class: {llm_class_name}")
+        llm_class = load_llm_class()
         
         # Get API key
         api_key = self.api_manager.get_key(config["api_key_name"])
@@ -120,6 +293,8 @@ class LLMHandler:
         # Add streaming if specified
         callbacks = None
         if config.get("streaming", False):
+            from langchain.callbacks.manager import CallbackManager
+            from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
             callbacks = CallbackManager([StreamingStdOutCallbackHandler()])
         
         # Special handling for OpenRouter models (DeepSeek R1)
@@ -131,20 +306,40 @@ class LLMHandler:
             if config.get("x_title"):
                 openrouter_headers["X-Title"] = config["x_title"]
                 
+            # Optional base_url lets a task point at a local OpenAI-compatible stub server
+            base_url_param = {"openai_api_base": config["base_url"]} if config.get("base_url") else {}
+            # Client-side retries hide failures from the router's circuit breakers
+            if "max_retries" in config:
+                base_url_param["max_retries"] = config["max_retries"]
+                
             return llm_class(
                 model_name=config["model"],  # Changed from model to model_name
                 openai_api_key=api_key,
                 temperature=config["temperature"],
                 callbacks=callbacks,
                 openrouter_headers=openrouter_headers,
+                **base_url_param,
             )
         else:
             # Handle other LLM types with common parameters
             api_key_param = {f"{config['api_key_name'].lower()}": api_key}
+            base_url_param = {"base_url": config["base_url"]} if config.get("base_url") else {}
+            if "max_retries" in config:
+                base_url_param["max_retries"] = config["max_retries"]
             
             return llm_class(
                 model=config["model"],
                 temperature=config["temperature"],
                 callbacks=callbacks,
                 **api_key_param,
-            )
\ No newline at end of file
+                **base_url_param,
+            )
+
+
+@lru_cache()
+def get_llm_handler() -> LLMHandler:
+    """
+    Get the shared LLM handler so routing state (latency, circuit breakers)
+    and API key usage persist across requests
+    """
+    return LLMHandler(api_manager=ApiManager())
\ No newline at end of file
@@ -0,0 +1,428 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from langchain_core.exceptions import OutputParserException
+from pydantic import ValidationError
+
+from app.core.tracing import (estimate_tokens, record_cancelled_tokens, record_span, record_token_usage, span,
+                              usage_from_message)
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyTracker:
+    """
+    Tracks call latency for a single candidate using an EWMA plus a rolling
+    window of recent samples for percentile estimates
+    """
+
+    def __init__(self, alpha: float = 0.2, window: int = 100):
+        self.alpha = alpha
+        self.samples = deque(maxlen=window)
+        self.ewma_ms: Optional[float] = None
+
+    def observe(self, latency_ms: float) -> None:
+        self.samples.append(latency_ms)
+        if self.ewma_ms is None:
+            self.ewma_ms = latency_ms
+        else:
+            self.ewma_ms = self.alpha * latency_ms + (1 - self.alpha) * self.ewma_ms
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        idx = min(len(ordered) - 1, int(q * len(ordered)))
+        return ordered[idx]
+
+    def __len__(self):
+        return len(self.samples)
+
+
+class StructuredOutputError(ValueError):
+    """The model answered, but its output could not be parsed into the requested schema"""
+
+    def __init__(self, message: str, raw: Optional[str] = None):
+        super().__init__(message)
+        self.raw = raw
+
+
+# Errors in the model's output rather than in the provider: the provider answered,
+# so they do not count against its circuit breaker
+OUTPUT_ERRORS = (StructuredOutputError, ValidationError, OutputParserException)
+
+
+class CircuitOpenError(Exception):
+    """A call was refused by an open circuit (or by a half-open one already probing)"""
+
+
+class CircuitBreaker:
+    """
+    Per-provider circuit breaker.
+
+    closed -> open after `failure_threshold` consecutive failures,
+    open -> half-open after `reset_timeout_s`, when a single probe call is let
+    through; half-open -> closed if the probe succeeds, back to open if it fails.
+    Other callers are refused while the probe is in flight.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout_s: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+    def allow(self) -> bool:
+        """Whether a call could be made now (without claiming the half-open probe)"""
+        if self.state == self.OPEN:
+            return time.monotonic() - self.opened_at >= self.reset_timeout_s
+        if self.state == self.HALF_OPEN:
+            return not self.probing
+        return True
+
+    def acquire(self) -> bool:
+        """
+        Claim permission for a call just before making it
+
+        Returns:
+            False only while a half-open probe is in flight. An open circuit whose
+            timeout has not expired is let through: the router only calls it as a
+            last resort when every candidate's circuit is open.
+        """
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at < self.reset_timeout_s:
+            return True
+        if self.probing:
+            return False
+        self.state = self.HALF_OPEN
+        self.probing = True
+        return True
+
+    def release(self) -> None:
+        """A call ended without a verdict (cancelled); let another probe through"""
+        self.probing = False
+
+    def record_success(self) -> None:
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self) -> None:
+        self.probing = False
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class LLMStream:
+    """
+    Async iterator over the text chunks of a routed streaming completion.
+
+    Candidates are tried in order until one starts streaming; once output has
+    started, a failure is raised rather than switching provider mid-answer.
+    `candidate` and `model` are set once a candidate produces its first chunk.
+    """
+
+    def __init__(self, router: "LLMRouter", task_type: str, messages: List[Any], **kwargs):
+        self.router = router
+        self.task_type = task_type
+        self.messages = messages
+        self.kwargs = kwargs
+        self.candidate: Optional[str] = None
+        self.model: Optional[str] = None
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        router = self.router
+        last_error: Optional[Exception] = None
+
+        for candidate in router.get_candidates(self.task_type):
+            breaker = router._breaker(candidate)
+            start = time.perf_counter()
+            started = False
+            first_chunk_ms = None
+            usage = {}
+            streamed = []
+            if not breaker.acquire():
+                last_error = CircuitOpenError(f"LLM candidate {candidate} is being probed")
+                continue
+            try:
+                llm = router.llm_handler.get_llm_for_config(candidate)
+                chunks = llm.astream(self.messages, **self.kwargs).__aiter__()
+                while True:
+                    try:
+                        # Idle timeout between chunks rather than for the whole stream
+                        chunk = await asyncio.wait_for(chunks.__anext__(), timeout=router.timeout_s)
+                    except StopAsyncIteration:
+                        break
+                    if not started:
+                        started = True
+                        first_chunk_ms = (time.perf_counter() - start) * 1000
+                        self.candidate = candidate
+                        self.model = router.llm_handler.llm_config.get(candidate, {}).get("model", candidate)
+                    for key, value in (getattr(chunk, "usage_metadata", None) or {}).items():
+                        if isinstance(value, int):
+                            usage[key] = usage.get(key, 0) + value
+                    if isinstance(chunk.content, str) and chunk.content:
+                        streamed.append(chunk.content)
+                        yield chunk.content
+            except asyncio.CancelledError:
+                breaker.release()
+                model = router.llm_handler.llm_config.get(candidate, {}).get("model", candidate)
+                record_cancelled_tokens(self.task_type, model,
+                                        estimate_tokens(self.messages) + estimate_tokens("".join(streamed)))
+                raise
+            except Exception as e:
+                breaker.record_failure()
+                logger.warning(f"LLM candidate {candidate} stream failed: {e}")
+                record_span("llm.stream", start, task=self.task_type, candidate=candidate, error=str(e))
+                if started:
+                    raise
+                last_error = e
+                continue
+
+            router._tracker(candidate).observe((time.perf_counter() - start) * 1000)
+            breaker.record_success()
+            record_span("llm.stream", start, task=self.task_type, candidate=candidate, first_chunk_ms=first_chunk_ms)
+            record_token_usage(self.task_type, self.model, usage)
+            return
+
+        raise last_error or ValueError(f"No LLM candidates available for task type: {self.task_type}")
+
+
+class LLMRouter:
+    """
+    Routes LLM calls for a task across an ordered list of candidate configurations.
+
+    Each candidate is the name of an entry in llm-config.json. The router skips
+    candidates whose provider circuit is open, hedges to the next candidate when
+    the current one has not answered within its observed latency percentile, and
+    falls through to the next candidate on errors or timeouts.
+    """
+
+    def __init__(self, llm_handler, routing_config: Optional[Dict[str, Any]] = None):
+        """
+        Initialize the router
+
+        Args:
+            llm_handler: LLMHandler used to build LLM instances for candidates
+            routing_config: The "routing" section of llm-config.json
+        """
+        self.llm_handler = llm_handler
+        routing_config = routing_config or {}
+
+        self.task_candidates: Dict[str, List[str]] = {
+            task: self._distinct(task, candidates) for task, candidates in routing_config.get("tasks", {}).items()
+        }
+
+        hedging = routing_config.get("hedging", {})
+        self.hedging_enabled = hedging.get("enabled", True)
+        self.hedge_percentile = hedging.get("percentile", 0.9)
+        self.hedge_min_samples = hedging.get("min_samples", 10)
+        self.hedge_min_delay_ms = hedging.get("min_delay_ms", 250)
+        self.hedge_default_delay_ms = hedging.get("default_delay_ms", 5000)
+
+        breaker = routing_config.get("circuit_breaker", {})
+        self.failure_threshold = breaker.get("failure_threshold", 3)
+        self.reset_timeout_s = breaker.get("reset_timeout_s", 30)
+
+        self.ewma_alpha = routing_config.get("ewma_alpha", 0.2)
+        self.timeout_s = routing_config.get("timeout_s", 60)
+
+        self.latency: Dict[str, LatencyTracker] = {}
+        self.breakers: Dict[str, CircuitBreaker] = {}
+
+    def _provider_key(self, candidate: str) -> str:
+        """Providers are grouped by explicit name, or by LLM class and endpoint"""
+        config = self.llm_handler.llm_config.get(candidate, {})
+        return config.get("provider") or f"{config.get('llm')}:{config.get('base_url', 'default')}"
+
+    def _distinct(self, task_type: str, candidates: List[str]) -> List[str]:
+        """
+        Drop candidates with the same provider and model as an earlier one: hedging or
+        falling back to them would send the call to the same model behind the same breaker
+        """
+        distinct = []
+        seen = set()
+        for candidate in candidates:
+            key = (self._provider_key(candidate), self.llm_handler.llm_config.get(candidate, {}).get("model"))
+            if key in seen:
+                logger.warning(f"Routing for {task_type}: {candidate} repeats the provider and model of an earlier candidate, skipping it")
+                continue
+            seen.add(key)
+            distinct.append(candidate)
+        return distinct
+
+    def _tracker(self, candidate: str) -> LatencyTracker:
+        if candidate not in self.latency:
+            self.latency[candidate] = LatencyTracker(alpha=self.ewma_alpha)
+        return self.latency[candidate]
+
+    def _breaker(self, candidate: str) -> CircuitBreaker:
+        provider = self._provider_key(candidate)
+        if provider not in self.breakers:
+            self.breakers[provider] = CircuitBreaker(self.failure_threshold, self.reset_timeout_s)
+        return self.breakers[provider]
+
+    def get_candidates(self, task_type: str) -> List[str]:
+        """
+        Get the candidates for a task, in preference order, with open circuits removed
+        """
+        candidates = self.task_candidates.get(task_type)
+        if not candidates:
+            candidates = [task_type] if task_type in self.llm_handler.llm_config else ["fallback"]
+
+        available = [c for c in candidates if self._breaker(c).allow()]
+        if not available:
+            # Every circuit is open: try the first candidate anyway rather than failing outright
+            logger.warning(f"All providers for {task_type} have open circuits, trying {candidates[0]}")
+            available = candidates[:1]
+        return available
+
+    def _hedge_delay_s(self, candidate: str) -> float:
+        tracker = self._tracker(candidate)
+        delay_ms = self.hedge_default_delay_ms
+        if len(tracker) >= self.hedge_min_samples:
+            delay_ms = max(self.hedge_min_delay_ms, tracker.percentile(self.hedge_percentile))
+        return delay_ms / 1000
+
+    async def _call(self, task_type: str, candidate: str, messages: List[Any], schema=None, **kwargs):
+        """Invoke a single candidate, recording latency, token usage and breaker state"""
+        breaker = self._breaker(candidate)
+        if not breaker.acquire():
+            raise CircuitOpenError(f"LLM candidate {candidate} is being probed")
+        start = time.perf_counter()
+        with span("llm.call", task=task_type, candidate=candidate, structured=schema is not None) as call_span:
+            try:
+                llm = self.llm_handler.get_llm_for_config(candidate, schema=schema)
+                response = await asyncio.wait_for(llm.ainvoke(messages, **kwargs), timeout=self.timeout_s)
+            except asyncio.CancelledError:
+                # Lost a hedge race; not the provider's fault. Its latency is at least the
+                # time it ran, and leaving it out would bias the hedge percentile low
+                call_span.attributes["cancelled"] = True
+                self._tracker(candidate).observe((time.perf_counter() - start) * 1000)
+                breaker.release()
+                model = self.llm_handler.llm_config.get(candidate, {}).get("model", candidate)
+                record_cancelled_tokens(task_type, model, estimate_tokens(messages))
+                raise
+            except OUTPUT_ERRORS as e:
+                # The provider is healthy; the caller decides whether to retry with a repair prompt
+                self._tracker(candidate).observe((time.perf_counter() - start) * 1000)
+                breaker.record_success()
+                call_span.attributes["output_error"] = str(e)
+                logger.warning(f"LLM candidate {candidate} returned output that does not match the schema: {e}")
+                raise
+            except Exception as e:
+                breaker.record_failure()
+                call_span.attributes["error"] = str(e)
+                logger.warning(f"LLM candidate {candidate} failed after {(time.perf_counter() - start) * 1000:.0f}ms: {e}")
+                raise
+        self._tracker(candidate).observe((time.perf_counter() - start) * 1000)
+        breaker.record_success()
+        model = self.llm_handler.llm_config.get(candidate, {}).get("model", candidate)
+        record_token_usage(task_type, model, usage_from_message(response))
+        return response
+
+    async def ainvoke(self,
+                      task_type: str,
+                      messages: List[Any],
+                      schema=None,
+                      candidates: Optional[List[str]] = None,
+                      **kwargs):
+        """
+        Invoke the best available candidate for a task
+
+        Args:
+            task_type: Task type to route (e.g. "email_classification")
+            messages: LangChain messages to send
+            schema: Optional pydantic model for provider-native structured output
+            candidates: Optional pre-filtered candidate list (defaults to the task's candidates)
+
+        Returns:
+            The first successful LLM response
+
+        Raises:
+            Exception: The last error if every candidate fails
+        """
+        candidates = candidates or self.get_candidates(task_type)
+        pending: Dict[asyncio.Task, str] = {}
+        next_idx = 0
+        last_error: Optional[Exception] = None
+
+        def launch():
+            nonlocal next_idx
+            candidate = candidates[next_idx]
+            next_idx += 1
+            task = asyncio.create_task(self._call(task_type, candidate, messages, schema=schema, **kwargs))
+            pending[task] = candidate
+            return candidate
+
+        current = launch()
+        try:
+            while pending:
+                can_hedge = self.hedging_enabled and next_idx < len(candidates)
+                timeout = self._hedge_delay_s(current) if can_hedge else None
+                done, _ = await asyncio.wait(pending.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    # Current candidate is slower than usual: hedge with the next one
+                    logger.info(f"Hedging {task_type}: {current} exceeded {timeout * 1000:.0f}ms")
+                    current = launch()
+                    continue
+
+                for task in done:
+                    candidate = pending.pop(task)
+                    if task.exception() is None:
+                        if candidate != candidates[0]:
+                            logger.info(f"Served {task_type} from {candidate}")
+                        return task.result()
+                    last_error = task.exception()
+
+                # Everything in flight failed: fall through to the next candidate
+                if not pending and next_idx < len(candidates):
+                    current = launch()
+        finally:
+            for task in pending:
+                task.cancel()
+
+        raise last_error or ValueError(f"No LLM candidates available for task type: {task_type}")
+
+    def astream(self, task_type: str, messages: List[Any], **kwargs) -> LLMStream:
+        """
+        Stream a completion for a task from the first available candidate that starts answering.
+        Streams are not hedged: duplicate partial output cannot be merged.
+        """
+        return LLMStream(self, task_type, messages, **kwargs)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get latency and circuit breaker state for all candidates"""
+        return {
+            "latency": {
+                name: {
+                    "ewma_ms": tracker.ewma_ms,
+                    "p90_ms": tracker.percentile(0.9),
+                    "samples": len(tracker)
+                }
+                for name, tracker in self.latency.items()
+            },
+            "circuit_breakers": {
+                provider: {
+                    "state": breaker.state,
+                    "consecutive_failures": breaker.consecutive_failures
+                }
+                for provider, breaker in self.breakers.items()
+            }
+        }
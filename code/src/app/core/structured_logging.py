@@ -0,0 +1,156 @@
+import json
+import logging
+from typing import Any, Dict, List, Optional
+
+# Attribute on LogRecord that carries structured fields passed to `log_event`
+FIELDS_ATTR = "fields"
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    Formats records as a single line with structured fields appended.
+
+    text: `<timestamp> - <logger> - <level> - <message> key=value ...`
+    json: one JSON object per line with timestamp, logger, level, message and fields
+    """
+
+    def __init__(self, fmt: str = "text"):
+        super().__init__('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        self.output = fmt
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields: Dict[str, Any] = getattr(record, FIELDS_ATTR, None) or {}
+        if self.output == "json":
+            payload = {
+                "timestamp": self.formatTime(record),
+                "logger": record.name,
+                "level": record.levelname,
+                "message": record.getMessage(),
+                **fields
+            }
+            if record.exc_info:
+                payload["exception"] = self.formatException(record.exc_info)
+            return json.dumps(payload, default=str)
+
+        line = super().format(record)
+        if fields:
+            line += " " + " ".join(f"{k}={_format_value(v)}" for k, v in fields.items())
+        return line
+
+
+def _format_value(value: Any) -> str:
+    if isinstance(value, float):
+        return f"{value:.4f}"
+    text = str(value)
+    return f'"{text}"' if " " in text else text
+
+
+def parse_module_levels(spec: str) -> Dict[str, int]:
+    """
+    Parse per-module levels from "module=LEVEL,module=LEVEL"
+
+    Example: "app.services.IntelligentDuplicateDetector=DEBUG,httpx=WARNING"
+    """
+    levels = {}
+    for item in filter(None, (part.strip() for part in (spec or "").split(","))):
+        name, _, level = item.partition("=")
+        if name and level:
+            levels[name.strip()] = getattr(logging, level.strip().upper())
+    return levels
+
+
+def configure_logging(level: str = "INFO", module_levels: str = "", fmt: str = "text") -> None:
+    """
+    Configure the root handler and per-module levels
+
+    Args:
+        level: Root level name (Settings.log_level)
+        module_levels: Per-module overrides, "module=LEVEL,..." (Settings.log_levels)
+        fmt: "text" or "json" (Settings.log_format)
+    """
+    handler = logging.StreamHandler()
+    handler.setFormatter(StructuredFormatter(fmt))
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(getattr(logging, level.upper()))
+    for name, module_level in parse_module_levels(module_levels).items():
+        logging.getLogger(name).setLevel(module_level)
+
+
+def log_event(logger: logging.Logger, level: int, message: str, **fields: Any) -> None:
+    """
+    Log a message with structured fields.
+
+    Nothing is formatted unless the logger is enabled for `level`.
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, message, extra={FIELDS_ATTR: fields}, stacklevel=2)
+
+
+class ScanLog:
+    """
+    Aggregates per-item events of a loop into one summary line.
+
+    Per-item details are logged at DEBUG only, and only for a sample of items
+    (the first `sample_first`, then every `sample_every`-th), so a scan over
+    10k cache entries costs a handful of log lines even with DEBUG enabled.
+    """
+
+    def __init__(self, logger: logging.Logger, name: str, sample_first: int = 5, sample_every: int = 1000):
+        self.logger = logger
+        self.name = name
+        self.sample_first = sample_first
+        self.sample_every = sample_every
+        self.debug = logger.isEnabledFor(logging.DEBUG)
+        self.items = 0
+        self.counts: Dict[str, int] = {}
+        self.maxima: Dict[str, float] = {}
+
+    def item(self) -> bool:
+        """
+        Count an item
+
+        Returns:
+            Whether this item's details should be logged
+        """
+        self.items += 1
+        return self.debug and (self.items <= self.sample_first or self.items % self.sample_every == 0)
+
+    def add(self, count: int) -> List[int]:
+        """
+        Count `count` items at once, for scans that process all items together
+
+        Returns:
+            Numbers (1-based) of the items whose details should be logged
+        """
+        start = self.items
+        self.items += count
+        if not self.debug:
+            return []
+        first = range(start + 1, min(self.items, self.sample_first) + 1)
+        lowest = max(start + 1, self.sample_first + 1)
+        every = range(-(-lowest // self.sample_every) * self.sample_every, self.items + 1, self.sample_every)
+        return list(first) + list(every)
+
+    def sample(self, message: str, *args: Any, item: Optional[int] = None) -> None:
+        """Log per-item details lazily; call only for items `item()` or `add()` selected"""
+        self.logger.debug(f"[{self.name} #{item or self.items}] " + message, *args, stacklevel=2)
+
+    def incr(self, key: str, amount: int = 1) -> None:
+        self.counts[key] = self.counts.get(key, 0) + amount
+
+    def observe_max(self, key: str, value: float) -> None:
+        if value > self.maxima.get(key, float("-inf")):
+            self.maxima[key] = value
+
+    def summary(self, level: int = logging.INFO, message: Optional[str] = None, **fields: Any) -> None:
+        """Emit the single summary line for the scan"""
+        log_event(
+            self.logger,
+            level,
+            message or f"{self.name} complete",
+            items=self.items,
+            **self.counts,
+            **{f"max_{k}": v for k, v in self.maxima.items()},
+            **fields
+        )
@@ -0,0 +1,80 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TaskGraph:
+    """
+    Small DAG executor for the stages of one request.
+
+    Each stage is an async callable started as a task as soon as it is added; it
+    first awaits the stages it depends on and receives their results as
+    arguments, so independent stages overlap and a stage starts as soon as its
+    inputs are ready. Stages can be added while the graph runs (for example one
+    per attachment once parsing has found them).
+
+    Use as `async with TaskGraph() as graph:`. Leaving the block cancels stages
+    that are still running, so an early return (such as a duplicate) does not
+    wait for work whose result is no longer needed.
+
+    Cancelling a stage that awaits `asyncio.to_thread` stops the stage but not
+    the thread, which runs its call to completion; expensive thread work that
+    may be abandoned should wait for the decision before it starts.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def add(self, name: str, func: Callable[..., Awaitable[Any]], *depends_on: str) -> asyncio.Task:
+        """
+        Add a stage and start it
+
+        Args:
+            name: Unique stage name
+            func: Async callable taking the results of `depends_on`, in order
+            depends_on: Names of stages already added to the graph
+
+        Returns:
+            The stage's task
+        """
+        if name in self._tasks:
+            raise ValueError(f"Stage already added: {name}")
+        dependencies = [self._tasks[d] for d in depends_on]
+
+        async def run():
+            inputs = [await dependency for dependency in dependencies]
+            return await func(*inputs)
+
+        task = asyncio.create_task(run(), name=name)
+        self._tasks[name] = task
+        return task
+
+    def get(self, name: str) -> Optional[asyncio.Task]:
+        """Get a stage's task, or None if no stage has that name"""
+        return self._tasks.get(name)
+
+    async def result(self, name: str) -> Any:
+        """Wait for a stage and return its result (or raise its exception)"""
+        return await self._tasks[name]
+
+    async def results(self, *names: str) -> List[Any]:
+        """Wait for several stages, returning their results in order"""
+        return list(await asyncio.gather(*(self._tasks[n] for n in names)))
+
+    async def cancel(self) -> None:
+        """Cancel unfinished stages and wait for them to stop"""
+        pending = [task for task in self._tasks.values() if not task.done()]
+        for task in pending:
+            task.cancel()
+        # Also retrieves exceptions of finished stages nobody awaited
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        if pending:
+            logger.debug("Cancelled %d unfinished stages: %s", len(pending), [t.get_name() for t in pending])
+
+    async def __aenter__(self) -> "TaskGraph":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.cancel()
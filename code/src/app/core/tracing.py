@@ -0,0 +1,255 @@
+import functools
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Histogram buckets for stage durations, in seconds
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+class Span:
+    """A timed pipeline stage"""
+    __slots__ = ("name", "parent", "start", "duration_ms", "attributes")
+
+    def __init__(self, name: str, parent: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.parent = parent
+        self.start = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+        self.attributes = attributes
+
+
+class Trace:
+    """
+    Spans, token counts and cache hit/miss counters for one request.
+
+    The trace is carried in a context variable, so spans opened anywhere below
+    `start_trace()` - including code run through `asyncio.to_thread` - attach to it.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans: List[Span] = []
+        self.counters: Counter = Counter()
+
+    def summary(self) -> Dict[str, Any]:
+        """Timings breakdown returned in `ClassificationResponse.timings`"""
+        return {
+            "total_ms": round((time.perf_counter() - self.start) * 1000, 2),
+            "spans": [
+                {
+                    "name": s.name,
+                    "parent": s.parent,
+                    "start_ms": round((s.start - self.start) * 1000, 2),
+                    "duration_ms": round(s.duration_ms, 2) if s.duration_ms is not None else None,
+                    **({"attributes": s.attributes} if s.attributes else {})
+                }
+                for s in sorted(self.spans, key=lambda s: s.start)
+            ],
+            "counters": dict(self.counters)
+        }
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus exposition model"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Process-wide aggregates of stage durations and counters, exported on /metrics"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stage_durations: Dict[str, Histogram] = defaultdict(Histogram)
+        # (metric name, sorted label items) -> value
+        self.counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = defaultdict(float)
+
+    def observe_stage(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.stage_durations[stage].observe(seconds)
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        with self._lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    @staticmethod
+    def _labels(items) -> str:
+        if not items:
+            return ""
+        escaped = (f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in items)
+        return "{" + ",".join(escaped) + "}"
+
+    def render_prometheus(self) -> str:
+        """Render all metrics in the Prometheus text exposition format"""
+        lines = [
+            "# HELP email_pipeline_stage_duration_seconds Duration of classification pipeline stages",
+            "# TYPE email_pipeline_stage_duration_seconds histogram"
+        ]
+        with self._lock:
+            for stage, histogram in sorted(self.stage_durations.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(
+                        f"email_pipeline_stage_duration_seconds_bucket"
+                        f"{self._labels([('stage', stage), ('le', repr(bound))])} {cumulative}"
+                    )
+                lines.append(
+                    f"email_pipeline_stage_duration_seconds_bucket"
+                    f"{self._labels([('stage', stage), ('le', '+Inf')])} {histogram.count}"
+                )
+                lines.append(f"email_pipeline_stage_duration_seconds_sum{self._labels([('stage', stage)])} {histogram.sum}")
+                lines.append(f"email_pipeline_stage_duration_seconds_count{self._labels([('stage', stage)])} {histogram.count}")
+
+            names = sorted({name for name, _ in self.counters})
+            for name in names:
+                lines.append(f"# TYPE {name} counter")
+                for (metric, labels), value in sorted(self.counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{self._labels(labels)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+def start_trace() -> Trace:
+    """Start a trace for the current request; spans opened below it attach to it"""
+    trace = Trace()
+    _current_trace.set(trace)
+    _current_span.set(None)
+    return trace
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span]:
+    """
+    Time a pipeline stage
+
+    The duration is always recorded in the process-wide histograms; when a trace
+    is active the span is also added to it. Attributes can be added to the
+    yielded span while it is open.
+    """
+    parent = _current_span.get()
+    current = Span(name, parent.name if parent else None, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    finally:
+        _current_span.reset(token)
+        elapsed = time.perf_counter() - current.start
+        current.duration_ms = elapsed * 1000
+        metrics.observe_stage(name, elapsed)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.spans.append(current)
+
+
+def record_span(name: str, start: float, **attributes: Any) -> None:
+    """
+    Record a stage that has already finished, given its `time.perf_counter()` start.
+    For code such as async generators where a `with span(...)` block would stay
+    open across yields.
+    """
+    parent = _current_span.get()
+    finished = Span(name, parent.name if parent else None, attributes)
+    finished.start = start
+    elapsed = time.perf_counter() - start
+    finished.duration_ms = elapsed * 1000
+    metrics.observe_stage(name, elapsed)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.spans.append(finished)
+
+
+def traced(name: str):
+    """Decorator form of `span` for synchronous functions"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name: str, value: int = 1, **labels: str) -> None:
+    """
+    Increment a counter on the current trace and in the process-wide metrics
+
+    Args:
+        name: Prometheus metric name, e.g. "email_pipeline_cache_events_total"
+        value: Amount to add
+        labels: Metric labels; they also key the per-trace counter
+    """
+    metrics.inc(name, value, **labels)
+    trace = _current_trace.get()
+    if trace is not None:
+        key = ".".join([name.replace("email_pipeline_", "").replace("_total", "")] + [str(v) for _, v in sorted(labels.items())])
+        trace.counters[key] += value
+
+
+def usage_from_message(message: Any) -> Optional[Dict[str, int]]:
+    """Get input/output token counts reported on a LangChain message, if any"""
+    usage = getattr(message, "usage_metadata", None)
+    if usage:
+        return dict(usage)
+    token_usage = (getattr(message, "response_metadata", None) or {}).get("token_usage") or {}
+    if token_usage:
+        return {
+            "input_tokens": token_usage.get("prompt_tokens", 0),
+            "output_tokens": token_usage.get("completion_tokens", 0)
+        }
+    return None
+
+
+def estimate_tokens(messages: Any) -> int:
+    """Rough token count of LangChain messages (about four characters per token)"""
+    if isinstance(messages, str):
+        return len(messages) // 4
+    return sum(len(str(getattr(message, "content", message))) for message in messages) // 4
+
+
+def record_cancelled_tokens(task_type: str, model: str, tokens: int) -> None:
+    """
+    Record the estimated tokens of an LLM call cancelled before it reported usage
+
+    Providers still bill a request that is cut off, but report no usage for it, so
+    the prompt (and any output streamed so far) is counted from an estimate.
+    """
+    if tokens:
+        count("email_pipeline_llm_cancelled_tokens_total", tokens, task=task_type, model=model)
+
+
+def record_token_usage(task_type: str, model: str, usage: Optional[Dict[str, int]]) -> None:
+    """Record input/output token counts for an LLM call"""
+    if not usage:
+        return
+    for direction in ("input", "output"):
+        tokens = usage.get(f"{direction}_tokens", 0)
+        if tokens:
+            count("email_pipeline_llm_tokens_total", tokens, task=task_type, model=model, direction=direction)
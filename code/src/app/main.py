@@ -1,4 +1,12 @@
+import argparse
+import gc
 import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
 import uvicorn
 
 from fastapi import FastAPI
@@ -7,18 +15,27 @@ from fastapi.openapi.utils import get_openapi
 
 from app.api.routes import router
 from app.config import get_settings
+from app.core.structured_logging import configure_logging
 
 from .api import router as request_config_router
 from .db.session import close_db, init_db
+from .services.request_type_catalog import request_type_catalog
+from .services.job_queue import job_queue
+from .services.analytics_sink import analytics_sink
+from .services.analytics_rollups import analytics_rollups
+from .services.thread_state import thread_state_store
+from .services.warmup import warmup
+from .services.email_processor import get_ocr_reader
+from .services.IntelligentDuplicateDetector import get_embedding_provider
+from .services.model_sidecar import SidecarClient
+from .schemas.analytics import create_indexes as create_analytics_indexes
+from .api.routes import get_classification_service
 
 # Get settings
 settings = get_settings()
 
 # Configure logging
-logging.basicConfig(
-    level=getattr(logging, settings.log_level),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-)
+configure_logging(settings.log_level, settings.log_levels, settings.log_format)
 logger = logging.getLogger(__name__)
 
 # Initialize FastAPI app
@@ -35,6 +52,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Paged analytics endpoints return the next page's cursor in this header
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Include routes
@@ -63,6 +82,23 @@ async def startup_event():
     """Startup event handler"""
     logger.info("Starting up Email Classification API")
     await init_db()
+    await request_type_catalog.start()
+    try:
+        await create_analytics_indexes()
+    except Exception as e:
+        logger.error(f"Error creating analytics indexes: {e}")
+    try:
+        await thread_state_store.ensure_indexes()
+    except Exception as e:
+        logger.error(f"Error creating thread state indexes: {e}")
+    try:
+        await analytics_rollups.start()
+    except Exception as e:
+        logger.error(f"Error starting analytics rollups: {e}")
+    analytics_sink.add_listener(analytics_rollups.record)
+    await analytics_sink.start()
+    await job_queue.start(get_classification_service)
+    warmup.start()
     # Log configuration
     logger.info(f"Duplicate cache duration: {settings.duplicate_cache_days} days")
     logger.info(f"Max attachment size: {settings.max_attachment_size_mb} MB")
@@ -71,14 +107,166 @@ async def startup_event():
 async def shutdown_event():
     """Shutdown event handler"""
     logger.info("Shutting down Email Classification API")
+    await warmup.stop()
+    await job_queue.stop()
+    await thread_state_store.stop()
+    await analytics_sink.stop()
+    await analytics_rollups.stop()
+    await request_type_catalog.stop()
     await close_db()
 
 
+def _preload_models() -> None:
+    """Load the models in the master so forked workers share their memory copy-on-write"""
+    if settings.warmup_embeddings:
+        get_embedding_provider()
+    if settings.warmup_ocr:
+        get_ocr_reader()
+
+
+def _start_sidecar(timeout: float = 300.0):
+    """
+    Start the model sidecar unless one is already listening on the socket
+
+    Returns:
+        The sidecar process, or None when an existing sidecar is used
+    """
+    client = SidecarClient(settings.model_sidecar_socket, timeout=5.0)
+    if client.ping():
+        logger.info(f"Using the model sidecar already listening on {settings.model_sidecar_socket}")
+        return None
+    process = subprocess.Popen(
+        [sys.executable, "-m", "app.services.model_sidecar", "--socket", settings.model_sidecar_socket]
+    )
+    deadline = time.monotonic() + timeout
+    while not client.ping():
+        if process.poll() is not None:
+            raise RuntimeError(f"Model sidecar exited with status {process.returncode}")
+        if time.monotonic() > deadline:
+            process.terminate()
+            raise RuntimeError(f"Model sidecar did not start within {timeout:.0f}s")
+        time.sleep(0.2)
+    return process
+
+
+def _run_worker(sock: socket.socket, slot: int) -> None:
+    """
+    Serve the app on the listening socket inherited from the master
+
+    Args:
+        sock: Listening socket
+        slot: Worker number, kept by the worker that replaces this one if it exits
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    gc.enable()
+    if analytics_sink.spill_path and slot:
+        # One spill file per worker slot, so workers never replay each other's file
+        # and a restarted worker replays the one its predecessor left; the first
+        # worker keeps the configured path, like a single-process deployment
+        root, extension = os.path.splitext(analytics_sink.spill_path)
+        analytics_sink.spill_path = f"{root}.worker{slot}{extension}"
+    uvicorn.Server(uvicorn.Config(app, host="0.0.0.0", port=settings.port)).run(sockets=[sock])
+
+
+def serve(workers: int) -> None:
+    """
+    Run the API with `workers` processes forked from this one
+
+    The master binds the port, loads the models (model_sharing=prefork) with the
+    garbage collector disabled and freezes everything allocated so far with
+    gc.freeze(), so the collector never writes to those objects and the workers
+    keep sharing the model pages instead of copying them. No inference runs in
+    the master, so thread pools are created in each worker after the fork. With
+    model_sharing=sidecar the models live in one sidecar process instead, which
+    is started here unless one already listens on model_sidecar_socket. Workers
+    that exit are restarted; SIGTERM/SIGINT stop the workers and then the master.
+
+    Each worker keeps its own duplicate cache, so an email is only recognized as
+    a duplicate of one handled by the same worker.
+
+    Args:
+        workers: Number of worker processes
+    """
+    sidecar = _start_sidecar() if settings.model_sharing == "sidecar" else None
+    try:
+        if workers <= 1:
+            uvicorn.run(app, host="0.0.0.0", port=settings.port)
+            return
+        if not hasattr(os, "fork"):
+            # No fork (e.g. Windows): uvicorn's spawned workers each load their own models
+            uvicorn.run("app.main:app", host="0.0.0.0", port=settings.port, workers=workers)
+            return
+
+        logger.warning(
+            f"Each of the {workers} workers keeps its own duplicate cache: duplicates of emails "
+            f"handled by another worker are not detected (run one worker where that matters)"
+        )
+        sock = socket.create_server(("0.0.0.0", settings.port), backlog=2048)
+        gc.disable()
+        if settings.model_sharing == "prefork":
+            _preload_models()
+        gc.freeze()
+
+        children = {}
+
+        def spawn(slot: int) -> None:
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    _run_worker(sock, slot)
+                finally:
+                    os._exit(0)
+            children[pid] = (slot, time.monotonic())
+            logger.info(f"Started worker {pid}")
+
+        for slot in range(workers):
+            spawn(slot)
+        gc.enable()
+
+        stopping = False
+
+        def stop(signum, frame) -> None:
+            nonlocal stopping
+            stopping = True
+            for pid in children:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        logger.info(f"Serving on port {settings.port} with {workers} workers (model sharing: {settings.model_sharing})")
+        while children:
+            pid, status = os.wait()
+            if sidecar is not None and pid == sidecar.pid:
+                logger.error(f"Model sidecar exited with status {os.waitstatus_to_exitcode(status)}")
+                if not stopping:
+                    sidecar = _start_sidecar()
+                continue
+            child = children.pop(pid, None)
+            if child is None or stopping:
+                continue
+            slot, started = child
+            logger.warning(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}, restarting it")
+            if time.monotonic() - started < 1.0:
+                # Do not spin on a worker that fails at startup
+                time.sleep(1.0)
+            spawn(slot)
+        sock.close()
+    finally:
+        if sidecar is not None and sidecar.poll() is None:
+            sidecar.terminate()
+            sidecar.wait()
+
+
 if __name__ == "__main__":
-    # Start server
-    uvicorn.run(
-        "app.main:app", 
-        host="0.0.0.0", 
-        port=settings.port, 
-        reload=True
-    )
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Run the Email Classification API")
+    parser.add_argument("--workers", type=int, default=settings.workers, help="Worker processes")
+    parser.add_argument("--reload", action="store_true", help="Development: one process that restarts on code changes")
+    args = parser.parse_args()
+    if args.reload:
+        uvicorn.run("app.main:app", host="0.0.0.0", port=settings.port, reload=True)
+    else:
+        serve(args.workers)
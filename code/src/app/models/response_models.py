@@ -38,6 +38,14 @@ class ExtractedField(BaseModel):
             }
         }
 
+class RequestTypeClassification(BaseModel):
+    """Structured-output schema wrapping the request type classification results"""
+    request_types: List[RequestTypeResult]
+
+class FieldExtraction(BaseModel):
+    """Structured-output schema wrapping the extracted fields"""
+    extracted_fields: List[ExtractedField]
+
 class ClassificationResponse(BaseModel):
     """Model for the complete classification response"""
     request_types: List[RequestTypeResult]
@@ -49,6 +57,7 @@ class ClassificationResponse(BaseModel):
     duplicate_id: Optional[str] = Field(default=None, description="ID of the matched duplicate if found")
     processing_time_ms: Optional[float] = None
     error: Optional[str] = None
+    timings: Optional[Dict[str, Any]] = Field(default=None, description="Per-stage timing breakdown, when requested")
     
     class Config:
         json_schema_extra = {
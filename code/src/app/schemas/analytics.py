@@ -1,7 +1,8 @@
 from pydantic import BaseModel
+from pymongo import ASCENDING, DESCENDING
 from ..db.session import db
 from datetime import datetime
-from typing import List
+from typing import List, Optional
 
 
 class Analytics(BaseModel):
@@ -17,5 +18,66 @@ class DuplicateAnalytics(BaseModel):
     timestamp: str = datetime.now().isoformat()
     duplicate_confidence: float
 
+class FieldSummary(BaseModel):
+    field_name: str
+    count: int
+    average_confidence: float
+
+class GroupSummary(BaseModel):
+    request_type: Optional[str] = None
+    sub_request_type: Optional[str] = None
+    support_group: Optional[str] = None
+    count: int
+    average_confidence: float
+    fields: List[FieldSummary] = []
+
+class BucketSummary(BaseModel):
+    bucket: str
+    count: int
+    average_confidence: float
+    duplicates: int
+    average_duplicate_confidence: float
+    duplicate_rate: float
+
+class AnalyticsSummary(BaseModel):
+    count: int
+    average_confidence: float
+    duplicates: int
+    average_duplicate_confidence: float
+    duplicate_rate: float
+    by_request_type: List[GroupSummary]
+    by_sub_request_type: List[GroupSummary]
+    by_support_group: List[GroupSummary]
+    fields: List[FieldSummary]
+    timeline: List[BucketSummary]
+
+def stored_timestamp(value: datetime) -> str:
+    """
+    Format a time like the `timestamp` of stored analytics (naive local time in ISO
+    format), so the two compare in time order as strings
+
+    Args:
+        value: Naive local time, or a timezone-aware time which is converted to local time
+
+    Returns:
+        ISO-format string
+    """
+    if value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return value.isoformat()
+
 analytics_collection = db['analytics']
-duplicate_analytics_collection = db['duplicate_analytics']
\ No newline at end of file
+duplicate_analytics_collection = db['duplicate_analytics']
+analytics_rollups_collection = db['analytics_rollups']
+# Subject and body excerpts the pre-classifier trains on, kept apart from the dashboard's
+# analytics (restrict access to it) and removed after FAST_PATH_TRAINING_RETENTION_DAYS
+fast_path_training_collection = db['fast_path_training']
+
+
+async def create_indexes():
+    """Indexes for the analytics API's newest-first pages, time ranges and request type filter"""
+    await analytics_collection.create_index([("timestamp", DESCENDING), ("_id", DESCENDING)])
+    await analytics_collection.create_index([("request_type", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)])
+    await duplicate_analytics_collection.create_index([("timestamp", DESCENDING), ("_id", DESCENDING)])
+    await fast_path_training_collection.create_index([("timestamp", DESCENDING)])
+    await fast_path_training_collection.create_index("expires_at", expireAfterSeconds=0)
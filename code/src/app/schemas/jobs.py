@@ -0,0 +1,28 @@
+from pydantic import BaseModel, Field
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from ..db.session import db
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+
+class ClassificationJob(BaseModel):
+    job_id: str
+    kind: str
+    status: str
+    thread_id: Optional[str] = None
+    filename: Optional[str] = None
+    content_type: Optional[str] = None
+    payload_id: Optional[Any] = None
+    attachments: List[dict] = []
+    attempts: int = 0
+    created_at: datetime = Field(default_factory=datetime.now)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    lease_expires_at: Optional[datetime] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+
+# Job documents double as the persistent work queue
+classification_jobs_collection = db['classification_jobs']
+# Uploaded file contents, kept out of the job documents to stay clear of the 16MB document limit
+job_payloads_bucket = AsyncIOMotorGridFSBucket(db, bucket_name="job_payloads")
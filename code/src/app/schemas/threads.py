@@ -0,0 +1,18 @@
+from pydantic import BaseModel
+from ..db.session import db
+from datetime import datetime
+from typing import List, Optional
+
+
+class ThreadState(BaseModel):
+    thread_id: str
+    request_types: List[dict] = []
+    support_group: str = ""
+    extracted_fields: List[dict] = []
+    # Paragraph hashes of the thread's messages, to recognize them when quoted
+    message_hashes: List[str] = []
+    message_count: int = 0
+    updated_at: Optional[datetime] = None
+
+# Classification state per email thread, for incremental processing of replies
+thread_states_collection = db['thread_states']
@@ -1,49 +1,92 @@
 import hashlib
 import re
+import threading
 from typing import Tuple, Dict, Set, Optional, List, Any, Union
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import logging
 from collections import OrderedDict
 import uuid
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 import json
 
+from app.config import get_settings
+from app.core.structured_logging import ScanLog
+from app.core.tracing import count, span
+from app.services.cache_features import (
+    IP_WEIGHT, MICROSECOND, META_WEIGHT, RECIPIENT_WEIGHT, SENDER_WEIGHT, THREAD_WEIGHT,
+    EntryFeatures, FeatureStore, email_domain, epoch_micros, normalize_email_address, recipient_addresses
+)
+from app.services.embedding_store import EMBEDDING_FIELDS, EmbeddingStore
+from app.services.embedding_strategy import EmbeddingStrategy, get_embedding_strategy
+
 # Configure logging to show debug messages
 logger = logging.getLogger(__name__)
 
 class LRUCache:
     """
     Simple LRU cache implementation
+
+    Entry embeddings (content_embedding, subject_embedding) are not kept in the
+    entries: each entry gets a slot in an EmbeddingStore, which holds them
+    normalized at `embedding_precision`, and in a FeatureStore, which holds the
+    metadata and times the scan compares, so a scan scores the whole cache at once.
     """
-    def __init__(self, capacity: int = 1000):
+    def __init__(self, capacity: int = 1000, embedding_precision: str = "float16"):
         self.cache = OrderedDict()
         self.capacity = capacity
-        logger.info(f"Initialized LRUCache with capacity {capacity}")
+        self.embeddings = EmbeddingStore(embedding_precision, capacity=capacity)
+        self.features = FeatureStore(capacity=capacity)
+        # Cache key -> row of the entry's embeddings in the store
+        self.slots: Dict[str, int] = {}
+        self._free_slots: List[int] = []
+        # Held for a whole duplicate check, which scans and then updates the cache
+        self.lock = threading.RLock()
+        logger.info("Initialized LRUCache with capacity %s (%s embeddings)", capacity, embedding_precision)
     
     def get(self, key: str) -> Optional[Dict]:
         if key not in self.cache:
-            logger.info(f"Cache miss for key: {key}")
+            logger.debug("Cache miss for key: %s", key)
+            count("email_pipeline_cache_events_total", cache="duplicate_lru", result="miss")
             return None
         
         # Move to end (most recently used)
         value = self.cache.pop(key)
         self.cache[key] = value
-        logger.info(f"Cache hit for key: {key}")
+        self.features.touch(self.slots[key])
+        logger.debug("Cache hit for key: %s", key)
+        count("email_pipeline_cache_events_total", cache="duplicate_lru", result="hit")
         return value
     
     def put(self, key: str, value: Dict) -> None:
         if key in self.cache:
-            logger.info(f"Updating existing cache entry: {key}")
+            logger.debug("Updating existing cache entry: %s", key)
             self.cache.pop(key)
         elif len(self.cache) >= self.capacity:
             # Remove least recently used
             removed_key, _ = self.cache.popitem(last=False)
-            logger.info(f"Cache full, removing LRU entry: {removed_key}")
+            self._release(removed_key)
+            logger.debug("Cache full, removing LRU entry: %s", removed_key)
         else:
-            logger.info(f"Adding new cache entry: {key}")
-        
-        self.cache[key] = value
+            logger.debug("Adding new cache entry: %s", key)
+        
+        slot = self.slots.get(key)
+        if slot is None:
+            # Slots in use are 0..len-1 unless some were freed
+            slot = self._free_slots.pop() if self._free_slots else len(self.slots)
+            self.slots[key] = slot
+        for field in EMBEDDING_FIELDS:
+            self.embeddings.put(slot, field, value.get(field))
+        entry = {k: v for k, v in value.items() if k not in EMBEDDING_FIELDS}
+        self.features.put(slot, key, EntryFeatures.from_entry(entry))
+        self.cache[key] = entry
+    
+    def get_embeddings(self, key: str) -> Dict[str, np.ndarray]:
+        """Stored (normalized) embeddings of an entry, keyed like the entry fields"""
+        slot = self.slots.get(key)
+        if slot is None:
+            return {}
+        embeddings = {field: self.embeddings.get(slot, field) for field in EMBEDDING_FIELDS}
+        return {field: vector for field, vector in embeddings.items() if vector is not None}
     
     def items(self):
         return self.cache.items()
@@ -54,10 +97,31 @@ class LRUCache:
     def __len__(self):
         return len(self.cache)
     
+    def _release(self, key: str) -> None:
+        slot = self.slots.pop(key, None)
+        if slot is not None:
+            self.embeddings.clear(slot)
+            self.features.clear(slot)
+            self._free_slots.append(slot)
+    
     def remove(self, key: str) -> None:
         if key in self.cache:
-            logger.info(f"Manually removing cache entry: {key}")
+            logger.debug("Manually removing cache entry: %s", key)
             self.cache.pop(key)
+            self._release(key)
+    
+    def popitem(self, last: bool = True) -> Tuple[str, Dict]:
+        """Remove and return the most (last=True) or least recently used entry"""
+        key, value = self.cache.popitem(last=last)
+        self._release(key)
+        return key, value
+    
+    def clear(self) -> None:
+        self.cache.clear()
+        self.slots.clear()
+        self._free_slots.clear()
+        self.embeddings = EmbeddingStore(self.embeddings.precision, capacity=self.capacity)
+        self.features = FeatureStore(capacity=self.capacity)
 
 
 class EmbeddingProvider:
@@ -68,6 +132,10 @@ class EmbeddingProvider:
     def get_embedding(self, text: str) -> np.ndarray:
         """Get embedding vector for text"""
         raise NotImplementedError("Embedding provider must implement get_embedding")
+    
+    def get_embeddings(self, texts: List[str]) -> List[np.ndarray]:
+        """Get embedding vectors for several texts (providers may batch this)"""
+        return [self.get_embedding(text) for text in texts]
 
 
 class MockEmbeddingProvider(EmbeddingProvider):
@@ -80,12 +148,12 @@ class MockEmbeddingProvider(EmbeddingProvider):
         self.vocab = {}  # word -> index mapping
         self.vocab_size = 0
         self.max_vocab_size = 10000
-        logger.info(f"Initialized MockEmbeddingProvider with dim={embedding_dim}")
+        logger.info("Initialized MockEmbeddingProvider with dim=%s", embedding_dim)
     
     def _tokenize(self, text: str) -> List[str]:
         """Simple tokenizer - split on non-alphanumeric chars and lowercase"""
         tokens = re.findall(r'\w+', text.lower())
-        logger.info(f"Tokenized text into {len(tokens)} tokens")
+        logger.debug("Tokenized text into %s tokens", len(tokens))
         return tokens
     
     def _update_vocab(self, tokens: List[str]) -> None:
@@ -97,7 +165,7 @@ class MockEmbeddingProvider(EmbeddingProvider):
                 self.vocab_size += 1
         
         if self.vocab_size > initial_size:
-            logger.info(f"Vocabulary updated from {initial_size} to {self.vocab_size} tokens")
+            logger.debug("Vocabulary updated from %s to %s tokens", initial_size, self.vocab_size)
     
     def get_embedding(self, text: str) -> np.ndarray:
         """
@@ -105,7 +173,7 @@ class MockEmbeddingProvider(EmbeddingProvider):
         This is not a true semantic embedding but can work for basic similarity
         """
         if not text:
-            logger.info("Creating zero embedding for empty text")
+            logger.debug("Creating zero embedding for empty text")
             return np.zeros(self.embedding_dim)
         
         tokens = self._tokenize(text)
@@ -137,13 +205,13 @@ class MockEmbeddingProvider(EmbeddingProvider):
             if np.sum(result**2) > 0:
                 result = result / np.sqrt(np.sum(result**2))
             
-            logger.info(f"Created embedding with shape {result.shape}, norm={np.linalg.norm(result):.4f}")
+            logger.debug("Created embedding with shape %s, norm=%.4f", result.shape, np.linalg.norm(result))
             return result
         else:
             # Pad with zeros
             result = np.zeros(self.embedding_dim)
             result[:len(vec)] = vec
-            logger.info(f"Created embedding with shape {result.shape}, norm={np.linalg.norm(result):.4f}")
+            logger.debug("Created embedding with shape %s, norm=%.4f", result.shape, np.linalg.norm(result))
             return result
 
 
@@ -151,34 +219,68 @@ class SentenceTransformerProvider(EmbeddingProvider):
     """
     Embedding provider using SentenceTransformers
     Requires sentence-transformers to be installed
+
+    Backends (all run the same model on CPU):
+        torch       float32 PyTorch
+        torch-int8  PyTorch with the Linear layers dynamically quantized to int8
+        onnx        ONNX Runtime (requires sentence-transformers[onnx])
+        onnx-int8   ONNX Runtime with an int8-quantized export of the model (`onnx_file`)
+    A backend that cannot be loaded falls back to torch.
     """
-    def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
+    def __init__(self,
+                 model_name: str = "all-MiniLM-L6-v2",
+                 backend: str = "torch",
+                 onnx_file: str = "onnx/model_quint8_avx2.onnx"):
         try:
             from sentence_transformers import SentenceTransformer
-            self.model = SentenceTransformer(model_name)
-            logger.info(f"Loaded SentenceTransformer model: {model_name}")
+            self.backend = backend
+            try:
+                self.model = self._load(SentenceTransformer, model_name, backend, onnx_file)
+            except Exception as e:
+                if backend == "torch":
+                    raise
+                logger.error(f"Could not load {model_name} with the {backend} backend ({e}), using torch")
+                self.backend = "torch"
+                self.model = SentenceTransformer(model_name)
+            logger.info("Loaded SentenceTransformer model: %s (%s backend)", model_name, self.backend)
         except ImportError:
             logger.error("SentenceTransformers not installed. Using MockEmbeddingProvider as fallback.")
             self.model = None
             self.mock_provider = MockEmbeddingProvider()
             logger.info("Initialized MockEmbeddingProvider as fallback")
     
+    @staticmethod
+    def _load(model_class, model_name: str, backend: str, onnx_file: str):
+        if backend == "onnx":
+            return model_class(model_name, backend="onnx")
+        if backend == "onnx-int8":
+            # Model repositories such as all-MiniLM-L6-v2 ship quantized exports
+            # (model_qint8_avx512.onnx, model_quint8_avx2.onnx, model_qint8_arm64.onnx)
+            return model_class(model_name, backend="onnx", model_kwargs={"file_name": onnx_file})
+        model = model_class(model_name)
+        if backend == "torch-int8":
+            import torch
+            return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        if backend != "torch":
+            raise ValueError(f"Unknown embedding backend: {backend}")
+        return model
+    
     def get_embedding(self, text: str) -> np.ndarray:
         """Get embedding using sentence transformer model"""
         if not text:
             if self.model:
                 # Get the embedding dimension by encoding an empty string
                 empty_embedding = np.zeros(self.model.get_sentence_embedding_dimension())
-                logger.info(f"Created empty embedding with shape {empty_embedding.shape}")
+                logger.debug("Created empty embedding with shape %s", empty_embedding.shape)
                 return empty_embedding
             else:
                 return self.mock_provider.get_embedding("")
         
         if self.model:
             try:
-                logger.info(f"Generating embedding for text of length {len(text)}")
+                logger.debug("Generating embedding for text of length %s", len(text))
                 embedding = self.model.encode(text, convert_to_numpy=True)
-                logger.info(f"Created embedding with shape {embedding.shape}, norm={np.linalg.norm(embedding):.4f}")
+                logger.debug("Created embedding with shape %s, norm=%.4f", embedding.shape, np.linalg.norm(embedding))
                 return embedding
             except Exception as e:
                 logger.error(f"Error generating embedding with SentenceTransformer: {e}")
@@ -186,6 +288,74 @@ class SentenceTransformerProvider(EmbeddingProvider):
                 return self.mock_provider.get_embedding(text)
         else:
             return self.mock_provider.get_embedding(text)
+    
+    def get_embeddings(self, texts: List[str]) -> List[np.ndarray]:
+        """Encode non-empty texts in a single batched model call"""
+        if not self.model:
+            return [self.mock_provider.get_embedding(text) for text in texts]
+        
+        non_empty = [i for i, text in enumerate(texts) if text]
+        dim = self.model.get_sentence_embedding_dimension()
+        embeddings = [np.zeros(dim) for _ in texts]
+        if non_empty:
+            try:
+                logger.debug("Generating %s embeddings in one batch", len(non_empty))
+                encoded = self.model.encode([texts[i] for i in non_empty], convert_to_numpy=True)
+                for i, embedding in zip(non_empty, encoded):
+                    embeddings[i] = embedding
+            except Exception as e:
+                logger.error(f"Error generating batched embeddings with SentenceTransformer: {e}")
+                return [self.get_embedding(text) for text in texts]
+        return embeddings
+
+
+# Loading the model takes seconds and hundreds of MB, so one provider is shared
+# by every detector in the process
+_embedding_provider: Optional[EmbeddingProvider] = None
+_embedding_provider_lock = threading.Lock()
+
+
+def load_embedding_provider() -> EmbeddingProvider:
+    """
+    Load the configured embedding model in this process
+
+    Returns:
+        SentenceTransformerProvider for `embedding_model`, or MockEmbeddingProvider
+        if it cannot be created
+    """
+    with span("dedup.embedding_model_load"):
+        try:
+            logger.info("Attempting to initialize SentenceTransformerProvider")
+            settings = get_settings()
+            return SentenceTransformerProvider(
+                settings.embedding_model,
+                backend=settings.embedding_backend,
+                onnx_file=settings.embedding_onnx_file
+            )
+        except Exception as e:
+            logger.warning(f"Failed to initialize SentenceTransformerProvider: {e}")
+            logger.info("Falling back to MockEmbeddingProvider")
+            return MockEmbeddingProvider()
+
+
+def get_embedding_provider() -> EmbeddingProvider:
+    """
+    Get the shared embedding provider, loading the model on first use
+
+    With `model_sharing` set to "sidecar" the provider is a client of the model
+    sidecar process instead, so the model is not loaded in this process at all.
+    """
+    global _embedding_provider
+    if _embedding_provider is None:
+        with _embedding_provider_lock:
+            if _embedding_provider is None:
+                settings = get_settings()
+                if settings.model_sharing == "sidecar":
+                    from app.services.model_sidecar import SidecarEmbeddingProvider
+                    _embedding_provider = SidecarEmbeddingProvider(settings.model_sidecar_socket)
+                else:
+                    _embedding_provider = load_embedding_provider()
+    return _embedding_provider
 
 
 class IntelligentDuplicateDetector:
@@ -203,7 +373,8 @@ class IntelligentDuplicateDetector:
         subject_weight: float = 0.3,
         content_weight: float = 0.7,
         time_window_hours: int = 72,
-        email_cache: LRUCache = None
+        email_cache: LRUCache = None,
+        embedding_strategy: Optional[EmbeddingStrategy] = None
     ):
         """
         Initialize the intelligent duplicate detector
@@ -211,12 +382,13 @@ class IntelligentDuplicateDetector:
         Args:
             cache_duration_days: Number of days to keep emails in cache
             cache_size: Maximum number of emails to keep in cache
-            embedding_provider: Provider for text embeddings (defaults to mock if None)
+            embedding_provider: Provider for text embeddings (defaults to the shared provider)
             semantic_threshold: Threshold for considering content semantically similar
             metadata_weight: Weight to give metadata vs content (0-1)
             subject_weight: Weight for subject vs body in content similarity
             content_weight: Weight for content in overall similarity
             time_window_hours: Time window to consider for duplicates (in hours)
+            embedding_strategy: Which part of long texts is embedded (defaults to the configured one)
         """
         # Use LRU cache for storage
         self.email_cache = email_cache
@@ -224,16 +396,12 @@ class IntelligentDuplicateDetector:
         
         # Set up embedding provider
         if embedding_provider is None:
-            try:
-                logger.info("Attempting to initialize SentenceTransformerProvider")
-                self.embedding_provider = SentenceTransformerProvider()
-            except Exception as e:
-                logger.warning(f"Failed to initialize SentenceTransformerProvider: {e}")
-                logger.info("Falling back to MockEmbeddingProvider")
-                self.embedding_provider = MockEmbeddingProvider()
+            self.embedding_provider = get_embedding_provider()
         else:
             self.embedding_provider = embedding_provider
-            logger.info(f"Using provided embedding provider: {type(embedding_provider).__name__}")
+            logger.info("Using provided embedding provider: %s", type(embedding_provider).__name__)
+        
+        self.embedding_strategy = embedding_strategy or get_embedding_strategy()
         
         # Configuration parameters
         self.semantic_threshold = semantic_threshold
@@ -259,7 +427,9 @@ class IntelligentDuplicateDetector:
         in_reply_to: Optional[str] = None,
         thread_id: Optional[str] = None,
         ip_address: Optional[str] = None,
-        additional_metadata: Optional[Dict[str, Any]] = None
+        additional_metadata: Optional[Dict[str, Any]] = None,
+        content_embedding: Optional[np.ndarray] = None,
+        subject_embedding: Optional[np.ndarray] = None
     ) -> Tuple[bool, Optional[str], Optional[float], Optional[str]]:
         """
         Check if an email is a duplicate using semantic content similarity and metadata
@@ -276,190 +446,181 @@ class IntelligentDuplicateDetector:
             thread_id: Optional thread identifier
             ip_address: Sender's IP address if available
             additional_metadata: Any additional metadata to consider
+            content_embedding: Precomputed content embedding (see compute_embeddings)
+            subject_embedding: Precomputed subject embedding (see compute_embeddings)
             
         Returns:
             Tuple of (is_duplicate, reason, confidence_score, duplicate_id)
         """
-        logger.info(f"Checking duplicate for email from {sender} with subject '{subject}'")
-        logger.info(f"Email details: message_id={message_id}, thread_id={thread_id}, ip={ip_address}")
+        logger.debug("Checking duplicate for email from %s with subject '%s'", sender, subject)
+        logger.debug("Email details: message_id=%s, thread_id=%s, ip=%s", message_id, thread_id, ip_address)
         
         # Clean up expired cache entries
-        expired_count = self._cleanup_cache()
-        logger.info(f"Cleaned up {expired_count} expired entries from cache")
+        with span("dedup.cache_cleanup"):
+            expired_count = self._cleanup_cache()
+        logger.debug("Cleaned up %s expired entries from cache", expired_count)
         
         # Set timestamp if not provided
         current_time = datetime.now()
-        logger.info(f"Current time: {current_time.isoformat()}")
+        logger.debug("Current time: %s", current_time.isoformat())
         
         if received_date is None:
             received_date = current_time
-            logger.info(f"No received_date provided, using current time: {received_date.isoformat()}")
+            logger.debug("No received_date provided, using current time: %s", received_date.isoformat())
         elif isinstance(received_date, str):
             try:
                 received_date = datetime.fromisoformat(received_date)
-                logger.info(f"Parsed received_date from string: {received_date.isoformat()}")
+                logger.debug("Parsed received_date from string: %s", received_date.isoformat())
             except ValueError:
                 logger.warning(f"Could not parse received_date: {received_date}, using current time")
                 received_date = current_time
         
         # Get message embeddings
-        logger.info("Normalizing email content and subject")
+        logger.debug("Normalizing email content and subject")
         normalized_content = self._normalize_email(email_content)
         normalized_subject = self._normalize_subject(subject)
         
-        logger.info(f"Normalized content length: {len(normalized_content)}")
-        logger.info(f"Normalized subject: '{normalized_subject}'")
-        
-        logger.info("Generating content embedding")
-        content_embedding = self.embedding_provider.get_embedding(normalized_content)
-        logger.info("Generating subject embedding")
-        subject_embedding = self.embedding_provider.get_embedding(normalized_subject)
+        logger.debug("Normalized content length: %s", len(normalized_content))
+        logger.debug("Normalized subject: '%s'", normalized_subject)
+        
+        with span("dedup.embedding", precomputed=content_embedding is not None and subject_embedding is not None):
+            if content_embedding is None and subject_embedding is None:
+                logger.debug("Generating content and subject embeddings")
+                content_embedding, subject_embedding = self.embedding_strategy.embed(
+                    self.embedding_provider, [normalized_content, normalized_subject]
+                )
+            elif content_embedding is None:
+                logger.debug("Generating content embedding")
+                content_embedding = self.embedding_strategy.embed(self.embedding_provider, [normalized_content])[0]
+            elif subject_embedding is None:
+                logger.debug("Generating subject embedding")
+                subject_embedding = self.embedding_strategy.embed(self.embedding_provider, [normalized_subject])[0]
         
         # Get thread identifier if available
-        derived_thread_id = thread_id
-        if not derived_thread_id and references:
-            derived_thread_id = references[0]  # Use first reference as thread ID
-            logger.info(f"Using first reference as thread_id: {derived_thread_id}")
-        if not derived_thread_id and in_reply_to:
-            derived_thread_id = in_reply_to
-            logger.info(f"Using in_reply_to as thread_id: {derived_thread_id}")
+        derived_thread_id = self._derive_thread_id(thread_id, references, in_reply_to)
         
         # Create a unique ID for this email
         email_id = str(uuid.uuid4())
         if message_id:
             # Use hash of message_id as email_id if available
             email_id = self._generate_hash(message_id)
-            logger.info(f"Generated email_id from message_id: {email_id}")
+            logger.debug("Generated email_id from message_id: %s", email_id)
         else:
-            logger.info(f"Generated random email_id: {email_id}")
-        
-        # Check for email with the same Message-ID
-        if message_id:
-            logger.info(f"Checking for duplicate message_id: {message_id}")
-            for cache_key, entry in self.email_cache.items():
-                if entry.get('message_id') == message_id:
+            logger.debug("Generated random email_id: %s", email_id)
+        
+        cache = self.email_cache
+        features = cache.features
+        with span("dedup.cache_scan", entries=len(cache)):
+            # Check for email with the same Message-ID
+            if message_id:
+                logger.debug("Checking for duplicate message_id: %s", message_id)
+                cache_key = features.find_message_id(message_id, cache.cache)
+                if cache_key is not None:
+                    entry = cache.cache[cache_key]
                     match_time = entry.get('received_date', 'unknown time')
-                    logger.info(f"Found exact message_id match: {cache_key} from {entry['sender']} ({match_time})")
+                    logger.info("Found exact message_id match: %s from %s (%s)", cache_key, entry['sender'], match_time)
+                    count("email_pipeline_duplicate_checks_total", result="message_id")
                     return True, f"Duplicate message ID from {entry['sender']} ({match_time})", 1.0, entry['id']
-        
-        # Check for potential duplicates within time window
-        logger.info("Checking for potential semantic duplicates")
-        potential_duplicates = []
-        
-        for key, entry in self.email_cache.items():
-            logger.info(f"Checking cache entry: {key}")
-            
-            # Skip if entries are too far apart in time
-            entry_time = entry.get('received_date')
-            if isinstance(entry_time, str):
-                try:
-                    entry_time = datetime.fromisoformat(entry_time)
-                    logger.info(f"Parsed entry time: {entry_time.isoformat()}")
-                except ValueError:
-                    logger.warning(f"Could not parse entry received_date: {entry_time}")
-                    entry_time = None
-            
-            if entry_time and isinstance(received_date, datetime):
-                # Ensure both datetime objects are comparable (both naive or both aware)
-                if received_date.tzinfo is not None and entry_time.tzinfo is None:
-                    # Convert entry_time to UTC to match received_date
-                    from datetime import timezone
-                    entry_time = entry_time.replace(tzinfo=timezone.utc)
-                elif received_date.tzinfo is None and entry_time.tzinfo is not None:
-                    # Convert received_date to UTC to match entry_time
-                    from datetime import timezone
-                    received_date = received_date.replace(tzinfo=timezone.utc)
-                
-                # Now they can be safely compared
-                time_diff = abs(received_date - entry_time)
-                logger.info(f"Time difference: {time_diff.total_seconds()/3600:.2f} hours")
-                
-                # Skip if emails are outside our time window
-                if time_diff > self.time_window:
-                    logger.info(f"Skipping entry {key} - outside time window")
-                    continue
             
-            # Calculate metadata similarity
-            logger.info("Calculating metadata similarity")
-            metadata_sim = self._calculate_metadata_similarity(
-                sender, recipient, entry.get('sender', ''), entry.get('recipient', ''),
-                ip_address, entry.get('ip_address'), derived_thread_id, entry.get('thread_id'),
-                additional_metadata, entry.get('additional_metadata')
-            )
-            logger.info(f"Metadata similarity: {metadata_sim:.4f}")
-            
-            # Calculate content similarity
-            content_sim = 0.0
-            if 'content_embedding' in entry:
-                logger.info("Calculating content similarity")
-                content_sim = self._calculate_embedding_similarity(content_embedding, entry['content_embedding'])
-                logger.info(f"Content similarity: {content_sim:.4f}")
-            else:
-                logger.info("No content embedding in cache entry, skipping content similarity")
-            
-            # Calculate subject similarity
-            subject_sim = 0.0
-            if 'subject_embedding' in entry:
-                logger.info("Calculating subject similarity")
-                subject_sim = self._calculate_embedding_similarity(subject_embedding, entry['subject_embedding'])
-                logger.info(f"Subject similarity: {subject_sim:.4f}")
-            else:
-                logger.info("No subject embedding in cache entry, skipping subject similarity")
+            # Every entry is scored at once from the features computed when it was cached
+            # Per-entry details are sampled at DEBUG; the scan emits one summary line
+            scan = ScanLog(logger, "duplicate scan")
+            occupied = features.occupied()
+            sampled = scan.add(len(occupied))
+            
+            has_time, time_diffs = features.time_differences(epoch_micros(received_date), occupied)
+            unparseable = int(np.count_nonzero(features.columns["unparseable_date"][occupied]))
+            if unparseable:
+                scan.incr("unparseable_dates", unparseable)
+            # Compared with a timezone-aware entry, a naive receive time is read (and cached) as UTC,
+            # and so are the naive entry times after that entry in LRU order
+            aware_since = None if received_date.tzinfo is None else 0
+            aware = occupied[has_time & features.columns["received_aware"][occupied]]
+            if aware_since is None and len(aware):
+                aware_since = int(features.columns["sequence"][features.first(aware)])
+                received_date = received_date.replace(tzinfo=timezone.utc)
+            
+            # Skip entries outside our time window
+            in_window = ~(has_time & (time_diffs > self.time_window // MICROSECOND))
+            outside = len(occupied) - int(np.count_nonzero(in_window))
+            if outside:
+                scan.incr("outside_window", outside)
+            slots, has_time, time_diffs = occupied[in_window], has_time[in_window], time_diffs[in_window]
+            
+            query = EntryFeatures.from_entry({
+                'sender': sender, 'recipient': recipient, 'ip_address': ip_address,
+                'thread_id': derived_thread_id, 'additional_metadata': additional_metadata
+            })
+            metadata_sims = features.metadata_similarity(query, slots, cache.cache)
+            # Content and subject similarity of every candidate in one pass over the stored embeddings
+            content_sims = cache.embeddings.similarities('content_embedding', content_embedding, slots).astype(np.float64)
+            subject_sims = cache.embeddings.similarities('subject_embedding', subject_embedding, slots).astype(np.float64)
             
             # Combined similarity score weighted by importance
-            combined_content_sim = (self.content_weight * content_sim + 
-                                    self.subject_weight * subject_sim) / (self.content_weight + self.subject_weight)
-            logger.info(f"Combined content similarity: {combined_content_sim:.4f}")
+            combined_content_sims = (self.content_weight * content_sims +
+                                     self.subject_weight * subject_sims) / (self.content_weight + self.subject_weight)
             
             # Overall score with metadata and content components
-            overall_score = (self.metadata_weight * metadata_sim + 
-                           (1 - self.metadata_weight) * combined_content_sim)
-            logger.info(f"Overall score before time factor: {overall_score:.4f}")
+            overall_scores = (self.metadata_weight * metadata_sims +
+                              (1 - self.metadata_weight) * combined_content_sims)
             
             # Add timing factor - emails closer in time are more likely to be duplicates
-            time_factor = 1.0
-            if entry_time and isinstance(received_date, datetime):
-                # Normalize time difference to a factor between 0.7 and 1.0
-                # Closer in time = higher factor
-                hours_diff = min(self.time_window.total_seconds() / 3600, time_diff.total_seconds() / 3600)
-                max_hours = self.time_window.total_seconds() / 3600
-                time_factor = 1.0 - (0.3 * hours_diff / max_hours)
-                logger.info(f"Time factor: {time_factor:.4f} (diff: {hours_diff:.2f}h, max: {max_hours:.2f}h)")
-            
-            final_score = overall_score * time_factor
-            logger.info(f"Final similarity score: {final_score:.4f}")
-            
-            # If sufficient similarity, add to potential duplicates
-            if final_score >= 0.5:  # Lower threshold for potential candidates
-                logger.info(f"Adding to potential duplicates (score: {final_score:.4f})")
-                potential_duplicates.append({
+            # Normalize time difference to a factor between 0.7 and 1.0 (closer in time = higher factor)
+            max_hours = self.time_window.total_seconds() / 3600
+            hours_diffs = np.minimum(max_hours, time_diffs / 1e6 / 3600)
+            time_factors = np.where(has_time, 1.0 - (0.3 * hours_diffs / max_hours), 1.0)
+            
+            final_scores = overall_scores * time_factors
+            if len(final_scores):
+                scan.observe_max("score", float(final_scores.max()))
+            if sampled:
+                # Item numbers follow the cache's LRU order
+                numbers = np.empty(len(occupied), dtype=np.int64)
+                numbers[np.argsort(features.columns["sequence"][occupied], kind="stable")] = np.arange(1, len(occupied) + 1)
+                numbers = numbers[in_window]
+                for i in np.flatnonzero(np.isin(numbers, sampled)):
+                    scan.sample(
+                        "entry %s: metadata=%.4f content=%.4f subject=%.4f time_factor=%.4f final=%.4f",
+                        features.columns["key"][slots[i]], metadata_sims[i], content_sims[i], subject_sims[i],
+                        time_factors[i], final_scores[i], item=int(numbers[i])
+                    )
+            
+            # Entries with sufficient similarity are potential duplicates; the best is the
+            # highest score, the least recently used one among equal scores
+            candidates = np.flatnonzero(final_scores >= 0.5)  # Lower threshold for potential candidates
+            best_match = None
+            if len(candidates):
+                scan.incr("candidates", len(candidates))
+                best_scores = candidates[final_scores[candidates] == final_scores[candidates].max()]
+                i = best_scores[np.argmin(features.columns["sequence"][slots[best_scores]])]
+                entry = cache.cache[features.columns["key"][slots[i]]]
+                best_match = {
                     'id': entry['id'],
                     'sender': entry['sender'],
                     'subject': entry.get('subject', ''),
-                    'received_date': entry_time,
-                    'score': final_score,
-                    'metadata_sim': metadata_sim,
-                    'content_sim': content_sim,
-                    'subject_sim': subject_sim,
-                    'time_factor': time_factor
-                })
-            else:
-                logger.info(f"Score below threshold (0.5), not adding to potential duplicates")
-        
-        logger.info(f"Found {len(potential_duplicates)} potential duplicates")
+                    'received_date': self._entry_time(
+                        entry, aware_since is not None and features.columns["sequence"][slots[i]] > aware_since
+                    ),
+                    'score': float(final_scores[i]),
+                    'metadata_sim': float(metadata_sims[i]),
+                    'content_sim': float(content_sims[i]),
+                    'subject_sim': float(subject_sims[i]),
+                    'time_factor': float(time_factors[i])
+                }
         
-        # Sort potential duplicates by score (highest first)
-        potential_duplicates.sort(key=lambda x: x['score'], reverse=True)
+        scan.summary(
+            message="Duplicate scan complete",
+            sender=sender,
+            best_id=best_match['id'] if best_match else None
+        )
         
         # If we have potential duplicates, evaluate the best match
-        if potential_duplicates:
-            best_match = potential_duplicates[0]
-            logger.info(f"Best match: id={best_match['id']}, score={best_match['score']:.4f}")
-            
+        if best_match:
             # High confidence duplicate
             if best_match['score'] >= self.semantic_threshold:
                 reason = self._generate_duplicate_reason(best_match)
-                logger.info(f"High confidence duplicate detected: {reason}")
+                logger.info("High confidence duplicate detected: %s", reason)
+                count("email_pipeline_duplicate_checks_total", result="duplicate")
                 return True, reason, best_match['score'], best_match['id']
             
             # Medium confidence duplicate
@@ -467,8 +628,7 @@ class IntelligentDuplicateDetector:
                 reason = f"Likely duplicate of email from {best_match['sender']}"
                 if best_match['received_date']:
                     reason += f" (received: {best_match['received_date'].isoformat() if isinstance(best_match['received_date'], datetime) else best_match['received_date']})"
-                logger.info(f"Medium confidence duplicate detected: {reason}")
-                logger.info(f"adding to cache with id {email_id}")
+                logger.info("Medium confidence duplicate detected: %s, adding to cache with id %s", reason, email_id)
                 # medium confidence duplicates also go into cache
                 email_data = {
                     'id': email_id,
@@ -489,16 +649,13 @@ class IntelligentDuplicateDetector:
                 # Add any additional metadata
                 if additional_metadata:
                     email_data['additional_metadata'] = additional_metadata
-                    logger.info(f"Added additional metadata: {len(additional_metadata)} fields")
                 
                 # Store in cache
                 self.email_cache.put(email_id, email_data)
+                count("email_pipeline_duplicate_checks_total", result="likely_duplicate")
                 return True, reason, best_match['score'], best_match['id']
-            
-            logger.info(f"Best match score {best_match['score']:.4f} below threshold, not treating as duplicate")
         
         # Not a duplicate, add to cache
-        logger.info(f"No duplicate found, adding to cache with id {email_id}")
         email_data = {
             'id': email_id,
             'content_embedding': content_embedding,
@@ -518,18 +675,48 @@ class IntelligentDuplicateDetector:
         # Add any additional metadata
         if additional_metadata:
             email_data['additional_metadata'] = additional_metadata
-            logger.info(f"Added additional metadata: {len(additional_metadata)} fields")
         
         # Store in cache
         self.email_cache.put(email_id, email_data)
-        logger.info(f"Email added to cache, new cache size: {len(self.email_cache)}")
+        logger.debug("No duplicate found, added %s to cache (size %d)", email_id, len(self.email_cache))
+        count("email_pipeline_duplicate_checks_total", result="unique")
         
         return False, None, 0.0, None
     
+    def compute_embeddings(self, emails: List[Tuple[str, str]]) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Compute content and subject embeddings for several emails in one provider call
+        
+        Args:
+            emails: List of (email_content, subject) pairs
+            
+        Returns:
+            List of (content_embedding, subject_embedding) pairs, in input order
+        """
+        texts = []
+        for email_content, subject in emails:
+            texts.append(self._normalize_email(email_content))
+            texts.append(self._normalize_subject(subject))
+        with span("dedup.embedding_batch", emails=len(emails)):
+            embeddings = self.embedding_strategy.embed(self.embedding_provider, texts)
+        return [(embeddings[i], embeddings[i + 1]) for i in range(0, len(embeddings), 2)]
+    
+    def _derive_thread_id(self, thread_id: Optional[str], references: Optional[List[str]],
+                          in_reply_to: Optional[str]) -> Optional[str]:
+        """Thread identifier of an email: its own, else the first reference, else In-Reply-To"""
+        derived_thread_id = thread_id
+        if not derived_thread_id and references:
+            derived_thread_id = references[0]  # Use first reference as thread ID
+            logger.debug("Using first reference as thread_id: %s", derived_thread_id)
+        if not derived_thread_id and in_reply_to:
+            derived_thread_id = in_reply_to
+            logger.debug("Using in_reply_to as thread_id: %s", derived_thread_id)
+        return derived_thread_id
+    
     def _normalize_email(self, content: str) -> str:
         """Normalize email content for semantic comparison"""
         if not content:
-            logger.info("Empty content to normalize")
+            logger.debug("Empty content to normalize")
             return ""
             
         # Remove email forwarding/reply markers
@@ -542,13 +729,13 @@ class IntelligentDuplicateDetector:
         # Remove extra whitespace and line breaks
         content = re.sub(r'\s+', ' ', content).strip()
         
-        logger.info(f"Normalized email content from {len(content)} characters")
+        logger.debug("Normalized email content from %s characters", len(content))
         return content
     
     def _normalize_subject(self, subject: str) -> str:
         """Normalize email subject for comparison"""
         if not subject:
-            logger.info("Empty subject to normalize")
+            logger.debug("Empty subject to normalize")
             return ""
             
         original_subject = subject
@@ -560,7 +747,7 @@ class IntelligentDuplicateDetector:
         subject = re.sub(r'\s+', ' ', subject).strip()
         
         if subject != original_subject:
-            logger.info(f"Normalized subject: '{original_subject}' -> '{subject}'")
+            logger.debug("Normalized subject: '%s' -> '%s'", original_subject, subject)
         
         return subject
     
@@ -568,27 +755,26 @@ class IntelligentDuplicateDetector:
         """Generate a hash for the text"""
         if not text:
             hash_val = hashlib.md5(b"empty").hexdigest()
-            logger.info(f"Generated hash for empty text: {hash_val}")
+            logger.debug("Generated hash for empty text: %s", hash_val)
             return hash_val
             
         hash_val = hashlib.md5(text.encode('utf-8')).hexdigest()
-        logger.info(f"Generated hash: {hash_val}")
+        logger.debug("Generated hash: %s", hash_val)
         return hash_val
     
     def _calculate_embedding_similarity(self, embedding1: np.ndarray, embedding2: np.ndarray) -> float:
         """Calculate cosine similarity between two embeddings"""
         if embedding1 is None or embedding2 is None:
-            logger.info("Null embedding provided, returning 0 similarity")
             return 0.0
             
-        # Reshape for sklearn
-        v1 = embedding1.reshape(1, -1)
-        v2 = embedding2.reshape(1, -1)
-        
         try:
-            similarity = float(cosine_similarity(v1, v2)[0][0])
-            logger.info(f"Embedding similarity: {similarity:.4f}")
-            return similarity
+            v1 = np.asarray(embedding1, dtype=np.float64).ravel()
+            v2 = np.asarray(embedding2, dtype=np.float64).ravel()
+            norm = np.linalg.norm(v1) * np.linalg.norm(v2)
+            # Like sklearn's cosine_similarity, a zero vector is similar to nothing
+            if norm == 0:
+                return 0.0
+            return float(np.dot(v1, v2) / norm)
         except Exception as e:
             logger.error(f"Error calculating embedding similarity: {e}")
             return 0.0
@@ -607,35 +793,28 @@ class IntelligentDuplicateDetector:
         meta2: Optional[Dict] = None
     ) -> float:
         """Calculate similarity between email metadata"""
-        logger.info(f"Calculating metadata similarity between {sender1} and {sender2}")
         score = 0.0
         total_weight = 0.0
         
         # Sender match (high weight)
         if sender1 and sender2:
-            sender_weight = 0.4
+            sender_weight = SENDER_WEIGHT
             norm_sender1 = self._normalize_email_address(sender1)
             norm_sender2 = self._normalize_email_address(sender2)
             
-            logger.info(f"Normalized senders: '{norm_sender1}' vs '{norm_sender2}'")
-            
             if norm_sender1 == norm_sender2:
                 score += sender_weight
-                logger.info("Exact sender match")
             elif self._get_email_domain(sender1) == self._get_email_domain(sender2):
                 # Same domain partial match
                 score += sender_weight * 0.5
-                logger.info("Same sender domain match")
             total_weight += sender_weight
         
         # Recipient match
         if recipient1 and recipient2:
-            recipient_weight = 0.2
+            recipient_weight = RECIPIENT_WEIGHT
             # Normalize and split recipients (could be multiple)
-            recip1_set = {self._normalize_email_address(r.strip()) for r in recipient1.split(',') if r.strip()}
-            recip2_set = {self._normalize_email_address(r.strip()) for r in recipient2.split(',') if r.strip()}
-            
-            logger.info(f"Recipients: {recip1_set} vs {recip2_set}")
+            recip1_set = recipient_addresses(recipient1)
+            recip2_set = recipient_addresses(recipient2)
             
             if recip1_set and recip2_set:
                 # Calculate overlap between recipient sets
@@ -644,82 +823,70 @@ class IntelligentDuplicateDetector:
                 if total > 0:
                     recipient_score = recipient_weight * (overlap / total)
                     score += recipient_score
-                    logger.info(f"Recipient overlap: {overlap}/{total} = {recipient_score:.4f}")
                 else:
                     score += 0
                 total_weight += recipient_weight
         
         # IP address match (if available)
         if ip1 and ip2:
-            ip_weight = 0.1
-            logger.info(f"IP addresses: {ip1} vs {ip2}")
+            ip_weight = IP_WEIGHT
             if ip1 == ip2:
                 score += ip_weight
-                logger.info("IP address match")
             total_weight += ip_weight
         
         # Thread ID match
         if thread_id1 and thread_id2:
-            thread_weight = 0.3
-            logger.info(f"Thread IDs: {thread_id1} vs {thread_id2}")
+            thread_weight = THREAD_WEIGHT
             if thread_id1 == thread_id2:
                 score += thread_weight
-                logger.info("Thread ID match")
             total_weight += thread_weight
         
         # Additional metadata matches
         if meta1 and meta2:
-            meta_weight = 0.1
+            meta_weight = META_WEIGHT
             meta_matches = 0
             meta_total = 0
             
             # Compare common keys
             common_keys = set(meta1.keys()).intersection(set(meta2.keys()))
-            logger.info(f"Common metadata keys: {common_keys}")
             
             for key in common_keys:
                 meta_total += 1
                 if meta1[key] == meta2[key]:
                     meta_matches += 1
-                    logger.info(f"Metadata match for key '{key}': {meta1[key]}")
             
             if meta_total > 0:
                 meta_score = meta_weight * (meta_matches / meta_total)
                 score += meta_score
-                logger.info(f"Metadata matches: {meta_matches}/{meta_total} = {meta_score:.4f}")
                 total_weight += meta_weight
         
         # Normalize score
         final_score = score / max(total_weight, 0.001)
-        logger.info(f"Final metadata similarity: {final_score:.4f} (score={score:.4f}, weight={total_weight:.4f})")
         return final_score
     
     def _normalize_email_address(self, email: str) -> str:
         """Normalize email address for comparison"""
-        if not email:
-            return ""
-        
-        # Extract just the email if it's in "Display Name <email>" format
-        match = re.search(r'<(.+@.+)>', email)
-        if match:
-            email = match.group(1)
-            logger.info(f"Extracted email from display name format: {email}")
-        
-        normalized = email.strip().lower()
-        return normalized
+        return normalize_email_address(email)
     
     def _get_email_domain(self, email: str) -> str:
         """Extract domain from email address"""
-        email = self._normalize_email_address(email)
-        if '@' in email:
-            domain = email.split('@')[-1]
-            logger.info(f"Extracted domain from {email}: {domain}")
-            return domain
-        return ""
+        return email_domain(email)
+    
+    def _entry_time(self, entry: Dict, as_utc: bool) -> Optional[datetime]:
+        """A cache entry's receive time, with a naive one read as UTC if `as_utc`"""
+        entry_time = entry.get('received_date')
+        if isinstance(entry_time, str):
+            try:
+                entry_time = datetime.fromisoformat(entry_time)
+            except ValueError:
+                return None
+        if isinstance(entry_time, datetime) and as_utc and entry_time.tzinfo is None:
+            entry_time = entry_time.replace(tzinfo=timezone.utc)
+        return entry_time
     
     def _generate_duplicate_reason(self, match: Dict) -> str:
         """Generate a descriptive reason for why this is a duplicate"""
-        logger.info(f"Generating duplicate reason for match: {match['id']}")
+        logger.debug("Generating duplicate reason for match: %s", match['id'])
         reason = f"Duplicate email from {match['sender']}"
         
         if match['received_date']:
@@ -744,35 +911,20 @@ class IntelligentDuplicateDetector:
         if details:
             reason += f" ({', '.join(details)})"
         
-        logger.info(f"Generated duplicate reason: {reason}")
+        logger.debug("Generated duplicate reason: %s", reason)
         return reason
     
     def _cleanup_cache(self) -> int:
         """Remove expired entries from the cache"""
-        now = datetime.now()
-        expired_keys = []
-        
-        logger.info(f"Cleaning up cache with {len(self.email_cache)} entries")
-        
-        for key, entry in self.email_cache.items():
-            if 'expiry' in entry:
-                try:
-                    if isinstance(entry['expiry'], str):
-                        expiry = datetime.fromisoformat(entry['expiry'])
-                    else:
-                        expiry = entry['expiry']
-                    
-                    if expiry < now:
-                        expired_keys.append(key)
-                        logger.info(f"Found expired entry: {key}, expiry: {expiry}")
-                except (ValueError, TypeError) as e:
-                    logger.warning(f"Invalid expiry format in cache entry {key}: {e}")
+        logger.debug("Cleaning up cache with %s entries", len(self.email_cache))
         
+        # Expiry times were parsed when the entries were cached
+        expired_keys = self.email_cache.features.expired_keys(datetime.now())
         for key in expired_keys:
             self.email_cache.remove(key)
             
         if expired_keys:
-            logger.info(f"Removed {len(expired_keys)} expired entries from email cache")
+            logger.info("Removed %s expired entries from email cache", len(expired_keys))
         
         return len(expired_keys)
     
@@ -789,13 +941,13 @@ class IntelligentDuplicateDetector:
             }
         }
         
-        logger.info(f"Current detector stats: cache_size={stats['cache_size']}")
+        logger.debug("Current detector stats: cache_size=%s", stats['cache_size'])
         return stats
     
     def save_state(self, file_path: str) -> bool:
         """Save detector state to a file"""
         try:
-            logger.info(f"Saving detector state to {file_path}")
+            logger.info("Saving detector state to %s", file_path)
             state = {
                 "configuration": {
                     "semantic_threshold": self.semantic_threshold,
@@ -810,10 +962,10 @@ class IntelligentDuplicateDetector:
             # Convert cache entries to serializable format
             for key, entry in self.email_cache.items():
                 serializable_entry = {}
-                for k, v in entry.items():
+                for k, v in {**entry, **self.email_cache.get_embeddings(key)}.items():
                     if isinstance(v, np.ndarray):
                         serializable_entry[k] = v.tolist()
-                        logger.info(f"Converted numpy array to list for key {k}")
+                        logger.debug("Converted numpy array to list for key %s", k)
                     else:
                         serializable_entry[k] = v
                 state["cache"][key] = serializable_entry
@@ -821,7 +973,7 @@ class IntelligentDuplicateDetector:
             with open(file_path, 'w') as f:
                 json.dump(state, f)
             
-            logger.info(f"Successfully saved state with {len(state['cache'])} cache entries")
+            logger.info("Successfully saved state with %s cache entries", len(state['cache']))
             return True
         except Exception as e:
             logger.error(f"Error saving state to {file_path}: {e}")
@@ -830,14 +982,14 @@ class IntelligentDuplicateDetector:
     def load_state(self, file_path: str) -> bool:
         """Load detector state from a file"""
         try:
-            logger.info(f"Loading detector state from {file_path}")
+            logger.info("Loading detector state from %s", file_path)
             with open(file_path, 'r') as f:
                 state = json.load(f)
             
             # Restore configuration
             if "configuration" in state:
                 config = state["configuration"]
-                logger.info(f"Loaded configuration: {config}")
+                logger.info("Loaded configuration: %s", config)
                 self.semantic_threshold = config.get("semantic_threshold", self.semantic_threshold)
                 self.metadata_weight = config.get("metadata_weight", self.metadata_weight)
                 self.subject_weight = config.get("subject_weight", self.subject_weight)
@@ -855,14 +1007,14 @@ class IntelligentDuplicateDetector:
                     for k, v in entry.items():
                         if k.endswith('_embedding') and isinstance(v, list):
                             entry[k] = np.array(v)
-                            logger.info(f"Converted list back to numpy array for {k}")
+                            logger.debug("Converted list back to numpy array for %s", k)
                     
                     self.email_cache.put(key, entry)
                     cache_count += 1
                 
-                logger.info(f"Restored {cache_count} cache entries")
+                logger.debug("Restored %s cache entries", cache_count)
             
-            logger.info(f"Successfully loaded state from {file_path}")
+            logger.info("Successfully loaded state from %s", file_path)
             return True
         except Exception as e:
             logger.error(f"Error loading state from {file_path}: {e}")
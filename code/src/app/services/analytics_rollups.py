@@ -0,0 +1,452 @@
+import asyncio
+import contextvars
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from app.core.tracing import count, span
+from app.schemas.analytics import (analytics_collection, analytics_rollups_collection, duplicate_analytics_collection,
+                                   stored_timestamp)
+
+logger = logging.getLogger(__name__)
+
+# Length of the ISO timestamp prefix that identifies each period's bucket
+PERIODS = {"day": 10, "hour": 13}
+ALL = "all"
+GROUP = "group"
+TOTALS = "totals"
+DUPLICATE_KEY_ERROR = 11000
+BACKFILL_MARKER = "backfill"
+BACKFILL_BATCH_SIZE = 1000
+# How long a process's claim on an unfinished backfill lasts without progress
+BACKFILL_LEASE_SECONDS = 300
+
+# (kind, period, bucket, request_type, sub_request_type, support_group)
+RollupKey = Tuple[str, str, str, Optional[str], Optional[str], Optional[str]]
+
+
+def _field_key(field_name: str) -> str:
+    """Field names become document keys, which may not contain dots or start with $"""
+    return str(field_name).replace(".", "_").lstrip("$") or "_"
+
+
+def _average(total: float, n: int) -> float:
+    return total / n if n else 0.0
+
+
+class AnalyticsRollups:
+    """
+    Pre-aggregated analytics for the dashboard.
+
+    Keeps running counts and confidence sums in the rollup collection, one
+    document per request type / sub-request type / support group and per bucket
+    (all time, each day and each hour), plus a totals document per bucket with
+    duplicate counts. Every batch the analytics sink writes is folded into these
+    documents with `$inc` upserts, so `summary` reads a number of documents that
+    depends on the number of groups and buckets requested, not on the size of the
+    history.
+
+    Analytics written before the rollups existed are counted once by a
+    background backfill on first start. The backfill records its progress in a
+    marker document, so one that fails or is stopped resumes on the next start.
+    Increments that fail to apply are kept and retried with the next batch.
+    """
+
+    def __init__(self, collection, analytics=None, duplicate_analytics=None):
+        """
+        Initialize the rollups
+
+        Args:
+            collection: Collection holding the rollup documents
+            analytics: Analytics collection (for the backfill)
+            duplicate_analytics: Duplicate analytics collection (for the backfill)
+        """
+        self.collection = collection
+        self.analytics = analytics
+        self.duplicate_analytics = duplicate_analytics
+        self._backfill_task: Optional[asyncio.Task] = None
+        self._backfill_before: Optional[ObjectId] = None
+        # Increments whose write failed, merged with later ones until a write succeeds
+        self._pending: Dict[RollupKey, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        self._pending_documents = 0
+
+    @staticmethod
+    def _buckets(timestamp: Any) -> List[Tuple[str, str]]:
+        buckets = [(ALL, ALL)]
+        if isinstance(timestamp, str):
+            buckets.extend((period, timestamp[:length]) for period, length in PERIODS.items() if len(timestamp) >= length)
+        return buckets
+
+    def increments(self, collection_name: str, documents: List[Dict[str, Any]]) -> Dict[RollupKey, Dict[str, float]]:
+        """
+        Combine a batch of analytics documents into one `$inc` per rollup document
+
+        Args:
+            collection_name: Collection the documents were written to
+            documents: Analytics or duplicate analytics documents
+
+        Returns:
+            Increments by rollup key
+        """
+        increments: Dict[RollupKey, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        for document in documents:
+            buckets = self._buckets(document.get("timestamp"))
+            if collection_name == self.duplicate_analytics.name:
+                for period, bucket in buckets:
+                    totals = increments[(TOTALS, period, bucket, None, None, None)]
+                    totals["duplicates"] += 1
+                    totals["duplicate_confidence_sum"] += document.get("duplicate_confidence") or 0.0
+                continue
+
+            confidence = document.get("confidence") or 0.0
+            for period, bucket in buckets:
+                totals = increments[(TOTALS, period, bucket, None, None, None)]
+                totals["count"] += 1
+                totals["confidence_sum"] += confidence
+
+                group = increments[(
+                    GROUP, period, bucket,
+                    document.get("request_type"),
+                    document.get("sub_request_type"),
+                    document.get("support_group")
+                )]
+                group["count"] += 1
+                group["confidence_sum"] += confidence
+                for field in document.get("extracted_fields") or []:
+                    key = _field_key(field.get("field_name"))
+                    group[f"fields.{key}.count"] += 1
+                    group[f"fields.{key}.confidence_sum"] += field.get("confidence") or 0.0
+        return increments
+
+    async def _apply(self, increments: Dict[RollupKey, Dict[str, float]]) -> None:
+        operations = [
+            UpdateOne(
+                {
+                    "period": period,
+                    "kind": kind,
+                    "bucket": bucket,
+                    "request_type": request_type,
+                    "sub_request_type": sub_request_type,
+                    "support_group": support_group
+                },
+                {"$inc": dict(values)},
+                upsert=True
+            )
+            for (kind, period, bucket, request_type, sub_request_type, support_group), values in increments.items()
+        ]
+        for attempt in range(2):
+            try:
+                await self.collection.bulk_write(operations, ordered=False)
+                return
+            except BulkWriteError as e:
+                errors = e.details.get("writeErrors", [])
+                # Two processes upserting a new rollup document at once: the loser
+                # fails on the unique index and matches the winner's document on retry
+                if attempt or any(error.get("code") != DUPLICATE_KEY_ERROR for error in errors):
+                    raise
+                operations = [operations[error["index"]] for error in errors]
+
+    async def record(self, collection_name: str, documents: List[Dict[str, Any]]) -> None:
+        """
+        Fold newly written analytics documents into the rollups (analytics sink listener)
+
+        Args:
+            collection_name: Collection the documents were written to
+            documents: Documents written
+        """
+        if collection_name not in (self.analytics.name, self.duplicate_analytics.name):
+            return
+        if self._backfill_before:
+            # Older documents (e.g. replayed from the sink's spill file) belong to the backfill
+            documents = [
+                d for d in documents
+                if not (isinstance(d.get("_id"), ObjectId) and d["_id"] < self._backfill_before)
+            ]
+        if not documents:
+            return
+        self._merge_pending(self.increments(collection_name, documents), len(documents))
+        await self.flush_pending()
+
+    def _merge_pending(self, increments: Dict[RollupKey, Dict[str, float]], documents: int) -> None:
+        # $inc is additive, so increments that failed earlier are merged into the next write
+        for key, values in increments.items():
+            for field, value in values.items():
+                self._pending[key][field] += value
+        self._pending_documents += documents
+
+    async def flush_pending(self) -> bool:
+        """
+        Apply the increments not written yet; on failure they are kept for the next attempt
+
+        Returns:
+            True if nothing is left pending
+        """
+        if not self._pending:
+            return True
+        pending, documents = self._pending, self._pending_documents
+        self._pending = defaultdict(lambda: defaultdict(float))
+        self._pending_documents = 0
+        try:
+            with span("mongo.analytics_rollup", documents=documents):
+                await self._apply(pending)
+        except asyncio.CancelledError:
+            self._merge_pending(pending, documents)
+            raise
+        except Exception as e:
+            # A partial bulk write may have applied some of these; retrying them can
+            # overcount those documents, which is preferred to losing the whole batch
+            self._merge_pending(pending, documents)
+            logger.warning("Analytics rollup update for %d documents failed, retrying with the next batch: %s",
+                           self._pending_documents, e)
+            count("email_pipeline_analytics_rollup_errors_total")
+            return False
+        count("email_pipeline_analytics_rollup_documents_total", documents)
+        return True
+
+    async def ensure_indexes(self) -> None:
+        await self.collection.create_index(
+            [("period", ASCENDING), ("kind", ASCENDING), ("bucket", ASCENDING),
+             ("request_type", ASCENDING), ("sub_request_type", ASCENDING), ("support_group", ASCENDING)],
+            unique=True
+        )
+
+    async def backfill(self, before: ObjectId, progress: Optional[Dict[str, ObjectId]] = None) -> None:
+        """
+        Count analytics written before the rollups were maintained
+
+        Documents are read in _id order and the last _id counted is saved in the
+        marker after each batch, so an interrupted backfill resumes after it.
+
+        Args:
+            before: Documents with a lower _id are counted; later ones are counted
+                as they are written
+            progress: Last _id already counted, by collection name
+        """
+        progress = progress or {}
+        for collection in (self.analytics, self.duplicate_analytics):
+            total = 0
+            batch = []
+            query: Dict[str, Any] = {"_id": {"$lt": before}}
+            if progress.get(collection.name) is not None:
+                query["_id"]["$gt"] = progress[collection.name]
+            cursor = collection.find(
+                query,
+                {"timestamp": 1, "confidence": 1, "duplicate_confidence": 1, "request_type": 1,
+                 "sub_request_type": 1, "support_group": 1, "extracted_fields": 1}
+            ).sort("_id", ASCENDING)
+            async for document in cursor:
+                batch.append(document)
+                if len(batch) >= BACKFILL_BATCH_SIZE:
+                    await self._backfill_batch(collection.name, batch)
+                    total += len(batch)
+                    batch = []
+            if batch:
+                await self._backfill_batch(collection.name, batch)
+                total += len(batch)
+            logger.info("Backfilled analytics rollups from %d %s documents", total, collection.name)
+        await self.collection.update_one(
+            {"_id": BACKFILL_MARKER},
+            {"$set": {"completed_at": datetime.now().isoformat()}, "$unset": {"lease_until": ""}}
+        )
+
+    async def _backfill_batch(self, collection_name: str, batch: List[Dict[str, Any]]) -> None:
+        await self._apply(self.increments(collection_name, batch))
+        # Not atomic with the increments: a crash in between counts this batch twice on resume
+        await self.collection.update_one(
+            {"_id": BACKFILL_MARKER},
+            {"$set": {f"progress.{collection_name}": batch[-1]["_id"], "lease_until": self._lease_until()}}
+        )
+
+    @staticmethod
+    def _lease_until() -> datetime:
+        return datetime.now(timezone.utc) + timedelta(seconds=BACKFILL_LEASE_SECONDS)
+
+    async def _run_backfill(self, before: ObjectId, progress: Optional[Dict[str, ObjectId]] = None) -> None:
+        try:
+            await self.backfill(before, progress)
+        except Exception as e:
+            logger.error("Error backfilling analytics rollups, it resumes on the next start: %s", e)
+            await self._release_backfill()
+
+    async def _release_backfill(self) -> None:
+        """Let the next process to start resume the backfill without waiting for the lease"""
+        try:
+            await self.collection.update_one({"_id": BACKFILL_MARKER}, {"$unset": {"lease_until": ""}})
+        except Exception as e:
+            logger.error("Error releasing the analytics rollup backfill: %s", e)
+
+    async def start(self) -> None:
+        """Create indexes and backfill the existing history in the background, if not done yet"""
+        await self.ensure_indexes()
+        before = ObjectId.from_datetime(datetime.now(timezone.utc))
+        try:
+            # Only the first process to start with rollups sets the cutoff; the others
+            # use it so that no document is counted twice
+            await self.collection.insert_one({
+                "_id": BACKFILL_MARKER,
+                "before": before,
+                "started_at": datetime.now().isoformat(),
+                "lease_until": self._lease_until()
+            })
+        except DuplicateKeyError:
+            # Claim an unfinished backfill whose previous owner stopped or failed
+            marker = await self.collection.find_one_and_update(
+                {
+                    "_id": BACKFILL_MARKER,
+                    "completed_at": {"$exists": False},
+                    "$or": [
+                        {"lease_until": {"$exists": False}},
+                        {"lease_until": {"$lt": datetime.now(timezone.utc)}}
+                    ]
+                },
+                {"$set": {"lease_until": self._lease_until()}}
+            )
+            if marker is None:
+                marker = await self.collection.find_one({"_id": BACKFILL_MARKER})
+                self._backfill_before = marker.get("before") if marker else None
+                return
+            self._backfill_before = marker["before"]
+            logger.info("Resuming the analytics rollup backfill")
+            self._backfill_task = contextvars.Context().run(
+                asyncio.create_task, self._run_backfill(marker["before"], marker.get("progress"))
+            )
+            return
+        self._backfill_before = before
+        self._backfill_task = contextvars.Context().run(asyncio.create_task, self._run_backfill(before))
+
+    async def stop(self) -> None:
+        if self._backfill_task and not self._backfill_task.done():
+            logger.warning("Stopping before the analytics rollup backfill finished; it resumes on the next start")
+            self._backfill_task.cancel()
+            await asyncio.gather(self._backfill_task, return_exceptions=True)
+            await self._release_backfill()
+        self._backfill_task = None
+        if not await self.flush_pending():
+            logger.error("Analytics rollups miss %d documents whose update failed; rebuild them to reconcile",
+                         self._pending_documents)
+
+    async def summary(self,
+                      period: Optional[str] = None,
+                      start: Optional[datetime] = None,
+                      end: Optional[datetime] = None,
+                      buckets: int = 30) -> Dict[str, Any]:
+        """
+        Summarize the analytics from the rollups
+
+        Args:
+            period: "day" or "hour" to include a timeline with one entry per bucket
+            start: First bucket to include (the one containing this time)
+            end: Buckets before the one containing this time are included
+            buckets: Most recent buckets in the timeline when no start is given
+
+        Returns:
+            Totals, breakdowns by request type, sub-request type, support group and
+            extracted field, and the timeline
+        """
+        # Without a time range everything comes from the all-time documents
+        range_period = (period or "day") if (start or end) else ALL
+        query: Dict[str, Any] = {"period": range_period}
+        bucket_range = {}
+        if start:
+            bucket_range["$gte"] = stored_timestamp(start)[:PERIODS[range_period]]
+        if end:
+            bucket_range["$lt"] = stored_timestamp(end)[:PERIODS[range_period]]
+        if bucket_range:
+            query["bucket"] = bucket_range
+
+        documents = await self.collection.find(query, {"_id": 0}).to_list(length=None)
+        timeline_documents = []
+        if period:
+            timeline_query = {"period": period, "kind": TOTALS}
+            if bucket_range:
+                timeline_query["bucket"] = bucket_range
+            cursor = self.collection.find(timeline_query, {"_id": 0}).sort("bucket", -1)
+            if not start:
+                cursor = cursor.limit(buckets)
+            timeline_documents = await cursor.to_list(length=None)
+        return self._summarize(documents, timeline_documents)
+
+    @staticmethod
+    def _summarize(documents: List[Dict[str, Any]], timeline_documents: List[Dict[str, Any]]) -> Dict[str, Any]:
+        totals = defaultdict(float)
+        by_request_type: Dict[Any, Dict[str, Any]] = {}
+        by_sub_request_type: Dict[Any, Dict[str, Any]] = {}
+        by_support_group: Dict[Any, Dict[str, Any]] = {}
+        fields: Dict[str, Dict[str, float]] = {}
+
+        def add_fields(target: Dict[str, Dict[str, float]], document_fields: Dict[str, Dict[str, float]]):
+            for name, values in document_fields.items():
+                entry = target.setdefault(name, {"count": 0, "confidence_sum": 0.0})
+                entry["count"] += values.get("count", 0)
+                entry["confidence_sum"] += values.get("confidence_sum", 0.0)
+
+        for document in documents:
+            if document.get("kind") == TOTALS:
+                for key in ("count", "confidence_sum", "duplicates", "duplicate_confidence_sum"):
+                    totals[key] += document.get(key, 0)
+                continue
+            if document.get("kind") != GROUP:
+                continue
+            groups = (
+                (by_request_type, (document.get("request_type"),)),
+                (by_sub_request_type, (document.get("request_type"), document.get("sub_request_type"))),
+                (by_support_group, (document.get("support_group"),))
+            )
+            for target, key in groups:
+                entry = target.setdefault(key, {"count": 0, "confidence_sum": 0.0, "fields": {}})
+                entry["count"] += document.get("count", 0)
+                entry["confidence_sum"] += document.get("confidence_sum", 0.0)
+                if target is by_request_type:
+                    add_fields(entry["fields"], document.get("fields", {}))
+            add_fields(fields, document.get("fields", {}))
+
+        def field_summaries(values: Dict[str, Dict[str, float]]) -> List[Dict[str, Any]]:
+            return sorted((
+                {
+                    "field_name": name,
+                    "count": int(entry["count"]),
+                    "average_confidence": _average(entry["confidence_sum"], entry["count"])
+                } for name, entry in values.items()
+            ), key=lambda f: -f["count"])
+
+        def group_summaries(target: Dict[Any, Dict[str, Any]], names: Tuple[str, ...]) -> List[Dict[str, Any]]:
+            summaries = []
+            for key, entry in target.items():
+                summary = dict(zip(names, key))
+                summary["count"] = int(entry["count"])
+                summary["average_confidence"] = _average(entry["confidence_sum"], entry["count"])
+                if entry["fields"]:
+                    summary["fields"] = field_summaries(entry["fields"])
+                summaries.append(summary)
+            return sorted(summaries, key=lambda s: -s["count"])
+
+        def counts(document: Dict[str, Any]) -> Dict[str, Any]:
+            classified = int(document.get("count", 0))
+            duplicates = int(document.get("duplicates", 0))
+            return {
+                "count": classified,
+                "average_confidence": _average(document.get("confidence_sum", 0.0), classified),
+                "duplicates": duplicates,
+                "average_duplicate_confidence": _average(document.get("duplicate_confidence_sum", 0.0), duplicates),
+                "duplicate_rate": _average(duplicates, classified + duplicates)
+            }
+
+        return {
+            **counts(totals),
+            "by_request_type": group_summaries(by_request_type, ("request_type",)),
+            "by_sub_request_type": group_summaries(by_sub_request_type, ("request_type", "sub_request_type")),
+            "by_support_group": group_summaries(by_support_group, ("support_group",)),
+            "fields": field_summaries(fields),
+            "timeline": [
+                {"bucket": document["bucket"], **counts(document)}
+                for document in sorted(timeline_documents, key=lambda d: d["bucket"])
+            ]
+        }
+
+
+analytics_rollups = AnalyticsRollups(analytics_rollups_collection, analytics_collection, duplicate_analytics_collection)
@@ -0,0 +1,344 @@
+import asyncio
+import contextlib
+import contextvars
+import logging
+import os
+import time
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from bson import ObjectId, json_util
+from pymongo.errors import BulkWriteError
+
+from app.config import get_settings
+from app.core.tracing import count, span
+from app.schemas.analytics import analytics_collection, duplicate_analytics_collection, fast_path_training_collection
+
+logger = logging.getLogger(__name__)
+
+# Bulk write error code for a document whose _id was already inserted
+DUPLICATE_KEY_ERROR = 11000
+
+
+class AnalyticsSink:
+    """
+    Buffered background writer for analytics documents.
+
+    Requests hand their analytics documents to `submit` and return without
+    waiting for MongoDB. A worker buffers them and writes each collection's
+    documents with one `insert_many` when `batch_size` documents are buffered or
+    `flush_seconds` have passed. When `max_pending` documents are queued,
+    `submit` waits for room (back-pressure) for up to `submit_timeout` seconds
+    and then spills the document to disk instead of blocking the request longer.
+
+    Documents that cannot be written (MongoDB unavailable) are appended to the
+    spill file as extended JSON lines and re-inserted by a background replay after
+    the next successful write or on startup. Every document gets its `_id` when
+    submitted, so a batch retried after a partial write does not create
+    duplicates. A batch whose write and spill both fail, or whose flush is
+    cancelled, goes back into the buffer. `stop` flushes everything on shutdown.
+
+    Listeners added with `add_listener` are called with every batch once it has
+    been written (each document once, including replayed ones).
+    """
+
+    def __init__(self,
+                 max_pending: int = 10000,
+                 batch_size: int = 100,
+                 flush_seconds: float = 1.0,
+                 submit_timeout: float = 5.0,
+                 spill_path: Optional[str] = "analytics_spill.ndjson",
+                 collections: Optional[List[Any]] = None):
+        """
+        Initialize the sink
+
+        Args:
+            max_pending: Documents queued before `submit` waits for room
+            batch_size: Buffered documents that trigger a write
+            flush_seconds: Maximum time a document stays buffered
+            submit_timeout: How long `submit` waits for room before spilling the document
+            spill_path: File for documents that could not be written (None to drop them)
+            collections: Collections that spilled documents may belong to; collections
+                passed to `submit` are added automatically
+        """
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.submit_timeout = submit_timeout
+        self.spill_path = spill_path
+        self._collections: Dict[str, Any] = {c.name: c for c in collections or []}
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_task: Optional[asyncio.Task] = None
+        self._replay_task: Optional[asyncio.Task] = None
+        self._buffers: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._spill_lock = asyncio.Lock()
+        self._spilled = False
+        self._listeners: List[Callable[[str, List[Dict[str, Any]]], Awaitable[None]]] = []
+
+    def add_listener(self, listener: Callable[[str, List[Dict[str, Any]]], Awaitable[None]]) -> None:
+        """
+        Call `await listener(collection_name, documents)` with the documents of every write
+
+        Args:
+            listener: Async callable; its errors are logged and do not affect the write
+        """
+        self._listeners.append(listener)
+
+    def _ensure_worker(self) -> None:
+        if self._worker_task is None or self._worker_task.done():
+            if self._queue is None:
+                self._queue = asyncio.Queue(maxsize=self.max_pending)
+            # Run outside the caller's context so the worker's spans do not
+            # attach to whichever request happened to start it
+            self._worker_task = contextvars.Context().run(asyncio.create_task, self._worker())
+
+    def _schedule_replay(self) -> None:
+        """Replay the spill file in the background, so the worker keeps writing new documents meanwhile"""
+        if self._replay_task is None or self._replay_task.done():
+            self._replay_task = contextvars.Context().run(asyncio.create_task, self._replay_safely())
+
+    async def _replay_safely(self) -> None:
+        try:
+            await self.replay_spilled()
+        except Exception as e:
+            logger.error("Error replaying spilled analytics: %s", e)
+
+    async def submit(self, collection, document: Dict[str, Any]) -> None:
+        """
+        Queue a document for insertion into a collection
+
+        Returns immediately unless the queue is full, in which case it waits for
+        room for up to `submit_timeout` seconds and then spills the document.
+
+        Args:
+            collection: Motor collection to insert into
+            document: Document to insert
+        """
+        self._ensure_worker()
+        # The collection last submitted under a name is the one written to
+        self._collections[collection.name] = collection
+        document.setdefault("_id", ObjectId())
+        try:
+            self._queue.put_nowait((collection.name, document))
+            return
+        except asyncio.QueueFull:
+            pass
+
+        count("email_pipeline_analytics_backpressure_total", collection=collection.name)
+        try:
+            await asyncio.wait_for(self._queue.put((collection.name, document)), timeout=self.submit_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Analytics queue full for %.1fs, spilling document for %s", self.submit_timeout, collection.name)
+            await self._spill(collection.name, [document])
+
+    @property
+    def pending(self) -> int:
+        """Documents queued or buffered but not yet written"""
+        queued = self._queue.qsize() if self._queue else 0
+        return queued + sum(len(b) for b in self._buffers.values())
+
+    async def _insert(self, name: str, documents: List[Dict[str, Any]]) -> None:
+        """Insert documents, treating ones already written by an earlier attempt as written"""
+        try:
+            await self._collections[name].insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            # Only the documents this attempt inserted are passed to listeners
+            failed = {error.get("index") for error in errors}
+            await self._notify(name, [d for i, d in enumerate(documents) if i not in failed])
+            if any(error.get("code") != DUPLICATE_KEY_ERROR for error in errors):
+                raise
+            return
+        await self._notify(name, documents)
+
+    async def _notify(self, name: str, documents: List[Dict[str, Any]]) -> None:
+        if not documents:
+            return
+        for listener in self._listeners:
+            try:
+                await listener(name, documents)
+            except Exception as e:
+                logger.error("Analytics listener %s failed for %d %s documents: %s",
+                             getattr(listener, "__qualname__", listener), len(documents), name, e)
+                count("email_pipeline_analytics_listener_errors_total", collection=name)
+
+    async def _flush(self) -> None:
+        """Write every buffered batch, spilling batches that fail"""
+        written = False
+        for name in list(self._buffers):
+            documents = self._buffers.pop(name)
+            if not documents:
+                continue
+            settled = False
+            try:
+                try:
+                    with span("mongo.analytics_flush", collection=name, documents=len(documents)):
+                        await self._insert(name, documents)
+                    count("email_pipeline_analytics_writes_total", len(documents), collection=name, result="written")
+                    written = True
+                except Exception as e:
+                    logger.error("Error writing %d analytics documents to %s: %s", len(documents), name, e)
+                    await self._spill(name, documents)
+                settled = True
+            finally:
+                if not settled:
+                    # Neither written nor spilled (the spill failed or the flush was
+                    # cancelled): keep the batch for the next flush or for stop().
+                    # A retry of documents that did get written is absorbed by their _id.
+                    self._buffers[name][:0] = documents
+        if written and self._spilled:
+            self._schedule_replay()
+
+    async def _spill(self, name: str, documents: List[Dict[str, Any]]) -> None:
+        if not self.spill_path:
+            count("email_pipeline_analytics_writes_total", len(documents), collection=name, result="dropped")
+            return
+        lines = "".join(
+            json_util.dumps({"collection": name, "document": document}) + "\n" for document in documents
+        )
+        async with self._spill_lock:
+            await asyncio.to_thread(self._append_spill, lines)
+        self._spilled = True
+        count("email_pipeline_analytics_writes_total", len(documents), collection=name, result="spilled")
+
+    def _append_spill(self, lines: str) -> None:
+        with open(self.spill_path, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+    @staticmethod
+    def _read_spill(path: str) -> Dict[str, List[Dict[str, Any]]]:
+        documents: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json_util.loads(line)
+                    documents[entry["collection"]].append(entry["document"])
+        return documents
+
+    async def replay_spilled(self) -> None:
+        """Re-insert spilled documents; whatever still fails stays in the spill file"""
+        if not self.spill_path:
+            return
+        async with self._spill_lock:
+            if not os.path.exists(self.spill_path):
+                self._spilled = False
+                return
+            # Take the file over so documents spilled while replaying go to a new one
+            replaying = f"{self.spill_path}.replaying"
+            try:
+                os.replace(self.spill_path, replaying)
+            except FileNotFoundError:
+                # Taken over by another replay since the check above
+                self._spilled = False
+                return
+            self._spilled = False
+        try:
+            spilled = await asyncio.to_thread(self._read_spill, replaying)
+        except Exception as e:
+            logger.error("Could not read analytics spill file %s: %s", replaying, e)
+            return
+
+        failed = []
+        for name, documents in spilled.items():
+            if name not in self._collections:
+                logger.warning("Dropping %d spilled documents for unknown collection %s", len(documents), name)
+                continue
+            for i in range(0, len(documents), self.batch_size):
+                batch = documents[i:i + self.batch_size]
+                try:
+                    await self._insert(name, batch)
+                    count("email_pipeline_analytics_writes_total", len(batch), collection=name, result="replayed")
+                except Exception as e:
+                    logger.warning("Replaying spilled analytics for %s failed: %s", name, e)
+                    failed.append((name, batch))
+        for name, batch in failed:
+            await self._spill(name, batch)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(replaying)
+        logger.info("Replayed spilled analytics (%d batches still pending)", len(failed))
+
+    async def _flush_safely(self) -> Optional[float]:
+        """Flush without letting errors stop the worker; returns the deadline for retrying what is left"""
+        try:
+            await self._flush()
+        except Exception as e:
+            logger.error("Error flushing analytics: %s", e)
+        if any(self._buffers.values()):
+            return time.monotonic() + self.flush_seconds
+        return None
+
+    async def _worker(self) -> None:
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout=timeout)
+            except asyncio.TimeoutError:
+                deadline = await self._flush_safely()
+                continue
+
+            if item is None:
+                # Queued by stop() behind every document submitted before it
+                await self._flush_safely()
+                return
+            name, document = item
+            self._buffers[name].append(document)
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_seconds
+            if sum(len(b) for b in self._buffers.values()) >= self.batch_size:
+                deadline = await self._flush_safely()
+
+    async def start(self) -> None:
+        """Start the worker and re-insert documents spilled by an earlier run"""
+        self._ensure_worker()
+        if not self.spill_path:
+            return
+        interrupted = f"{self.spill_path}.replaying"
+        with contextlib.suppress(FileNotFoundError):
+            # A replay was interrupted: return its documents to the spill file
+            with open(interrupted, encoding="utf-8") as f:
+                self._append_spill(f.read())
+            os.remove(interrupted)
+        if os.path.exists(self.spill_path):
+            self._spilled = True
+            self._schedule_replay()
+
+    async def stop(self, timeout: float = 30.0) -> None:
+        """Write everything queued and buffered (spilling what cannot be written), then stop the worker"""
+        if self._worker_task is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.put(None), timeout=timeout)
+            await asyncio.wait_for(asyncio.shield(self._worker_task), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Analytics sink did not finish flushing within %.0fs", timeout)
+            self._worker_task.cancel()
+            # Let the cancelled flush return its batch to the buffer before spilling it below
+            await asyncio.wait([self._worker_task])
+        self._worker_task = None
+        if self._replay_task is not None:
+            # An unfinished replay leaves its file behind for the next start()
+            self._replay_task.cancel()
+            await asyncio.wait([self._replay_task])
+            self._replay_task = None
+        # Anything the worker did not get to goes to the spill file
+        while self._queue and not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                self._buffers[item[0]].append(item[1])
+        for name in list(self._buffers):
+            documents = self._buffers.pop(name)
+            if documents:
+                await self._spill(name, documents)
+        self._queue = None
+
+
+settings = get_settings()
+analytics_sink = AnalyticsSink(
+    max_pending=settings.analytics_queue_size,
+    batch_size=settings.analytics_batch_size,
+    flush_seconds=settings.analytics_flush_seconds,
+    submit_timeout=settings.analytics_submit_timeout_seconds,
+    spill_path=settings.analytics_spill_path or None,
+    collections=[analytics_collection, duplicate_analytics_collection, fast_path_training_collection]
+)
@@ -0,0 +1,433 @@
+import asyncio
+import io
+import logging
+import os
+import time
+import uuid
+import zipfile
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from app.config import get_settings
+from app.models.response_models import ClassificationResponse
+
+logger = logging.getLogger(__name__)
+
+KIND_EML = "eml"
+KIND_PDF = "pdf"
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+
+# Sentinel passed down the stage queues when a stage has no more work
+_DONE = object()
+
+
+@dataclass
+class BatchItem:
+    """A single email in a batch job"""
+    index: int
+    filename: str
+    kind: Optional[str]
+    content: Optional[bytes] = None
+    content_type: Optional[str] = None
+    status: str = STATUS_QUEUED
+    result: Optional[ClassificationResponse] = None
+    error: Optional[str] = None
+    started_at: Optional[float] = None
+
+    def to_dict(self, job_id: str) -> Dict[str, Any]:
+        return {
+            "job_id": job_id,
+            "index": self.index,
+            "filename": self.filename,
+            "status": self.status,
+            "result": self.result.model_dump() if self.result else None,
+            "error": self.error
+        }
+
+
+@dataclass
+class BatchJob:
+    """State of a batch classification job and its results in completion order"""
+    job_id: str
+    items: List[BatchItem]
+    thread_id: Optional[str] = None
+    status: str = STATUS_QUEUED
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    completed: List[BatchItem] = field(default_factory=list)
+    _changed: asyncio.Condition = field(default_factory=asyncio.Condition)
+
+    @property
+    def total(self) -> int:
+        return len(self.items)
+
+    @property
+    def done(self) -> bool:
+        return self.status in (STATUS_COMPLETED, STATUS_FAILED)
+
+    async def finish_item(self, item: BatchItem, result: Optional[ClassificationResponse] = None,
+                          error: Optional[str] = None) -> None:
+        item.result = result
+        item.error = error or (result.error if result else None)
+        item.status = STATUS_FAILED if item.error else STATUS_COMPLETED
+        # Raw file bytes are no longer needed once the item is done
+        item.content = None
+        async with self._changed:
+            self.completed.append(item)
+            self._changed.notify_all()
+
+    async def finish(self, status: str) -> None:
+        async with self._changed:
+            self.status = status
+            self.finished_at = time.time()
+            self._changed.notify_all()
+
+    async def stream_results(self) -> AsyncIterator[BatchItem]:
+        """Yield finished items as they complete, starting from the first one"""
+        position = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: position < len(self.completed) or self.done)
+                ready = self.completed[position:]
+                finished = self.done
+            for item in ready:
+                yield item
+            position += len(ready)
+            if finished and position >= len(self.completed):
+                return
+
+    def get_status(self) -> Dict[str, Any]:
+        failed = sum(1 for item in self.completed if item.status == STATUS_FAILED)
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "total": self.total,
+            "completed": len(self.completed),
+            "failed": failed,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at
+        }
+
+
+def _detect_kind(filename: str, content_type: Optional[str] = None) -> Optional[str]:
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension == ".eml" or content_type == "message/rfc822":
+        return KIND_EML
+    if extension == ".pdf" or content_type == "application/pdf":
+        return KIND_PDF
+    return None
+
+
+class BatchLimitError(ValueError):
+    """Raised when an upload exceeds the batch file count or size limits"""
+
+
+def _read_member(archive: zipfile.ZipFile, member: zipfile.ZipInfo, max_bytes: int) -> bytes:
+    # The sizes in the zip directory are declared by the archive, so the
+    # decompressed stream is capped as it is read rather than trusted
+    with archive.open(member) as stream:
+        content = stream.read(max_bytes + 1)
+    if len(content) > max_bytes:
+        raise BatchLimitError(f"Archive member {member.filename} exceeds {max_bytes} bytes")
+    return content
+
+
+def expand_uploads(files: List[Tuple[str, Optional[str], bytes]],
+                   max_files: int = 1000,
+                   max_file_bytes: int = 25 * 1024 * 1024,
+                   max_total_bytes: int = 500 * 1024 * 1024,
+                   max_compression_ratio: int = 100) -> List[BatchItem]:
+    """
+    Turn uploaded files into batch items, expanding zip archives into their EML/PDF members
+
+    Archive members are counted and their declared sizes checked before anything
+    is decompressed, and each member is read with a size cap, so a zip bomb is
+    rejected without being expanded into memory.
+
+    Args:
+        files: List of (filename, content_type, content) tuples
+        max_files: Maximum number of items after zip expansion
+        max_file_bytes: Maximum decompressed size of a single archive member
+        max_total_bytes: Maximum decompressed size of all items together
+        max_compression_ratio: Maximum ratio of decompressed to compressed size of a member
+
+    Returns:
+        Batch items in upload order; unsupported files become items with kind None
+
+    Raises:
+        BatchLimitError: If the upload exceeds any of the limits
+    """
+    items: List[BatchItem] = []
+    total_bytes = 0
+    for filename, content_type, content in files:
+        if (filename or "").lower().endswith(".zip") or content_type in ("application/zip", "application/x-zip-compressed"):
+            with zipfile.ZipFile(io.BytesIO(content)) as archive:
+                members = [
+                    member for member in archive.infolist()
+                    if not (member.is_dir() or member.filename.startswith("__MACOSX/")
+                            or os.path.basename(member.filename).startswith("."))
+                ]
+                if len(items) + len(members) > max_files:
+                    raise BatchLimitError(f"Batch exceeds maximum of {max_files} files")
+                for member in members:
+                    if member.file_size > max_file_bytes:
+                        raise BatchLimitError(f"Archive member {member.filename} exceeds {max_file_bytes} bytes")
+                    if member.file_size > max_compression_ratio * max(member.compress_size, 1):
+                        raise BatchLimitError(f"Archive member {member.filename} exceeds the maximum compression ratio")
+                if total_bytes + sum(member.file_size for member in members) > max_total_bytes:
+                    raise BatchLimitError(f"Batch exceeds maximum of {max_total_bytes} bytes")
+                for member in members:
+                    member_content = _read_member(archive, member, min(max_file_bytes, max_total_bytes - total_bytes))
+                    total_bytes += len(member_content)
+                    items.append(BatchItem(
+                        index=len(items),
+                        filename=member.filename,
+                        kind=_detect_kind(member.filename),
+                        content=member_content
+                    ))
+        else:
+            if len(items) + 1 > max_files:
+                raise BatchLimitError(f"Batch exceeds maximum of {max_files} files")
+            total_bytes += len(content)
+            if total_bytes > max_total_bytes:
+                raise BatchLimitError(f"Batch exceeds maximum of {max_total_bytes} bytes")
+            items.append(BatchItem(
+                index=len(items),
+                filename=filename,
+                kind=_detect_kind(filename, content_type),
+                content=content,
+                content_type=content_type
+            ))
+    return items
+
+
+class BatchProcessor:
+    """
+    Runs batch jobs as a three-stage pipeline over bounded queues:
+
+    parse (thread pool, `parse_concurrency` workers)
+      -> duplicate check (single worker, embeddings computed in micro-batches)
+      -> classification and extraction (`llm_concurrency` workers)
+
+    Duplicate checks stay on a single worker so emails within the same batch are
+    checked against each other in order, exactly as sequential requests would be.
+    """
+
+    def __init__(self,
+                 parse_concurrency: int = 4,
+                 llm_concurrency: int = 4,
+                 embedding_batch_size: int = 32,
+                 retention_minutes: int = 60):
+        """
+        Initialize the batch processor
+
+        Args:
+            parse_concurrency: Number of emails parsed (PDF text, OCR) at once
+            llm_concurrency: Number of emails classified by the LLM at once
+            embedding_batch_size: Maximum emails embedded in one provider call
+            retention_minutes: How long finished jobs are kept for result retrieval
+        """
+        self.parse_concurrency = parse_concurrency
+        self.llm_concurrency = llm_concurrency
+        self.embedding_batch_size = embedding_batch_size
+        self.retention_seconds = retention_minutes * 60
+        self.jobs: Dict[str, BatchJob] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def _purge_expired(self) -> None:
+        now = time.time()
+        for job_id in [j.job_id for j in self.jobs.values()
+                       if j.done and now - j.finished_at > self.retention_seconds]:
+            self.jobs.pop(job_id, None)
+
+    def get_job(self, job_id: str) -> Optional[BatchJob]:
+        self._purge_expired()
+        return self.jobs.get(job_id)
+
+    def submit(self, items: List[BatchItem], classification_service, thread_id: Optional[str] = None) -> BatchJob:
+        """
+        Register a batch job and start processing it in the background
+
+        Returns:
+            The new job; results can be streamed from it while it runs
+        """
+        self._purge_expired()
+        job = BatchJob(job_id=str(uuid.uuid4()), items=items, thread_id=thread_id)
+        self.jobs[job.job_id] = job
+        task = asyncio.create_task(self._run(job, classification_service))
+        self._tasks[job.job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job.job_id, None))
+        logger.info(f"Submitted batch job {job.job_id} with {job.total} items")
+        return job
+
+    async def _run(self, job: BatchJob, service) -> None:
+        job.status = STATUS_RUNNING
+        start = time.time()
+        parse_queue: asyncio.Queue = asyncio.Queue()
+        dedup_queue: asyncio.Queue = asyncio.Queue(maxsize=self.embedding_batch_size * 2)
+        llm_queue: asyncio.Queue = asyncio.Queue(maxsize=self.llm_concurrency * 2)
+
+        for item in job.items:
+            if item.kind is None:
+                await job.finish_item(item, error=f"Unsupported file type: {item.filename}")
+            else:
+                parse_queue.put_nowait(item)
+        for _ in range(self.parse_concurrency):
+            parse_queue.put_nowait(_DONE)
+
+        parse_workers = [asyncio.create_task(self._parse_worker(job, service, parse_queue, dedup_queue))
+                         for _ in range(self.parse_concurrency)]
+        dedup_worker = asyncio.create_task(self._dedup_worker(job, service, dedup_queue, llm_queue))
+        llm_workers = [asyncio.create_task(self._llm_worker(job, service, llm_queue))
+                       for _ in range(self.llm_concurrency)]
+
+        try:
+            await asyncio.gather(*parse_workers)
+            await dedup_queue.put(_DONE)
+            await dedup_worker
+            for _ in range(self.llm_concurrency):
+                await llm_queue.put(_DONE)
+            await asyncio.gather(*llm_workers)
+            await job.finish(STATUS_COMPLETED)
+        except Exception as e:
+            logger.error(f"Batch job {job.job_id} failed: {str(e)}")
+            for task in parse_workers + llm_workers + [dedup_worker]:
+                task.cancel()
+            for item in job.items:
+                if item.status in (STATUS_QUEUED, STATUS_RUNNING):
+                    await job.finish_item(item, error=f"Batch job failed: {str(e)}")
+            await job.finish(STATUS_FAILED)
+
+        logger.info(
+            f"Batch job {job.job_id} finished {len(job.completed)}/{job.total} items "
+            f"in {(time.time() - start) * 1000:.2f}ms"
+        )
+
+    def _error_response(self, item: BatchItem, message: str) -> ClassificationResponse:
+        label = "EML" if item.kind == KIND_EML else "email chain"
+        return ClassificationResponse(
+            request_types=[],
+            extracted_fields=[],
+            support_group="",
+            processing_time_ms=(time.time() - item.started_at) * 1000,
+            error=f"Error processing {label}: {message}"
+        )
+
+    async def _parse_worker(self, job: BatchJob, service, parse_queue: asyncio.Queue,
+                            dedup_queue: asyncio.Queue) -> None:
+        while True:
+            item = await parse_queue.get()
+            if item is _DONE:
+                return
+            item.status = STATUS_RUNNING
+            item.started_at = time.time()
+            try:
+                if item.kind == KIND_EML:
+                    parsed = await asyncio.to_thread(service.parse_eml, item.content)
+                else:
+                    parsed = await asyncio.to_thread(
+                        service.parse_email_chain, item.content, item.filename,
+                        item.content_type or "application/pdf", []
+                    )
+            except Exception as e:
+                logger.error(f"Error parsing batch item {item.filename}: {str(e)}")
+                await job.finish_item(item, self._error_response(item, str(e)))
+                continue
+            await dedup_queue.put((item, parsed))
+
+    async def _dedup_worker(self, job: BatchJob, service, dedup_queue: asyncio.Queue,
+                            llm_queue: asyncio.Queue) -> None:
+        finished = False
+        while not finished:
+            # Wait for one parsed email, then take whatever else is already waiting
+            batch = [await dedup_queue.get()]
+            while len(batch) < self.embedding_batch_size and not dedup_queue.empty():
+                batch.append(dedup_queue.get_nowait())
+            if _DONE in batch:
+                finished = True
+                batch = [entry for entry in batch if entry is not _DONE]
+            if not batch:
+                continue
+
+            try:
+                embeddings = await asyncio.to_thread(
+                    service.duplicate_detector.compute_embeddings,
+                    [(info.get("content", ""), info.get("subject", "Unknown")) for _, (info, _) in batch]
+                )
+            except Exception as e:
+                logger.warning(f"Batched embedding failed, embedding per email: {str(e)}")
+                embeddings = [None] * len(batch)
+
+            for (item, (email_info, attachments)), embedding in zip(batch, embeddings):
+                try:
+                    is_duplicate, reason, score, duplicate_id = await service.check_duplicate(
+                        email_info, job.thread_id, embeddings=embedding
+                    )
+                except Exception as e:
+                    logger.error(f"Error checking duplicate for batch item {item.filename}: {str(e)}")
+                    await job.finish_item(item, self._error_response(item, str(e)))
+                    continue
+
+                cutoff = service.EML_DUPLICATE_CUTOFF if item.kind == KIND_EML else service.CHAIN_DUPLICATE_CUTOFF
+                if is_duplicate and score > cutoff:
+                    await job.finish_item(item, ClassificationResponse(
+                        request_types=[],
+                        extracted_fields=[],
+                        support_group="",
+                        is_duplicate=True,
+                        duplicate_reason=reason,
+                        duplicate_confidence=score,
+                        duplicate_id=duplicate_id,
+                        processing_time_ms=(time.time() - item.started_at) * 1000
+                    ))
+                    continue
+
+                # Below-cutoff matches are reported for EML files only, as in process_eml
+                duplicate = (is_duplicate, reason, score, duplicate_id) if item.kind == KIND_EML \
+                    else (False, None, 0.0, None)
+                await llm_queue.put((item, email_info, attachments, duplicate))
+
+    async def _llm_worker(self, job: BatchJob, service, llm_queue: asyncio.Queue) -> None:
+        while True:
+            entry = await llm_queue.get()
+            if entry is _DONE:
+                return
+            item, email_info, attachments, (is_duplicate, reason, score, duplicate_id) = entry
+            try:
+                request_type_results, extracted_fields, support_group = await service.classify_and_extract(
+                    email_info, attachments
+                )
+            except Exception as e:
+                logger.error(f"Error classifying batch item {item.filename}: {str(e)}")
+                await job.finish_item(item, self._error_response(item, str(e)))
+                continue
+
+            await job.finish_item(item, ClassificationResponse(
+                request_types=request_type_results,
+                extracted_fields=extracted_fields,
+                support_group=support_group,
+                is_duplicate=is_duplicate,
+                duplicate_reason=reason,
+                duplicate_confidence=score,
+                duplicate_id=duplicate_id,
+                processing_time_ms=(time.time() - item.started_at) * 1000
+            ))
+
+
+@lru_cache()
+def get_batch_processor() -> BatchProcessor:
+    """
+    Get the shared batch processor so jobs outlive the request that submitted them
+    """
+    settings = get_settings()
+    return BatchProcessor(
+        parse_concurrency=settings.batch_parse_concurrency,
+        llm_concurrency=settings.batch_llm_concurrency,
+        embedding_batch_size=settings.batch_embedding_batch_size,
+        retention_minutes=settings.batch_job_retention_minutes
+    )
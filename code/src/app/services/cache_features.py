@@ -0,0 +1,360 @@
+import ipaddress
+import logging
+import re
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Weights of the metadata similarity components
+SENDER_WEIGHT = 0.4
+RECIPIENT_WEIGHT = 0.2
+IP_WEIGHT = 0.1
+THREAD_WEIGHT = 0.3
+META_WEIGHT = 0.1
+
+MICROSECOND = timedelta(microseconds=1)
+_EPOCH = datetime(1970, 1, 1)
+_EPOCH_UTC = _EPOCH.replace(tzinfo=timezone.utc)
+NO_EXPIRY = np.iinfo(np.int64).max
+INITIAL_ROWS = 64
+_EMPTY = np.zeros(0, dtype=np.int64)
+
+
+def normalize_email_address(email: str) -> str:
+    """Normalize email address for comparison"""
+    if not email:
+        return ""
+
+    # Extract just the email if it's in "Display Name <email>" format
+    match = re.search(r'<(.+@.+)>', email)
+    if match:
+        email = match.group(1)
+
+    return email.strip().lower()
+
+
+def email_domain(email: str) -> str:
+    """Extract domain from email address"""
+    email = normalize_email_address(email)
+    if '@' in email:
+        return email.split('@')[-1]
+    return ""
+
+
+def recipient_addresses(recipient: str) -> Set[str]:
+    """Normalized addresses of a comma-separated recipient list"""
+    return {normalize_email_address(r.strip()) for r in recipient.split(',') if r.strip()}
+
+
+def ip_address_id(ip: str) -> int:
+    """
+    64-bit id of an IP address: an IPv4 address's own value, so equal ids always
+    mean equal addresses, else (IPv6 is too wide, or the value is not an address)
+    a hash of the text
+    """
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return hash(ip)
+    return int(address) if address.version == 4 else hash(ip)
+
+
+def epoch_micros(value: datetime) -> int:
+    """Microseconds since the epoch, reading a naive datetime as UTC"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return (value - _EPOCH_UTC) // MICROSECOND
+
+
+def _hash_ids(values) -> np.ndarray:
+    # Python's string hash: 64 bits, so equal ids mean equal strings barring a
+    # collision, and no vocabulary outlives the entries that use it
+    return np.unique(np.fromiter((hash(v) for v in values), dtype=np.int64))
+
+
+@dataclass
+class EntryFeatures:
+    """
+    What the duplicate scan compares of one email, with strings reduced to 64-bit hashes
+    """
+    has_sender: bool = False
+    sender: int = 0
+    domain: int = 0
+    # Sorted hashes of the normalized recipient addresses
+    recipients: np.ndarray = field(default_factory=lambda: _EMPTY)
+    has_ip: bool = False
+    ip: int = 0
+    has_thread: bool = False
+    thread: int = 0
+    has_meta: bool = False
+    # False when a metadata key or value is not a string; such entries are compared in Python
+    meta_exact: bool = True
+    # Sorted key hashes and the hashes of their values
+    meta_keys: np.ndarray = field(default_factory=lambda: _EMPTY)
+    meta_values: np.ndarray = field(default_factory=lambda: _EMPTY)
+    has_received: bool = False
+    received: int = 0
+    received_aware: bool = False
+    unparseable_date: bool = False
+    expiry: int = NO_EXPIRY
+    has_message_id: bool = False
+    message_id: int = 0
+    meta: Optional[Dict] = None
+
+    @classmethod
+    def from_entry(cls, entry: Dict[str, Any]) -> "EntryFeatures":
+        """Compute the features of a cache entry (or of an email being checked, in the same shape)"""
+        features = cls()
+        sender = entry.get('sender')
+        if sender:
+            features.has_sender = True
+            features.sender = hash(normalize_email_address(sender))
+            features.domain = hash(email_domain(sender))
+        recipient = entry.get('recipient')
+        if recipient:
+            features.recipients = _hash_ids(recipient_addresses(recipient))
+        ip = entry.get('ip_address')
+        if ip:
+            features.has_ip = True
+            features.ip = ip_address_id(ip)
+        thread_id = entry.get('thread_id')
+        if thread_id:
+            features.has_thread = True
+            features.thread = hash(thread_id)
+        meta = entry.get('additional_metadata')
+        if meta:
+            features.has_meta = True
+            features.meta = meta
+            if all(isinstance(k, str) and isinstance(v, str) for k, v in meta.items()):
+                keys = np.fromiter((hash(k) for k in meta), dtype=np.int64, count=len(meta))
+                values = np.fromiter((hash(v) for v in meta.values()), dtype=np.int64, count=len(meta))
+                order = np.argsort(keys)
+                features.meta_keys, features.meta_values = keys[order], values[order]
+            else:
+                features.meta_exact = False
+        received, features.unparseable_date = _parse_datetime(entry.get('received_date'))
+        if received is not None:
+            features.has_received = True
+            features.received = epoch_micros(received)
+            features.received_aware = received.tzinfo is not None
+        if 'expiry' in entry:
+            features.expiry = _expiry_micros(entry['expiry'], entry.get('id'))
+        message_id = entry.get('message_id')
+        if message_id:
+            features.has_message_id = True
+            features.message_id = hash(message_id)
+        return features
+
+
+def _parse_datetime(value: Any) -> Tuple[Optional[datetime], bool]:
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value), False
+        except ValueError:
+            return None, True
+    return (value, False) if isinstance(value, datetime) else (None, False)
+
+
+def _expiry_micros(value: Any, entry_id: Any) -> int:
+    # Expiry is compared with the naive local time, so an aware or invalid one never expires
+    expiry, _ = _parse_datetime(value)
+    if expiry is None or expiry.tzinfo is not None:
+        logger.warning(f"Invalid expiry format in cache entry {entry_id}: {value!r}")
+        return NO_EXPIRY
+    return (expiry - _EPOCH) // MICROSECOND
+
+
+# Column name -> dtype; every EntryFeatures field except `meta` is a column
+_COLUMNS = {
+    "key": object, "in_use": bool, "sequence": np.int64,
+    "has_sender": bool, "sender": np.int64, "domain": np.int64,
+    "recipients": object, "recipient_count": np.int64,
+    "has_ip": bool, "ip": np.int64, "has_thread": bool, "thread": np.int64,
+    "has_meta": bool, "meta_exact": bool, "meta_keys": object, "meta_values": object, "meta_count": np.int64,
+    "has_received": bool, "received": np.int64, "received_aware": bool, "unparseable_date": bool,
+    "expiry": np.int64, "has_message_id": bool, "message_id": np.int64
+}
+_FEATURE_COLUMNS = [name for name in _COLUMNS if name not in ("key", "in_use", "sequence", "recipient_count", "meta_count")]
+
+
+def _overlaps(column: np.ndarray, slots: np.ndarray, counts: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """For each slot, how many of its sorted ids are in the sorted `query` ids"""
+    flat = np.concatenate(list(column[slots])) if len(slots) else _EMPTY
+    owners = np.repeat(np.arange(len(slots)), counts)
+    hits = np.isin(flat, query, assume_unique=True)
+    return np.bincount(owners[hits], minlength=len(slots))
+
+
+class FeatureStore:
+    """
+    Features of the duplicate cache entries, one row per cache slot and a column per
+    feature, so the scan scores metadata and time for every entry in NumPy
+    """
+
+    def __init__(self, capacity: Optional[int] = None):
+        self.capacity = capacity
+        self.rows = 0
+        self.columns: Dict[str, np.ndarray] = {name: np.zeros(0, dtype=dtype) for name, dtype in _COLUMNS.items()}
+        self._sequence = 0
+
+    def _grow(self, slot: int) -> None:
+        rows = max(slot + 1, self.rows * 2, INITIAL_ROWS)
+        if self.capacity:
+            rows = max(slot + 1, min(rows, self.capacity))
+        for name, column in self.columns.items():
+            grown = np.zeros(rows, dtype=column.dtype)
+            grown[:self.rows] = column
+            self.columns[name] = grown
+        self.rows = rows
+
+    def put(self, slot: int, key: str, features: EntryFeatures) -> None:
+        """Store an entry's features in its slot"""
+        if slot >= self.rows:
+            self._grow(slot)
+        columns = self.columns
+        for name in _FEATURE_COLUMNS:
+            columns[name][slot] = getattr(features, name)
+        columns["recipient_count"][slot] = len(features.recipients)
+        columns["meta_count"][slot] = len(features.meta_keys)
+        columns["key"][slot] = key
+        columns["in_use"][slot] = True
+        self.touch(slot)
+
+    def touch(self, slot: int) -> None:
+        """Mark a slot most recently used (the scan breaks ties in LRU order)"""
+        self._sequence += 1
+        self.columns["sequence"][slot] = self._sequence
+
+    def clear(self, slot: int) -> None:
+        if slot < self.rows:
+            self.columns["in_use"][slot] = False
+            self.columns["key"][slot] = None
+            self.columns["recipients"][slot] = None
+            self.columns["meta_keys"][slot] = None
+            self.columns["meta_values"][slot] = None
+
+    def occupied(self) -> np.ndarray:
+        """Slots of the entries in the cache"""
+        return np.flatnonzero(self.columns["in_use"])
+
+    def lru_order(self, slots: np.ndarray) -> np.ndarray:
+        """Slots sorted least recently used first, the cache's iteration order"""
+        return slots[np.argsort(self.columns["sequence"][slots], kind="stable")]
+
+    def first(self, slots: np.ndarray) -> Optional[int]:
+        """The least recently used of some slots"""
+        if not len(slots):
+            return None
+        return int(slots[np.argmin(self.columns["sequence"][slots])])
+
+    def find_message_id(self, message_id: str, entries: Dict[str, Dict]) -> Optional[str]:
+        """Key of the least recently used entry with this Message-ID"""
+        columns = self.columns
+        slots = np.flatnonzero(columns["in_use"] & columns["has_message_id"] & (columns["message_id"] == hash(message_id)))
+        slots = [slot for slot in slots if entries[columns["key"][slot]].get('message_id') == message_id]
+        slot = self.first(np.asarray(slots, dtype=np.intp))
+        return None if slot is None else columns["key"][slot]
+
+    def expired_keys(self, now: datetime) -> List[str]:
+        """Keys of the entries whose expiry is before `now` (naive local time)"""
+        now_us = (now - _EPOCH) // MICROSECOND
+        columns = self.columns
+        return list(columns["key"][columns["in_use"] & (columns["expiry"] < now_us)])
+
+    def time_differences(self, received: int, slots: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Time between an email and the entries
+
+        Returns:
+            (has_time, microseconds): whether the entry has a receive time and the
+            absolute difference to `received` (meaningless where has_time is False)
+        """
+        columns = self.columns
+        return columns["has_received"][slots], np.abs(columns["received"][slots] - received)
+
+    def metadata_similarity(self, query: EntryFeatures, slots: np.ndarray, entries: Dict[str, Dict]) -> np.ndarray:
+        """
+        Metadata similarity of an email to the entries in some slots, the same scores
+        IntelligentDuplicateDetector._calculate_metadata_similarity gives pair by pair
+
+        Args:
+            query: Features of the email being checked
+            slots: Slots of the entries to compare with
+            entries: The cache's entries by key (for metadata that is not all strings)
+
+        Returns:
+            float64 array of scores in [0, 1], one per slot
+        """
+        columns = self.columns
+        score = np.zeros(len(slots))
+        total = np.zeros(len(slots))
+
+        # Sender match (high weight), or same domain for half
+        if query.has_sender:
+            both = columns["has_sender"][slots]
+            same_sender = both & (columns["sender"][slots] == query.sender)
+            same_domain = both & ~same_sender & (columns["domain"][slots] == query.domain)
+            score += np.where(same_sender, SENDER_WEIGHT, np.where(same_domain, SENDER_WEIGHT * 0.5, 0.0))
+            total += np.where(both, SENDER_WEIGHT, 0.0)
+
+        # Recipient overlap (Jaccard) when both have recipients
+        if len(query.recipients):
+            counts = columns["recipient_count"][slots]
+            both = np.flatnonzero(counts > 0)
+            overlap = _overlaps(columns["recipients"], slots[both], counts[both], query.recipients)
+            union = counts[both] + len(query.recipients) - overlap
+            score[both] += RECIPIENT_WEIGHT * (overlap / union)
+            total[both] += RECIPIENT_WEIGHT
+
+        # IP address match (if available)
+        if query.has_ip:
+            both = columns["has_ip"][slots]
+            score += np.where(both & (columns["ip"][slots] == query.ip), IP_WEIGHT, 0.0)
+            total += np.where(both, IP_WEIGHT, 0.0)
+
+        # Thread ID match
+        if query.has_thread:
+            both = columns["has_thread"][slots]
+            score += np.where(both & (columns["thread"][slots] == query.thread), THREAD_WEIGHT, 0.0)
+            total += np.where(both, THREAD_WEIGHT, 0.0)
+
+        # Share of common additional metadata keys with equal values
+        if query.has_meta:
+            self._add_metadata_matches(query, slots, entries, score, total)
+
+        return score / np.maximum(total, 0.001)
+
+    def _add_metadata_matches(self, query: EntryFeatures, slots: np.ndarray, entries: Dict[str, Dict],
+                              score: np.ndarray, total: np.ndarray) -> None:
+        columns = self.columns
+        both = columns["has_meta"][slots]
+        exact = both & columns["meta_exact"][slots] & query.meta_exact
+        common = np.zeros(len(slots), dtype=np.int64)
+        matches = np.zeros(len(slots), dtype=np.int64)
+
+        positions = np.flatnonzero(exact)
+        counts = columns["meta_count"][slots[positions]]
+        if len(positions):
+            keys = np.concatenate(list(columns["meta_keys"][slots[positions]]))
+            values = np.concatenate(list(columns["meta_values"][slots[positions]]))
+            owners = np.repeat(np.arange(len(positions)), counts)
+            index = np.minimum(np.searchsorted(query.meta_keys, keys), len(query.meta_keys) - 1)
+            found = query.meta_keys[index] == keys
+            equal = found & (query.meta_values[index] == values)
+            common[positions] = np.bincount(owners[found], minlength=len(positions))
+            matches[positions] = np.bincount(owners[equal], minlength=len(positions))
+
+        # Metadata with other types of keys or values keeps Python's == semantics
+        for position in np.flatnonzero(both & ~exact):
+            meta = entries[columns["key"][slots[position]]].get('additional_metadata') or {}
+            shared = set(query.meta.keys()).intersection(set(meta.keys()))
+            common[position] = len(shared)
+            matches[position] = sum(query.meta[key] == meta[key] for key in shared)
+
+        scored = np.flatnonzero(common > 0)
+        score[scored] += META_WEIGHT * (matches[scored] / common[scored])
+        total[scored] += META_WEIGHT
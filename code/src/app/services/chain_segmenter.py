@@ -0,0 +1,214 @@
+import re
+import zlib
+from dataclasses import dataclass, field
+from typing import Dict, List, Set, Tuple
+
+# Lines that start the quoted history of a reply
+QUOTE_MARKER = re.compile(r'^(?:>|-{2,}\s*(?:Original|Forwarded) Message\s*-{2,}|_{10,}$)', re.IGNORECASE)
+REPLY_ATTRIBUTION = re.compile(r'^On\b(.{0,300})\bwrote:$', re.IGNORECASE)
+HEADER_LINE = re.compile(r'^(?:From|Sent|Date|To|Cc|Subject):\s', re.IGNORECASE)
+SEPARATOR = re.compile(r'^(?:-{2,}\s*(?:Original|Forwarded) Message\s*-{2,}|_{10,}|-{10,})$', re.IGNORECASE)
+HEADER_FIELD = re.compile(
+    r'^(From|Sent|Date|To|Cc|Bcc|Subject|Message-ID|In-Reply-To|References):\s*(.*)$', re.IGNORECASE
+)
+# Header fields that may wrap onto following lines (long recipient lists)
+CONTINUED_FIELDS = {"to", "cc", "bcc", "references"}
+
+# Words per shingle when comparing paragraphs
+SHINGLE_WORDS = 8
+# Share of a paragraph's shingles seen earlier for it to count as repeated
+REPEAT_THRESHOLD = 0.8
+_HASH_BASE = 1000003
+_HASH_MOD = (1 << 61) - 1
+
+
+@dataclass
+class ChainMessage:
+    """One message of an email chain, with quoted text seen earlier in the chain removed"""
+    sender: str = ""
+    recipient: str = ""
+    subject: str = ""
+    date: str = ""
+    body: str = ""
+    headers: Dict[str, str] = field(default_factory=dict)
+    # Paragraphs dropped because they repeat text from elsewhere in the chain
+    removed_paragraphs: int = 0
+
+
+def _header_block(lines: List[str], start: int) -> Tuple[Dict[str, str], int]:
+    """
+    Read the header block starting at `start`
+
+    Returns:
+        Tuple of (headers by lowercase name, index of the first line after the block);
+        headers is empty when the lines are not a message header
+    """
+    headers: Dict[str, str] = {}
+    last = None
+    i = start
+    while i < len(lines):
+        line = lines[i].strip().lstrip(">").strip()
+        match = HEADER_FIELD.match(line)
+        if match:
+            last = match.group(1).lower()
+            headers[last] = match.group(2).strip()
+        elif line and last in CONTINUED_FIELDS and ("@" in line or line.endswith((",", ";"))):
+            headers[last] += " " + line
+        else:
+            break
+        i += 1
+    # A lone "From:" or "Subject:" line in a body is not a header block
+    if "from" not in headers or len(headers) < 2:
+        return {}, start
+    return headers, i
+
+
+def _find_messages(lines: List[str]) -> List[Tuple[int, int, Dict[str, str]]]:
+    """Find message boundaries as (header start, body start, headers)"""
+    boundaries = []
+    i = 0
+    while i < len(lines):
+        line = lines[i].strip().lstrip(">").strip()
+        if HEADER_FIELD.match(line):
+            headers, end = _header_block(lines, i)
+            if headers:
+                boundaries.append((i, end, headers))
+                i = end
+                continue
+        attribution = REPLY_ATTRIBUTION.match(line)
+        wrapped = None
+        if not attribution and line.startswith("On ") and i + 1 < len(lines):
+            # Attributions are often wrapped onto a second line
+            wrapped = REPLY_ATTRIBUTION.match(f"{line} {lines[i + 1].strip().lstrip('>').strip()}")
+        if attribution or wrapped:
+            match = attribution or wrapped
+            end = i + (1 if attribution else 2)
+            boundaries.append((i, end, {"attribution": match.group(1).strip(" ,")}))
+            i = end
+            continue
+        i += 1
+    return boundaries
+
+
+def _shingles(words: List[str]) -> Set[int]:
+    """Rolling hashes of every SHINGLE_WORDS-word window, computed in one pass"""
+    if len(words) < SHINGLE_WORDS:
+        return {zlib.crc32(" ".join(words).encode("utf-8"))}
+    tokens = [zlib.crc32(w.encode("utf-8")) for w in words]
+    top = pow(_HASH_BASE, SHINGLE_WORDS - 1, _HASH_MOD)
+    value = 0
+    for token in tokens[:SHINGLE_WORDS]:
+        value = (value * _HASH_BASE + token) % _HASH_MOD
+    hashes = {value}
+    for i in range(SHINGLE_WORDS, len(tokens)):
+        value = ((value - tokens[i - SHINGLE_WORDS] * top) * _HASH_BASE + tokens[i]) % _HASH_MOD
+        hashes.add(value)
+    return hashes
+
+
+def _paragraphs(body_lines: List[str]) -> List[Tuple[str, bool]]:
+    """Split body lines into (paragraph text, is quoted) with quote markers removed"""
+    paragraphs = []
+    current: List[str] = []
+    quoted = False
+    for line in body_lines + [""]:
+        stripped = line.strip()
+        text = re.sub(r'^(?:>\s?)+', '', stripped)
+        if not text or SEPARATOR.match(text):
+            if current:
+                paragraphs.append(("\n".join(current), quoted))
+            current, quoted = [], False
+            continue
+        current.append(text)
+        quoted = quoted or stripped.startswith(">")
+    return paragraphs
+
+
+def segment_chain(text: str) -> List[ChainMessage]:
+    """
+    Split the text of an email chain into its messages, in document order
+
+    Messages start at header blocks (From: with Date:/Sent:/To:/Subject: lines)
+    or "On ... wrote:" attributions. Paragraphs that repeat text from elsewhere
+    in the chain are removed, compared by rolling hashes of word shingles so
+    re-wrapped or re-quoted text still matches: quoted ("> ") copies are removed
+    in favour of the original message, and otherwise the first copy is kept.
+
+    Args:
+        text: Raw chain text with its line breaks
+
+    Returns:
+        Messages in document order (one message when no headers are found)
+    """
+    lines = text.splitlines()
+    boundaries = _find_messages(lines)
+    if not boundaries or boundaries[0][0] > 0:
+        # Text before the first header (or a chain without headers) is a message of its own
+        boundaries.insert(0, (0, 0, {}))
+
+    raw_messages = []
+    for n, (_, body_start, headers) in enumerate(boundaries):
+        body_end = boundaries[n + 1][0] if n + 1 < len(boundaries) else len(lines)
+        paragraphs = []
+        for paragraph, quoted in _paragraphs(lines[body_start:body_end]):
+            words = re.sub(r'[^\w@.$%-]+', ' ', paragraph.lower()).split()
+            if words:
+                paragraphs.append((paragraph, quoted, _shingles(words)))
+        raw_messages.append((headers, paragraphs))
+
+    # Text written in a message (not quoted) is what later copies are compared to
+    original: Set[int] = set()
+    for _, paragraphs in raw_messages:
+        for _, quoted, shingles in paragraphs:
+            if not quoted:
+                original |= shingles
+
+    seen: Set[int] = set()
+    messages = []
+    for headers, paragraphs in raw_messages:
+        kept = []
+        removed = 0
+        for paragraph, quoted, shingles in paragraphs:
+            repeated = sum(1 for h in shingles if h in seen or (quoted and h in original))
+            if repeated >= REPEAT_THRESHOLD * len(shingles):
+                removed += 1
+                continue
+            kept.append(paragraph)
+            seen |= shingles
+        if not kept and not headers:
+            continue
+        messages.append(_message(headers, "\n\n".join(kept), removed))
+    return messages
+
+
+def _message(headers: Dict[str, str], body: str, removed: int) -> ChainMessage:
+    sender = headers.get("from", "")
+    date = headers.get("date") or headers.get("sent", "")
+    if "attribution" in headers:
+        # "On <date>, <sender> wrote:": the sender is the address and the capitalized name before it
+        attribution = headers["attribution"]
+        address = re.search(r"((?<!\S)(?:(?!(?:AM|PM)\b)[A-Z][\w.'-]*\s+){0,4}<?[\w.+-]+@[\w.-]+\.\w+>?)\s*$", attribution)
+        sender = address.group(1).strip() if address else attribution
+        date = attribution[:address.start()].strip(" ,") if address else ""
+    return ChainMessage(
+        sender=sender,
+        recipient=headers.get("to", ""),
+        subject=headers.get("subject", ""),
+        date=date,
+        body=body,
+        headers={k: v for k, v in headers.items() if k != "attribution"},
+        removed_paragraphs=removed
+    )
+
+
+def render_chain(messages: List[ChainMessage]) -> str:
+    """Render segmented messages as one text, each introduced by its headers"""
+    parts = []
+    for n, message in enumerate(messages, start=1):
+        header = ", ".join(
+            f"{name}: {value}" for name, value in
+            (("From", message.sender), ("Date", message.date), ("Subject", message.subject))
+            if value
+        )
+        parts.append(f"[Message {n}{' - ' + header if header else ''}]\n{message.body}")
+    return "\n\n".join(parts)
@@ -1,15 +1,23 @@
+import asyncio
 import json
 import time
 import logging
-from typing import Dict, List, Any, Optional, Tuple
-from langchain.schema.messages import SystemMessage, HumanMessage
+from typing import Callable, Dict, List, Any, Optional, Tuple
+from langchain_core.messages import SystemMessage, HumanMessage
+from app.core.json_stream import stream_json_array
+from app.core.task_graph import TaskGraph
+from app.core.tracing import count, current_trace, span, start_trace
 from app.core.llm_handler import LLMHandler
 from app.services.email_processor import EmailProcessor
 from app.services.IntelligentDuplicateDetector import IntelligentDuplicateDetector  
 from app.services.data_extractor import DataExtractor
-from app.models.response_models import ClassificationResponse, RequestTypeResult, ExtractedField
-from app.schemas.request_types import request_type_collection
-from app.schemas.analytics import analytics_collection
+from app.services.pre_classifier import PreClassifier
+from app.services.analytics_sink import analytics_sink
+from app.services.request_type_catalog import CatalogSnapshot, request_type_catalog
+from app.services.thread_state import ThreadStateStore, history_coverage, merge_extracted_fields, thread_context
+from app.models.response_models import ClassificationResponse, RequestTypeResult, ExtractedField, RequestTypeClassification
+from app.schemas.threads import ThreadState
+from app.schemas.analytics import analytics_collection, fast_path_training_collection
 from datetime import datetime
 from app.schemas.analytics import duplicate_analytics_collection
 
@@ -20,19 +28,41 @@ class ClassificationService:
     """
     Service for orchestrating the email classification workflow
     """
+    # Duplicate confidence above which classification is skipped
+    CHAIN_DUPLICATE_CUTOFF = 0.74
+    EML_DUPLICATE_CUTOFF = 0.8
     
     def __init__(self, 
                 llm_handler: LLMHandler,
                 email_processor: EmailProcessor,
                 duplicate_detector: IntelligentDuplicateDetector,  # Updated type
-                data_extractor: DataExtractor):
+                data_extractor: DataExtractor,
+                pre_classifier: Optional[PreClassifier] = None,
+                attachment_concurrency: int = 4,
+                speculative_classification: bool = False,
+                thread_state_store: Optional[ThreadStateStore] = None,
+                thread_min_coverage: float = 0.8):
         """
         Initialize the classification service
+        
+        Args:
+            attachment_concurrency: Attachments of one email extracted at the same time
+            speculative_classification: Classify request types while the duplicate check
+                runs, cancelling the classification if the email is a duplicate
+            thread_state_store: Per-thread state for classifying only the new message of
+                replies (None to always classify the whole email)
+            thread_min_coverage: Share of a reply's quoted paragraphs that must be known
+                from its thread for incremental classification
         """
         self.llm_handler = llm_handler
         self.email_processor = email_processor
         self.duplicate_detector = duplicate_detector
         self.data_extractor = data_extractor
+        self.pre_classifier = pre_classifier
+        self.attachment_concurrency = attachment_concurrency
+        self.speculative_classification = speculative_classification
+        self.thread_state_store = thread_state_store
+        self.thread_min_coverage = thread_min_coverage
         logger.info("Classification service initialized with IntelligentDuplicateDetector")
     
     async def process_email_chain(self,
@@ -40,69 +70,63 @@ class ClassificationService:
                               email_chain_filename: str,
                               email_chain_content_type: str,
                               attachments: List[Dict[str, Any]] = None,
-                              thread_id: Optional[str] = None) -> ClassificationResponse:
+                              thread_id: Optional[str] = None,
+                              include_timings: bool = False) -> ClassificationResponse:
         """
         Process an email chain from a PDF file with separate attachments
-        """
-        start_time = time.time()
         
-        try:
-            # Check file size once at the service level
-            if len(email_chain_file) > self.email_processor.max_attachment_size:
-                raise ValueError(f"Email chain file exceeds maximum size of {self.email_processor.max_attachment_size_mb}MB")
-            
-            # Check attachment size and throw early if any exceeds
-            if attachments:
-                for attachment in attachments:
-                    if len(attachment["content"]) > self.email_processor.max_attachment_size:
-                        raise ValueError(f"Attachment {attachment['filename']} exceeds maximum size of {self.email_processor.max_attachment_size_mb}MB")
-                    
-            # Process email chain file and attachments
-            logger.info(f"Processing email chain from file: {email_chain_filename}")
-            email_info, processed_attachments = self.email_processor.process_email_chain(
+        Args:
+            include_timings: Attach the per-stage timing breakdown to the response
+        """
+        trace = start_trace()
+        with span("request.email_chain"):
+            response = await self._process_email_chain(
                 email_chain_file,
                 email_chain_filename,
                 email_chain_content_type,
-                attachments
-            )
-            
-            # Extract metadata for IntelligentDuplicateDetector
-            sender = email_info.get("sender", "Unknown")
-            subject = email_info.get("subject", "Unknown")
-            recipient = email_info.get("recipient", "")
-            received_date = email_info.get("received_date", "")
-            processed_email = email_info.get("content", "")
-            message_id = email_info.get("message_id")
-            references = email_info.get("references", [])
-            in_reply_to = email_info.get("in_reply_to")
-            email_thread_id = email_info.get("thread_id") or thread_id
-            ip_address = email_info.get("ip_address")
-            additional_metadata = email_info.get("additional_metadata", {})
-            
-            # Check for duplicates with IntelligentDuplicateDetector
-            is_duplicate, duplicate_reason, confidence_score, duplicate_id = self.duplicate_detector.check_duplicate(
-                processed_email, 
-                sender, 
-                subject,
-                recipient,
-                received_date,
-                message_id,
-                references,
-                in_reply_to,
-                email_thread_id,
-                ip_address,
-                additional_metadata
+                attachments,
+                thread_id
             )
-            
-            if is_duplicate:
-                await duplicate_analytics_collection.insert_one(
-                    {
-                        "duplicate_confidence": confidence_score,
-                        "timestamp": datetime.now().isoformat(),
-                    }
+        if include_timings:
+            response.timings = trace.summary()
+        return response
+    
+    async def _process_email_chain(self,
+                              email_chain_file: bytes,
+                              email_chain_filename: str,
+                              email_chain_content_type: str,
+                              attachments: List[Dict[str, Any]] = None,
+                              thread_id: Optional[str] = None) -> ClassificationResponse:
+        start_time = time.time()
+        
+        try:
+            async with TaskGraph() as graph:
+                # The catalog fetch overlaps parsing of the chain and its attachments
+                graph.add("catalog", self._fetch_catalog)
+                graph.add("parse", lambda: asyncio.to_thread(
+                    self.parse_email_chain,
+                    email_chain_file,
+                    email_chain_filename,
+                    email_chain_content_type,
+                    attachments
+                ))
+                email_info, processed_attachments = await graph.result("parse")
+                
+                if self.speculative_classification:
+                    graph.add(
+                        "classify",
+                        lambda catalog: self._classify_speculatively(email_info, processed_attachments, catalog),
+                        "catalog"
+                    )
+                
+                # Check for duplicates with IntelligentDuplicateDetector
+                is_duplicate, duplicate_reason, confidence_score, duplicate_id = await self.check_duplicate(
+                    email_info, thread_id
                 )
-                logger.info(f"Duplicate email detected: {duplicate_reason} (confidence: {confidence_score:.2f})")
-                if confidence_score > 0.74:
+                
+                skip = is_duplicate and confidence_score > self.CHAIN_DUPLICATE_CUTOFF
+                speculative_results = await self._settle_speculation(graph, skip)
+                if skip:
                     return ClassificationResponse(
                         request_types=[],
                         extracted_fields=[],
@@ -113,83 +137,15 @@ class ClassificationService:
                         duplicate_id=duplicate_id,
                         processing_time_ms=(time.time() - start_time) * 1000
                     )
-            
-            # Get request types from MongoDB
-            request_types = await self._get_request_types_from_db()
-            
-            # Identify request types
-            request_type_results = await self._identify_request_types(
-                processed_email,
-                processed_attachments,
-                sender,
-                subject,
-                received_date,
-                request_types
-            )
-            
-            # Extract fields based on identified request types
-            extracted_fields = []
-            support_group = ""
-            primary_request = None
-            if request_type_results:
-                # Find primary request type
-                primary_request = next(
-                    (r for r in request_type_results if r.is_primary), 
-                    request_type_results[0] if request_type_results else None
-                )
                 
-                if primary_request:
-                    # Get required attributes for the sub-request type
-                    required_attributes, support_group = await self._get_required_attributes(
-                        primary_request.request_type,
-                        primary_request.sub_request_type
-                    )
-                    
-                    extracted_fields = await self.data_extractor.extract_fields(
-                        processed_email,
-                        processed_attachments,
-                        primary_request.request_type,
-                        primary_request.sub_request_type,
-                        required_attributes
-                    )
+                request_type_results, extracted_fields, support_group = await self.classify_and_extract(
+                    email_info, processed_attachments, await graph.result("catalog"), speculative_results,
+                    thread_id=thread_id
+                )
             
             processing_time = (time.time() - start_time) * 1000
             logger.info(f"Email chain processing completed in {processing_time:.2f}ms")
             
-            if not request_types:
-                raise Exception("No request type found")
-            
-            if not primary_request:
-                primary_request = request_types[0]
-            
-            # Record analytics
-            await analytics_collection.insert_one(
-                {
-                    "request_type": primary_request.request_type,
-                    "sub_request_type": primary_request.sub_request_type,
-                    "support_group": support_group,
-                    "confidence": primary_request.confidence,
-                    "timestamp": datetime.now().isoformat(),
-                    "request_types": [
-                        {
-                            "request_type": result.request_type,
-                            "sub_request_type": result.sub_request_type,
-                            "confidence": result.confidence,
-                            "reasoning": result.reasoning,
-                            "is_primary": result.is_primary
-                        } for result in request_type_results
-                    ],
-                    "extracted_fields": [
-                        {
-                            "field_name": field.field_name,
-                            "value": field.value,
-                            "confidence": field.confidence,
-                            "source": field.source
-                        } for field in extracted_fields
-                    ]
-                }
-            )
-            
             return ClassificationResponse(
                 request_types=request_type_results,
                 extracted_fields=extracted_fields,
@@ -219,58 +175,65 @@ class ClassificationService:
     
     async def process_eml(self,
                         eml_content: bytes,
-                        thread_id: Optional[str] = None) -> ClassificationResponse:
+                        thread_id: Optional[str] = None,
+                        include_timings: bool = False) -> ClassificationResponse:
         """
         Process an email from an EML file
+        
+        Args:
+            include_timings: Attach the per-stage timing breakdown to the response
         """
+        trace = start_trace()
+        with span("request.eml"):
+            response = await self._process_eml(eml_content, thread_id)
+        if include_timings:
+            response.timings = trace.summary()
+        return response
+    
+    async def _process_eml(self,
+                        eml_content: bytes,
+                        thread_id: Optional[str] = None) -> ClassificationResponse:
         start_time = time.time()
         
         try:
-            # Check file size once at the service level
-            if len(eml_content) > self.email_processor.max_attachment_size:
-                raise ValueError(f"EML file exceeds maximum size of {self.email_processor.max_attachment_size_mb}MB")
-            
-            # Process EML file
-            logger.info("Processing email from EML file")
-            email_info, processed_attachments = self.email_processor.process_eml(eml_content)
-            
-            # Extract metadata for IntelligentDuplicateDetector
-            sender = email_info.get("sender", "Unknown")
-            subject = email_info.get("subject", "Unknown")
-            recipient = email_info.get("recipient", "")
-            received_date = email_info.get("received_date", "")
-            processed_email = email_info.get("content", "")
-            message_id = email_info.get("message_id")
-            references = email_info.get("references", [])
-            in_reply_to = email_info.get("in_reply_to")
-            email_thread_id = email_info.get("thread_id") or thread_id
-            ip_address = email_info.get("ip_address")
-            additional_metadata = email_info.get("additional_metadata", {})
-            
-            # Check for duplicates with IntelligentDuplicateDetector
-            is_duplicate, duplicate_reason, confidence_score, duplicate_id = self.duplicate_detector.check_duplicate(
-                processed_email, 
-                sender, 
-                subject,
-                recipient,
-                received_date,
-                message_id,
-                references,
-                in_reply_to,
-                email_thread_id,
-                ip_address,
-                additional_metadata
-            )
-            
-            if is_duplicate:
-                await duplicate_analytics_collection.insert_one(
-                    {
-                        "duplicate_confidence": confidence_score,
-                        "timestamp": datetime.now().isoformat(),
-                    }
+            self._check_size(eml_content, "EML file")
+            
+            # Stages run as soon as their inputs are ready: the catalog fetch overlaps
+            # parsing, and attachment extraction overlaps the duplicate check
+            async with TaskGraph() as graph:
+                graph.add("catalog", self._fetch_catalog)
+                graph.add("parse", lambda: asyncio.to_thread(self.email_processor.parse_eml_message, eml_content))
+                email_info, pending_attachments = await graph.result("parse")
+                
+                graph.add("embeddings", lambda: asyncio.to_thread(self._compute_embeddings, email_info))
+                graph.add("thread", lambda: self._load_thread(email_info, thread_id))
+                slots = asyncio.Semaphore(self.attachment_concurrency)
+                # A stage running in a worker thread keeps running when cancelled, so OCR,
+                # the slowest extraction, waits until the email is known not to be a duplicate
+                ocr_allowed = asyncio.Event()
+                attachment_stages = []
+                for attachment in pending_attachments:
+                    name = f"attachment.{attachment['index']}"
+                    graph.add(name, lambda attachment=attachment: self._extract_attachment(attachment, slots, ocr_allowed))
+                    attachment_stages.append(name)
+                
+                if self._should_speculate(pending_attachments):
+                    graph.add(
+                        "classify",
+                        lambda catalog, thread, *attachments: self._classify_speculatively(thread[0], list(attachments), catalog),
+                        "catalog", "thread", *attachment_stages
+                    )
+                
+                # Check for duplicates with IntelligentDuplicateDetector
+                is_duplicate, duplicate_reason, confidence_score, duplicate_id = await self.check_duplicate(
+                    email_info, thread_id, await graph.result("embeddings")
                 )
-                logger.info(f"Duplicate email detected: {duplicate_reason} (confidence: {confidence_score:.2f})")
-                if confidence_score > 0.8:
+                
+                skip = is_duplicate and confidence_score > self.EML_DUPLICATE_CUTOFF
+                if not skip:
+                    ocr_allowed.set()
+                speculative_results = await self._settle_speculation(graph, skip)
+                if skip:
                     return ClassificationResponse(
                         request_types=[],
                         extracted_fields=[],
@@ -281,83 +244,16 @@ class ClassificationService:
                         duplicate_id=duplicate_id,
                         processing_time_ms=(time.time() - start_time) * 1000
                     )
-            
-            # Get request types from MongoDB
-            request_types = await self._get_request_types_from_db()
-            
-            # Identify request types
-            request_type_results = await self._identify_request_types(
-                processed_email,
-                processed_attachments,
-                sender,
-                subject,
-                received_date,
-                request_types
-            )
-            
-            # Extract fields based on identified request types
-            extracted_fields = []
-            support_group = ""
-            primary_request = None
-            if request_type_results:
-                # Find primary request type
-                primary_request = next(
-                    (r for r in request_type_results if r.is_primary), 
-                    request_type_results[0] if request_type_results else None
-                )
                 
-                if primary_request:
-                    # Get required attributes for the sub-request type
-                    required_attributes, support_group = await self._get_required_attributes(
-                        primary_request.request_type,
-                        primary_request.sub_request_type
-                    )
-                    
-                    extracted_fields = await self.data_extractor.extract_fields(
-                        processed_email,
-                        processed_attachments,
-                        primary_request.request_type,
-                        primary_request.sub_request_type,
-                        required_attributes
-                    )
+                processed_attachments = await graph.results(*attachment_stages)
+                request_type_results, extracted_fields, support_group = await self.classify_and_extract(
+                    email_info, processed_attachments, await graph.result("catalog"), speculative_results,
+                    thread=await graph.result("thread"), thread_id=thread_id
+                )
             
             processing_time = (time.time() - start_time) * 1000
             logger.info(f"EML processing completed in {processing_time:.2f}ms")
             
-            if not request_types:
-                raise Exception("No request type found")
-            
-            if not primary_request:
-                primary_request = request_types[0]
-            
-            # Record analytics
-            await analytics_collection.insert_one(
-                {
-                    "request_type": primary_request.request_type,
-                    "sub_request_type": primary_request.sub_request_type,
-                    "support_group": support_group,
-                    "confidence": primary_request.confidence,
-                    "timestamp": datetime.now().isoformat(),
-                    "request_types": [
-                        {
-                            "request_type": result.request_type,
-                            "sub_request_type": result.sub_request_type,
-                            "confidence": result.confidence,
-                            "reasoning": result.reasoning,
-                            "is_primary": result.is_primary
-                        } for result in request_type_results
-                    ],
-                    "extracted_fields": [
-                        {
-                            "field_name": field.field_name,
-                            "value": field.value,
-                            "confidence": field.confidence,
-                            "source": field.source
-                        } for field in extracted_fields
-                    ]
-                }
-            )
-            
             return ClassificationResponse(
                 request_types=request_type_results,
                 extracted_fields=extracted_fields,
@@ -385,57 +281,485 @@ class ClassificationService:
                 error=f"Error processing EML: {str(e)}"
             )
     
-    async def _get_request_types_from_db(self) -> List[Dict[str, Any]]:
+    async def _classify(self,
+                        email_info: Dict[str, Any],
+                        processed_attachments: List[Dict[str, str]],
+                        catalog: CatalogSnapshot,
+                        on_result: Optional[Callable[[RequestTypeResult], None]] = None) -> List[RequestTypeResult]:
+        with span("classify"):
+            return await self._classify_request_types(
+                email_info.get("content", ""),
+                processed_attachments,
+                email_info.get("sender", "Unknown"),
+                email_info.get("subject", "Unknown"),
+                email_info.get("received_date", ""),
+                catalog,
+                email_info.get("thread_context"),
+                on_result
+            )
+    
+    def _should_speculate(self, pending_attachments: List[Dict[str, Any]]) -> bool:
+        """
+        Whether to classify an EML speculatively
+        
+        Not when an attachment needs OCR: OCR waits for the duplicate check, so the
+        speculation could not start before it and would only add a wasted call for
+        duplicates. Such emails are counted as `skipped_ocr` and classified after
+        the duplicate check.
+        """
+        if not self.speculative_classification:
+            return False
+        if any(self.email_processor.needs_ocr(attachment) for attachment in pending_attachments):
+            count("email_pipeline_speculative_classifications_total", result="skipped_ocr")
+            return False
+        return True
+    
+    async def _classify_speculatively(self,
+                                      email_info: Dict[str, Any],
+                                      processed_attachments: List[Dict[str, str]],
+                                      catalog: CatalogSnapshot) -> Tuple[List[RequestTypeResult], int]:
         """
-        Get request types from MongoDB
+        Classify while the duplicate check is still running
+        
+        A speculation that is cancelled (the email was a duplicate) or fails is
+        recorded here with the tokens it spent, including the estimated tokens of
+        calls cut off mid-flight.
+        
+        Returns:
+            Tuple of (request_type_results, LLM tokens spent), so the tokens can be
+            reported as wasted if the email turns out to be a duplicate
         """
+        tokens_before = self._trace_llm_tokens()
         try:
-            # Fetch all request types from the database
-            request_types = await request_type_collection.find().to_list(length=None)
-            
-            # Convert database ObjectIds to strings for JSON serialization
-            for request_type in request_types:
-                request_type["_id"] = str(request_type["_id"])
-            
-            return request_types
+            with span("classify.speculative"):
+                results = await self._classify(email_info, processed_attachments, catalog)
+        except asyncio.CancelledError:
+            self._count_speculation("cancelled", self._trace_llm_tokens() - tokens_before)
+            raise
+        except Exception:
+            self._count_speculation("failed", self._trace_llm_tokens() - tokens_before)
+            raise
+        return results, self._trace_llm_tokens() - tokens_before
+    
+    @staticmethod
+    def _trace_llm_tokens() -> int:
+        trace = current_trace()
+        if trace is None:
+            return 0
+        return sum(
+            v for k, v in trace.counters.items()
+            if k.startswith("llm_tokens.") or k.startswith("llm_cancelled_tokens.")
+        )
+    
+    @staticmethod
+    def _count_speculation(result: str, tokens: int) -> None:
+        count("email_pipeline_speculative_classifications_total", result=result)
+        if tokens:
+            count("email_pipeline_speculative_wasted_tokens_total", tokens)
+    
+    async def _settle_speculation(self, graph: TaskGraph, is_duplicate: bool) -> Optional[List[RequestTypeResult]]:
+        """
+        Resolve the speculative classification stage once the duplicate check is done
+        
+        For a duplicate, a stage that already finished is recorded as wasted with its
+        token cost; one still running is cancelled when the TaskGraph exits and records
+        itself as cancelled. Otherwise its results are returned for reuse, or None if it
+        failed, so the email is classified normally.
+        """
+        task = graph.get("classify")
+        if task is None:
+            return None
+        if is_duplicate:
+            if task.done() and not task.cancelled() and task.exception() is None:
+                _, tokens = task.result()
+                self._count_speculation("wasted", tokens)
+            return None
+        try:
+            results, _ = await task
         except Exception as e:
-            logger.error(f"Error retrieving request types from database: {str(e)}")
-            return []
+            logger.warning(f"Speculative classification failed, classifying again: {str(e)}")
+            return None
+        count("email_pipeline_speculative_classifications_total", result="used")
+        return results
     
-    async def _get_required_attributes(self, request_type_name: str, sub_request_type_name: str) -> Tuple[List[str], str]:
+    async def _load_thread(self,
+                           email_info: Dict[str, Any],
+                           thread_id: Optional[str] = None) -> Tuple[Dict[str, Any], Optional[ThreadState]]:
         """
-        Get required attributes and support group for a specific request type and sub-request type
+        Decide whether only the new message of a reply needs classifying
+        
+        Returns:
+            Tuple of (prompt_info, thread_state). When the reply's quoted history
+            consists of messages already classified in its thread, prompt_info is a
+            copy of email_info whose content is only the new message, with the
+            thread's earlier result under "thread_context". Otherwise it is
+            email_info itself and thread_state is None.
         """
+        if not self.thread_state_store or not email_info.get("quoted_hashes") or not email_info.get("new_content"):
+            return email_info, None
         try:
-            # Find request type by name
-            request_type = await request_type_collection.find_one({"name": request_type_name})
-            
-            if not request_type:
-                logger.warning(f"Request type not found: {request_type_name}")
-                return ([], "Not found")
+            state = await self.thread_state_store.get(
+                [email_info.get("thread_id"), thread_id, email_info.get("in_reply_to")]
+            )
+        except Exception as e:
+            logger.error(f"Error loading thread state: {str(e)}")
+            return email_info, None
+        
+        if state is None or history_coverage(state, email_info["quoted_hashes"]) < self.thread_min_coverage:
+            count("email_pipeline_thread_messages_total", result="full")
+            return email_info, None
+        
+        count("email_pipeline_thread_messages_total", result="incremental")
+        logger.info(f"Classifying only the new message of thread {state.thread_id} ({state.message_count} earlier)")
+        return {
+            **email_info,
+            "content": email_info["new_content"],
+            "thread_context": thread_context(state)
+        }, state
+    
+    def _save_thread(self,
+                     email_info: Dict[str, Any],
+                     thread_id: Optional[str],
+                     request_type_results: List[RequestTypeResult],
+                     extracted_fields: List[ExtractedField],
+                     support_group: str,
+                     thread_state: Optional[ThreadState] = None) -> None:
+        # A thread's first email has no References/In-Reply-To headers, so it is recorded
+        # under its own Message-ID, which its first reply looks up via In-Reply-To. The
+        # write happens in the background
+        key = email_info.get("thread_id") or thread_id or email_info.get("message_id")
+        if not self.thread_state_store or not key:
+            return
+        known = set(thread_state.message_hashes) if thread_state else set()
+        hashes = [
+            h for h in dict.fromkeys(email_info.get("message_hashes", []) + email_info.get("quoted_hashes", []))
+            if h not in known
+        ]
+        self.thread_state_store.save_in_background(key, request_type_results, support_group, extracted_fields, hashes)
+    
+    async def _fetch_catalog(self) -> CatalogSnapshot:
+        with span("catalog"):
+            return await self._get_request_type_catalog()
+    
+    def _compute_embeddings(self, email_info: Dict[str, Any]) -> Tuple[Any, Any]:
+        return self.duplicate_detector.compute_embeddings(
+            [(email_info.get("content", ""), email_info.get("subject", "Unknown"))]
+        )[0]
+    
+    async def _extract_attachment(self,
+                                  attachment: Dict[str, Any],
+                                  slots: asyncio.Semaphore,
+                                  ocr_allowed: Optional[asyncio.Event] = None) -> Dict[str, str]:
+        if ocr_allowed is not None and self.email_processor.needs_ocr(attachment):
+            await ocr_allowed.wait()
+        async with slots:
+            return await asyncio.to_thread(self.email_processor.extract_attachment, attachment)
+    
+    def _check_size(self, content: bytes, label: str) -> None:
+        """Raise if an uploaded file exceeds the maximum attachment size"""
+        if len(content) > self.email_processor.max_attachment_size:
+            raise ValueError(f"{label} exceeds maximum size of {self.email_processor.max_attachment_size_mb}MB")
+    
+    def parse_email_chain(self,
+                          email_chain_file: bytes,
+                          email_chain_filename: str,
+                          email_chain_content_type: str,
+                          attachments: List[Dict[str, Any]] = None) -> Tuple[Dict[str, Any], List[Dict[str, str]]]:
+        """
+        Size-check and parse an email chain PDF and its attachments
+        """
+        # Check file size once at the service level
+        self._check_size(email_chain_file, "Email chain file")
+        
+        # Check attachment size and throw early if any exceeds
+        if attachments:
+            for attachment in attachments:
+                self._check_size(attachment["content"], f"Attachment {attachment['filename']}")
+                
+        # Process email chain file and attachments
+        logger.info(f"Processing email chain from file: {email_chain_filename}")
+        return self.email_processor.process_email_chain(
+            email_chain_file,
+            email_chain_filename,
+            email_chain_content_type,
+            attachments
+        )
+    
+    def parse_eml(self, eml_content: bytes) -> Tuple[Dict[str, Any], List[Dict[str, str]]]:
+        """
+        Size-check and parse an EML file
+        """
+        # Check file size once at the service level
+        self._check_size(eml_content, "EML file")
+        
+        # Process EML file
+        logger.info("Processing email from EML file")
+        return self.email_processor.process_eml(eml_content)
+    
+    async def check_duplicate(self,
+                              email_info: Dict[str, Any],
+                              thread_id: Optional[str] = None,
+                              embeddings: Optional[Tuple[Any, Any]] = None) -> Tuple[bool, Optional[str], float, Optional[str]]:
+        """
+        Check a parsed email for duplicates and record duplicate analytics
+        
+        Args:
+            email_info: Parsed email information
+            thread_id: Optional thread ID supplied by the caller
+            embeddings: Optional precomputed (content, subject) embeddings
             
-            # Find support group
-            support_group = request_type.get("support_group", "Not found")
+        Returns:
+            Tuple of (is_duplicate, reason, confidence_score, duplicate_id)
+        """
+        content_embedding, subject_embedding = embeddings or (None, None)
+        
+        def run_check():
+            # Checks scan and then update the shared cache, so they run one at a time
+            with self.duplicate_detector.email_cache.lock:
+                return self.duplicate_detector.check_duplicate(
+                    email_info.get("content", ""),
+                    email_info.get("sender", "Unknown"),
+                    email_info.get("subject", "Unknown"),
+                    email_info.get("recipient", ""),
+                    email_info.get("received_date", ""),
+                    email_info.get("message_id"),
+                    email_info.get("references", []),
+                    email_info.get("in_reply_to"),
+                    email_info.get("thread_id") or thread_id,
+                    email_info.get("ip_address"),
+                    email_info.get("additional_metadata", {}),
+                    content_embedding=content_embedding,
+                    subject_embedding=subject_embedding
+                )
+        
+        # In a worker thread so the event loop (and any speculative classification)
+        # keeps running during the cache scan
+        with span("dedup"):
+            is_duplicate, duplicate_reason, confidence_score, duplicate_id = await asyncio.to_thread(run_check)
+        
+        if is_duplicate:
+            # Written in the background, off the request's critical path
+            await analytics_sink.submit(
+                duplicate_analytics_collection,
+                {
+                    "duplicate_confidence": confidence_score,
+                    "timestamp": datetime.now().isoformat(),
+                }
+            )
+            logger.info(f"Duplicate email detected: {duplicate_reason} (confidence: {confidence_score:.2f})")
+        
+        return is_duplicate, duplicate_reason, confidence_score, duplicate_id
+    
+    async def classify_and_extract(self,
+                                   email_info: Dict[str, Any],
+                                   processed_attachments: List[Dict[str, str]],
+                                   catalog: Optional[CatalogSnapshot] = None,
+                                   request_type_results: Optional[List[RequestTypeResult]] = None,
+                                   thread: Optional[Tuple[Dict[str, Any], Optional[ThreadState]]] = None,
+                                   thread_id: Optional[str] = None) -> Tuple[List[RequestTypeResult], List[ExtractedField], str]:
+        """
+        Identify request types, extract fields for the primary one, record analytics
+        and update the thread's state
+        
+        Args:
+            catalog: Request type catalog snapshot, if already fetched
+            request_type_results: Request types already identified (speculatively), if any
+            thread: Result of `_load_thread`, if already loaded
+            thread_id: Optional thread ID supplied by the caller
             
-            # Find sub-request type
-            for sub_type in request_type.get("sub_request_types", []):
-                if sub_type.get("name") == sub_request_type_name:
-                    return (sub_type.get("required_attributes", []), support_group)
+        Returns:
+            Tuple of (request_type_results, extracted_fields, support_group)
+        """
+        sender = email_info.get("sender", "Unknown")
+        subject = email_info.get("subject", "Unknown")
+        received_date = email_info.get("received_date", "")
+        processed_email = email_info.get("content", "")
+        
+        # For a reply to a known thread, only the new message goes to the LLM
+        prompt_info, thread_state = thread or await self._load_thread(email_info, thread_id)
+        
+        # Get request types from the in-process catalog cache
+        if catalog is None:
+            catalog = await self._fetch_catalog()
+        request_types = catalog.request_types
+        
+        # Extraction for the primary request type starts as soon as it streams in,
+        # while the LLM is still writing the other request types
+        early_extraction: Dict[Tuple[str, str], asyncio.Task] = {}
+        
+        def start_extraction(result: RequestTypeResult) -> None:
+            if result.is_primary and not early_extraction:
+                early_extraction[(result.request_type, result.sub_request_type)] = asyncio.create_task(
+                    self._extract(prompt_info, processed_attachments, result, catalog)
+                )
+        
+        try:
+            # Identify request types (local fast path first, then LLM)
+            if request_type_results is None:
+                request_type_results = await self._classify(
+                    prompt_info, processed_attachments, catalog, on_result=start_extraction
+                )
             
-            logger.warning(f"Sub-request type not found: {sub_request_type_name} in {request_type_name}")
-            return ([], support_group)
+            # Extract fields based on identified request types
+            extracted_fields = []
+            support_group = ""
+            primary_request = None
+            if request_type_results:
+                # Find primary request type
+                primary_request = next(
+                    (r for r in request_type_results if r.is_primary), 
+                    request_type_results[0] if request_type_results else None
+                )
             
+            if primary_request:
+                # Get required attributes for the sub-request type
+                _, support_group = catalog.get_required_attributes(
+                    primary_request.request_type,
+                    primary_request.sub_request_type
+                )
+                early = early_extraction.pop((primary_request.request_type, primary_request.sub_request_type), None)
+                if early is not None:
+                    count("email_pipeline_early_extractions_total", result="used")
+                    extracted_fields = await early
+                else:
+                    extracted_fields = await self._extract(prompt_info, processed_attachments, primary_request, catalog)
+        finally:
+            # An early extraction for a request type that did not end up primary
+            for task in early_extraction.values():
+                task.cancel()
+                count("email_pipeline_early_extractions_total", result="discarded")
+        
+        if primary_request and thread_state:
+            # Fields found earlier in the thread still apply to the same request
+            previous_primary = next((r for r in thread_state.request_types if r.get("is_primary")), None)
+            if previous_primary and (previous_primary.get("request_type"), previous_primary.get("sub_request_type")) == \
+                    (primary_request.request_type, primary_request.sub_request_type):
+                extracted_fields = merge_extracted_fields(thread_state.extracted_fields, extracted_fields)
+        
+        if not request_types:
+            raise Exception("No request type found")
+        
+        if not primary_request:
+            primary_request = request_types[0]
+        
+        # Record analytics in the background, off the request's critical path
+        await analytics_sink.submit(
+            analytics_collection,
+            {
+                "request_type": primary_request.request_type,
+                "sub_request_type": primary_request.sub_request_type,
+                "support_group": support_group,
+                "confidence": primary_request.confidence,
+                "timestamp": datetime.now().isoformat(),
+                "request_types": [
+                    {
+                        "request_type": result.request_type,
+                        "sub_request_type": result.sub_request_type,
+                        "confidence": result.confidence,
+                        "reasoning": result.reasoning,
+                        "is_primary": result.is_primary
+                    } for result in request_type_results
+                ],
+                "extracted_fields": [
+                    {
+                        "field_name": field.field_name,
+                        "value": field.value,
+                        "confidence": field.confidence,
+                        "source": field.source
+                    } for field in extracted_fields
+                ]
+            }
+        )
+        
+        self._save_thread(email_info, thread_id, request_type_results, extracted_fields, support_group, thread_state)
+        
+        return request_type_results, extracted_fields, support_group
+    
+    async def _extract(self,
+                       prompt_info: Dict[str, Any],
+                       processed_attachments: List[Dict[str, str]],
+                       primary_request: RequestTypeResult,
+                       catalog: CatalogSnapshot) -> List[ExtractedField]:
+        """Extract the fields required by the primary request type's sub-request type"""
+        required_attributes, _ = catalog.get_required_attributes(
+            primary_request.request_type,
+            primary_request.sub_request_type
+        )
+        with span("extract"):
+            return await self.data_extractor.extract_fields(
+                prompt_info.get("content", ""),
+                processed_attachments,
+                primary_request.request_type,
+                primary_request.sub_request_type,
+                required_attributes,
+                prompt_info.get("thread_context")
+            )
+    
+    async def _get_request_type_catalog(self) -> CatalogSnapshot:
+        """
+        Get the request type catalog snapshot (cached in-process, no DB round trip once loaded)
+        """
+        try:
+            count(
+                "email_pipeline_cache_events_total",
+                cache="request_type_catalog",
+                result="hit" if request_type_catalog.is_loaded else "miss"
+            )
+            return await request_type_catalog.get()
         except Exception as e:
-            logger.error(f"Error retrieving required attributes: {str(e)}")
-            return ([], support_group)
+            logger.error(f"Error retrieving request types from database: {str(e)}")
+            return CatalogSnapshot(version=-1, request_types=[], prompt_fragment="[]")
             
+    async def _classify_request_types(self,
+                                    email_content: str,
+                                    attachments: List[Dict[str, str]],
+                                    sender: str,
+                                    subject: str,
+                                    received_date: str,
+                                    catalog: CatalogSnapshot,
+                                    thread_context: Optional[str] = None,
+                                    on_result: Optional[Callable[[RequestTypeResult], None]] = None) -> List[RequestTypeResult]:
+        """
+        Classify request types, using the local pre-classifier when it is confident
+        enough and enforcing, otherwise the LLM (with shadow comparison)
+        """
+        if not self.pre_classifier or not self.pre_classifier.enabled:
+            return await self._identify_request_types(
+                email_content, attachments, sender, subject, received_date, catalog, thread_context, on_result
+            )
+        
+        self.pre_classifier.schedule_refresh(catalog)
+        prediction = self.pre_classifier.predict(subject, email_content)
+        
+        if self.pre_classifier.should_skip_llm(prediction):
+            self.pre_classifier.stats["fast_path_served"] += 1
+            count("email_pipeline_fast_path_total", result="served")
+            logger.info(
+                f"Fast path classified email as {prediction.request_type}/{prediction.sub_request_type} "
+                f"(confidence: {prediction.confidence:.2f}), skipping LLM"
+            )
+            return [prediction]
+        
+        result_types = await self._identify_request_types(
+            email_content, attachments, sender, subject, received_date, catalog, thread_context, on_result
+        )
+        self.pre_classifier.record_agreement(prediction, result_types)
+        count("email_pipeline_fast_path_total", result="llm")
+        # Only the LLM's classifications are training labels, never the fast path's own
+        example = self.pre_classifier.training_example(subject, email_content, result_types)
+        if example:
+            await analytics_sink.submit(fast_path_training_collection, example)
+        return result_types
+    
     async def _identify_request_types(self,
                                     email_content: str,
                                     attachments: List[Dict[str, str]],
                                     sender: str,
                                     subject: str,
                                     received_date: str,
-                                    request_types: List[Dict[str, Any]]) -> List[RequestTypeResult]:
+                                    catalog: CatalogSnapshot,
+                                    thread_context: Optional[str] = None,
+                                    on_result: Optional[Callable[[RequestTypeResult], None]] = None) -> List[RequestTypeResult]:
         """
         Identify request types from email content and attachments
         
@@ -445,32 +769,17 @@ class ClassificationService:
             sender: Email sender
             subject: Email subject
             received_date: Email received date
-            request_types: List of available request types from MongoDB
+            catalog: Request type catalog snapshot with the pre-rendered prompt fragment
+            thread_context: Earlier classification of the email's thread, when only the
+                new message of a reply is given
+            on_result: Called with each request type as soon as it has been streamed
             
         Returns:
             List of request type results
         """
         try:
-            # Format request types for prompt (include name and definition for sub-types)
-            formatted_request_types = []
-            for rt in request_types:
-                # Format sub-types to include both name and definition
-                sub_types = [
-                    {
-                        "name": st.get("name"),
-                        "definition": st.get("definition", "")
-                    } 
-                    for st in rt.get("sub_request_types", [])
-                ]
-                
-                # Add the main request type with its sub-types
-                formatted_request_types.append({
-                    "request_type": rt.get("name"),
-                    "definition": rt.get("definition", ""),
-                    "sub_request_types": sub_types
-                })
-                
-            request_types_str = json.dumps(formatted_request_types, indent=2)
+            # Request types are pre-formatted once per catalog version
+            request_types_str = catalog.prompt_fragment
             
             # Format attachments for prompt
             attachments_str = ""
@@ -513,8 +822,17 @@ class ClassificationService:
                     - ONLY RETURN THE JSON. Avoid adding any other text in your response like explanation, reasoning etc.
                     """
             
+            # Earlier messages of a known thread are summarized instead of repeated
+            thread_str = ""
+            if thread_context:
+                thread_str = f"""THREAD CONTEXT (the email content below is only the newest reply in this thread):
+                {thread_context}
+                A reply usually continues the thread's request unless it clearly asks for something else.
+
+                """
+            
             # Create human prompt
-            human_prompt = f"""EMAIL METADATA:
+            human_prompt = f"""{thread_str}EMAIL METADATA:
                 - Sender: {sender}
                 - Subject: {subject}
                 - Received Date: {received_date}
@@ -527,111 +845,58 @@ class ClassificationService:
                 Remember to prioritize email content over attachments when determining request type and sub request type.
                 """
             
-            # Get LLM for classification
-            llm = self.llm_handler.get_llm("email_classification")
-            
-            # Get response from LLM
+            # Get response from LLM (routed across configured candidates)
             messages = [
                 SystemMessage(content=system_prompt),
                 HumanMessage(content=human_prompt)
             ]
             
-            response = await llm.ainvoke(messages)
-            response_content = response.content
-            
-            # Parse the response
+            # Prefer provider-native structured output when the configured model supports it
             try:
-                identified_types = json.loads(response_content)
-                
-                # Validate and convert to model objects
-                result_types = []
-                for item in identified_types:
-                    # Ensure required fields are present
-                    if all(k in item for k in ["request_type", "sub_request_type", "confidence", "reasoning"]):
-                        result_types.append(RequestTypeResult(
-                            request_type=item["request_type"],
-                            sub_request_type=item["sub_request_type"],
-                            confidence=float(item["confidence"]),
-                            reasoning=item["reasoning"],
-                            is_primary=bool(item.get("is_primary", False))
-                        ))
-                
-                # Ensure one primary request type
-                primary_found = False
-                for item in result_types:
-                    if item.is_primary:
-                        primary_found = True
-                        break
-                
-                # If no primary type was marked, mark the first one
-                if not primary_found and result_types:
+                structured = await self.llm_handler.ainvoke_structured(
+                    "email_classification", messages, RequestTypeClassification
+                )
+            except Exception as e:
+                logger.warning(f"Structured output failed, falling back to prompt-only JSON: {str(e)}")
+                structured = None
+            
+            if structured is not None:
+                result_types = list(structured.request_types)
+                if not any(r.is_primary for r in result_types) and result_types:
                     result_types[0].is_primary = True
-                
-                logger.info(f"Identified {len(result_types)} request types")
+                logger.info(f"Identified {len(result_types)} request types (structured output)")
                 return result_types
-                
-            except json.JSONDecodeError as e:
-                logger.error(f"Error parsing LLM response: {str(e)}")
-                logger.debug(f"Raw response: {str(response_content)}")
-                
-                # Try to fix JSON with OutputFixingParser
-                from langchain.output_parsers import OutputFixingParser
-                from langchain_core.output_parsers import JsonOutputParser
-
-                
-                # Create a JsonOutputParser first as the base parser
-                base_parser = JsonOutputParser()
-                
-                # Then create the OutputFixingParser with both the LLM and the base parser
-                fixing_parser = OutputFixingParser.from_llm(
-                    llm=llm,
-                    parser=base_parser
-                )
-                
-                try:
-                    # Check if the response is empty
-                    if not response_content.strip():
-                        logger.error("Empty response from LLM")
-                        return []
-                        
-                    # Try to fix and parse the JSON
-                    fixed_json = fixing_parser.parse(response_content)
-                    result_types = []
-                    
-                    # Validate the fixed JSON
-                    if not isinstance(fixed_json, list):
-                        logger.error(f"Fixed JSON is not a list: {fixed_json}")
-                        return []
-                    
-                    for item in fixed_json:
-                        # Ensure all required fields are present
-                        if not all(k in item for k in ["request_type", "sub_request_type", "confidence", "reasoning"]):
-                            logger.warning(f"Skipping item missing required fields: {item}")
-                            continue
-                            
-                        try:
-                            result_types.append(RequestTypeResult(
-                                request_type=item["request_type"],
-                                sub_request_type=item["sub_request_type"],
-                                confidence=float(item["confidence"]),
-                                reasoning=item["reasoning"],
-                                is_primary=bool(item.get("is_primary", False))
-                            ))
-                        except (ValueError, TypeError) as e:
-                            logger.warning(f"Error converting item to RequestTypeResult: {str(e)}")
-                            continue
-                    
-                    # Ensure one primary request type
-                    if not any(r.is_primary for r in result_types) and result_types:
-                        result_types[0].is_primary = True
-                    
-                    logger.info(f"Fixed JSON and identified {len(result_types)} request types")
-                    return result_types
+            
+            # Parse array elements as they stream in; malformed output is repaired
+            # locally before falling back to a corrective LLM call
+            result_types = []
+            async for item in stream_json_array(self.llm_handler, "email_classification", messages):
+                # Ensure required fields are present
+                if not all(k in item for k in ["request_type", "sub_request_type", "confidence", "reasoning"]):
+                    logger.warning(f"Skipping item missing required fields: {item}")
+                    continue
                     
-                except Exception as e2:
-                    logger.error(f"Error fixing JSON: {str(e2)}")
-                    # Return an empty list as a fallback
-                    return []
+                try:
+                    result = RequestTypeResult(
+                        request_type=item["request_type"],
+                        sub_request_type=item["sub_request_type"],
+                        confidence=float(item["confidence"]),
+                        reasoning=item["reasoning"],
+                        is_primary=bool(item.get("is_primary", False))
+                    )
+                except (ValueError, TypeError) as e:
+                    logger.warning(f"Error converting item to RequestTypeResult: {str(e)}")
+                    continue
+                result_types.append(result)
+                if on_result:
+                    on_result(result)
+            
+            # Ensure one primary request type
+            if not any(r.is_primary for r in result_types) and result_types:
+                result_types[0].is_primary = True
+            
+            logger.info(f"Identified {len(result_types)} request types")
+            return result_types
                 
         except Exception as e:
             logger.error(f"Error identifying request types: {str(e)}")
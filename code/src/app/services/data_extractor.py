@@ -3,10 +3,12 @@ import logging
 import re
 from typing import Dict, List, Any, Optional, Tuple, Union
 
-from langchain.schema.messages import SystemMessage, HumanMessage
+from langchain_core.messages import SystemMessage, HumanMessage
 
+from app.core.json_stream import stream_json_array
+from app.core.tracing import count
 from app.core.llm_handler import LLMHandler
-from app.models.response_models import ExtractedField
+from app.models.response_models import ExtractedField, FieldExtraction
 
 logger = logging.getLogger(__name__)
 
@@ -30,7 +32,8 @@ class DataExtractor:
                            attachments: List[Dict[str, str]],
                            request_type: str,
                            sub_request_type: str,
-                           required_attributes: List[str]) -> List[ExtractedField]:
+                           required_attributes: List[str],
+                           thread_context: Optional[str] = None) -> List[ExtractedField]:
         """
         Extract fields from email content based on request type and required attributes
         
@@ -40,6 +43,8 @@ class DataExtractor:
             request_type: Identified request type
             sub_request_type: Identified sub-request type
             required_attributes: List of required attributes to extract for this sub-request type
+            thread_context: Earlier classification and fields of the email's thread, when
+                only the new message of a reply is given
             
         Returns:
             List of extracted fields
@@ -92,8 +97,17 @@ class DataExtractor:
                 """
             
             
+            # Earlier messages of a known thread are summarized instead of repeated
+            thread_str = ""
+            if thread_context:
+                thread_str = f"""THREAD CONTEXT (the email content below is only the newest reply in this thread):
+                {thread_context}
+                Return a field from the context only if the new reply changes it.
+
+                """
+            
             # Create human prompt
-            human_prompt = f"""REQUEST TYPE: {request_type} - {sub_request_type}
+            human_prompt = f"""{thread_str}REQUEST TYPE: {request_type} - {sub_request_type}
 
                 EMAIL CONTENT:
                 {email_content}
@@ -103,87 +117,61 @@ class DataExtractor:
                 Based on the above email content and attachments, extract all relevant fields.
                 Remember to prioritize attachments over email body when extracting data.
                 """
-            # Get LLM for data extraction
-            llm = self.llm_handler.get_llm("data_extraction")
-            
-            # Get response from LLM
+            # Get response from LLM (routed across configured candidates)
             messages = [
                 SystemMessage(content=system_prompt),
                 HumanMessage(content=human_prompt)
             ]
             
-            response = await llm.ainvoke(messages)
-            response_content = response.content
-            
-            # Parse the response
+            # Prefer provider-native structured output when the configured model supports it
             try:
-                extracted_data = json.loads(response_content)
-                
-                # Validate and convert to model objects
-                result_fields = []
-                for item in extracted_data:
-                    # Ensure required fields are present
-                    if all(k in item for k in ["field_name", "value", "confidence", "source"]):
-                        # Skip low confidence extractions
-                        if float(item["confidence"]) < 0.5:
-                            continue
-                            
-                        # Normalize field names
-                        field_name = self._normalize_field_name(item["field_name"])
-                        
-                        # Add to results
-                        result_fields.append(ExtractedField(
-                            field_name=field_name,
-                            value=item["value"],
-                            confidence=float(item["confidence"]),
-                            source=item["source"]
-                        ))
-                
-                logger.info(f"Extracted {len(result_fields)} fields")
-                return result_fields
-                
-            except json.JSONDecodeError as e:
-                logger.error(f"Error parsing LLM response: {str(e)}")
-                logger.debug(f"Raw response: {response_content}")
-                
-                # Try to fix JSON with OutputFixingParser
-                from langchain.output_parsers import OutputFixingParser
-                from langchain_core.output_parsers import JsonOutputParser
-                
-                # Create a JsonOutputParser first as the base parser
-                base_parser = JsonOutputParser()
-                
-                # Then create the OutputFixingParser with both the LLM and the base parser
-                fixing_parser = OutputFixingParser.from_llm(
-                    llm=llm,
-                    parser=base_parser
+                structured = await self.llm_handler.ainvoke_structured(
+                    "data_extraction", messages, FieldExtraction
                 )
-                
-                try:
-                    fixed_json = fixing_parser.parse(response_content)
-                    result_fields = []
+            except Exception as e:
+                logger.warning(f"Structured output failed, falling back to prompt-only JSON: {str(e)}")
+                structured = None
+            
+            if structured is not None:
+                result_fields = [
+                    field.model_copy(update={"field_name": self._normalize_field_name(field.field_name)})
+                    for field in structured.extracted_fields
+                    if field.confidence >= 0.5  # Skip low confidence extractions
+                ]
+                logger.info(f"Extracted {len(result_fields)} fields (structured output)")
+                count("email_pipeline_extracted_fields_total", len(result_fields), path="structured")
+                return result_fields
+            
+            # Parse array elements as they stream in; malformed output is repaired
+            # locally before falling back to a corrective LLM call
+            result_fields = []
+            async for item in stream_json_array(self.llm_handler, "data_extraction", messages):
+                # Ensure required fields are present
+                if not all(k in item for k in ["field_name", "value", "confidence", "source"]):
+                    continue
                     
-                    for item in fixed_json:
-                        # Skip low confidence extractions
-                        if float(item.get("confidence", 0)) < 0.5:
-                            continue
-                            
-                        # Normalize field names
-                        field_name = self._normalize_field_name(item["field_name"])
+                try:
+                    # Skip low confidence extractions
+                    if float(item["confidence"]) < 0.5:
+                        continue
                         
-                        result_fields.append(ExtractedField(
-                            field_name=field_name,
-                            value=item["value"],
-                            confidence=float(item["confidence"]),
-                            source=item["source"]
-                        ))
+                    # Normalize field names
+                    field_name = self._normalize_field_name(item["field_name"])
                     
-                    logger.info(f"Fixed JSON and extracted {len(result_fields)} fields")
-                    return result_fields
-                    
-                except Exception as e2:
-                    logger.error(f"Error fixing JSON: {str(e2)}")
-                    return []
+                    # Add to results
+                    result_fields.append(ExtractedField(
+                        field_name=field_name,
+                        value=item["value"],
+                        confidence=float(item["confidence"]),
+                        source=item["source"]
+                    ))
+                except (ValueError, TypeError) as e:
+                    logger.warning(f"Error converting item to ExtractedField: {str(e)}")
+                    continue
+            
+            logger.info(f"Extracted {len(result_fields)} fields")
+            count("email_pipeline_extracted_fields_total", len(result_fields), path="stream")
+            return result_fields
                 
         except Exception as e:
             logger.error(f"Error extracting fields: {str(e)}")
@@ -1,11 +1,14 @@
 import os
 import io
 import re
+import hashlib
 import email as email_module  # Renamed the import to avoid conflict
 from typing import List, Dict, Any, Tuple
+from dataclasses import asdict
 from email.parser import Parser
 from email.policy import default
 import logging
+import threading
 from datetime import datetime
 import socket
 
@@ -14,10 +17,74 @@ import pypdf
 from bs4 import BeautifulSoup
 from PIL import Image
 import numpy as np
-import easyocr
+
+from app.config import get_settings
+from app.core.tracing import span, traced
+from app.services.chain_segmenter import HEADER_LINE, QUOTE_MARKER, REPLY_ATTRIBUTION, render_chain, segment_chain
 
 logger = logging.getLogger(__name__)
 
+# Paragraphs shorter than this (greetings, sign-offs) are not hashed
+MIN_HASHED_PARAGRAPH = 20
+
+# Attachment extensions whose text is extracted with OCR
+OCR_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp')
+
+# EasyOCR pulls in torch, torchvision and OpenCV, so it is imported and its
+# models loaded on the first image rather than when the module is imported
+_ocr_reader = None
+_ocr_reader_lock = threading.Lock()
+
+
+class _SerializedReader:
+    """
+    EasyOCR reader whose `readtext` calls run one at a time
+
+    The reader is shared by every worker thread of the process and is not
+    thread-safe, so concurrent attachments wait for each other here.
+    """
+
+    def __init__(self, reader):
+        self._reader = reader
+        self._lock = threading.Lock()
+
+    def readtext(self, image: np.ndarray, detail: int = 0) -> List[str]:
+        with self._lock:
+            return self._reader.readtext(image, detail=detail)
+
+
+def load_ocr_reader():
+    """
+    Load the EasyOCR reader in this process
+
+    Returns:
+        easyocr.Reader for English, with its `readtext` calls serialized
+    """
+    with span("parse.ocr_model_load"):
+        import easyocr
+        return _SerializedReader(easyocr.Reader(['en']))
+
+
+def get_ocr_reader():
+    """
+    Get the shared OCR reader, loading it on first use
+
+    With `model_sharing` set to "sidecar" the reader is a client of the model
+    sidecar process, with the same `readtext` method.
+    """
+    global _ocr_reader
+    if _ocr_reader is None:
+        with _ocr_reader_lock:
+            if _ocr_reader is None:
+                settings = get_settings()
+                if settings.model_sharing == "sidecar":
+                    from app.services.model_sidecar import SidecarOCRReader
+                    _ocr_reader = SidecarOCRReader(settings.model_sidecar_socket)
+                else:
+                    _ocr_reader = load_ocr_reader()
+    return _ocr_reader
+
+
 class EmailProcessor:
     """
     Service for processing email content and attachments to extract text
@@ -27,8 +94,10 @@ class EmailProcessor:
         """
         Initialize the email processor
         """
+        self.max_attachment_size_mb = max_attachment_size_mb
         self.max_attachment_size = max_attachment_size_mb * 1024 * 1024  # Convert to bytes
     
+    @traced("parse.email_chain")
     def process_email_chain(self,
                            email_chain_content: bytes,
                            email_chain_filename: str,
@@ -37,18 +106,25 @@ class EmailProcessor:
         """
         Process email chain from PDF and separate attachments
         """
-        # Extract email chain information from PDF
-        email_text = self._extract_text_from_pdf(email_chain_content)
+        # Extract email chain information from PDF, keeping line breaks so headers
+        # and message boundaries can be found
+        email_text = self._extract_raw_text_from_pdf(email_chain_content)
         
-        # Try to extract email metadata from the PDF content
+        # Try to extract email metadata from the PDF content (the first header is the top message's)
         email_info = self._extract_email_metadata_from_text(email_text)
         
         if not email_info.get("subject"):
             # If metadata extraction fails, use filename as subject
             email_info["subject"] = os.path.splitext(email_chain_filename)[0]
         
+        # Split the chain into its messages and drop quoted text repeated from earlier ones
+        with span("parse.segment_chain") as segment_span:
+            messages = segment_chain(email_text)
+            segment_span.attributes["messages"] = len(messages)
+        email_info["messages"] = [asdict(message) for message in messages]
+        
         # Add additional fields for IntelligentDuplicateDetector
-        email_info["content"] = email_text
+        email_info["content"] = self._clean_text(render_chain(messages) if messages else email_text)
         email_info["recipient"] = self._extract_recipient_from_text(email_text)
         
         # Add default values for additional IntelligentDuplicateDetector fields
@@ -91,11 +167,26 @@ class EmailProcessor:
         
         return email_info, processed_attachments
     
+    @traced("parse.eml")
     def process_eml(self, eml_content: bytes) -> Tuple[Dict[str, Any], List[Dict[str, str]]]:
         """
         Process EML file containing email with attachments
         Enhanced to extract detailed metadata for IntelligentDuplicateDetector
         """
+        email_info, pending_attachments = self.parse_eml_message(eml_content)
+        return email_info, [self.extract_attachment(attachment) for attachment in pending_attachments]
+    
+    @traced("parse.eml_message")
+    def parse_eml_message(self, eml_content: bytes) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """
+        Parse an EML file's headers and body, leaving attachment text extraction to
+        `extract_attachment` so attachments can be processed concurrently
+        
+        Returns:
+            Tuple of (email_info, pending_attachments). Pending attachments carry
+            index, filename, content_type and either the raw `content` or, when
+            there is nothing to extract, the final `text`.
+        """
         try:
             # Parse the EML content
             eml_text = eml_content.decode('utf-8', errors='ignore')
@@ -133,6 +224,9 @@ class EmailProcessor:
             # Extract email body and attachments
             processed_attachments = []
             attachment_idx = 0
+            # First plain text and HTML bodies, kept uncleaned to split off quoted history
+            plain_body = None
+            html_body = None
             
             if email_message.is_multipart():
                 for part in email_message.walk():
@@ -142,10 +236,15 @@ class EmailProcessor:
                     # Extract body content
                     if "attachment" not in content_disposition and part.get_payload(decode=True) is not None:
                         if content_type == "text/plain":
-                            email_info["content"] += part.get_payload(decode=True).decode('utf-8', errors='ignore') + "\n\n"
+                            text_content = part.get_payload(decode=True).decode('utf-8', errors='ignore')
+                            email_info["content"] += text_content + "\n\n"
+                            if plain_body is None:
+                                plain_body = text_content
                         elif content_type == "text/html":
                             html_content = part.get_payload(decode=True).decode('utf-8', errors='ignore')
                             email_info["content"] += self._extract_text_from_html(html_content) + "\n\n"
+                            if html_body is None:
+                                html_body = html_content
                     
                     # Extract attachments
                     elif "attachment" in content_disposition or "inline" in content_disposition:
@@ -157,18 +256,12 @@ class EmailProcessor:
                             
                             attachment_content = part.get_payload(decode=True)
                             if attachment_content and len(attachment_content) <= self.max_attachment_size:
-                                # Process the attachment
-                                processed_text = self.process_attachment(
-                                    attachment_content,
-                                    filename,
-                                    content_type
-                                )
-                                
+                                # Text is extracted later by extract_attachment
                                 processed_attachments.append({
                                     "index": attachment_idx,
                                     "filename": filename,
                                     "content_type": content_type,
-                                    "text": processed_text
+                                    "content": attachment_content
                                 })
                             else:
                                 logger.warning(f"Attachment too large or empty: {filename}")
@@ -190,14 +283,21 @@ class EmailProcessor:
                 # Handle non-multipart email
                 content_type = email_message.get_content_type()
                 if content_type == "text/plain":
-                    email_info["content"] = email_message.get_content()
+                    email_info["content"] = plain_body = email_message.get_content()
                 elif content_type == "text/html":
-                    html_content = email_message.get_content()
+                    html_content = html_body = email_message.get_content()
                     email_info["content"] = self._extract_text_from_html(html_content)
             
             # Clean the extracted text
             email_info["content"] = self._clean_text(email_info["content"])
             
+            # Separate the new message from the quoted history of a reply
+            reply_body = plain_body if plain_body is not None else self._html_to_lines(html_body or "")
+            new_text, quoted_text = self.split_reply(reply_body)
+            email_info["new_content"] = self._clean_text(new_text)
+            email_info["message_hashes"] = self.paragraph_hashes(new_text)
+            email_info["quoted_hashes"] = self.paragraph_hashes(quoted_text)
+            
             # Derive thread_id if available
             if email_info["references"] and len(email_info["references"]) > 0:
                 email_info["thread_id"] = email_info["references"][0]  # Use first reference as thread ID
@@ -240,6 +340,89 @@ class EmailProcessor:
             }
             return email_info, []
     
+    def extract_attachment(self, attachment: Dict[str, Any]) -> Dict[str, str]:
+        """
+        Extract the text of an attachment returned by `parse_eml_message`
+        
+        Returns:
+            Processed attachment with index, filename, content_type and text
+        """
+        if "text" in attachment:
+            return attachment
+        try:
+            text = self.process_attachment(attachment["content"], attachment["filename"], attachment["content_type"])
+        except Exception as e:
+            logger.error(f"Error processing attachment: {str(e)}")
+            text = f"[Error processing attachment: {str(e)}]"
+        return {
+            "index": attachment["index"],
+            "filename": attachment["filename"],
+            "content_type": attachment["content_type"],
+            "text": text
+        }
+    
+    def needs_ocr(self, attachment: Dict[str, Any]) -> bool:
+        """Whether extracting an attachment returned by `parse_eml_message` runs OCR"""
+        if "text" in attachment:
+            return False
+        return os.path.splitext(attachment["filename"].lower())[1] in OCR_EXTENSIONS
+    
+    def split_reply(self, text: str) -> Tuple[str, str]:
+        """
+        Split an email body into the new message and the quoted history below it
+        
+        The history starts at the first quoted (">") line, "On ... wrote:"
+        attribution, "Original Message" separator or Outlook-style header block.
+        
+        Returns:
+            Tuple of (new_text, quoted_text); quoted_text is empty when nothing is quoted
+        """
+        lines = text.splitlines()
+        for i, line in enumerate(lines):
+            stripped = line.strip()
+            following = [l.strip() for l in lines[i + 1:i + 5]]
+            if (
+                QUOTE_MARKER.match(stripped)
+                or REPLY_ATTRIBUTION.match(stripped)
+                # Attributions are often wrapped onto a second line
+                or (stripped.startswith("On ") and following and REPLY_ATTRIBUTION.match(f"{stripped} {following[0]}"))
+                # "From: ..." followed by "Sent:"/"Date:" within the next lines
+                or (re.match(r'^From:\s', stripped) and any(re.match(r'^(?:Sent|Date):\s', l) for l in following))
+            ):
+                return "\n".join(lines[:i]), "\n".join(lines[i:])
+        return text, ""
+    
+    def paragraph_hashes(self, text: str) -> List[str]:
+        """
+        Hash a text's paragraphs so the same message can be recognized when it is
+        quoted later: quote markers, line wrapping, case, header lines and reply
+        attributions do not change the hashes
+        """
+        lines = []
+        for line in text.splitlines():
+            line = re.sub(r'^[>\s]+', '', line)
+            if HEADER_LINE.match(line) or QUOTE_MARKER.match(line) or REPLY_ATTRIBUTION.match(line):
+                line = ""
+            lines.append(line)
+        hashes = []
+        for paragraph in re.split(r'\n\s*\n', "\n".join(lines)):
+            normalized = re.sub(r'\s+', ' ', paragraph).strip().lower()
+            if len(normalized) >= MIN_HASHED_PARAGRAPH:
+                hashes.append(hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:16])
+        return hashes
+    
+    def _html_to_lines(self, html_content: str) -> str:
+        """Text of an HTML body with its line structure, for reply splitting"""
+        if not html_content:
+            return ""
+        try:
+            soup = BeautifulSoup(html_content, 'html.parser')
+            for script in soup(["script", "style"]):
+                script.extract()
+            return soup.get_text(separator='\n')
+        except Exception:
+            return re.sub(r'<[^>]+>', '\n', html_content)
+    
     def _parse_references_header(self, references_header: str) -> List[str]:
         """Parse References header into a list of message IDs"""
         if not references_header:
@@ -280,6 +463,14 @@ class EmailProcessor:
         """
         file_extension = os.path.splitext(filename.lower())[1]
         
+        with span("parse.attachment", extension=file_extension, size_bytes=len(content)):
+            return self._process_attachment_by_type(content, filename, file_extension, content_type)
+    
+    def _process_attachment_by_type(self,
+                                    content: bytes,
+                                    filename: str,
+                                    file_extension: str,
+                                    content_type: str = None) -> str:
         try:
             # Process by file extension
             if file_extension == '.pdf':
@@ -294,7 +485,7 @@ class EmailProcessor:
                 return email_info.get("content", "")
             elif file_extension in ['.htm', '.html']:
                 return self._extract_text_from_html(content.decode('utf-8', errors='ignore'))
-            elif file_extension in ['.jpg', '.jpeg', '.png', '.gif', '.bmp']:
+            elif file_extension in OCR_EXTENSIONS:
                 # Image files - extract text with OCR
                 return self._extract_text_from_image(content)
             else:
@@ -492,18 +683,24 @@ class EmailProcessor:
     
     def _extract_text_from_pdf(self, content: bytes) -> str:
         """Extract text from PDF file content"""
+        return self._clean_text(self._extract_raw_text_from_pdf(content))
+    
+    def _extract_raw_text_from_pdf(self, content: bytes) -> str:
+        """Extract text from PDF file content, keeping its line breaks"""
         text = ""
         try:
-            pdf_file = io.BytesIO(content)
-            pdf_reader = pypdf.PdfReader(pdf_file)
-            
-            for page_num in range(len(pdf_reader.pages)):
-                page = pdf_reader.pages[page_num]
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n\n"
+            with span("parse.pdf", size_bytes=len(content)) as pdf_span:
+                pdf_file = io.BytesIO(content)
+                pdf_reader = pypdf.PdfReader(pdf_file)
+                pdf_span.attributes["pages"] = len(pdf_reader.pages)
                 
-            return self._clean_text(text)
+                for page_num in range(len(pdf_reader.pages)):
+                    page = pdf_reader.pages[page_num]
+                    page_text = page.extract_text()
+                    if page_text:
+                        text += page_text + "\n\n"
+                    
+                return text
         except Exception as e:
             logger.error(f"Error extracting PDF text: {str(e)}")
             return f"[Error extracting PDF text: {str(e)}]"
@@ -531,15 +728,16 @@ class EmailProcessor:
     def _extract_text_from_image(self, image_content: bytes) -> str:
         """Extract text from image file content using EasyOCR"""
         try:
-            reader = easyocr.Reader(['en'])
+            reader = get_ocr_reader()
             
-            # Convert bytes to a numpy array
-            image = np.array(Image.open(io.BytesIO(image_content)))
-            
-            # Use EasyOCR to extract text
-            result = reader.readtext(image, detail=0)
-            text = ' '.join(result)
-            return self._clean_text(text)
+            with span("parse.ocr", size_bytes=len(image_content)):
+                # Convert bytes to a numpy array
+                image = np.array(Image.open(io.BytesIO(image_content)))
+                
+                # Use EasyOCR to extract text
+                result = reader.readtext(image, detail=0)
+                text = ' '.join(result)
+                return self._clean_text(text)
         except Exception as e:
             logger.error(f"Error extracting text from image: {str(e)}")
             return f"[Error extracting text from image: {str(e)}]"
@@ -0,0 +1,146 @@
+import logging
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PRECISIONS = ("float32", "float16", "int8")
+# Entry keys whose values are kept in the store rather than in the cache entries
+EMBEDDING_FIELDS = ("content_embedding", "subject_embedding")
+INITIAL_ROWS = 64
+# Rows widened to float32 at a time by the similarity kernel
+BLOCK_ROWS = 1024
+
+
+class EmbeddingStore:
+    """
+    Embeddings of the duplicate cache, one row per cache slot and field, L2-normalized
+    when stored so cosine similarity is a dot product over a block of rows.
+
+    Precisions:
+        float32  4 bytes per dimension
+        float16  2 bytes per dimension
+        int8     1 byte per dimension and a float32 scale per vector (the largest
+                 component maps to 127)
+    A missing or zero embedding is stored as a zero row, which is similar to nothing.
+    """
+
+    def __init__(self, precision: str = "float16", capacity: Optional[int] = None,
+                 fields: Sequence[str] = EMBEDDING_FIELDS):
+        """
+        Initialize the store
+
+        Args:
+            precision: "float32", "float16" or "int8"
+            capacity: Most rows ever needed (the cache capacity); storage grows up to it
+            fields: Names of the embeddings stored per slot
+        """
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown embedding precision: {precision}")
+        self.precision = precision
+        self.dtype = np.dtype(precision)
+        self.capacity = capacity
+        self.fields = tuple(fields)
+        # Set by the first embedding stored
+        self.dim: Optional[int] = None
+        self.rows = 0
+        self._vectors: Dict[str, np.ndarray] = {}
+        self._scales: Dict[str, np.ndarray] = {}
+
+    def _grow(self, slot: int) -> None:
+        rows = max(slot + 1, self.rows * 2, INITIAL_ROWS)
+        if self.capacity:
+            rows = max(slot + 1, min(rows, self.capacity))
+        for field in self.fields:
+            vectors = np.zeros((rows, self.dim), dtype=self.dtype)
+            scales = np.zeros(rows, dtype=np.float32)
+            if self.rows:
+                vectors[:self.rows] = self._vectors[field]
+                scales[:self.rows] = self._scales[field]
+            self._vectors[field] = vectors
+            self._scales[field] = scales
+        self.rows = rows
+
+    def _normalize(self, vector) -> Optional[np.ndarray]:
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        if vector.shape[0] != self.dim:
+            logger.error(f"Embedding dimension {vector.shape[0]} does not match the cache ({self.dim})")
+            return None
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else None
+
+    def put(self, slot: int, field: str, vector: Optional[np.ndarray]) -> None:
+        """Store a field's embedding in a slot (None stores a zero row)"""
+        if self.dim is None:
+            if vector is None:
+                return
+            self.dim = int(np.asarray(vector).size)
+        if slot >= self.rows:
+            self._grow(slot)
+        normalized = self._normalize(vector) if vector is not None else None
+        if normalized is None:
+            self._vectors[field][slot] = 0
+            self._scales[field][slot] = 0
+        elif self.precision == "int8":
+            scale = float(np.abs(normalized).max()) / 127
+            self._vectors[field][slot] = np.rint(normalized / scale)
+            self._scales[field][slot] = scale
+        else:
+            self._vectors[field][slot] = normalized
+            self._scales[field][slot] = 1.0
+
+    def clear(self, slot: int) -> None:
+        """Zero a slot's rows when its entry leaves the cache"""
+        if slot < self.rows:
+            for field in self.fields:
+                self._vectors[field][slot] = 0
+                self._scales[field][slot] = 0
+
+    def get(self, slot: int, field: str) -> Optional[np.ndarray]:
+        """A field's stored embedding as float32 (normalized), or None if nothing was ever stored"""
+        if self.dim is None:
+            return None
+        if slot >= self.rows:
+            return np.zeros(self.dim, dtype=np.float32)
+        return self._vectors[field][slot].astype(np.float32) * self._scales[field][slot]
+
+    def similarities(self, field: str, query: Optional[np.ndarray], slots: np.ndarray) -> np.ndarray:
+        """
+        Cosine similarity of a query embedding to a field's embeddings in a block of slots
+
+        Args:
+            field: Embedding field to compare with
+            query: Query embedding (any dtype, not necessarily normalized)
+            slots: Slots of the candidate entries
+
+        Returns:
+            float32 array with one similarity per slot (0 for missing or zero embeddings)
+        """
+        scores = np.zeros(len(slots), dtype=np.float32)
+        if query is None or self.dim is None or not len(slots):
+            return scores
+        normalized = self._normalize(query)
+        if normalized is None:
+            return scores
+        vectors = self._vectors[field]
+        if self.precision == "float32":
+            return vectors[slots] @ normalized
+        # NumPy has no BLAS kernels for float16 or int8, so rows are widened to float32
+        # a block at a time into a buffer small enough to stay in the CPU cache
+        buffer = np.empty((min(BLOCK_ROWS, len(slots)), self.dim), dtype=np.float32)
+        for start in range(0, len(slots), BLOCK_ROWS):
+            block = slots[start:start + BLOCK_ROWS]
+            rows = buffer[:len(block)]
+            rows[...] = vectors[block]
+            np.matmul(rows, normalized, out=scores[start:start + len(block)])
+        if self.precision == "int8":
+            scores *= self._scales[field][slots]
+        return scores
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the stored embeddings and scales"""
+        return sum(array.nbytes for array in self._vectors.values()) + sum(
+            array.nbytes for array in self._scales.values()
+        )
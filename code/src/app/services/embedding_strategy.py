@@ -0,0 +1,137 @@
+from functools import lru_cache
+from typing import List, Sequence
+
+import numpy as np
+
+from app.config import get_settings
+
+STRATEGIES = ("head", "head_tail", "chunks")
+POOLING = ("mean", "max")
+# Word pieces per whitespace-separated word, on the high side for business email
+# (numbers, codes and addresses split into several pieces), so pieces sized from
+# it fit within the model's sequence length without tokenizing them first
+TOKENS_PER_WORD = 1.4
+
+
+class EmbeddingStrategy:
+    """
+    Chooses which part of a long text is embedded, since the model only reads
+    its first `max_tokens` tokens and tokenizing the rest is wasted work.
+
+    Strategies:
+        head        the first `max_tokens` words, of which the model reads its first
+                    `max_tokens` tokens (what embedding the whole text gives, without
+                    tokenizing the whole text)
+        head_tail   the beginning and the end of the text, sized to fit together
+        chunks      the text split into model-sized chunks, encoded in one batch and
+                    pooled (mean or max of the normalized chunk embeddings); above
+                    `max_chunks` chunks, chunks spread evenly over the text are used
+    Texts that fit within the model are embedded unchanged by every strategy.
+    """
+
+    def __init__(self,
+                 strategy: str = "head",
+                 max_tokens: int = 256,
+                 head_share: float = 0.5,
+                 max_chunks: int = 8,
+                 pooling: str = "mean"):
+        """
+        Initialize the strategy
+
+        Args:
+            strategy: "head", "head_tail" or "chunks"
+            max_tokens: Model maximum sequence length (256 for all-MiniLM-L6-v2)
+            head_share: Share of the budget given to the beginning with head_tail
+            max_chunks: Most chunks encoded per text with chunks
+            pooling: "mean" or "max" pooling of chunk embeddings
+        """
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown embedding strategy: {strategy}")
+        if pooling not in POOLING:
+            raise ValueError(f"Unknown embedding pooling: {pooling}")
+        self.strategy = strategy
+        self.max_tokens = max_tokens
+        self.head_share = min(max(head_share, 0.0), 1.0)
+        self.max_chunks = max(1, max_chunks)
+        self.pooling = pooling
+        # Words that surely fit in the model with the special tokens
+        self.fitting_words = max(1, int((max_tokens - 2) / TOKENS_PER_WORD))
+
+    def pieces(self, text: str) -> List[str]:
+        """The texts to encode for one text (one, or several chunks to pool)"""
+        if not text:
+            return [text]
+        if self.strategy == "chunks":
+            return self._chunks(text)
+        budget = self.max_tokens if self.strategy == "head" else self.fitting_words
+        # Split off no more words than are needed, so a megabyte body costs what a short one does
+        head = text.split(None, budget)
+        if len(head) <= budget:
+            return [text]
+        if self.strategy == "head":
+            return [" ".join(head[:budget])]
+        head_words = int(budget * self.head_share)
+        tail_words = budget - head_words
+        tail = text.rsplit(None, tail_words)[-tail_words:] if tail_words else []
+        return [" ".join(head[:head_words] + tail)]
+
+    def _chunks(self, text: str) -> List[str]:
+        words = text.split()
+        size = self.fitting_words
+        if len(words) <= size:
+            return [text]
+        starts = list(range(0, len(words), size))
+        # The last chunk ends at the end of the text, so no chunk is a short remainder
+        starts[-1] = len(words) - size
+        if len(starts) > self.max_chunks:
+            # Spread the chunks over the whole text, keeping the first and the last
+            if self.max_chunks == 1:
+                starts = starts[:1]
+            else:
+                step = (len(starts) - 1) / (self.max_chunks - 1)
+                starts = [starts[round(i * step)] for i in range(self.max_chunks)]
+        return [" ".join(words[start:start + size]) for start in starts]
+
+    def pool(self, embeddings: Sequence[np.ndarray]) -> np.ndarray:
+        """Combine the embeddings of one text's chunks"""
+        if len(embeddings) == 1:
+            return embeddings[0]
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = matrix / np.where(norms == 0, 1, norms)
+        return matrix.mean(axis=0) if self.pooling == "mean" else matrix.max(axis=0)
+
+    def embed(self, provider, texts: List[str]) -> List[np.ndarray]:
+        """
+        Embed texts with one provider call, pooling the chunks of each text
+
+        Args:
+            provider: EmbeddingProvider
+            texts: Texts to embed
+
+        Returns:
+            One embedding per text, in input order
+        """
+        pieces = []
+        owners = []
+        for i, text in enumerate(texts):
+            for piece in self.pieces(text):
+                pieces.append(piece)
+                owners.append(i)
+        grouped: List[List[np.ndarray]] = [[] for _ in texts]
+        for owner, embedding in zip(owners, provider.get_embeddings(pieces)):
+            grouped[owner].append(embedding)
+        return [self.pool(group) for group in grouped]
+
+
+@lru_cache()
+def get_embedding_strategy() -> EmbeddingStrategy:
+    """Get the configured embedding strategy"""
+    settings = get_settings()
+    return EmbeddingStrategy(
+        strategy=settings.embedding_strategy,
+        max_tokens=settings.embedding_max_tokens,
+        head_share=settings.embedding_head_share,
+        max_chunks=settings.embedding_max_chunks,
+        pooling=settings.embedding_chunk_pooling
+    )
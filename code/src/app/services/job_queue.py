@@ -0,0 +1,342 @@
+import asyncio
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from pymongo import ASCENDING, ReturnDocument
+
+from app.config import get_settings
+from app.schemas.jobs import classification_jobs_collection, job_payloads_bucket
+
+logger = logging.getLogger(__name__)
+
+KIND_EML = "eml"
+KIND_EMAIL_CHAIN = "email_chain"
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+TERMINAL_STATUSES = (STATUS_COMPLETED, STATUS_FAILED)
+
+
+class JobQueue:
+    """
+    Persistent classification job queue backed by MongoDB.
+
+    Submitted jobs are stored in `classification_jobs` (uploaded files in GridFS)
+    and claimed by a bounded pool of in-process workers with an atomic
+    find-and-update. A claimed job holds a lease that its worker renews while it
+    runs; jobs whose lease has expired (the process died or was restarted) are
+    claimed again, up to `max_attempts` times, so work resumes after a restart.
+    """
+
+    def __init__(self,
+                 workers: int = 2,
+                 lease_seconds: int = 300,
+                 max_attempts: int = 3,
+                 poll_seconds: float = 2.0,
+                 retention_days: int = 7):
+        """
+        Initialize the job queue
+
+        Args:
+            workers: Number of jobs processed concurrently by this process
+            lease_seconds: How long a claimed job is reserved before another worker may take it over
+            max_attempts: Claims allowed per job before it is marked failed
+            poll_seconds: How often idle workers check the queue for jobs submitted elsewhere
+            retention_days: How long finished jobs and their results are kept
+        """
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.poll_seconds = poll_seconds
+        self.retention_days = retention_days
+        self.worker_id = str(uuid.uuid4())
+
+        self._service_factory: Optional[Callable[[], Any]] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        # job_id -> event set when a job finishes in this process, for long polls
+        self._finished: Dict[str, asyncio.Event] = {}
+
+    async def ensure_indexes(self) -> None:
+        await classification_jobs_collection.create_index([("status", ASCENDING), ("created_at", ASCENDING)])
+        await classification_jobs_collection.create_index("lease_expires_at")
+        # Finished jobs expire once their expires_at passes
+        await classification_jobs_collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def submit(self,
+                     kind: str,
+                     content: bytes,
+                     filename: Optional[str] = None,
+                     content_type: Optional[str] = None,
+                     attachments: Optional[List[Dict[str, Any]]] = None,
+                     thread_id: Optional[str] = None) -> str:
+        """
+        Persist a classification job and wake a worker
+
+        Args:
+            kind: "eml" or "email_chain"
+            content: The EML or PDF file contents
+            filename: Original file name
+            content_type: Original content type
+            attachments: For email chains, separate attachments as filename/content_type/content dicts
+            thread_id: Optional thread ID for duplicate detection
+
+        Returns:
+            The job ID
+        """
+        job_id = str(uuid.uuid4())
+        payload_id = await job_payloads_bucket.upload_from_stream(filename or job_id, content)
+
+        stored_attachments = []
+        for attachment in attachments or []:
+            attachment_id = await job_payloads_bucket.upload_from_stream(attachment["filename"], attachment["content"])
+            stored_attachments.append({
+                "filename": attachment["filename"],
+                "content_type": attachment["content_type"],
+                "payload_id": attachment_id
+            })
+
+        await classification_jobs_collection.insert_one({
+            "_id": job_id,
+            "kind": kind,
+            "status": STATUS_QUEUED,
+            "thread_id": thread_id,
+            "filename": filename,
+            "content_type": content_type,
+            "payload_id": payload_id,
+            "attachments": stored_attachments,
+            "attempts": 0,
+            "created_at": datetime.now(),
+            "started_at": None,
+            "finished_at": None,
+            "lease_expires_at": None,
+            "result": None,
+            "error": None
+        })
+        logger.info(f"Queued {kind} job {job_id}")
+        self._wakeup.set()
+        return job_id
+
+    async def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Get a job's public state, or None if it does not exist"""
+        doc = await classification_jobs_collection.find_one(
+            {"_id": job_id},
+            {"payload_id": 0, "attachments": 0, "lease_expires_at": 0, "worker_id": 0, "expires_at": 0}
+        )
+        if doc:
+            doc["job_id"] = doc.pop("_id")
+        return doc
+
+    async def wait_for_job(self, job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """
+        Long-poll a job until it finishes or `timeout` seconds pass
+
+        Jobs finished by this process wake the caller immediately; jobs finished by
+        another process are picked up on the next poll of the collection.
+        """
+        deadline = time.monotonic() + timeout
+        event = self._finished.setdefault(job_id, asyncio.Event())
+        try:
+            while True:
+                job = await self.get_job(job_id)
+                remaining = deadline - time.monotonic()
+                if job is None or job["status"] in TERMINAL_STATUSES or remaining <= 0:
+                    return job
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=min(remaining, self.poll_seconds))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if not event.is_set():
+                self._finished.pop(job_id, None)
+
+    async def _claim(self) -> Optional[Dict[str, Any]]:
+        now = datetime.now()
+        return await classification_jobs_collection.find_one_and_update(
+            {
+                "$or": [
+                    {"status": STATUS_QUEUED},
+                    # Abandoned by a worker that stopped renewing its lease
+                    {"status": STATUS_RUNNING, "lease_expires_at": {"$lt": now}}
+                ]
+            },
+            {
+                "$set": {
+                    "status": STATUS_RUNNING,
+                    "worker_id": self.worker_id,
+                    "started_at": now,
+                    "lease_expires_at": now + timedelta(seconds=self.lease_seconds)
+                },
+                "$inc": {"attempts": 1}
+            },
+            sort=[("created_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _renew_lease(self, job_id: str) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await classification_jobs_collection.update_one(
+                    {"_id": job_id, "worker_id": self.worker_id},
+                    {"$set": {"lease_expires_at": datetime.now() + timedelta(seconds=self.lease_seconds)}}
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Keep trying: the lease only lapses if renewals fail for its whole duration
+                logger.warning(f"Could not renew the lease of job {job_id}: {e}")
+
+    async def _read_payload(self, payload_id) -> bytes:
+        stream = await job_payloads_bucket.open_download_stream(payload_id)
+        return await stream.read()
+
+    async def _delete_payloads(self, job: Dict[str, Any]) -> None:
+        payload_ids = [job.get("payload_id")] + [a.get("payload_id") for a in job.get("attachments", [])]
+        for payload_id in filter(None, payload_ids):
+            try:
+                await job_payloads_bucket.delete(payload_id)
+            except Exception as e:
+                logger.warning(f"Could not delete payload {payload_id} of job {job['_id']}: {e}")
+
+    async def _finish(self, job: Dict[str, Any], status: str, result: Optional[Dict[str, Any]] = None,
+                      error: Optional[str] = None) -> None:
+        now = datetime.now()
+        await classification_jobs_collection.update_one(
+            {"_id": job["_id"]},
+            {"$set": {
+                "status": status,
+                "result": result,
+                "error": error,
+                "finished_at": now,
+                "lease_expires_at": None,
+                "expires_at": now + timedelta(days=self.retention_days)
+            }}
+        )
+        await self._delete_payloads(job)
+        event = self._finished.get(job["_id"])
+        if event:
+            event.set()
+            self._finished.pop(job["_id"], None)
+
+    async def _process(self, job: Dict[str, Any]) -> None:
+        job_id = job["_id"]
+        if job["attempts"] > self.max_attempts:
+            logger.error(f"Job {job_id} abandoned after {self.max_attempts} attempts")
+            await self._finish(job, STATUS_FAILED, error=f"Job abandoned after {self.max_attempts} attempts")
+            return
+
+        logger.info(f"Worker {self.worker_id} processing {job['kind']} job {job_id} (attempt {job['attempts']})")
+        lease_task = asyncio.create_task(self._renew_lease(job_id))
+        try:
+            service = self._service_factory()
+            content = await self._read_payload(job["payload_id"])
+            if job["kind"] == KIND_EML:
+                response = await service.process_eml(eml_content=content, thread_id=job.get("thread_id"))
+            else:
+                attachments = [
+                    {
+                        "filename": a["filename"],
+                        "content_type": a["content_type"],
+                        "content": await self._read_payload(a["payload_id"])
+                    } for a in job.get("attachments", [])
+                ]
+                response = await service.process_email_chain(
+                    email_chain_file=content,
+                    email_chain_filename=job.get("filename"),
+                    email_chain_content_type=job.get("content_type"),
+                    attachments=attachments,
+                    thread_id=job.get("thread_id")
+                )
+        except asyncio.CancelledError:
+            # Shutting down: stop() returns the job to the queue
+            raise
+        except Exception as e:
+            logger.error(f"Error processing job {job_id}: {str(e)}")
+            if job["attempts"] < self.max_attempts:
+                await classification_jobs_collection.update_one(
+                    {"_id": job_id},
+                    {"$set": {"status": STATUS_QUEUED, "lease_expires_at": None, "error": str(e)}}
+                )
+            else:
+                await self._finish(job, STATUS_FAILED, error=str(e))
+            return
+        finally:
+            lease_task.cancel()
+
+        status = STATUS_FAILED if response.error else STATUS_COMPLETED
+        await self._finish(job, status, result=response.model_dump(), error=response.error)
+
+    async def _worker(self) -> None:
+        while True:
+            try:
+                job = await self._claim()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Error claiming job: {e}")
+                job = None
+
+            if job is None:
+                # Idle: wait for a local submission or poll for jobs from other processes
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                await self._process(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Could not record the outcome; the job is claimed again once its lease expires
+                logger.error(f"Error finishing job {job['_id']}: {e}")
+
+    async def start(self, service_factory: Callable[[], Any]) -> None:
+        """
+        Start the worker pool
+
+        Args:
+            service_factory: Callable returning a ClassificationService for each job
+        """
+        self._service_factory = service_factory
+        try:
+            await self.ensure_indexes()
+        except Exception as e:
+            logger.error(f"Error creating job queue indexes: {e}")
+        if not self._worker_tasks:
+            self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+            logger.info(f"Started {self.workers} job workers ({self.worker_id})")
+
+    async def stop(self) -> None:
+        """Stop the workers and hand their in-flight jobs back to the queue"""
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        try:
+            released = await classification_jobs_collection.update_many(
+                {"status": STATUS_RUNNING, "worker_id": self.worker_id},
+                {"$set": {"status": STATUS_QUEUED, "lease_expires_at": None}}
+            )
+            if released.modified_count:
+                logger.info(f"Returned {released.modified_count} in-flight jobs to the queue")
+        except Exception as e:
+            logger.warning(f"Could not release in-flight jobs, they will be reclaimed when their lease expires: {e}")
+
+
+settings = get_settings()
+job_queue = JobQueue(
+    workers=settings.job_workers,
+    lease_seconds=settings.job_lease_seconds,
+    max_attempts=settings.job_max_attempts,
+    poll_seconds=settings.job_poll_seconds,
+    retention_days=settings.job_retention_days
+)
@@ -0,0 +1,264 @@
+"""
+Model sidecar: one process holding the embedding and OCR models for every API worker.
+
+Workers started with `model_sharing=sidecar` do not load the models themselves;
+`get_embedding_provider` and `get_ocr_reader` return clients that send the work
+to this process over a Unix socket. The protocol is one JSON object per line in
+each direction, with arrays sent as base64 of their raw bytes:
+
+    {"op": "embed", "texts": [...]}                     -> {"array": {...}} (n x dim float32)
+    {"op": "ocr", "image": {"dtype", "shape", "data"}} -> {"text": [...]}
+    {"op": "ping"}                                      -> {"ok": true, "pid": ...}
+
+Errors come back as {"error": "..."}.
+
+Usage:
+    python -m app.services.model_sidecar --socket /tmp/email-models.sock --preload-ocr
+"""
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import os
+import signal
+import socket
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.config import get_settings
+from app.core.tracing import span
+from app.services.IntelligentDuplicateDetector import EmbeddingProvider
+
+logger = logging.getLogger(__name__)
+
+# Longest request line accepted (images are sent base64-encoded)
+MAX_REQUEST_BYTES = 256 * 1024 * 1024
+
+
+def _encode_array(array: np.ndarray) -> Dict[str, Any]:
+    array = np.ascontiguousarray(array)
+    return {"dtype": str(array.dtype), "shape": list(array.shape), "data": base64.b64encode(array.tobytes()).decode("ascii")}
+
+
+def _decode_array(payload: Dict[str, Any]) -> np.ndarray:
+    # bytearray so the array is writable, like one computed locally
+    data = bytearray(base64.b64decode(payload["data"]))
+    return np.frombuffer(data, dtype=np.dtype(payload["dtype"])).reshape(payload["shape"])
+
+
+class ModelSidecar:
+    """
+    Unix socket server running embedding and OCR requests for the API workers
+    """
+
+    def __init__(self, socket_path: str, preload_ocr: bool = False, concurrency: int = 2):
+        """
+        Initialize the sidecar
+
+        Args:
+            socket_path: Path of the Unix socket to listen on
+            preload_ocr: Load the OCR model at startup rather than on the first image
+            concurrency: Requests run at once (the models use several threads each)
+        """
+        self.socket_path = socket_path
+        self.preload_ocr = preload_ocr
+        self.concurrency = concurrency
+        self.embedding_provider: Optional[EmbeddingProvider] = None
+        # Loaded here directly: get_ocr_reader would return a client of this sidecar
+        self._ocr_reader = None
+        self._ocr_lock = threading.Lock()
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    async def serve(self) -> None:
+        """Load the models and answer requests until cancelled or sent SIGTERM"""
+        from app.services.IntelligentDuplicateDetector import load_embedding_provider
+
+        self.embedding_provider = await asyncio.to_thread(load_embedding_provider)
+        if self.preload_ocr:
+            await asyncio.to_thread(self._get_ocr_reader)
+        self._slots = asyncio.Semaphore(self.concurrency)
+
+        if os.path.exists(self.socket_path):
+            # Left behind by a sidecar that did not shut down cleanly
+            os.unlink(self.socket_path)
+        server = await asyncio.start_unix_server(self._handle, path=self.socket_path, limit=MAX_REQUEST_BYTES)
+        os.chmod(self.socket_path, 0o660)
+        logger.info("Model sidecar listening on %s (pid %d)", self.socket_path, os.getpid())
+
+        loop = asyncio.get_running_loop()
+        stopping = asyncio.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stopping.set)
+        try:
+            async with server:
+                await stopping.wait()
+        finally:
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            logger.info("Model sidecar stopped")
+
+    def _get_ocr_reader(self):
+        from app.services.email_processor import load_ocr_reader
+        with self._ocr_lock:
+            if self._ocr_reader is None:
+                self._ocr_reader = load_ocr_reader()
+        return self._ocr_reader
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    async with self._slots:
+                        response = await asyncio.to_thread(self._dispatch, request)
+                except Exception as e:
+                    logger.error(f"Model sidecar request failed: {e}")
+                    response = {"error": str(e)}
+                writer.write(json.dumps(response).encode("utf-8") + b"\n")
+                await writer.drain()
+        except (ConnectionResetError, BrokenPipeError):
+            pass
+        finally:
+            writer.close()
+
+    def _dispatch(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        op = request.get("op")
+        if op == "embed":
+            with span("sidecar.embed", texts=len(request["texts"])):
+                embeddings = self.embedding_provider.get_embeddings(request["texts"])
+            return {"array": _encode_array(np.asarray(embeddings, dtype=np.float32))}
+        if op == "ocr":
+            with span("sidecar.ocr"):
+                text = self._get_ocr_reader().readtext(_decode_array(request["image"]), detail=0)
+            return {"text": list(text)}
+        if op == "ping":
+            return {"ok": True, "pid": os.getpid()}
+        raise ValueError(f"Unknown operation: {op}")
+
+
+class SidecarClient:
+    """
+    Blocking client for the model sidecar, with one connection per thread
+    (embeddings and OCR run in worker threads)
+    """
+
+    def __init__(self, socket_path: str, timeout: float = 120.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            conn = (sock, sock.makefile("rwb"))
+            self._local.conn = conn
+        return conn
+
+    def _close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn:
+            conn[1].close()
+            conn[0].close()
+
+    def request(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Send one request and wait for its response
+
+        Raises:
+            OSError: If the sidecar cannot be reached
+            RuntimeError: If the sidecar reports an error
+        """
+        data = json.dumps(payload).encode("utf-8") + b"\n"
+        # A connection the sidecar closed (e.g. it restarted) is retried once on a new one
+        for attempt in range(2):
+            try:
+                _, stream = self._connection()
+                stream.write(data)
+                stream.flush()
+                line = stream.readline()
+                if not line:
+                    raise ConnectionResetError("Model sidecar closed the connection")
+                break
+            except OSError:
+                self._close()
+                if attempt:
+                    raise
+        response = json.loads(line)
+        if "error" in response:
+            raise RuntimeError(f"Model sidecar error: {response['error']}")
+        return response
+
+    def ping(self) -> bool:
+        try:
+            return bool(self.request({"op": "ping"}).get("ok"))
+        except (OSError, RuntimeError, ValueError):
+            return False
+
+
+class SidecarEmbeddingProvider(EmbeddingProvider):
+    """
+    Embedding provider that runs the model in the model sidecar process
+    """
+    def __init__(self, socket_path: str):
+        self.client = SidecarClient(socket_path)
+        logger.info("Using model sidecar at %s for embeddings", socket_path)
+
+    def get_embedding(self, text: str) -> np.ndarray:
+        return self.get_embeddings([text])[0]
+
+    def get_embeddings(self, texts: List[str]) -> List[np.ndarray]:
+        """
+        Encode texts in one sidecar request
+
+        Raises:
+            OSError, RuntimeError: If the sidecar cannot be reached or fails. Placeholder
+                vectors would be cached and compared with later emails, so the caller
+                fails the email instead
+        """
+        try:
+            array = _decode_array(self.client.request({"op": "embed", "texts": list(texts)})["array"])
+        except Exception as e:
+            logger.error(f"Error generating embeddings with the model sidecar: {e}")
+            raise
+        return list(array)
+
+
+class SidecarOCRReader:
+    """
+    Stand-in for easyocr.Reader that runs OCR in the model sidecar process
+    """
+    def __init__(self, socket_path: str):
+        self.client = SidecarClient(socket_path)
+        logger.info("Using model sidecar at %s for OCR", socket_path)
+
+    def readtext(self, image: np.ndarray, detail: int = 0) -> List[str]:
+        """Read the text of an image (only detail=0, plain strings, is supported)"""
+        return self.client.request({"op": "ocr", "image": _encode_array(np.asarray(image))})["text"]
+
+
+def main() -> None:
+    from app.core.structured_logging import configure_logging
+
+    settings = get_settings()
+    parser = argparse.ArgumentParser(description="Serve the embedding and OCR models to the API workers over a Unix socket")
+    parser.add_argument("--socket", default=settings.model_sidecar_socket, help="Unix socket path")
+    parser.add_argument("--preload-ocr", action="store_true", default=settings.warmup_ocr, help="Load the OCR model at startup")
+    parser.add_argument("--concurrency", type=int, default=2, help="Requests run at once")
+    args = parser.parse_args()
+
+    configure_logging(settings.log_level, settings.log_levels, settings.log_format)
+    asyncio.run(ModelSidecar(args.socket, preload_ocr=args.preload_ocr, concurrency=args.concurrency).serve())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import get_settings
+from app.models.response_models import RequestTypeResult
+from app.schemas.analytics import fast_path_training_collection
+
+logger = logging.getLogger(__name__)
+
+MODE_OFF = "off"
+MODE_SHADOW = "shadow"
+MODE_ENFORCE = "enforce"
+
+
+class PreClassifier:
+    """
+    Local TF-IDF nearest-centroid classifier used as a fast path in front of the
+    LLM request type classification.
+
+    Centroids are built from the request type/sub-request type definitions and
+    from past LLM classifications in the fast_path_training collection. Cosine
+    scores are turned into probabilities with a softmax whose temperature is
+    fitted on those examples, so the confidence threshold is comparable across
+    retrains.
+
+    Modes:
+        off: never used
+        shadow: predictions are logged and compared with the LLM, never returned
+        enforce: predictions at or above the threshold replace the LLM call, once
+            the temperature has been fitted (shadow until then)
+    """
+
+    def __init__(self,
+                 mode: str = MODE_OFF,
+                 threshold: float = 0.9,
+                 refresh_minutes: int = 60,
+                 max_history: int = 5000,
+                 default_temperature: float = 0.05,
+                 min_similarity: float = 0.3,
+                 retention_days: int = 30,
+                 min_calibration_examples: int = 20):
+        """
+        Initialize the pre-classifier
+
+        Args:
+            mode: One of "off", "shadow" or "enforce"
+            threshold: Minimum calibrated confidence for the fast path
+            refresh_minutes: How often to retrain from the training examples
+            max_history: Maximum number of training examples to train on
+            default_temperature: Softmax temperature used until enough history exists to fit one
+            min_similarity: Cosine similarity below which the email is too far from every
+                centroid to be trusted, however peaked the softmax is
+            retention_days: Days a training example is kept
+            min_calibration_examples: Training examples needed to fit the temperature
+                (and so to enforce)
+        """
+        self.mode = mode
+        self.threshold = threshold
+        self.refresh_seconds = refresh_minutes * 60
+        self.max_history = max_history
+        self.temperature = default_temperature
+        self.min_similarity = min_similarity
+        self.retention = timedelta(days=retention_days)
+        self.min_calibration_examples = min_calibration_examples
+        # Set once the temperature has been fitted on held-out examples
+        self.calibrated = False
+
+        self.vectorizer = None
+        self.centroids: Optional[np.ndarray] = None
+        self.labels: List[Tuple[str, str]] = []
+        self.trained_at: Optional[float] = None
+        self.catalog_version: Optional[int] = None
+        self._training_task: Optional[asyncio.Task] = None
+
+        # Shadow/enforce statistics
+        self.stats = Counter()
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode in (MODE_SHADOW, MODE_ENFORCE)
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def schedule_refresh(self, catalog) -> None:
+        """
+        Retrain in the background when the model is missing, stale or the catalog version changed.
+        The current model (if any) keeps serving until the new one is ready.
+        """
+        if not self.enabled or not catalog.request_types:
+            return
+        if self._training_task and not self._training_task.done():
+            return
+
+        stale = self.trained_at is None or time.monotonic() - self.trained_at > self.refresh_seconds
+        if stale or catalog.version != self.catalog_version:
+            self._training_task = asyncio.create_task(self._train(catalog.request_types, catalog.version))
+
+    def training_example(self, subject: str, email_content: str,
+                         llm_results: List[RequestTypeResult]) -> Optional[Dict[str, Any]]:
+        """
+        Training document for an email the LLM classified
+
+        Returns:
+            Document for the fast_path_training collection, or None when the
+            pre-classifier is off or the LLM returned no request type
+        """
+        if not self.enabled or not llm_results:
+            return None
+        primary = next((r for r in llm_results if r.is_primary), llm_results[0])
+        now = datetime.now()
+        return {
+            "request_type": primary.request_type,
+            "sub_request_type": primary.sub_request_type,
+            "text": " ".join(filter(None, [subject, (email_content or "")[:1000]])),
+            "timestamp": now.isoformat(),
+            "expires_at": now + self.retention
+        }
+
+    async def _load_history(self) -> List[Tuple[str, Tuple[str, str]]]:
+        """Load the LLM-labelled training examples"""
+        examples = []
+        cursor = fast_path_training_collection.find(
+            {}, {"request_type": 1, "sub_request_type": 1, "text": 1}
+        ).sort("timestamp", -1).limit(self.max_history)
+
+        async for doc in cursor:
+            label = (doc.get("request_type"), doc.get("sub_request_type"))
+            if all(label) and doc.get("text"):
+                examples.append((doc["text"], label))
+        return examples
+
+    async def _train(self, request_types: List[Dict[str, Any]], catalog_version: int) -> None:
+        try:
+            try:
+                history = await self._load_history()
+            except Exception as e:
+                logger.warning(f"Could not load training examples for pre-classifier: {e}")
+                history = []
+            await asyncio.to_thread(self._fit, request_types, history)
+            self.catalog_version = catalog_version
+            self.trained_at = time.monotonic()
+        except Exception as e:
+            logger.error(f"Error training pre-classifier: {e}")
+
+    def _fit(self, request_types: List[Dict[str, Any]], history: List[Tuple[str, Tuple[str, str]]]) -> None:
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.preprocessing import normalize
+
+        # One definition document per (request type, sub-request type)
+        labels = []
+        documents = []
+        for rt in request_types:
+            for st in rt.get("sub_request_types", []):
+                labels.append((rt.get("name"), st.get("name")))
+                documents.append(" ".join(filter(None, [
+                    rt.get("name"), rt.get("definition"), st.get("name"), st.get("definition")
+                ])))
+
+        if not labels:
+            return
+
+        label_index = {label: i for i, label in enumerate(labels)}
+        history = [(text, label) for text, label in history if label in label_index]
+
+        vectorizer = TfidfVectorizer(sublinear_tf=True, ngram_range=(1, 2), stop_words="english", min_df=1)
+        vectorizer.fit(documents + [text for text, _ in history])
+
+        doc_vectors = normalize(vectorizer.transform(documents)).toarray()
+
+        if history:
+            hist_vectors = normalize(vectorizer.transform([text for text, _ in history])).toarray()
+            hist_labels = np.array([label_index[label] for _, label in history])
+        else:
+            hist_vectors = np.zeros((0, doc_vectors.shape[1]))
+            hist_labels = np.zeros(0, dtype=int)
+
+        calibrated = False
+        if len(history) >= self.min_calibration_examples:
+            # Calibrate on a held-out fifth of the history so the temperature is not fitted to memorised examples
+            rng = np.random.default_rng(0)
+            holdout = rng.random(len(history)) < 0.2
+            fit_centroids = self._centroids(doc_vectors, hist_vectors[~holdout], hist_labels[~holdout])
+            if holdout.any():
+                self.temperature = self._fit_temperature(hist_vectors[holdout] @ fit_centroids.T, hist_labels[holdout])
+                calibrated = True
+
+        centroids = self._centroids(doc_vectors, hist_vectors, hist_labels)
+
+        self.vectorizer = vectorizer
+        self.centroids = centroids
+        self.labels = labels
+        self.calibrated = calibrated
+        logger.info(
+            f"Pre-classifier trained on {len(labels)} labels and {len(history)} historical examples "
+            f"(temperature={self.temperature:.3f})"
+        )
+
+    @staticmethod
+    def _centroids(doc_vectors: np.ndarray, hist_vectors: np.ndarray, hist_labels: np.ndarray) -> np.ndarray:
+        """Sum definition and historical vectors per label and L2-normalise"""
+        centroids = doc_vectors.copy()
+        for idx in np.unique(hist_labels):
+            centroids[idx] += hist_vectors[hist_labels == idx].sum(axis=0)
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        return centroids / np.maximum(norms, 1e-12)
+
+    @staticmethod
+    def _softmax(scores: np.ndarray, temperature: float) -> np.ndarray:
+        z = scores / temperature
+        z = z - z.max(axis=-1, keepdims=True)
+        e = np.exp(z)
+        return e / e.sum(axis=-1, keepdims=True)
+
+    def _fit_temperature(self, scores: np.ndarray, labels: np.ndarray) -> float:
+        """Pick the softmax temperature that minimises log loss on historical examples"""
+        best_t, best_loss = self.temperature, float("inf")
+        for t in np.geomspace(0.01, 1.0, 40):
+            probs = self._softmax(scores, t)[np.arange(len(labels)), labels]
+            loss = -np.mean(np.log(np.maximum(probs, 1e-12)))
+            if loss < best_loss:
+                best_t, best_loss = float(t), loss
+        return best_t
+
+    def predict(self, subject: str, email_content: str) -> Optional[RequestTypeResult]:
+        """
+        Predict the primary request type for an email
+
+        Returns:
+            RequestTypeResult with calibrated confidence, or None if not trained
+        """
+        if not self.is_trained:
+            return None
+
+        text = f"{subject or ''} {(email_content or '')[:5000]}"
+        vector = self.vectorizer.transform([text]).toarray()[0]
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return None
+
+        scores = self.centroids @ (vector / norm)
+        probs = self._softmax(scores, self.temperature)
+        best = int(np.argmax(probs))
+        request_type, sub_request_type = self.labels[best]
+
+        confidence = float(probs[best])
+        if scores[best] < self.min_similarity:
+            # Weak evidence overall: cap confidence at the raw similarity
+            confidence = min(confidence, float(scores[best]))
+
+        return RequestTypeResult(
+            request_type=request_type,
+            sub_request_type=sub_request_type,
+            confidence=confidence,
+            reasoning=f"Fast-path local classification (similarity {scores[best]:.2f})",
+            is_primary=True
+        )
+
+    def should_skip_llm(self, prediction: Optional[RequestTypeResult]) -> bool:
+        # The default temperature is not calibrated, so its confidences cannot be held to the threshold
+        return (self.mode == MODE_ENFORCE and self.calibrated and prediction is not None
+                and prediction.confidence >= self.threshold)
+
+    def record_agreement(self, prediction: Optional[RequestTypeResult], llm_results: List[RequestTypeResult]) -> None:
+        """Compare a fast-path prediction with the LLM's primary classification"""
+        if prediction is None:
+            self.stats["untrained"] += 1
+            return
+
+        primary = next((r for r in llm_results if r.is_primary), llm_results[0] if llm_results else None)
+        if primary is None:
+            return
+
+        agreed = (prediction.request_type, prediction.sub_request_type) == (primary.request_type, primary.sub_request_type)
+        confident = prediction.confidence >= self.threshold
+        bucket = "above_threshold" if confident else "below_threshold"
+        self.stats[f"{bucket}_total"] += 1
+        if agreed:
+            self.stats[f"{bucket}_agreed"] += 1
+
+        logger.info(
+            f"Pre-classifier shadow: predicted {prediction.request_type}/{prediction.sub_request_type} "
+            f"({prediction.confidence:.2f}), LLM {primary.request_type}/{primary.sub_request_type}, "
+            f"agreed={agreed}"
+        )
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get agreement statistics for the fast path"""
+        above = self.stats["above_threshold_total"]
+        return {
+            "mode": self.mode,
+            "threshold": self.threshold,
+            "trained": self.is_trained,
+            "calibrated": self.calibrated,
+            "temperature": self.temperature,
+            "counts": dict(self.stats),
+            "agreement_above_threshold": self.stats["above_threshold_agreed"] / above if above else None
+        }
+
+
+@lru_cache()
+def get_pre_classifier() -> PreClassifier:
+    """
+    Get the shared pre-classifier so its model and agreement statistics persist across requests
+    """
+    settings = get_settings()
+    return PreClassifier(
+        mode=settings.fast_path_mode,
+        threshold=settings.fast_path_threshold,
+        refresh_minutes=settings.fast_path_refresh_minutes,
+        retention_days=settings.fast_path_training_retention_days
+    )
@@ -0,0 +1,169 @@
+import asyncio
+import json
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import ReturnDocument
+
+from app.config import get_settings
+from app.db.session import db
+from app.schemas.request_types import request_type_collection
+
+logger = logging.getLogger(__name__)
+
+config_versions_collection = db['config_versions']
+CATALOG_VERSION_ID = "request_types"
+
+
+@dataclass
+class CatalogSnapshot:
+    """Immutable, pre-rendered view of the request type catalog"""
+    version: int
+    request_types: List[Dict[str, Any]]
+    prompt_fragment: str
+    # request type name -> (support_group, {sub-request type name: required_attributes})
+    attributes: Dict[str, Tuple[str, Dict[str, List[str]]]] = field(default_factory=dict)
+
+    def get_required_attributes(self, request_type_name: str, sub_request_type_name: str) -> Tuple[List[str], str]:
+        """
+        Get required attributes and support group for a request type and sub-request type
+        """
+        if request_type_name not in self.attributes:
+            logger.warning(f"Request type not found: {request_type_name}")
+            return ([], "Not found")
+
+        support_group, sub_types = self.attributes[request_type_name]
+        if sub_request_type_name not in sub_types:
+            logger.warning(f"Sub-request type not found: {sub_request_type_name} in {request_type_name}")
+            return ([], support_group)
+
+        return (sub_types[sub_request_type_name], support_group)
+
+
+def build_snapshot(request_types: List[Dict[str, Any]], version: int) -> CatalogSnapshot:
+    """Render the prompt fragment and lookup map once per catalog version"""
+    formatted_request_types = []
+    attributes = {}
+    for rt in request_types:
+        rt["_id"] = str(rt["_id"])
+        sub_types = rt.get("sub_request_types", [])
+
+        # Format sub-types to include both name and definition
+        formatted_request_types.append({
+            "request_type": rt.get("name"),
+            "definition": rt.get("definition", ""),
+            "sub_request_types": [
+                {"name": st.get("name"), "definition": st.get("definition", "")}
+                for st in sub_types
+            ]
+        })
+
+        attributes[rt.get("name")] = (
+            rt.get("support_group", "Not found"),
+            {st.get("name"): st.get("required_attributes", []) for st in sub_types}
+        )
+
+    return CatalogSnapshot(
+        version=version,
+        request_types=request_types,
+        prompt_fragment=json.dumps(formatted_request_types, indent=2),
+        attributes=attributes
+    )
+
+
+class RequestTypeCatalog:
+    """
+    In-process cache of the request type catalog.
+
+    The hot path reads the current snapshot without touching MongoDB. The snapshot
+    is reloaded when the version counter in `config_versions` changes, which the
+    /request-types mutation routes bump. Other processes learn about changes via a
+    MongoDB change stream when the deployment supports one, otherwise by polling
+    the version counter in the background.
+    """
+
+    def __init__(self, poll_seconds: float = 5.0):
+        self.poll_seconds = poll_seconds
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._lock = asyncio.Lock()
+        self._watch_task: Optional[asyncio.Task] = None
+
+    async def _read_version(self) -> int:
+        doc = await config_versions_collection.find_one({"_id": CATALOG_VERSION_ID})
+        return doc.get("version", 0) if doc else 0
+
+    async def refresh(self) -> CatalogSnapshot:
+        """Reload the catalog from MongoDB"""
+        async with self._lock:
+            version = await self._read_version()
+            request_types = await request_type_collection.find().to_list(length=None)
+            self._snapshot = build_snapshot(request_types, version)
+            logger.info(f"Loaded request type catalog version {version} ({len(request_types)} request types)")
+            return self._snapshot
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._snapshot is not None
+
+    async def get(self) -> CatalogSnapshot:
+        """Get the current catalog snapshot, loading it on first use"""
+        if self._snapshot is None:
+            return await self.refresh()
+        return self._snapshot
+
+    async def bump_version(self) -> None:
+        """Record a catalog change and reload this process's snapshot"""
+        await config_versions_collection.find_one_and_update(
+            {"_id": CATALOG_VERSION_ID},
+            {"$inc": {"version": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        await self.refresh()
+
+    async def _watch_changes(self) -> None:
+        async with request_type_collection.watch() as stream:
+            async for _ in stream:
+                await self.refresh()
+
+    async def _poll_version(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll_seconds)
+            try:
+                version = await self._read_version()
+                if self._snapshot is None or version != self._snapshot.version:
+                    await self.refresh()
+            except Exception as e:
+                logger.warning(f"Error polling request type catalog version: {e}")
+
+    async def _watch(self) -> None:
+        try:
+            await self._watch_changes()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Change streams need a replica set; standalone servers fall back to polling
+            logger.info(f"Change stream unavailable for request types ({e}), polling version counter")
+        await self._poll_version()
+
+    async def start(self) -> None:
+        """Load the catalog and start watching for changes"""
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.error(f"Error loading request type catalog: {e}")
+        if self._watch_task is None:
+            self._watch_task = asyncio.create_task(self._watch())
+
+    async def stop(self) -> None:
+        if self._watch_task:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
+
+
+request_type_catalog = RequestTypeCatalog(poll_seconds=get_settings().catalog_poll_seconds)
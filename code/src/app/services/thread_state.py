@@ -0,0 +1,173 @@
+import asyncio
+import contextvars
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set
+
+from pymongo import DESCENDING
+
+from app.config import get_settings
+from app.core.tracing import span
+from app.models.response_models import ExtractedField, RequestTypeResult
+from app.schemas.threads import ThreadState, thread_states_collection
+
+logger = logging.getLogger(__name__)
+
+
+class ThreadStateStore:
+    """
+    Per-thread classification state for incremental processing of replies.
+
+    After an email is classified, its thread's state keeps the request types,
+    support group, extracted fields and the paragraph hashes of the messages seen
+    so far. When a reply arrives whose quoted history consists of those messages,
+    only the new message needs to go to the LLM, with the stored result as
+    context. States expire `ttl_days` after the thread's last message.
+    """
+
+    def __init__(self, collection, ttl_days: int = 30, max_hashes: int = 1000):
+        """
+        Initialize the store
+
+        Args:
+            collection: Collection holding one document per thread
+            ttl_days: Days after its last message that a thread's state is kept
+            max_hashes: Paragraph hashes kept per thread (the most recent ones)
+        """
+        self.collection = collection
+        self.ttl_days = ttl_days
+        self.max_hashes = max_hashes
+        self._saves: Set[asyncio.Task] = set()
+
+    async def ensure_indexes(self) -> None:
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def get(self, thread_ids: List[str]) -> Optional[ThreadState]:
+        """
+        Get the most recently updated state of any of the given thread IDs
+
+        Args:
+            thread_ids: Candidate IDs (header-derived, caller-supplied, In-Reply-To)
+        """
+        thread_ids = [t for t in dict.fromkeys(thread_ids) if t]
+        if not thread_ids:
+            return None
+        with span("mongo.thread_state_get"):
+            documents = await self.collection.find(
+                {"_id": {"$in": thread_ids}}
+            ).sort("updated_at", DESCENDING).limit(1).to_list(length=1)
+        if not documents:
+            return None
+        document = documents[0]
+        return ThreadState(thread_id=document.pop("_id"), **document)
+
+    async def save(self,
+                   thread_id: str,
+                   request_types: List[RequestTypeResult],
+                   support_group: str,
+                   extracted_fields: List[ExtractedField],
+                   message_hashes: List[str]) -> None:
+        """
+        Record the result of classifying a thread's latest message
+
+        Args:
+            thread_id: Thread the message belongs to
+            request_types: Request types identified for the thread
+            support_group: Support group for the primary request type
+            extracted_fields: Fields extracted for the thread so far
+            message_hashes: Paragraph hashes of the messages just processed
+        """
+        now = datetime.now()
+        with span("mongo.thread_state_save"):
+            await self.collection.update_one(
+                {"_id": thread_id},
+                {
+                    "$set": {
+                        "request_types": [r.model_dump() for r in request_types],
+                        "support_group": support_group,
+                        "extracted_fields": [f.model_dump() for f in extracted_fields],
+                        "updated_at": now,
+                        "expires_at": now + timedelta(days=self.ttl_days)
+                    },
+                    "$push": {"message_hashes": {"$each": message_hashes, "$slice": -self.max_hashes}},
+                    "$inc": {"message_count": 1}
+                },
+                upsert=True
+            )
+
+    def save_in_background(self,
+                           thread_id: str,
+                           request_types: List[RequestTypeResult],
+                           support_group: str,
+                           extracted_fields: List[ExtractedField],
+                           message_hashes: List[str]) -> None:
+        """
+        Schedule `save` without waiting for it, so the write stays off the request path
+
+        Errors are logged. `stop` waits for saves still running.
+        """
+        async def run():
+            try:
+                await self.save(thread_id, request_types, support_group, extracted_fields, message_hashes)
+            except Exception as e:
+                logger.error(f"Error saving thread state: {str(e)}")
+
+        # Run outside the caller's context so the save's span does not attach to the request
+        task = contextvars.Context().run(asyncio.create_task, run())
+        self._saves.add(task)
+        task.add_done_callback(self._saves.discard)
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Wait for background saves to finish"""
+        if not self._saves:
+            return
+        _, pending = await asyncio.wait(set(self._saves), timeout=timeout)
+        if pending:
+            logger.warning("%d thread state saves did not finish before shutdown", len(pending))
+
+
+def history_coverage(state: ThreadState, quoted_hashes: List[str]) -> float:
+    """Share of a reply's quoted paragraphs that belong to messages already seen in the thread"""
+    if not quoted_hashes:
+        return 0.0
+    known = set(state.message_hashes)
+    return sum(1 for h in quoted_hashes if h in known) / len(quoted_hashes)
+
+
+def thread_context(state: ThreadState) -> str:
+    """Compact description of a thread's prior classification, for the LLM prompts"""
+    lines = [f"Earlier messages in this thread ({state.message_count}) were classified as:"]
+    for result in state.request_types:
+        primary = ", primary" if result.get("is_primary") else ""
+        lines.append(
+            f"- {result.get('request_type')} / {result.get('sub_request_type')} "
+            f"(confidence {result.get('confidence', 0):.2f}{primary})"
+        )
+    if state.support_group:
+        lines.append(f"Support group: {state.support_group}")
+    if state.extracted_fields:
+        lines.append("Fields extracted so far:")
+        for field in state.extracted_fields:
+            lines.append(f"- {field.get('field_name')}: {json.dumps(field.get('value'), default=str)}")
+    return "\n".join(lines)
+
+
+def merge_extracted_fields(previous: List[Dict[str, Any]], extracted: List[ExtractedField]) -> List[ExtractedField]:
+    """Fields extracted from a new message, plus earlier fields it does not mention"""
+    names = {field.field_name for field in extracted}
+    carried = []
+    for field in previous:
+        if field.get("field_name") not in names:
+            try:
+                carried.append(ExtractedField(**field))
+            except Exception as e:
+                logger.warning(f"Skipping invalid stored field {field}: {e}")
+    return list(extracted) + carried
+
+
+settings = get_settings()
+thread_state_store = ThreadStateStore(
+    thread_states_collection,
+    ttl_days=settings.thread_state_ttl_days
+)
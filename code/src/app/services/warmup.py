@@ -0,0 +1,198 @@
+import asyncio
+import contextvars
+import io
+import logging
+import time
+from datetime import datetime
+from email.message import EmailMessage
+from email.utils import format_datetime, make_msgid
+from typing import Any, Callable, Dict, Optional
+
+from app.config import get_settings
+from app.core.tracing import span
+from app.services.email_processor import EmailProcessor, get_ocr_reader
+from app.services.IntelligentDuplicateDetector import IntelligentDuplicateDetector, LRUCache, get_embedding_provider
+
+logger = logging.getLogger(__name__)
+
+STATUS_PENDING = "pending"
+STATUS_WARMING_UP = "warming_up"
+STATUS_READY = "ready"
+STATUS_STOPPING = "stopping"
+
+SYNTHETIC_SUBJECT = "Loan payment confirmation for account 4417"
+SYNTHETIC_BODY = (
+    "Hello team,\n\n"
+    "Please confirm that the principal payment of USD 125,000.00 on facility 4417 "
+    "was received on 12 March and applied to the outstanding balance. The borrower "
+    "also asked whether the interest for the period will be billed separately.\n\n"
+    "Regards,\nAgency Operations"
+)
+
+
+def synthetic_eml() -> bytes:
+    """A small but realistic email for exercising the pipeline"""
+    message = EmailMessage()
+    message["From"] = "agency.operations@example.com"
+    message["To"] = "loan.servicing@example.com"
+    message["Subject"] = SYNTHETIC_SUBJECT
+    message["Date"] = format_datetime(datetime.now().astimezone())
+    message["Message-ID"] = make_msgid(domain="example.com")
+    message.set_content(SYNTHETIC_BODY)
+    return message.as_bytes()
+
+
+def synthetic_image() -> bytes:
+    """A PNG with a line of text, for the first OCR call"""
+    from PIL import Image, ImageDraw
+    image = Image.new("RGB", (320, 48), "white")
+    ImageDraw.Draw(image).text((8, 16), "Payment received 125,000.00", fill="black")
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class Warmup:
+    """
+    Startup warm-up that readiness waits for.
+
+    Loads the embedding model (and optionally the OCR model) and runs a synthetic
+    email through parsing, embedding and duplicate scoring, so the first real
+    request does not pay for model loading and first-call allocation. Runs in the
+    background after startup: liveness answers at once, readiness only once the
+    warm-up has finished. Steps that fail are reported with their error and do
+    not block readiness, since the pipeline falls back (e.g. to mock embeddings).
+    """
+
+    def __init__(self, enabled: bool = True, embeddings: bool = True, ocr: bool = False):
+        """
+        Initialize the warm-up
+
+        Args:
+            enabled: Run the warm-up; when False the service is ready as soon as it starts
+            embeddings: Load the embedding model and embed and score the synthetic email
+            ocr: Load the OCR model and read a synthetic image
+        """
+        self.enabled = enabled
+        self.embeddings = embeddings
+        self.ocr = ocr
+        self.state = STATUS_PENDING
+        self.timings_ms: Dict[str, float] = {}
+        self.errors: Dict[str, str] = {}
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == STATUS_READY
+
+    def start(self) -> None:
+        """Start the warm-up in the background (or become ready at once when disabled)"""
+        if not self.enabled:
+            self.state = STATUS_READY
+            return
+        self.state = STATUS_WARMING_UP
+        # Outside the caller's context so the warm-up spans are not part of a request trace
+        self._task = contextvars.Context().run(asyncio.create_task, self.run())
+
+    async def stop(self) -> None:
+        """Stop reporting ready so load balancers drain the instance, and cancel an unfinished warm-up"""
+        self.state = STATUS_STOPPING
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def _step(self, name: str, func: Callable[[], Any]) -> Any:
+        """Run one blocking step in a thread, recording its duration or error"""
+        started = time.perf_counter()
+        try:
+            with span(f"warmup.{name}"):
+                return await asyncio.to_thread(func)
+        except Exception as e:
+            logger.error(f"Warm-up step {name} failed: {e}")
+            self.errors[name] = str(e)
+            return None
+        finally:
+            self.timings_ms[name] = round((time.perf_counter() - started) * 1000, 1)
+
+    async def run(self) -> None:
+        """Run every warm-up step, then mark the service ready"""
+        settings = get_settings()
+        self.started_at = datetime.now()
+        started = time.perf_counter()
+        logger.info("Warm-up started (embeddings: %s, ocr: %s)", self.embeddings, self.ocr)
+
+        if self.embeddings:
+            await self._step("embedding_model", get_embedding_provider)
+        if self.ocr:
+            await self._step("ocr_model", get_ocr_reader)
+
+        processor = EmailProcessor(max_attachment_size_mb=settings.max_attachment_size_mb)
+        parsed = await self._step("parse", lambda: processor.parse_eml_message(synthetic_eml()))
+        email_info = parsed[0] if parsed else {"content": SYNTHETIC_BODY, "subject": SYNTHETIC_SUBJECT}
+        if self.ocr:
+            await self._step("ocr", lambda: processor.process_attachment(synthetic_image(), "warmup.png", "image/png"))
+
+        if self.embeddings:
+            # A detector with its own cache, so nothing synthetic reaches the shared duplicate cache
+            detector = IntelligentDuplicateDetector(
+                cache_duration_days=settings.duplicate_cache_days,
+                semantic_threshold=settings.semantic_threshold,
+                metadata_weight=settings.metadata_weight,
+                subject_weight=settings.subject_weight,
+                content_weight=settings.content_weight,
+                time_window_hours=settings.time_window_hours,
+                email_cache=LRUCache(capacity=1)
+            )
+            content = email_info.get("content", "")
+            subject = email_info.get("subject", "")
+            embeddings = await self._step("embed", lambda: detector.compute_embeddings([
+                (content, subject),
+                (content.replace("12 March", "14 March"), f"RE: {subject}")
+            ]))
+            if embeddings:
+                (content1, subject1), (content2, subject2) = embeddings
+                sender = email_info.get("sender", "")
+                recipient = email_info.get("recipient", "")
+                await self._step("score", lambda: (
+                    detector._calculate_embedding_similarity(content1, content2),
+                    detector._calculate_embedding_similarity(subject1, subject2),
+                    detector._calculate_metadata_similarity(sender, recipient, sender, recipient)
+                ))
+
+        self.timings_ms["total"] = round((time.perf_counter() - started) * 1000, 1)
+        self.finished_at = datetime.now()
+        if self.state == STATUS_WARMING_UP:
+            self.state = STATUS_READY
+        logger.info(
+            "Warm-up finished in %.0f ms (%s)%s",
+            self.timings_ms["total"],
+            ", ".join(f"{name}: {ms:.0f} ms" for name, ms in self.timings_ms.items() if name != "total"),
+            f", failed steps: {', '.join(self.errors)}" if self.errors else ""
+        )
+
+    def status(self) -> Dict[str, Any]:
+        """Readiness state with the warm-up timings, for /health/ready"""
+        return {
+            "status": self.state,
+            "warmup": {
+                "enabled": self.enabled,
+                "started_at": self.started_at.isoformat() if self.started_at else None,
+                "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+                "timings_ms": dict(self.timings_ms),
+                "errors": dict(self.errors)
+            }
+        }
+
+
+settings = get_settings()
+warmup = Warmup(
+    enabled=settings.warmup_enabled,
+    embeddings=settings.warmup_embeddings,
+    ocr=settings.warmup_ocr
+)
@@ -0,0 +1,438 @@
+"""
+Offline replay and threshold tuning for the duplicate detector.
+
+Replays a labelled corpus of EML files through IntelligentDuplicateDetector once,
+in the order of the labels file, and keeps everything its decisions depend on:
+the content and subject similarity of every pair of emails (from the embeddings
+as the cache stores them), their metadata similarity, the time between them and
+whether their Message-IDs match. Every combination of the --semantic-threshold,
+--metadata-weight, --subject-weight, --content-weight and --time-window-hours
+values is then scored from those matrices, replaying how the cache fills (unique
+and likely duplicates are cached, high-confidence duplicates are not) for all
+combinations at once.
+
+An email is reported as a duplicate the way ClassificationService treats an EML:
+a Message-ID match or a score above --cutoff. It is a duplicate in the labels when
+an earlier email in the labels file has the same group.
+
+Labels file (CSV with a header; a blank group means the email has no duplicates):
+    file,group
+    payment_1.eml,payment-1
+    payment_1_resent.eml,payment-1
+    recall.eml,
+
+Emails without a Date header arrive --arrival-minutes apart in labels-file order.
+The cache is assumed large enough to hold the whole corpus and nothing expires
+during the replay, so DUPLICATE_CACHE_SIZE and the cache duration are not tuned.
+The matrices take about 30 bytes per pair of emails, so a few thousand emails is
+the practical limit.
+
+For each combination the report has precision, recall and F1, mean_candidates
+(the cached emails within the time window per check, which the online scan's time
+grows with) and tuning_ms (its share of the scoring time). The per-check latency
+of the replay itself is measured with the current settings, and
+simulation_agreement is the share of the replay's decisions (duplicate or not, and
+the score to float32 rounding) the scoring reproduces for those settings.
+
+--replay-cache keeps the replay in an .npz file and reuses it while the labels
+file lists the same emails and the replay inputs (--embedding, the embedding
+model and precision, --arrival-minutes) are unchanged, so tuning again only
+takes the scoring time.
+
+Exits with status 1 when the simulation does not reproduce the replay.
+
+Usage:
+    python -m benchmarks.duplicate_tuning --corpus mail/ --labels labels.csv
+    python -m benchmarks.duplicate_tuning --corpus mail/ --labels labels.csv --replay-cache replay.npz \\
+        --metadata-weight 0.1 0.25 0.4 --time-window-hours 24 72 --top 20 --output tuning.json
+"""
+import argparse
+import csv
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from benchmarks.pipeline_benchmark import git_commit, percentile
+
+PARAMETERS = ("semantic_threshold", "metadata_weight", "subject_weight", "content_weight", "time_window_hours")
+DEFAULT_GRID = {
+    "semantic_threshold": [0.7, 0.75, 0.8, 0.85, 0.9, 0.95],
+    "metadata_weight": [0.0, 0.1, 0.25, 0.4, 0.55],
+    "subject_weight": [0.15, 0.3, 0.45, 0.6],
+    "content_weight": [0.5, 0.7, 0.9],
+    "time_window_hours": [24, 72, 168]
+}
+# Lowest score the detector reports as a (likely) duplicate
+CANDIDATE_SCORE = 0.5
+
+logger = logging.getLogger(__name__)
+
+
+def load_labels(path: str) -> List[Tuple[str, str]]:
+    """(file, group) rows of a labels CSV, in file order"""
+    with open(path, newline="") as f:
+        rows = [(row["file"].strip(), (row.get("group") or "").strip()) for row in csv.DictReader(f)]
+    files = [name for name, _ in rows]
+    if len(set(files)) != len(files):
+        raise ValueError(f"{path} lists a file more than once")
+    return rows
+
+
+def expected_duplicates(groups: List[str]) -> np.ndarray:
+    """Whether each email has an earlier email of the same group"""
+    seen = set()
+    expected = np.zeros(len(groups), dtype=bool)
+    for i, group in enumerate(groups):
+        if group:
+            expected[i] = group in seen
+            seen.add(group)
+    return expected
+
+
+def replay(corpus: str, labels: List[Tuple[str, str]], settings, embedding: str,
+           arrival_minutes: float) -> Dict[str, np.ndarray]:
+    """
+    Run the labelled emails through the detector once and build the pairwise matrices
+
+    Args:
+        corpus: Directory of the EML files
+        labels: (file, group) rows in replay order
+        settings: Settings whose detector parameters and embedding precision are replayed
+        embedding: "mock" for MockEmbeddingProvider, "model" for the configured model
+        arrival_minutes: Minutes between the arrival of emails without a Date header
+
+    Returns:
+        Arrays by name: the pairwise matrices, the replay's decisions and check latencies
+    """
+    from app.services.cache_features import EntryFeatures, FeatureStore, epoch_micros
+    from app.services.email_processor import EmailProcessor
+    from app.services.embedding_store import EmbeddingStore
+    from app.services.IntelligentDuplicateDetector import IntelligentDuplicateDetector, LRUCache, MockEmbeddingProvider
+
+    n = len(labels)
+    processor = EmailProcessor(max_attachment_size_mb=settings.max_attachment_size_mb)
+    detector = IntelligentDuplicateDetector(
+        embedding_provider=MockEmbeddingProvider() if embedding == "mock" else None,
+        semantic_threshold=settings.semantic_threshold,
+        metadata_weight=settings.metadata_weight,
+        subject_weight=settings.subject_weight,
+        content_weight=settings.content_weight,
+        time_window_hours=settings.time_window_hours,
+        email_cache=LRUCache(capacity=n + 1, embedding_precision=settings.duplicate_embedding_precision)
+    )
+
+    emails = []
+    start = datetime.now(timezone.utc).replace(microsecond=0)
+    for i, (name, _) in enumerate(labels):
+        with open(os.path.join(corpus, name), "rb") as f:
+            email_info = processor.parse_eml_message(f.read())[0]
+        try:
+            received = datetime.fromisoformat(email_info.get("received_date") or "")
+        except ValueError:
+            received = start + timedelta(minutes=i * arrival_minutes)
+        email_info["received_date"] = received
+        emails.append(email_info)
+
+    started = time.perf_counter()
+    embeddings = detector.compute_embeddings(
+        [(email_info.get("content", ""), email_info.get("subject", "Unknown")) for email_info in emails]
+    )
+    embedding_seconds = time.perf_counter() - started
+
+    # The replay, with the arguments ClassificationService.check_duplicate passes
+    duplicates = np.zeros(n, dtype=bool)
+    scores = np.zeros(n)
+    latencies = np.zeros(n)
+    entries = []
+    for i, (email_info, (content_embedding, subject_embedding)) in enumerate(zip(emails, embeddings)):
+        arguments = {
+            "sender": email_info.get("sender", "Unknown"),
+            "recipient": email_info.get("recipient", ""),
+            "ip_address": email_info.get("ip_address"),
+            "thread_id": detector._derive_thread_id(
+                email_info.get("thread_id"), email_info.get("references", []), email_info.get("in_reply_to")
+            ),
+            "additional_metadata": email_info.get("additional_metadata", {})
+        }
+        entries.append(arguments)
+        started = time.perf_counter()
+        is_duplicate, _, score, _ = detector.check_duplicate(
+            email_info.get("content", ""),
+            arguments["sender"],
+            email_info.get("subject", "Unknown"),
+            arguments["recipient"],
+            email_info["received_date"],
+            email_info.get("message_id"),
+            email_info.get("references", []),
+            email_info.get("in_reply_to"),
+            email_info.get("thread_id"),
+            arguments["ip_address"],
+            arguments["additional_metadata"],
+            content_embedding=content_embedding,
+            subject_embedding=subject_embedding
+        )
+        latencies[i] = time.perf_counter() - started
+        scores[i] = score or 0.0
+        duplicates[i] = bool(is_duplicate)
+
+    # Pairwise matrices, from the embeddings and features as the cache keeps them
+    store = EmbeddingStore(settings.duplicate_embedding_precision, capacity=n)
+    features = FeatureStore(capacity=n)
+    keyed = {}
+    for i, ((content_embedding, subject_embedding), entry) in enumerate(zip(embeddings, entries)):
+        store.put(i, "content_embedding", content_embedding)
+        store.put(i, "subject_embedding", subject_embedding)
+        features.put(i, str(i), EntryFeatures.from_entry(entry))
+        keyed[str(i)] = entry
+    slots = np.arange(n)
+    content = np.zeros((n, n), dtype=np.float32)
+    subject = np.zeros((n, n), dtype=np.float32)
+    metadata = np.zeros((n, n))
+    for i, ((content_embedding, subject_embedding), entry) in enumerate(zip(embeddings, entries)):
+        content[i] = store.similarities("content_embedding", content_embedding, slots)
+        subject[i] = store.similarities("subject_embedding", subject_embedding, slots)
+        metadata[i] = features.metadata_similarity(EntryFeatures.from_entry(entry), slots, keyed)
+    received = np.array([epoch_micros(email_info["received_date"]) for email_info in emails], dtype=np.int64)
+    message_ids = [email_info.get("message_id") or None for email_info in emails]
+    same_message_id = np.array([[a is not None and a == b for b in message_ids] for a in message_ids], dtype=bool)
+
+    return {
+        "files": np.array([name for name, _ in labels]),
+        "groups": np.array([group for _, group in labels]),
+        "content": content,
+        "subject": subject,
+        "metadata": metadata,
+        "time_diffs": np.abs(received[:, None] - received[None, :]),
+        "same_message_id": same_message_id.reshape(n, n),
+        "replay_duplicates": duplicates,
+        "replay_scores": scores,
+        "latencies": latencies,
+        "embedding_seconds": np.array(embedding_seconds),
+        "replayed": np.array([getattr(settings, name) for name in PARAMETERS], dtype=np.float64),
+        "precision": np.array(settings.duplicate_embedding_precision)
+    }
+
+
+def simulate(data: Dict[str, np.ndarray], configs: np.ndarray, cutoff: float) -> Dict[str, np.ndarray]:
+    """
+    Decisions of the detector for every configuration, from the replay's matrices
+
+    Args:
+        data: Arrays returned by replay()
+        configs: One row per configuration, columns in PARAMETERS order
+        cutoff: Score above which a duplicate is reported
+
+    Returns:
+        duplicates, scores (as check_duplicate returns them) and reported, each
+        configurations x emails; candidates (mean cached emails in the window per
+        check) and tuning_ms per configuration
+    """
+    n = len(data["files"])
+    k = len(configs)
+    duplicates = np.zeros((k, n), dtype=bool)
+    scores = np.zeros((k, n))
+    candidates = np.zeros(k)
+    tuning_ms = np.zeros(k)
+    content, subject, metadata = data["content"], data["subject"], data["metadata"]
+    time_diffs, same_message_id = data["time_diffs"], data["same_message_id"]
+
+    # Configurations sharing a time window share its mask and time factors
+    for window_hours in np.unique(configs[:, 4]):
+        started = time.perf_counter()
+        group = np.flatnonzero(configs[:, 4] == window_hours)
+        threshold, metadata_weight, subject_weight, content_weight = (
+            configs[group, column][:, None] for column in range(4)
+        )
+        window = timedelta(hours=float(window_hours))
+        max_hours = window.total_seconds() / 3600
+        in_window = time_diffs <= window // timedelta(microseconds=1)
+        time_factors = 1.0 - (0.3 * np.minimum(max_hours, time_diffs / 1e6 / 3600) / max_hours)
+
+        cached = np.zeros((len(group), n), dtype=bool)
+        scanned = np.zeros(len(group))
+        for i in range(n):
+            if i:
+                message_id_match = (cached[:, :i] & same_message_id[i, :i]).any(axis=1)
+                combined = (content_weight * content[i, :i].astype(np.float64) +
+                            subject_weight * subject[i, :i].astype(np.float64)) / (content_weight + subject_weight)
+                final = (metadata_weight * metadata[i, :i] + (1 - metadata_weight) * combined) * time_factors[i, :i]
+                valid = cached[:, :i] & in_window[i, :i]
+                best = np.where(valid, final, -np.inf).max(axis=1)
+                scanned += np.where(message_id_match, 0, np.count_nonzero(valid, axis=1))
+            else:
+                message_id_match = np.zeros(len(group), dtype=bool)
+                best = np.full(len(group), -np.inf)
+            candidate = best >= CANDIDATE_SCORE
+            duplicates[group, i] = message_id_match | candidate
+            scores[group, i] = np.where(message_id_match, 1.0, np.where(candidate, best, 0.0))
+            # High-confidence duplicates and Message-ID matches are not cached
+            cached[:, i] = ~message_id_match & ~(candidate & (best >= threshold[:, 0]))
+        candidates[group] = scanned / n
+        tuning_ms[group] = (time.perf_counter() - started) * 1000 / len(group)
+
+    return {
+        "duplicates": duplicates,
+        "scores": scores,
+        "reported": duplicates & (scores > cutoff),
+        "candidates": candidates,
+        "tuning_ms": tuning_ms
+    }
+
+
+def metrics(reported: np.ndarray, expected: np.ndarray) -> Dict[str, Any]:
+    tp = int(np.count_nonzero(reported & expected))
+    fp = int(np.count_nonzero(reported & ~expected))
+    fn = int(np.count_nonzero(~reported & expected))
+    precision = tp / (tp + fp) if tp + fp else 1.0
+    recall = tp / (tp + fn) if tp + fn else 1.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {
+        "tp": tp, "fp": fp, "fn": fn,
+        "precision": round(precision, 4), "recall": round(recall, 4), "f1": round(f1, 4)
+    }
+
+
+def config_grid(args) -> np.ndarray:
+    return np.array(list(itertools.product(*(getattr(args, name) for name in PARAMETERS))), dtype=np.float64)
+
+
+def replay_inputs(args, settings) -> Dict[str, Any]:
+    """Inputs besides the emails that change the replay's similarities and timing"""
+    return {
+        "embedding": args.embedding,
+        "embedding_model": settings.embedding_model if args.embedding == "model" else None,
+        "embedding_precision": settings.duplicate_embedding_precision,
+        "arrival_minutes": args.arrival_minutes
+    }
+
+
+def load_replay(path: str, labels: List[Tuple[str, str]], inputs: Dict[str, Any]) -> Dict[str, np.ndarray]:
+    """A saved replay, or None if it is missing or replays other emails or inputs"""
+    if not path or not os.path.exists(path):
+        return None
+    with np.load(path) as saved:
+        data = {name: saved[name] for name in saved.files}
+    if list(data["files"]) != [name for name, _ in labels]:
+        logger.warning(f"{path} replays other emails than the labels file, replaying again")
+        return None
+    saved_inputs = json.loads(str(data["inputs"])) if "inputs" in data else None
+    if saved_inputs != inputs:
+        logger.warning(f"{path} was replayed with {saved_inputs}, not {inputs}, replaying again")
+        return None
+    # Groups can be relabelled without replaying
+    data["groups"] = np.array([group for _, group in labels])
+    return data
+
+
+def main() -> None:
+    from app.config import get_settings
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", required=True, help="Directory of the EML files")
+    parser.add_argument("--labels", required=True, help="CSV of file,group rows in replay order")
+    parser.add_argument("--replay-cache", help="Save the replay to (or reuse it from) this .npz file")
+    parser.add_argument("--embedding", choices=("mock", "model"), default="model",
+                        help="mock: MockEmbeddingProvider; model: the configured embedding model")
+    parser.add_argument("--arrival-minutes", type=float, default=1.0,
+                        help="Minutes between emails without a Date header")
+    parser.add_argument("--cutoff", type=float,
+                        help="Score above which a duplicate is reported (default: ClassificationService.EML_DUPLICATE_CUTOFF)")
+    for name in PARAMETERS:
+        parser.add_argument(f"--{name.replace('_', '-')}", type=int if name == "time_window_hours" else float,
+                            nargs="+", default=DEFAULT_GRID[name], help=f"Values of {name} to try")
+    parser.add_argument("--top", type=int, default=10, help="Configurations listed, best F1 first")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    if args.cutoff is None:
+        from app.services.classification_service import ClassificationService
+        args.cutoff = ClassificationService.EML_DUPLICATE_CUTOFF
+
+    settings = get_settings()
+    labels = load_labels(args.labels)
+    started = time.perf_counter()
+    inputs = replay_inputs(args, settings)
+    data = load_replay(args.replay_cache, labels, inputs)
+    if data is None:
+        data = replay(args.corpus, labels, settings, args.embedding, args.arrival_minutes)
+        if args.replay_cache:
+            np.savez_compressed(args.replay_cache, inputs=np.array(json.dumps(inputs)), **data)
+    replay_seconds = time.perf_counter() - started
+    expected = expected_duplicates(list(data["groups"]))
+
+    # The replayed settings are always scored, to check the simulation against the replay
+    replayed = data["replayed"]
+    grid = config_grid(args)
+    configs = np.vstack([replayed, grid[~np.all(grid == replayed, axis=1)]])
+    started = time.perf_counter()
+    simulated = simulate(data, configs, args.cutoff)
+    tuning_seconds = time.perf_counter() - started
+
+    results = []
+    for i, config in enumerate(configs):
+        row = {name: (int(value) if name == "time_window_hours" else float(value)) for name, value in zip(PARAMETERS, config)}
+        row.update(metrics(simulated["reported"][i], expected))
+        row["mean_candidates"] = round(float(simulated["candidates"][i]), 2)
+        row["tuning_ms"] = round(float(simulated["tuning_ms"][i]), 3)
+        results.append(row)
+    current = dict(results[0])
+    # ClassificationService skips an EML when it is a duplicate scoring above the cutoff
+    replay_reported = data["replay_duplicates"] & (data["replay_scores"] > args.cutoff)
+    # Scores agree to float32 rounding (BLAS sums a block of rows in a shape-dependent order)
+    agreement = float(np.mean(
+        (simulated["duplicates"][0] == data["replay_duplicates"]) &
+        np.isclose(simulated["scores"][0], data["replay_scores"], rtol=0, atol=1e-6)
+    ))
+    current["simulation_agreement"] = round(agreement, 5)
+    current["replay_metrics"] = metrics(replay_reported, expected)
+    ranked = sorted(results, key=lambda row: (-row["f1"], -row["precision"], row["mean_candidates"]))
+
+    latencies = [float(value) * 1000 for value in data["latencies"]]
+    report = {
+        "git_commit": git_commit(),
+        "emails": len(data["files"]),
+        "expected_duplicates": int(np.count_nonzero(expected)),
+        "cutoff": args.cutoff,
+        "embedding_precision": str(data["precision"]),
+        "replay": {
+            "seconds": round(replay_seconds, 3),
+            "embedding_seconds": round(float(data["embedding_seconds"]), 3),
+            "check_p50_ms": round(percentile(latencies, 50), 3),
+            "check_p95_ms": round(percentile(latencies, 95), 3)
+        },
+        "configurations": len(configs),
+        "tuning_seconds": round(tuning_seconds, 3),
+        "current": current,
+        "best": ranked[0],
+        "top": ranked[:args.top]
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+    header = f"{'threshold':>9} {'meta':>5} {'subject':>7} {'content':>7} {'window':>6} {'prec':>6} {'recall':>6} {'f1':>6} {'cands':>7}"
+    print(header, file=sys.stderr)
+    for row in [current] + ranked[:args.top]:
+        print(
+            f"{row['semantic_threshold']:>9.2f} {row['metadata_weight']:>5.2f} {row['subject_weight']:>7.2f} "
+            f"{row['content_weight']:>7.2f} {row['time_window_hours']:>6d} {row['precision']:>6.3f} "
+            f"{row['recall']:>6.3f} {row['f1']:>6.3f} {row['mean_candidates']:>7.2f}"
+            + ("  (current)" if row is current else ""),
+            file=sys.stderr
+        )
+    if agreement < 1.0:
+        print(f"FAIL: the simulation reproduces {agreement:.2%} of the replay's decisions", file=sys.stderr)
+    sys.exit(0 if agreement == 1.0 else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Parity and throughput of the embedding backends on the sample corpus.
+
+Parses every .eml and .pdf in code/test the way the API does and embeds the
+normalized content and subject of each (the texts the duplicate detector
+embeds) with every backend of SentenceTransformerProvider. For each backend it
+reports load time, batch throughput, single-text latency and, against the
+float32 torch backend:
+
+    cosine          cosine between a text's embedding and its torch embedding (min / mean)
+    pairwise_drift  largest change in the cosine similarity of any two texts, which is
+                    what the duplicate detector compares with semantic_threshold
+
+Exits with status 1 when a backend's minimum cosine is below --min-cosine or its
+pairwise drift is above --max-pairwise-drift, so it can gate a backend change.
+A backend that is not installed (it falls back to torch) is reported as
+unavailable.
+
+Usage:
+    python -m benchmarks.embedding_backends
+    python -m benchmarks.embedding_backends --backends torch onnx-int8 --repeats 10 --output backends.json
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+from app.config import get_settings
+from benchmarks.pipeline_benchmark import DEFAULT_CORPUS, git_commit, load_corpus, percentile
+
+BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+# Default parity bounds against the float32 torch backend
+MIN_COSINE = 0.98
+MAX_PAIRWISE_DRIFT = 0.03
+
+logger = logging.getLogger(__name__)
+
+
+def corpus_texts(path: str) -> List[str]:
+    """Normalized content and subject of every sample email, as the duplicate detector embeds them"""
+    from app.services.email_processor import EmailProcessor
+    from app.services.IntelligentDuplicateDetector import IntelligentDuplicateDetector, LRUCache, MockEmbeddingProvider
+
+    processor = EmailProcessor(max_attachment_size_mb=50)
+    detector = IntelligentDuplicateDetector(embedding_provider=MockEmbeddingProvider(), email_cache=LRUCache(capacity=1))
+    corpus = load_corpus(path)
+    emails = []
+    for _, content in corpus["eml"]:
+        emails.append(processor.parse_eml_message(content)[0])
+    for name, content in corpus["pdf"]:
+        emails.append(processor.process_email_chain(content, name, "application/pdf")[0])
+    texts = []
+    for email_info in emails:
+        texts.append(detector._normalize_email(email_info.get("content", "")))
+        texts.append(detector._normalize_subject(email_info.get("subject", "")))
+    return [text for text in texts if text]
+
+
+def _normalize(embeddings: List[np.ndarray]) -> np.ndarray:
+    matrix = np.asarray(embeddings, dtype=np.float64)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def measure(backend: str, texts: List[str], repeats: int, model_name: str, onnx_file: str) -> Dict[str, Any]:
+    from app.services.IntelligentDuplicateDetector import SentenceTransformerProvider
+
+    started = time.perf_counter()
+    provider = SentenceTransformerProvider(model_name, backend=backend, onnx_file=onnx_file)
+    load_s = time.perf_counter() - started
+    if provider.model is None or provider.backend != backend:
+        return {"backend": backend, "available": False}
+
+    embeddings = provider.get_embeddings(texts)
+    batch_seconds = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        provider.get_embeddings(texts)
+        batch_seconds.append(time.perf_counter() - started)
+    single_ms = []
+    for text in texts:
+        started = time.perf_counter()
+        provider.get_embedding(text)
+        single_ms.append((time.perf_counter() - started) * 1000)
+
+    best = min(batch_seconds)
+    return {
+        "backend": backend,
+        "available": True,
+        "load_s": round(load_s, 2),
+        "texts_per_second": round(len(texts) / best, 1),
+        "batch_seconds": round(best, 4),
+        "single_p50_ms": round(percentile(single_ms, 50), 2),
+        "single_p95_ms": round(percentile(single_ms, 95), 2),
+        "embeddings": _normalize(embeddings)
+    }
+
+
+def parity(reference: np.ndarray, candidate: np.ndarray) -> Dict[str, float]:
+    """Per-text cosine to the reference and the largest change in pairwise similarity"""
+    cosine = np.sum(reference * candidate, axis=1)
+    drift = np.abs(reference @ reference.T - candidate @ candidate.T)
+    return {
+        "cosine_min": round(float(cosine.min()), 5),
+        "cosine_mean": round(float(cosine.mean()), 5),
+        "pairwise_drift": round(float(drift.max()), 5)
+    }
+
+
+def main() -> None:
+    settings = get_settings()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="Directory of sample .eml and .pdf files")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument("--model", default=settings.embedding_model)
+    parser.add_argument("--onnx-file", default=settings.embedding_onnx_file, help="Quantized export for onnx-int8")
+    parser.add_argument("--repeats", type=int, default=5, help="Timed batch passes per backend (the fastest is reported)")
+    parser.add_argument("--min-cosine", type=float, default=MIN_COSINE)
+    parser.add_argument("--max-pairwise-drift", type=float, default=MAX_PAIRWISE_DRIFT)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    texts = corpus_texts(args.corpus)
+    results = [measure(backend, texts, args.repeats, args.model, args.onnx_file) for backend in ["torch"] + [
+        backend for backend in args.backends if backend != "torch"
+    ]]
+    reference = results[0].get("embeddings")
+    failures = [] if reference is not None else ["the torch reference backend is not available"]
+    for result in results:
+        embeddings = result.pop("embeddings", None)
+        if embeddings is None or reference is None:
+            continue
+        result.update(parity(reference, embeddings))
+        result["speedup"] = round(result["texts_per_second"] / results[0]["texts_per_second"], 2)
+        if result["cosine_min"] < args.min_cosine:
+            failures.append(f"{result['backend']}: min cosine {result['cosine_min']} < {args.min_cosine}")
+        if result["pairwise_drift"] > args.max_pairwise_drift:
+            failures.append(f"{result['backend']}: pairwise drift {result['pairwise_drift']} > {args.max_pairwise_drift}")
+
+    report = {
+        "git_commit": git_commit(),
+        "model": args.model,
+        "texts": len(texts),
+        "mean_text_chars": round(sum(len(t) for t in texts) / len(texts), 1) if texts else 0,
+        "results": results,
+        "passed": not failures
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+Memory and duplicate-decision agreement of the duplicate cache's embedding precisions.
+
+Generates a synthetic stream of emails: embeddings drawn around shared topics,
+with a share of them re-sends of an earlier email at a random amount of noise
+(so their similarities spread across `semantic_threshold`), senders and
+recipients from small pools and receive times a few minutes apart. The stream
+is run through IntelligentDuplicateDetector once per precision and each
+decision (duplicate or not, high or likely confidence, matched email) is
+compared with float32, the full-precision store.
+
+Also reports, for a cache of --cache-entries entries:
+
+    cache_mb           memory of the filled cache (entries and embeddings, tracemalloc)
+    embeddings_mb      memory of the embedding store alone
+    kernel_ms          similarity of one query to every cached embedding
+plus the same cache_mb for the entries holding float64 embeddings, as the
+MockEmbeddingProvider returns them and the cache stored them before the store.
+
+Exits with status 1 when a precision's agreement is below --min-agreement.
+
+Usage:
+    python -m benchmarks.embedding_precision
+    python -m benchmarks.embedding_precision --emails 3000 --cache-entries 50000 --output precision.json
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+import numpy as np
+
+from app.services.embedding_store import PRECISIONS
+from benchmarks.pipeline_benchmark import git_commit
+
+REFERENCE = "float32"
+
+
+def _unit(vector: np.ndarray) -> np.ndarray:
+    return vector / np.linalg.norm(vector)
+
+
+def synthetic_stream(emails: int, dim: int, resend_share: float, seed: int) -> List[Dict[str, Any]]:
+    """Synthetic emails with float64 embeddings, a share of them noisy re-sends of earlier ones"""
+    rng = np.random.default_rng(seed)
+    topics = [_unit(rng.standard_normal(dim)) for _ in range(max(1, emails // 20))]
+    senders = [f"user{i}@example{i % 7}.com" for i in range(40)]
+    recipients = [f"ops{i}@bank.com" for i in range(6)]
+    start = datetime(2025, 1, 6, 9, 0)
+    stream = []
+    for i in range(emails):
+        received = start + timedelta(minutes=int(i * 3 + rng.integers(0, 3)))
+        if stream and rng.random() < resend_share:
+            original = stream[int(rng.integers(0, len(stream)))]
+            noise = rng.uniform(0.05, 1.2)
+            email = dict(original)
+            email["content_embedding"] = _unit(original["content_embedding"] + noise * _unit(rng.standard_normal(dim)))
+            email["subject_embedding"] = _unit(original["subject_embedding"] + noise * _unit(rng.standard_normal(dim)))
+            if rng.random() < 0.3:
+                email["sender"] = senders[int(rng.integers(0, len(senders)))]
+        else:
+            topic = topics[int(rng.integers(0, len(topics)))]
+            email = {
+                "content_embedding": _unit(topic + _unit(rng.standard_normal(dim))),
+                "subject_embedding": _unit(rng.standard_normal(dim)),
+                "sender": senders[int(rng.integers(0, len(senders)))],
+                "recipient": recipients[int(rng.integers(0, len(recipients)))]
+            }
+        email["message_id"] = f"<synthetic-{i}@example.com>"
+        email["received_date"] = received.isoformat()
+        stream.append(email)
+    return stream
+
+
+def run_stream(stream: List[Dict[str, Any]], precision: str) -> List[Dict[str, Any]]:
+    from app.config import get_settings
+    from app.services.IntelligentDuplicateDetector import IntelligentDuplicateDetector, LRUCache, MockEmbeddingProvider
+
+    settings = get_settings()
+    detector = IntelligentDuplicateDetector(
+        embedding_provider=MockEmbeddingProvider(),
+        semantic_threshold=settings.semantic_threshold,
+        metadata_weight=settings.metadata_weight,
+        subject_weight=settings.subject_weight,
+        content_weight=settings.content_weight,
+        time_window_hours=settings.time_window_hours,
+        email_cache=LRUCache(capacity=len(stream) + 1, embedding_precision=precision)
+    )
+    decisions = []
+    for email in stream:
+        is_duplicate, _, score, duplicate_id = detector.check_duplicate(
+            "", email["sender"], "", email["recipient"], email["received_date"],
+            message_id=email["message_id"],
+            content_embedding=email["content_embedding"],
+            subject_embedding=email["subject_embedding"]
+        )
+        decisions.append({
+            "duplicate": is_duplicate,
+            "high_confidence": bool(is_duplicate and score >= detector.semantic_threshold),
+            "match": duplicate_id,
+            "score": score or 0.0
+        })
+    return decisions
+
+
+def agreement(reference: List[Dict[str, Any]], decisions: List[Dict[str, Any]]) -> Dict[str, Any]:
+    same = sum(
+        (r["duplicate"], r["high_confidence"], r["match"]) == (d["duplicate"], d["high_confidence"], d["match"])
+        for r, d in zip(reference, decisions)
+    )
+    both = [(r["score"], d["score"]) for r, d in zip(reference, decisions) if r["match"] and r["match"] == d["match"]]
+    return {
+        "agreement": round(same / len(reference), 5),
+        "disagreements": len(reference) - same,
+        "duplicates": sum(d["duplicate"] for d in decisions),
+        "max_score_diff": round(max((abs(r - d) for r, d in both), default=0.0), 6)
+    }
+
+
+def cache_memory(entries: int, dim: int, precision: str, seed: int) -> Dict[str, Any]:
+    """Memory of a cache of synthetic entries, with the store at `precision` or (None) float64 in the entries"""
+    from app.services.IntelligentDuplicateDetector import LRUCache
+
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((entries, 2, dim))
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    cache = OrderedDict() if precision is None else LRUCache(capacity=entries, embedding_precision=precision)
+    for i in range(entries):
+        entry = {
+            "id": f"entry-{i}",
+            # Copies, as a provider returns a new array per email
+            "content_embedding": vectors[i, 0].copy(),
+            "subject_embedding": vectors[i, 1].copy(),
+            "sender": f"user{i % 500}@example{i % 37}.com",
+            "recipient": f"ops{i % 11}@bank.com",
+            "received_date": datetime(2025, 1, 6).isoformat()
+        }
+        if precision is None:
+            cache[entry["id"]] = entry
+        else:
+            cache.put(entry["id"], entry)
+    cache_bytes = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    result = {"precision": precision or "float64 entries", "cache_mb": round(cache_bytes / 2 ** 20, 2)}
+    if precision is not None:
+        result["embeddings_mb"] = round(cache.embeddings.nbytes / 2 ** 20, 2)
+        slots = np.arange(entries)
+        query = rng.standard_normal(dim)
+        timings = []
+        for _ in range(5):
+            started = time.perf_counter()
+            cache.embeddings.similarities("content_embedding", query, slots)
+            timings.append(time.perf_counter() - started)
+        result["kernel_ms"] = round(min(timings) * 1000, 3)
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--emails", type=int, default=1000, help="Emails in the synthetic stream")
+    parser.add_argument("--resend-share", type=float, default=0.4, help="Share of emails that re-send an earlier one")
+    parser.add_argument("--cache-entries", type=int, default=10000, help="Entries in the cache measured for memory")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--min-agreement", type=float, default=0.99)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    stream = synthetic_stream(args.emails, args.dim, args.resend_share, args.seed)
+    decisions = {precision: run_stream(stream, precision) for precision in PRECISIONS}
+    memory = {row["precision"]: row for row in [cache_memory(args.cache_entries, args.dim, None, args.seed)] + [
+        cache_memory(args.cache_entries, args.dim, precision, args.seed) for precision in PRECISIONS
+    ]}
+    baseline_mb = memory["float64 entries"]["cache_mb"]
+
+    results = []
+    failures = []
+    for precision in PRECISIONS:
+        row = {**agreement(decisions[REFERENCE], decisions[precision]), **memory[precision]}
+        row["cache_saved_mb"] = round(baseline_mb - row["cache_mb"], 2)
+        results.append(row)
+        if row["agreement"] < args.min_agreement:
+            failures.append(f"{precision}: agreement {row['agreement']} < {args.min_agreement}")
+
+    report = {
+        "git_commit": git_commit(),
+        "emails": args.emails,
+        "cache_entries": args.cache_entries,
+        "dim": args.dim,
+        "float64_entries_cache_mb": baseline_mb,
+        "results": results,
+        "passed": not failures
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Time per email versus body length for each embedding strategy.
+
+Builds bodies of --lengths characters from the sample corpus text and embeds
+each with every strategy, plus "full" (the whole body handed to the model, as
+before strategies existed). For each length and strategy it reports the time to
+embed one body and two similarities to the original body:
+
+    deep_edit_similarity   the last quarter of the body replaced by other text; a
+                           strategy that only reads the beginning scores 1.0 and so
+                           cannot tell these emails apart
+    small_edit_similarity  a few words changed in the middle; should stay high
+
+Usage:
+    python -m benchmarks.embedding_strategy
+    python -m benchmarks.embedding_strategy --lengths 2000 20000 200000 --repeats 5 --mock
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+from benchmarks.embedding_backends import corpus_texts
+from benchmarks.pipeline_benchmark import DEFAULT_CORPUS, git_commit
+
+logger = logging.getLogger(__name__)
+
+
+def build_body(words: List[str], length: int, offset: int = 0) -> str:
+    """Corpus words, repeated as needed, up to `length` characters"""
+    out = []
+    size = 0
+    i = offset
+    while size < length:
+        word = words[i % len(words)]
+        out.append(word)
+        size += len(word) + 1
+        i += 1
+    return " ".join(out)
+
+
+def _cosine(a: np.ndarray, b: np.ndarray) -> float:
+    norm = np.linalg.norm(a) * np.linalg.norm(b)
+    return float(np.dot(a, b) / norm) if norm else 0.0
+
+
+def variants(body: str, other_words: List[str]) -> Dict[str, str]:
+    words = body.split()
+    quarter = len(words) * 3 // 4
+    deep = words[:quarter] + [other_words[i % len(other_words)] for i in range(len(words) - quarter)]
+    small = list(words)
+    middle = len(small) // 2
+    for i in range(middle, min(middle + 5, len(small))):
+        small[i] = "changed"
+    return {"deep_edit": " ".join(deep), "small_edit": " ".join(small)}
+
+
+def measure(name: str, embed, body: str, edits: Dict[str, str], repeats: int) -> Dict[str, Any]:
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        original = embed(body)
+        timings.append(time.perf_counter() - started)
+    return {
+        "strategy": name,
+        "ms_per_email": round(min(timings) * 1000, 2),
+        "deep_edit_similarity": round(_cosine(original, embed(edits["deep_edit"])), 4),
+        "small_edit_similarity": round(_cosine(original, embed(edits["small_edit"])), 4)
+    }
+
+
+def main() -> None:
+    from app.config import get_settings
+    from app.services.embedding_strategy import EmbeddingStrategy
+    from app.services.IntelligentDuplicateDetector import MockEmbeddingProvider, get_embedding_provider
+
+    settings = get_settings()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="Directory of sample .eml and .pdf files")
+    parser.add_argument("--lengths", type=int, nargs="+", default=[1000, 10000, 100000, 1000000], help="Body lengths in characters")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per body (the fastest is reported)")
+    parser.add_argument("--max-tokens", type=int, default=settings.embedding_max_tokens)
+    parser.add_argument("--max-chunks", type=int, default=settings.embedding_max_chunks)
+    parser.add_argument("--mock", action="store_true", help="Use the mock embedding provider instead of the model")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    provider = MockEmbeddingProvider() if args.mock else get_embedding_provider()
+    strategies = {
+        "head": EmbeddingStrategy("head", args.max_tokens),
+        "head_tail": EmbeddingStrategy("head_tail", args.max_tokens),
+        "chunks_mean": EmbeddingStrategy("chunks", args.max_tokens, max_chunks=args.max_chunks, pooling="mean"),
+        "chunks_max": EmbeddingStrategy("chunks", args.max_tokens, max_chunks=args.max_chunks, pooling="max")
+    }
+    embedders = {"full": lambda text: provider.get_embeddings([text])[0]}
+    for name, strategy in strategies.items():
+        embedders[name] = lambda text, strategy=strategy: strategy.embed(provider, [text])[0]
+
+    words = " ".join(corpus_texts(args.corpus)).split()
+    other_words = words[len(words) // 2:] + words[:len(words) // 2]
+    results = []
+    for length in args.lengths:
+        body = build_body(words, length)
+        edits = variants(body, other_words)
+        for name, embed in embedders.items():
+            row = measure(name, embed, body, edits, args.repeats)
+            pieces = len(strategies[name].pieces(body)) if name in strategies else 1
+            results.append({"length_chars": length, "pieces": pieces, **row})
+            print(f"{length:>9} chars  {name:<12} {row['ms_per_email']:>9.2f} ms  "
+                  f"deep edit {row['deep_edit_similarity']:.3f}  small edit {row['small_edit_similarity']:.3f}",
+                  file=sys.stderr)
+
+    report = {
+        "git_commit": git_commit(),
+        "provider": type(provider).__name__,
+        "max_tokens": args.max_tokens,
+        "max_chunks": args.max_chunks,
+        "results": results
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Startup report: how long importing the API takes and which modules it spends it on.
+
+Runs `python -X importtime -c "import app.main"` in fresh interpreters, keeps the
+fastest run and reports the total import time, the slowest modules by cumulative
+and by self time, and any heavy ML/provider packages that were imported. Those
+are meant to load on first use, so finding one at import is a failure, as is a
+total above --budget-ms.
+
+With --serve it also starts the API under uvicorn and reports how long it takes
+until `GET /` answers (includes the startup hooks, so run it with MongoDB up).
+
+Exits with status 1 when the budget is exceeded or a heavy package is imported,
+so it can gate CI.
+
+Usage:
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --budget-ms 2500 --top 30 --output startup.json
+    python -m benchmarks.import_time --serve
+"""
+import argparse
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from typing import Any, Dict, List, Optional
+
+# Packages that must not be imported when the app starts
+HEAVY_MODULES = (
+    "torch",
+    "torchvision",
+    "easyocr",
+    "cv2",
+    "skimage",
+    "sklearn",
+    "sentence_transformers",
+    "transformers",
+    "onnxruntime",
+    "langchain_anthropic",
+    "langchain_openai",
+    "langchain_community",
+    "anthropic",
+    "openai",
+)
+DEFAULT_BUDGET_MS = 2500
+
+_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$')
+
+
+def run_importtime(module: str) -> List[Dict[str, Any]]:
+    """
+    Import a module in a fresh interpreter with -X importtime
+
+    Returns:
+        One entry per imported module with self_ms, cumulative_ms and depth
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=os.getcwd()
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    entries = []
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            entries.append({
+                "module": match.group(4),
+                "self_ms": int(match.group(1)) / 1000,
+                "cumulative_ms": int(match.group(2)) / 1000,
+                # importtime indents nested imports by two spaces per level
+                "depth": (len(match.group(3)) - 1) // 2
+            })
+    return entries
+
+
+def time_to_first_response(port: int, timeout: float) -> Optional[float]:
+    """Start the API under uvicorn and time how long until GET / answers"""
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            if server.poll() is not None:
+                return None
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.05)
+        return None
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            # Startup hooks still blocked (e.g. waiting for MongoDB)
+            server.kill()
+            server.wait()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def build_report(module: str, runs: int, top: int) -> Dict[str, Any]:
+    fastest = None
+    for _ in range(runs):
+        entries = run_importtime(module)
+        total = next((e["cumulative_ms"] for e in reversed(entries) if e["module"] == module), 0.0)
+        if fastest is None or total < fastest[0]:
+            fastest = (total, entries)
+    total, entries = fastest
+
+    heavy = sorted({e["module"] for e in entries if e["module"] in HEAVY_MODULES})
+    # Whole packages and the app's own modules give the clearest picture of where the time goes
+    packages: Dict[str, float] = {}
+    for e in entries:
+        if "." not in e["module"] or e["module"].startswith("app."):
+            packages[e["module"]] = max(packages.get(e["module"], 0.0), e["cumulative_ms"])
+    return {
+        "module": module,
+        "python": sys.version.split()[0],
+        "runs": runs,
+        "total_ms": round(total, 1),
+        "modules_imported": len(entries),
+        "heavy_modules_imported": heavy,
+        "slowest_cumulative": [
+            {"module": name, "cumulative_ms": round(ms, 1)}
+            for name, ms in sorted(packages.items(), key=lambda item: -item[1])[:top]
+        ],
+        "slowest_self": [
+            {"module": e["module"], "self_ms": round(e["self_ms"], 1)}
+            for e in sorted(entries, key=lambda e: -e["self_ms"])[:top]
+        ]
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="app.main", help="Module to import")
+    parser.add_argument("--runs", type=int, default=3, help="Fresh interpreters to time; the fastest is reported")
+    parser.add_argument("--top", type=int, default=20, help="Modules listed per ranking")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS, help="Maximum total import time")
+    parser.add_argument("--serve", action="store_true", help="Also time uvicorn startup until GET / answers")
+    parser.add_argument("--serve-timeout", type=float, default=60.0)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = build_report(args.module, args.runs, args.top)
+    report["budget_ms"] = args.budget_ms
+    if args.serve:
+        elapsed = time_to_first_response(_free_port(), args.serve_timeout)
+        report["first_response_ms"] = round(elapsed * 1000, 1) if elapsed is not None else None
+
+    failures = []
+    if report["total_ms"] > args.budget_ms:
+        failures.append(f"import took {report['total_ms']:.0f} ms (budget {args.budget_ms:.0f} ms)")
+    if report["heavy_modules_imported"]:
+        failures.append(f"heavy modules imported at startup: {', '.join(report['heavy_modules_imported'])}")
+    report["passed"] = not failures
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
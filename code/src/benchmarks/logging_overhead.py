@@ -0,0 +1,127 @@
+"""
+Measure the cost of logging in the duplicate detector's hot loops.
+
+Fills an LRUCache with synthetic entries (precomputed random embeddings, so the
+embedding model is not part of the measurement), then times check_duplicate
+scans with the root logger at INFO writing to an in-memory stream, the way the
+API runs by default. Reports scan latency and how many log lines and bytes each
+scan produced.
+
+Usage:
+    python -m benchmarks.logging_overhead --entries 10000 --scans 5
+"""
+import argparse
+import io
+import json
+import logging
+import statistics
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from app.services.IntelligentDuplicateDetector import (
+    IntelligentDuplicateDetector,
+    LRUCache,
+    MockEmbeddingProvider
+)
+
+
+class _CountingStream(io.StringIO):
+    def __init__(self):
+        super().__init__()
+        self.lines = 0
+        self.bytes = 0
+
+    def write(self, s):
+        self.lines += s.count("\n")
+        self.bytes += len(s)
+        return len(s)
+
+
+def build_cache(entries: int, dim: int = 384, seed: int = 0, capacity: int = None) -> LRUCache:
+    """Build an LRUCache of synthetic recent emails with random embeddings"""
+    rng = np.random.default_rng(seed)
+    cache = LRUCache(capacity=capacity or entries + 100)
+    now = datetime.now()
+    for i in range(entries):
+        cache.put(f"entry-{i}", {
+            "id": f"entry-{i}",
+            "content_embedding": rng.standard_normal(dim),
+            "subject_embedding": rng.standard_normal(dim),
+            "sender": f"user{i % 500}@example{i % 37}.com",
+            "recipient": f"ops{i % 11}@bank.com",
+            "subject": f"Subject {i}",
+            "message_id": f"<msg-{i}@example.com>",
+            "thread_id": f"thread-{i % 1000}",
+            "received_date": (now - timedelta(minutes=i % 4000)).isoformat(),
+            "ip_address": f"10.0.{i % 256}.{i % 200}",
+            "expiry": (now + timedelta(days=14)).isoformat()
+        })
+    return cache
+
+
+def build_detector(entries: int, dim: int = 384, seed: int = 0) -> IntelligentDuplicateDetector:
+    return IntelligentDuplicateDetector(
+        embedding_provider=MockEmbeddingProvider(embedding_dim=dim),
+        email_cache=build_cache(entries, dim, seed),
+        semantic_threshold=0.8,
+        metadata_weight=0.25,
+        subject_weight=0.45,
+        content_weight=0.9,
+        time_window_hours=72
+    )
+
+
+def run(entries: int, scans: int, dim: int = 384) -> dict:
+    stream = _CountingStream()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    root = logging.getLogger()
+    previous_handlers, previous_level = root.handlers[:], root.level
+    root.handlers = [handler]
+    root.setLevel(logging.INFO)
+
+    try:
+        detector = build_detector(entries, dim)
+        rng = np.random.default_rng(1)
+        latencies = []
+        lines_before, bytes_before = stream.lines, stream.bytes
+        for i in range(scans):
+            start = time.perf_counter()
+            detector.check_duplicate(
+                f"benchmark email body {i}",
+                "someone@example.com",
+                f"benchmark subject {i}",
+                "ops1@bank.com",
+                datetime.now().isoformat(),
+                content_embedding=rng.standard_normal(dim),
+                subject_embedding=rng.standard_normal(dim)
+            )
+            latencies.append((time.perf_counter() - start) * 1000)
+            # Keep the cache size constant across scans
+            detector.email_cache.popitem(last=True)
+    finally:
+        root.handlers, root.level = previous_handlers, previous_level
+
+    return {
+        "entries": entries,
+        "scans": scans,
+        "scan_ms_mean": round(statistics.mean(latencies), 2),
+        "scan_ms_median": round(statistics.median(latencies), 2),
+        "log_lines_per_scan": (stream.lines - lines_before) / scans,
+        "log_bytes_per_scan": (stream.bytes - bytes_before) / scans
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--scans", type=int, default=5)
+    args = parser.parse_args()
+
+    print(json.dumps([run(n, args.scans) for n in args.entries], indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,367 @@
+"""
+End-to-end benchmark of ClassificationService.process_eml / process_email_chain.
+
+The LLM is replaced by a deterministic in-process stub (configurable latency and
+jitter) and MongoDB by in-memory collections, so results depend only on the code
+under test and can be compared across commits. Parsing, OCR, embeddings and the
+duplicate scan run for real.
+
+Scenarios:
+    corpus      every .eml and .pdf in code/test
+    cache       the corpus EMLs against a duplicate cache pre-filled with N synthetic emails
+    large_pdf   one email chain PDF built by repeating the corpus PDFs up to --pdf-pages pages
+    images      one EML carrying --images generated PNG attachments (OCR)
+
+For each scenario the report has throughput, p50/p95/p99 per pipeline stage
+(from the request traces) and the process's peak RSS so far, as JSON.
+
+Usage:
+    python -m benchmarks.pipeline_benchmark --output bench.json
+    python -m benchmarks.pipeline_benchmark --scenarios cache --cache-sizes 1000 10000 100000
+    python -m benchmarks.pipeline_benchmark --baseline bench-main.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+from email.message import EmailMessage
+from email.utils import format_datetime, make_msgid
+from typing import Any, Dict, List, Optional
+
+from benchmarks.logging_overhead import build_cache
+from benchmarks.stubs import StubChatModel, StubLLMHandler, install_in_memory_mongo
+
+SCENARIOS = ("corpus", "cache", "large_pdf", "images")
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "test")
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of `values` (q in 0-100)"""
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_corpus(path: str) -> Dict[str, List[tuple]]:
+    """Read the sample .eml and .pdf files as (filename, bytes)"""
+    corpus = {"eml": [], "pdf": []}
+    for name in sorted(os.listdir(path)):
+        extension = os.path.splitext(name)[1].lower().lstrip(".")
+        if extension in corpus:
+            with open(os.path.join(path, name), "rb") as f:
+                corpus[extension].append((name, f.read()))
+    return corpus
+
+
+def build_large_pdf(pdfs: List[tuple], pages: int) -> bytes:
+    """Concatenate pages of the corpus PDFs, cycling through them, up to `pages` pages"""
+    import pypdf
+
+    readers = [pypdf.PdfReader(io.BytesIO(content)) for _, content in pdfs]
+    source_pages = [page for reader in readers for page in reader.pages]
+    writer = pypdf.PdfWriter()
+    for i in range(pages):
+        writer.add_page(source_pages[i % len(source_pages)])
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+def build_image_eml(images: int, seed: int = 0) -> bytes:
+    """Build an EML with `images` PNG attachments containing a line of text each"""
+    from PIL import Image, ImageDraw
+
+    message = EmailMessage()
+    message["From"] = "agent@lenderbank.com"
+    message["To"] = "loanops@bank.com"
+    message["Subject"] = f"Scanned remittance advices ({images} pages)"
+    message["Date"] = format_datetime(datetime.now())
+    message["Message-ID"] = make_msgid(idstring=f"bench-images-{seed}")
+    message.set_content("Please find attached the scanned remittance advices for today's inbound payments.")
+    for i in range(images):
+        image = Image.new("RGB", (800, 200), "white")
+        ImageDraw.Draw(image).text((20, 80), f"Remittance {i}: USD {1000 + i * 17:,}.00 value date 2025-03-14", fill="black")
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        message.add_attachment(buffer.getvalue(), maintype="image", subtype="png", filename=f"scan_{i}.png")
+    return message.as_bytes()
+
+
+def build_service(llm_latency_ms: float, llm_jitter_ms: float, embedding: str, max_attachment_size_mb: int):
+    """Build a ClassificationService wired to the stub LLM, in-memory Mongo and a fresh duplicate cache"""
+    from app.config import get_settings
+    from app.services.classification_service import ClassificationService
+    from app.services.data_extractor import DataExtractor
+    from app.services.email_processor import EmailProcessor
+    from app.services.IntelligentDuplicateDetector import (
+        IntelligentDuplicateDetector,
+        LRUCache,
+        MockEmbeddingProvider
+    )
+    from app.services.pre_classifier import MODE_OFF, PreClassifier
+
+    settings = get_settings()
+    llm_handler = StubLLMHandler(StubChatModel(latency_ms=llm_latency_ms, jitter_ms=llm_jitter_ms))
+    duplicate_detector = IntelligentDuplicateDetector(
+        cache_duration_days=settings.duplicate_cache_days,
+        cache_size=settings.duplicate_cache_size,
+        # None selects the configured model, as in the API
+        embedding_provider=MockEmbeddingProvider() if embedding == "mock" else None,
+        semantic_threshold=settings.semantic_threshold,
+        metadata_weight=settings.metadata_weight,
+        subject_weight=settings.subject_weight,
+        content_weight=settings.content_weight,
+        time_window_hours=settings.time_window_hours,
+        email_cache=LRUCache(capacity=settings.duplicate_cache_size, embedding_precision=settings.duplicate_embedding_precision)
+    )
+    return ClassificationService(
+        llm_handler=llm_handler,
+        email_processor=EmailProcessor(max_attachment_size_mb=max_attachment_size_mb),
+        duplicate_detector=duplicate_detector,
+        data_extractor=DataExtractor(llm_handler=llm_handler),
+        # The fast path trains in the background; keep it off so runs are comparable
+        pre_classifier=PreClassifier(mode=MODE_OFF),
+        attachment_concurrency=settings.attachment_parse_concurrency,
+        speculative_classification=settings.speculative_classification
+    )
+
+
+class ScenarioResult:
+    """Collects per-request traces for one scenario"""
+
+    def __init__(self, name: str, **parameters: Any):
+        self.name = name
+        self.parameters = parameters
+        self.stages: Dict[str, List[float]] = defaultdict(list)
+        self.requests = 0
+        self.errors = 0
+        self.duplicates = 0
+        self.wall_s = 0.0
+
+    def add(self, response) -> None:
+        self.requests += 1
+        self.errors += bool(response.error)
+        self.duplicates += bool(response.is_duplicate)
+        timings = response.timings or {}
+        self.stages["total"].append(timings.get("total_ms", response.processing_time_ms))
+        for s in timings.get("spans", []):
+            if s["duration_ms"] is not None:
+                self.stages[s["name"]].append(s["duration_ms"])
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "scenario": self.name,
+            **self.parameters,
+            "requests": self.requests,
+            "errors": self.errors,
+            "duplicates": self.duplicates,
+            "wall_s": round(self.wall_s, 3),
+            "throughput_rps": round(self.requests / self.wall_s, 3) if self.wall_s else None,
+            "stages": {
+                name: {
+                    "count": len(values),
+                    "mean_ms": round(sum(values) / len(values), 2),
+                    "p50_ms": round(percentile(values, 50), 2),
+                    "p95_ms": round(percentile(values, 95), 2),
+                    "p99_ms": round(percentile(values, 99), 2)
+                }
+                for name, values in sorted(self.stages.items())
+            },
+            "peak_rss_mb": peak_rss_mb()
+        }
+
+
+async def _run_requests(service, requests: List[Dict[str, Any]], result: ScenarioResult,
+                        concurrency: int, reset_cache_to: Optional[int] = None) -> None:
+    """
+    Run requests with at most `concurrency` in flight
+
+    Args:
+        reset_cache_to: If set, trim entries added by each request so the duplicate
+            cache stays at this size
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    cache = service.duplicate_detector.email_cache
+
+    async def run_one(request: Dict[str, Any]) -> None:
+        async with semaphore:
+            if request["kind"] == "eml":
+                response = await service.process_eml(request["content"], include_timings=True)
+            else:
+                response = await service.process_email_chain(
+                    request["content"], request["filename"], "application/pdf", [], include_timings=True
+                )
+            result.add(response)
+            if reset_cache_to is not None:
+                while len(cache) > reset_cache_to:
+                    cache.popitem(last=True)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_one(r) for r in requests))
+    result.wall_s += time.perf_counter() - start
+
+
+async def run_corpus(service, corpus, iterations: int, concurrency: int) -> ScenarioResult:
+    result = ScenarioResult("corpus", files=len(corpus["eml"]) + len(corpus["pdf"]), iterations=iterations,
+                            concurrency=concurrency)
+    requests = [{"kind": "eml", "filename": n, "content": c} for n, c in corpus["eml"]]
+    requests += [{"kind": "pdf", "filename": n, "content": c} for n, c in corpus["pdf"]]
+    for _ in range(iterations):
+        # Each pass starts from an empty cache so later passes are not served as duplicates
+        service.duplicate_detector.email_cache.clear()
+        await _run_requests(service, requests, result, concurrency)
+    return result
+
+
+async def run_cache(service, corpus, cache_size: int, iterations: int, embedding_dim: int) -> ScenarioResult:
+    result = ScenarioResult("cache", cache_entries=cache_size, iterations=iterations)
+    service.duplicate_detector.email_cache = build_cache(cache_size, dim=embedding_dim, capacity=cache_size + 1000)
+    requests = [{"kind": "eml", "filename": n, "content": c} for n, c in corpus["eml"]]
+    for _ in range(iterations):
+        await _run_requests(service, requests, result, 1, reset_cache_to=cache_size)
+    return result
+
+
+async def run_large_pdf(service, corpus, pages: int, iterations: int) -> ScenarioResult:
+    result = ScenarioResult("large_pdf", pages=pages, iterations=iterations)
+    content = build_large_pdf(corpus["pdf"], pages)
+    result.parameters["size_mb"] = round(len(content) / (1024 * 1024), 2)
+    for _ in range(iterations):
+        service.duplicate_detector.email_cache.clear()
+        await _run_requests(service, [{"kind": "pdf", "filename": "large_chain.pdf", "content": content}], result, 1)
+    return result
+
+
+async def run_images(service, images: int, iterations: int) -> ScenarioResult:
+    result = ScenarioResult("images", images=images, iterations=iterations)
+    content = build_image_eml(images)
+    result.parameters["size_mb"] = round(len(content) / (1024 * 1024), 2)
+    for _ in range(iterations):
+        service.duplicate_detector.email_cache.clear()
+        await _run_requests(service, [{"kind": "eml", "filename": "images.eml", "content": content}], result, 1)
+    return result
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+    """Annotate each scenario with throughput and p95 ratios against a matching baseline scenario"""
+    def key(s):
+        return s["scenario"], s.get("cache_entries"), s.get("pages"), s.get("images")
+
+    previous = {key(s): s for s in baseline.get("scenarios", [])}
+    for scenario in report["scenarios"]:
+        before = previous.get(key(scenario))
+        if not before:
+            continue
+        scenario["vs_baseline"] = {
+            "commit": baseline.get("commit"),
+            "throughput_ratio": round(scenario["throughput_rps"] / before["throughput_rps"], 3)
+            if scenario["throughput_rps"] and before.get("throughput_rps") else None,
+            "p95_ratio": {
+                stage: round(stats["p95_ms"] / before["stages"][stage]["p95_ms"], 3)
+                for stage, stats in scenario["stages"].items()
+                if before["stages"].get(stage, {}).get("p95_ms")
+            }
+        }
+
+
+async def run(args) -> Dict[str, Any]:
+    install_in_memory_mongo()
+    service = build_service(args.llm_latency_ms, args.llm_jitter_ms, args.embedding, args.max_attachment_mb)
+    corpus = load_corpus(args.corpus)
+    embedding_dim = len(service.duplicate_detector.embedding_provider.get_embedding("dimension probe"))
+
+    report = {
+        "commit": git_commit(),
+        "started_at": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "llm_latency_ms": args.llm_latency_ms,
+            "llm_jitter_ms": args.llm_jitter_ms,
+            "embedding": args.embedding
+        },
+        "scenarios": []
+    }
+
+    for scenario in args.scenarios:
+        logger.info("Running scenario %s", scenario)
+        if scenario == "corpus":
+            results = [await run_corpus(service, corpus, args.iterations, args.concurrency)]
+        elif scenario == "cache":
+            results = [await run_cache(service, corpus, n, args.iterations, embedding_dim) for n in args.cache_sizes]
+            service.duplicate_detector.email_cache = build_cache(0, dim=embedding_dim)
+        elif scenario == "large_pdf":
+            results = [await run_large_pdf(service, corpus, args.pdf_pages, args.iterations)]
+        else:
+            results = [await run_images(service, args.images, args.iterations)]
+        report["scenarios"].extend(r.to_dict() for r in results)
+
+    from app.services.analytics_sink import analytics_sink
+    await analytics_sink.stop()
+
+    report["llm_calls"] = service.llm_handler.stub.calls
+    report["peak_rss_mb"] = peak_rss_mb()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="Directory of sample .eml/.pdf files")
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=1, help="Requests in flight in the corpus scenario")
+    parser.add_argument("--cache-sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--pdf-pages", type=int, default=200)
+    parser.add_argument("--images", type=int, default=20)
+    parser.add_argument("--llm-latency-ms", type=float, default=200.0)
+    parser.add_argument("--llm-jitter-ms", type=float, default=0.0)
+    parser.add_argument("--embedding", choices=("mock", "model"), default="mock",
+                        help="mock: MockEmbeddingProvider; model: the configured sentence-transformers model")
+    parser.add_argument("--max-attachment-mb", type=int, default=100)
+    parser.add_argument("--baseline", help="Earlier report to compare against")
+    parser.add_argument("--output", help="Write the JSON report to this file as well as stdout")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=getattr(logging, args.log_level.upper()))
+    report = asyncio.run(run(args))
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(report, json.load(f))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Local OpenAI-compatible stub LLM server for exercising LLM routing, hedging and
+circuit breakers without calling a real provider.
+
+Point an llm-config.json entry at it with "base_url": "http://127.0.0.1:9001/v1".
+
+Usage:
+    python -m benchmarks.stub_llm_server --port 9001 --latency-ms 800 --jitter-ms 400 --failure-rate 0.1
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+DEFAULT_CLASSIFICATION = [
+    {
+        "request_type": "Money Movement-Inbound",
+        "sub_request_type": "Principal",
+        "confidence": 0.9,
+        "reasoning": "Stub response",
+        "is_primary": True
+    }
+]
+
+
+def create_app(latency_ms: float = 0.0,
+               jitter_ms: float = 0.0,
+               failure_rate: float = 0.0,
+               response_text: str = None,
+               seed: int = 0) -> FastAPI:
+    """
+    Build a stub app that answers /v1/chat/completions after a configurable delay
+    """
+    app = FastAPI(title="Stub LLM")
+    rng = random.Random(seed)
+    content = response_text or json.dumps(DEFAULT_CLASSIFICATION)
+    stats = {"requests": 0, "failures": 0}
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+
+        await asyncio.sleep(max(0.0, latency_ms + rng.uniform(-jitter_ms, jitter_ms)) / 1000)
+
+        if rng.random() < failure_rate:
+            stats["failures"] += 1
+            raise HTTPException(status_code=503, detail="Stub failure")
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        model = body.get("model", "stub")
+
+        if body.get("stream"):
+            async def event_stream():
+                # Stream in small chunks so incremental parsers see partial JSON
+                for i in range(0, len(content), 16):
+                    chunk = {
+                        "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                        "choices": [{"index": 0, "delta": {"content": content[i:i + 16]}, "finish_reason": None}]
+                    }
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                done = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+                }
+                yield f"data: {json.dumps(done)}\n\n"
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        }
+
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local OpenAI-compatible stub LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--latency-ms", type=float, default=500.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--response-file", help="File whose contents are returned as the completion")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    response_text = open(args.response_file).read() if args.response_file else None
+    uvicorn.run(
+        create_app(args.latency_ms, args.jitter_ms, args.failure_rate, response_text, args.seed),
+        host=args.host,
+        port=args.port
+    )
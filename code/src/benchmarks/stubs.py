@@ -0,0 +1,459 @@
+"""
+In-process stand-ins for the LLM providers and MongoDB, so the classification
+pipeline can be benchmarked deterministically without network access.
+
+`StubChatModel` answers classification and extraction prompts with JSON derived
+from a hash of the prompt after a configurable delay. `InMemoryCollection`
+implements the subset of the motor collection API the pipeline uses, and
+`install_in_memory_mongo` swaps it in for the module-level collections.
+"""
+import asyncio
+import copy
+import hashlib
+import json
+import re
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from bson import ObjectId
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pymongo import ReturnDocument
+
+from app.core.api_manager import ApiManager
+from app.core.llm_handler import LLMHandler
+
+# Synthetic catalog seeded into the in-memory request_types collection
+REQUEST_TYPES = [
+    {
+        "name": "Money Movement-Inbound",
+        "definition": "Incoming payments and fund transfers to the bank",
+        "support_group": "Payments Operations",
+        "sub_request_types": [
+            {"name": "Principal", "definition": "Principal repayment", "required_attributes": ["amount", "value_date", "deal_name"]},
+            {"name": "Interest", "definition": "Interest payment", "required_attributes": ["amount", "value_date", "interest_rate"]},
+            {"name": "Fees", "definition": "Fee payment", "required_attributes": ["amount", "fee_type"]}
+        ]
+    },
+    {
+        "name": "Money Movement-Outbound",
+        "definition": "Outgoing payments and wires",
+        "support_group": "Payments Operations",
+        "sub_request_types": [
+            {"name": "Timebound", "definition": "Payment due on a date", "required_attributes": ["amount", "value_date", "account_number"]},
+            {"name": "Foreign Currency", "definition": "Cross-currency payment", "required_attributes": ["amount", "currency", "account_number"]}
+        ]
+    },
+    {
+        "name": "Adjustment",
+        "definition": "Changes to loan terms or balances",
+        "support_group": "Loan Servicing",
+        "sub_request_types": [
+            {"name": "Reallocation Fees", "definition": "Fee reallocation", "required_attributes": ["amount", "deal_name"]},
+            {"name": "Amendment Fees", "definition": "Amendment fee", "required_attributes": ["amount", "effective_date"]}
+        ]
+    },
+    {
+        "name": "Commitment Change",
+        "definition": "Changes to a facility commitment",
+        "support_group": "Loan Servicing",
+        "sub_request_types": [
+            {"name": "Cashless Roll", "definition": "Roll over without cash movement", "required_attributes": ["deal_name", "effective_date"]},
+            {"name": "Decrease", "definition": "Commitment decrease", "required_attributes": ["amount", "effective_date", "deal_name"]},
+            {"name": "Increase", "definition": "Commitment increase", "required_attributes": ["amount", "effective_date", "deal_name"]}
+        ]
+    }
+]
+
+FIELD_VALUES = {
+    "amount": 25000.0,
+    "value_date": "2025-03-14",
+    "effective_date": "2025-04-01",
+    "deal_name": "ABC Term Loan",
+    "interest_rate": 5.25,
+    "fee_type": "Amendment",
+    "account_number": "123456789",
+    "currency": "USD"
+}
+
+_FIELDS_TO_EXTRACT = re.compile(r"FIELDS TO EXTRACT:\s*(\[.*?\])", re.DOTALL)
+
+
+def _prompt_digest(messages: List[BaseMessage]) -> int:
+    text = "\n".join(str(m.content) for m in messages)
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+
+
+class StubChatModel(BaseChatModel):
+    """
+    Deterministic chat model for benchmarks.
+
+    Classification prompts get the request type selected by the prompt's hash;
+    extraction prompts get a value for every field listed under FIELDS TO EXTRACT.
+    Each call waits `latency_ms` plus a jitter in [-jitter_ms, jitter_ms] that is
+    also derived from the prompt hash, so repeated runs see the same delays.
+    """
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    chunk_size: int = 16
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def _respond(self, messages: List[BaseMessage]) -> str:
+        digest = _prompt_digest(messages)
+        system = str(messages[0].content) if messages else ""
+        match = _FIELDS_TO_EXTRACT.search(system)
+        if match:
+            fields = json.loads(match.group(1))
+            return json.dumps([
+                {
+                    "field_name": name,
+                    "value": FIELD_VALUES.get(name, f"{name}-{digest % 1000}"),
+                    "confidence": 0.9,
+                    "source": "email_body"
+                } for name in fields
+            ])
+
+        request_type = REQUEST_TYPES[digest % len(REQUEST_TYPES)]
+        sub_types = request_type["sub_request_types"]
+        sub_type = sub_types[(digest // len(REQUEST_TYPES)) % len(sub_types)]
+        return json.dumps([{
+            "request_type": request_type["name"],
+            "sub_request_type": sub_type["name"],
+            "confidence": 0.8 + (digest % 20) / 100,
+            "reasoning": "Stub classification",
+            "is_primary": True
+        }])
+
+    def _delay_s(self, messages: List[BaseMessage]) -> float:
+        jitter = ((_prompt_digest(messages) % 2001) / 1000 - 1) * self.jitter_ms
+        return max(0.0, self.latency_ms + jitter) / 1000
+
+    def _result(self, content: str) -> ChatResult:
+        message = AIMessage(
+            content=content,
+            usage_metadata={"input_tokens": 0, "output_tokens": len(content) // 4, "total_tokens": len(content) // 4}
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        self.calls += 1
+        time.sleep(self._delay_s(messages))
+        return self._result(self._respond(messages))
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager=None, **kwargs: Any) -> ChatResult:
+        self.calls += 1
+        await asyncio.sleep(self._delay_s(messages))
+        return self._result(self._respond(messages))
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        result = self._generate(messages, stop, run_manager, **kwargs)
+        yield ChatGenerationChunk(message=AIMessageChunk(content=result.generations[0].message.content))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        # The delay is time to first chunk; the rest streams without waiting
+        self.calls += 1
+        await asyncio.sleep(self._delay_s(messages))
+        content = self._respond(messages)
+        for i in range(0, len(content), self.chunk_size):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=content[i:i + self.chunk_size]))
+
+
+class StubLLMHandler(LLMHandler):
+    """LLMHandler whose configuration entries all resolve to one StubChatModel"""
+
+    def __init__(self, stub: StubChatModel, config_filename: str = "llm-config.json"):
+        super().__init__(api_manager=ApiManager(), config_filename=config_filename)
+        self.stub = stub
+
+    def _build_llm(self, config: Dict[str, Any]):
+        return self.stub
+
+
+class _InsertOneResult:
+    def __init__(self, inserted_id):
+        self.inserted_id = inserted_id
+
+
+class _InsertManyResult:
+    def __init__(self, inserted_ids):
+        self.inserted_ids = inserted_ids
+
+
+class _UpdateResult:
+    def __init__(self, matched_count: int, modified_count: int, upserted_id=None):
+        self.matched_count = matched_count
+        self.modified_count = modified_count
+        self.upserted_id = upserted_id
+
+
+class _DeleteResult:
+    def __init__(self, deleted_count: int):
+        self.deleted_count = deleted_count
+
+
+def _get_path(doc: Dict[str, Any], path: str) -> Any:
+    value: Any = doc
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def _matches(doc: Dict[str, Any], query: Optional[Dict[str, Any]]) -> bool:
+    for key, condition in (query or {}).items():
+        if key == "$or":
+            if not any(_matches(doc, sub) for sub in condition):
+                return False
+            continue
+        if key == "$and":
+            if not all(_matches(doc, sub) for sub in condition):
+                return False
+            continue
+        value = _get_path(doc, key)
+        if isinstance(condition, dict) and any(k.startswith("$") for k in condition):
+            for op, operand in condition.items():
+                if op == "$exists":
+                    if (value is not None) != bool(operand):
+                        return False
+                elif op == "$in":
+                    if value not in operand:
+                        return False
+                elif op == "$ne":
+                    if value == operand:
+                        return False
+                elif value is None:
+                    return False
+                elif op == "$lt" and not value < operand:
+                    return False
+                elif op == "$lte" and not value <= operand:
+                    return False
+                elif op == "$gt" and not value > operand:
+                    return False
+                elif op == "$gte" and not value >= operand:
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+
+def _project(doc: Dict[str, Any], projection: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if not projection:
+        return copy.deepcopy(doc)
+    included = {k for k, v in projection.items() if v}
+    if included:
+        keys = included | ({"_id"} if projection.get("_id", 1) else set())
+        return {k: copy.deepcopy(v) for k, v in doc.items() if k in keys}
+    return {k: copy.deepcopy(v) for k, v in doc.items() if k not in projection}
+
+
+def _apply_update(doc: Dict[str, Any], update: Dict[str, Any]) -> None:
+    for key, value in update.get("$set", {}).items():
+        *parents, last = key.split(".")
+        target = doc
+        for part in parents:
+            target = target.setdefault(part, {})
+        target[last] = copy.deepcopy(value)
+    for key, value in update.get("$setOnInsert", {}).items():
+        doc.setdefault(key, copy.deepcopy(value))
+    for key, value in update.get("$inc", {}).items():
+        *parents, last = key.split(".")
+        target = doc
+        for part in parents:
+            target = target.setdefault(part, {})
+        target[last] = target.get(last, 0) + value
+    for key, value in update.get("$push", {}).items():
+        if isinstance(value, dict) and "$each" in value:
+            doc.setdefault(key, []).extend(copy.deepcopy(value["$each"]))
+            if "$slice" in value:
+                doc[key] = doc[key][value["$slice"]:] if value["$slice"] < 0 else doc[key][:value["$slice"]]
+        else:
+            doc.setdefault(key, []).append(copy.deepcopy(value))
+    for key in update.get("$unset", {}):
+        doc.pop(key, None)
+
+
+class InMemoryCursor:
+    """Cursor over a snapshot of matching documents (sort, skip, limit, to_list, async iteration)"""
+
+    def __init__(self, docs: List[Dict[str, Any]]):
+        self._docs = docs
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key, direction: int = 1) -> "InMemoryCursor":
+        keys = [(key, direction)] if isinstance(key, str) else list(key)
+        for field_name, field_direction in reversed(keys):
+            self._docs.sort(
+                key=lambda d: (_get_path(d, field_name) is not None, _get_path(d, field_name)),
+                reverse=field_direction < 0
+            )
+        return self
+
+    def skip(self, n: int) -> "InMemoryCursor":
+        self._skip = n
+        return self
+
+    def limit(self, n: int) -> "InMemoryCursor":
+        self._limit = n
+        return self
+
+    def _results(self) -> List[Dict[str, Any]]:
+        docs = self._docs[self._skip:]
+        return docs[:self._limit] if self._limit else docs
+
+    async def to_list(self, length: Optional[int] = None) -> List[Dict[str, Any]]:
+        docs = self._results()
+        return docs[:length] if length else docs
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self._results():
+            yield doc
+
+
+class InMemoryCollection:
+    """
+    Dict-backed stand-in for a motor collection.
+
+    Supports equality, $or/$and and the common comparison operators in queries,
+    $set/$setOnInsert/$inc/$push/$unset in updates (also as UpdateOne in
+    bulk_write), and accepts (and ignores) index creation. Change streams are
+    not supported, so `watch` raises like a standalone server does.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.docs: Dict[Any, Dict[str, Any]] = {}
+        self.indexes: List[Any] = []
+
+    def _matching(self, query: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return [doc for doc in self.docs.values() if _matches(doc, query)]
+
+    async def insert_one(self, document: Dict[str, Any]) -> _InsertOneResult:
+        document.setdefault("_id", ObjectId())
+        self.docs[document["_id"]] = copy.deepcopy(document)
+        return _InsertOneResult(document["_id"])
+
+    async def insert_many(self, documents: List[Dict[str, Any]], ordered: bool = True) -> _InsertManyResult:
+        ids = [(await self.insert_one(document)).inserted_id for document in documents]
+        return _InsertManyResult(ids)
+
+    def find(self, query: Optional[Dict[str, Any]] = None, projection: Optional[Dict[str, Any]] = None) -> InMemoryCursor:
+        return InMemoryCursor([_project(doc, projection) for doc in self._matching(query)])
+
+    async def find_one(self, query: Optional[Dict[str, Any]] = None,
+                       projection: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        matching = self._matching(query)
+        return _project(matching[0], projection) if matching else None
+
+    async def find_one_and_update(self, query: Dict[str, Any], update: Dict[str, Any],
+                                  projection: Optional[Dict[str, Any]] = None, sort=None, upsert: bool = False,
+                                  return_document: bool = ReturnDocument.BEFORE) -> Optional[Dict[str, Any]]:
+        cursor = InMemoryCursor(self._matching(query))
+        if sort:
+            cursor.sort(sort)
+        matching = await cursor.to_list()
+        if not matching:
+            if not upsert:
+                return None
+            doc = {k: v for k, v in query.items() if not k.startswith("$")}
+            _apply_update(doc, update)
+            await self.insert_one(doc)
+            return _project(self.docs[doc["_id"]], projection) if return_document == ReturnDocument.AFTER else None
+        doc = matching[0]
+        before = _project(doc, projection)
+        _apply_update(doc, {k: v for k, v in update.items() if k != "$setOnInsert"})
+        return _project(doc, projection) if return_document == ReturnDocument.AFTER else before
+
+    async def update_one(self, query: Dict[str, Any], update: Dict[str, Any], upsert: bool = False) -> _UpdateResult:
+        matching = self._matching(query)
+        if matching:
+            _apply_update(matching[0], {k: v for k, v in update.items() if k != "$setOnInsert"})
+            return _UpdateResult(1, 1)
+        if upsert:
+            doc = {k: v for k, v in query.items() if not k.startswith("$")}
+            _apply_update(doc, update)
+            result = await self.insert_one(doc)
+            return _UpdateResult(0, 0, result.inserted_id)
+        return _UpdateResult(0, 0)
+
+    async def update_many(self, query: Dict[str, Any], update: Dict[str, Any]) -> _UpdateResult:
+        matching = self._matching(query)
+        for doc in matching:
+            _apply_update(doc, update)
+        return _UpdateResult(len(matching), len(matching))
+
+    async def delete_one(self, query: Dict[str, Any]) -> _DeleteResult:
+        matching = self._matching(query)
+        if matching:
+            del self.docs[matching[0]["_id"]]
+        return _DeleteResult(len(matching[:1]))
+
+    async def delete_many(self, query: Dict[str, Any]) -> _DeleteResult:
+        matching = self._matching(query)
+        for doc in matching:
+            del self.docs[doc["_id"]]
+        return _DeleteResult(len(matching))
+
+    async def bulk_write(self, requests: List[Any], ordered: bool = True) -> None:
+        for request in requests:
+            # pymongo's UpdateOne keeps its arguments in private attributes
+            await self.update_one(request._filter, request._doc, upsert=request._upsert)
+
+    async def count_documents(self, query: Optional[Dict[str, Any]] = None) -> int:
+        return len(self._matching(query))
+
+    async def create_index(self, keys, **kwargs) -> str:
+        self.indexes.append((keys, kwargs))
+        return str(keys)
+
+    def aggregate(self, pipeline: List[Dict[str, Any]]):
+        raise NotImplementedError("InMemoryCollection does not support aggregation pipelines")
+
+    def watch(self, *args, **kwargs):
+        raise RuntimeError("Change streams are not supported by InMemoryCollection")
+
+
+def install_in_memory_mongo(request_types: Optional[List[Dict[str, Any]]] = None) -> Dict[str, InMemoryCollection]:
+    """
+    Replace the pipeline's module-level MongoDB collections with in-memory ones
+
+    Args:
+        request_types: Catalog to seed (defaults to REQUEST_TYPES)
+
+    Returns:
+        The in-memory collections by name
+    """
+    from app.services import classification_service, pre_classifier, request_type_catalog
+
+    collections = {
+        name: InMemoryCollection(name)
+        for name in ("analytics", "duplicate_analytics", "fast_path_training", "request_types", "config_versions")
+    }
+    for request_type in copy.deepcopy(request_types or REQUEST_TYPES):
+        request_type["_id"] = ObjectId()
+        for sub_type in request_type.get("sub_request_types", []):
+            sub_type.setdefault("_id", str(ObjectId()))
+        collections["request_types"].docs[request_type["_id"]] = request_type
+
+    classification_service.analytics_collection = collections["analytics"]
+    classification_service.duplicate_analytics_collection = collections["duplicate_analytics"]
+    classification_service.fast_path_training_collection = collections["fast_path_training"]
+    pre_classifier.fast_path_training_collection = collections["fast_path_training"]
+    request_type_catalog.request_type_collection = collections["request_types"]
+    request_type_catalog.config_versions_collection = collections["config_versions"]
+    # Drop any snapshot loaded from the real database
+    request_type_catalog.request_type_catalog._snapshot = None
+    return collections
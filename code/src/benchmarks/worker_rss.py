@@ -0,0 +1,166 @@
+"""
+Memory per API worker for each way of sharing the models between workers.
+
+For each --modes entry, starts `python -m app.main --workers N` with that
+`model_sharing` mode on a free port, waits until /health/ready passes (the
+warm-up has run) plus --settle seconds, and reads /proc/<pid>/smaps_rollup for
+the master, the workers and the model sidecar. RSS counts shared pages in every
+process that maps them, so the report also has PSS (shared pages split between
+the processes sharing them; the sum is the real footprint) and private memory
+(pages only that process holds).
+
+Modes:
+    none      every worker loads its own models
+    prefork   models loaded in the master before forking (copy-on-write, gc.freeze)
+    sidecar   one model sidecar process serving all workers over a Unix socket
+
+Linux only (reads /proc). The API's startup needs MongoDB to reach readiness;
+without it the report is taken after --timeout and marked "ready": false.
+
+Usage:
+    python -m benchmarks.worker_rss --workers 4
+    python -m benchmarks.worker_rss --workers 2 8 --modes none prefork --output rss.json
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from typing import Any, Dict, List
+
+MODES = ("none", "prefork", "sidecar")
+SMAPS_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty")
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def memory_mb(pid: int) -> Dict[str, float]:
+    """RSS, PSS, shared and private memory of a process from smaps_rollup, in MB"""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            name, _, rest = line.partition(":")
+            if name in SMAPS_FIELDS:
+                values[name] = int(rest.split()[0]) / 1024
+    return {
+        "rss_mb": round(values.get("Rss", 0.0), 1),
+        "pss_mb": round(values.get("Pss", 0.0), 1),
+        "shared_mb": round(values.get("Shared_Clean", 0.0) + values.get("Shared_Dirty", 0.0), 1),
+        "private_mb": round(values.get("Private_Clean", 0.0) + values.get("Private_Dirty", 0.0), 1)
+    }
+
+
+def process_tree(pid: int) -> List[int]:
+    """A process and all its descendants"""
+    pids = [pid]
+    try:
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/children") as f:
+                for child in f.read().split():
+                    pids.extend(process_tree(int(child)))
+    except FileNotFoundError:
+        pass
+    return pids
+
+
+def _role(pid: int, root: int) -> str:
+    if pid == root:
+        return "master"
+    with open(f"/proc/{pid}/cmdline", "rb") as f:
+        cmdline = f.read().replace(b"\0", b" ").decode(errors="replace")
+    return "sidecar" if "model_sidecar" in cmdline else "worker"
+
+
+def _wait_ready(port: int, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/health/ready", timeout=2) as response:
+                if response.status == 200:
+                    return True
+        except OSError:
+            pass
+        time.sleep(0.5)
+    return False
+
+
+def measure(mode: str, workers: int, timeout: float, settle: float) -> Dict[str, Any]:
+    port = _free_port()
+    env = dict(os.environ)
+    # Settings are case-sensitive and read from the field names
+    env.update({
+        "port": str(port),
+        "workers": str(workers),
+        "model_sharing": mode,
+        "model_sidecar_socket": f"/tmp/email-models-{port}.sock"
+    })
+    started = time.monotonic()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "app.main", "--workers", str(workers)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        ready = _wait_ready(port, timeout)
+        startup_s = round(time.monotonic() - started, 1)
+        time.sleep(settle)
+        processes = []
+        for pid in process_tree(server.pid):
+            try:
+                processes.append({"pid": pid, "role": _role(pid, server.pid), **memory_mb(pid)})
+            except (FileNotFoundError, ProcessLookupError):
+                continue
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+
+    worker_rows = [p for p in processes if p["role"] == "worker"]
+    return {
+        "mode": mode,
+        "workers": workers,
+        "ready": ready,
+        "startup_s": startup_s,
+        "total_rss_mb": round(sum(p["rss_mb"] for p in processes), 1),
+        # Sum of PSS: what the whole deployment actually occupies
+        "total_pss_mb": round(sum(p["pss_mb"] for p in processes), 1),
+        "mean_worker_rss_mb": round(sum(p["rss_mb"] for p in worker_rows) / len(worker_rows), 1) if worker_rows else None,
+        "mean_worker_private_mb": round(sum(p["private_mb"] for p in worker_rows) / len(worker_rows), 1) if worker_rows else None,
+        "processes": processes
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[4], help="Worker counts to measure")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--timeout", type=float, default=300.0, help="Seconds to wait for /health/ready")
+    parser.add_argument("--settle", type=float, default=5.0, help="Seconds to wait after readiness before measuring")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = {
+        "python": sys.version.split()[0],
+        "results": [
+            measure(mode, workers, args.timeout, args.settle)
+            for workers in args.workers for mode in args.modes
+        ]
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -43,6 +43,35 @@ const chartConfig = {
   },
 } satisfies ChartConfig;
 
+// Days of the timeline charts, and of raw records listed under Recent Requests
+const TIMELINE_DAYS = 30;
+const RECENT_DAYS = 7;
+const RECENT_LIMIT = 100;
+
+interface GroupSummary {
+  request_type?: string;
+  support_group?: string;
+  count: number;
+  average_confidence: number;
+}
+
+interface AnalyticsSummary {
+  count: number;
+  by_request_type: GroupSummary[];
+  by_support_group: GroupSummary[];
+  timeline: Array<{
+    bucket: string;
+    count: number;
+    average_confidence: number;
+    duplicates: number;
+    average_duplicate_confidence: number;
+  }>;
+}
+
+// Day buckets are "YYYY-MM-DD" in the server's local time
+const bucketDate = (bucket: string) =>
+  new Date(`${bucket}T00:00:00`).toLocaleDateString();
+
 const Dashboard = () => {
   interface RequestData {
     request_type: string;
@@ -87,84 +116,84 @@ const Dashboard = () => {
   useEffect(() => {
     const fetchData = async () => {
       try {
-        const response = await axios.get(backend_uri + "/analytics");
-        const dupeResponse = await axios.get(
-          backend_uri + "/duplicate-analytics"
-        );
-        if (Array.isArray(dupeResponse.data)) {
-          setDuplicateConfidenceData(dupeResponse.data);
-          const dupeRequestsPerDay = Object.entries(
-            dupeResponse.data.reduce((acc, { timestamp }) => {
-              const date = new Date(timestamp).toLocaleDateString();
-              acc[date] = (acc[date] || 0) + 1;
-              return acc;
-            }, {} as Record<string, number>)
-          ).map(([date, count]) => ({ date, count: Number(count) }));
-          console.log(dupeRequestsPerDay);
-          setDupeRequestsPerDay(dupeRequestsPerDay);
-        } else {
-          console.error(
-            "Fetched duplicate data is not an array:",
-            dupeResponse.data
-          );
-        }
+        // Charts come from the pre-aggregated rollups, so their cost does not grow
+        // with the history; only the latest requests are fetched as raw records
+        const recentStart = new Date(
+          Date.now() - RECENT_DAYS * 24 * 60 * 60 * 1000
+        ).toISOString();
+        const [summaryResponse, recentResponse] = await Promise.all([
+          axios.get<AnalyticsSummary>(backend_uri + "/analytics/summary", {
+            params: { period: "day", buckets: TIMELINE_DAYS },
+          }),
+          axios.get<RequestData[]>(backend_uri + "/analytics", {
+            params: { start: recentStart, limit: RECENT_LIMIT },
+          }),
+        ]);
+        const summary = summaryResponse.data;
 
-        if (Array.isArray(response.data)) {
-          setData(response.data);
+        setTotalRequests(summary.count);
 
-          // Calculate total requests
-          setTotalRequests(response.data.length);
+        // Request type and support group counts
+        const requestTypeCount = summary.by_request_type.map((group) => ({
+          name: group.request_type ?? "",
+          value: group.count,
+        }));
+        setRequestTypeCount(requestTypeCount);
 
-          // Calculate request type count
-          const requestTypeCount = Object.entries(
-            response.data.reduce((acc, { request_type }) => {
-              acc[request_type] = (acc[request_type] || 0) + 1;
-              return acc;
-            }, {} as Record<string, number>)
-          ).map(([name, value]) => ({ name, value: value as number }));
-          setRequestTypeCount(requestTypeCount);
+        // Calculate request type chart config
+        const requestTypeChartConfig = requestTypeCount.reduce(
+          (acc, { name }, index) => {
+            acc[name] = {
+              label: name,
+              color: `hsl(var(--chart-${(index % 5) + 1}))`,
+            };
+            return acc;
+          },
+          {} as ChartConfig
+        );
+        setRequestTypeChartConfig(requestTypeChartConfig);
 
-          // Calculate request type chart config
-          const requestTypeChartConfig = requestTypeCount.reduce(
-            (acc, { name }, index) => {
-              acc[name] = {
-                label: name,
-                color: `hsl(var(--chart-${(index % 5) + 1}))`,
-              };
-              return acc;
-            },
-            {} as ChartConfig
-          );
-          setRequestTypeChartConfig(requestTypeChartConfig);
+        setSupportGroupCount(
+          summary.by_support_group.map((group) => ({
+            name: group.support_group ?? "",
+            value: group.count,
+          }))
+        );
 
-          // Calculate support group count
-          const supportGroupCount = Object.entries(
-            response.data.reduce((acc, { support_group }) => {
-              acc[support_group] = (acc[support_group] || 0) + 1;
-              return acc;
-            }, {} as Record<string, number>)
-          ).map(([name, value]) => ({ name, value: value as number }));
-          setSupportGroupCount(supportGroupCount);
+        // Per-day timeline: requests, average confidence and duplicates
+        setRequestsPerDay(
+          summary.timeline.map(({ bucket, count }) => ({
+            date: bucketDate(bucket),
+            count,
+          }))
+        );
+        setConfidenceData(
+          summary.timeline.map(({ bucket, average_confidence }) => ({
+            name: bucketDate(bucket),
+            confidence: average_confidence,
+          }))
+        );
+        setDupeRequestsPerDay(
+          summary.timeline.map(({ bucket, duplicates }) => ({
+            date: bucketDate(bucket),
+            count: duplicates,
+          }))
+        );
+        setDuplicateConfidenceData(
+          summary.timeline
+            .filter(({ duplicates }) => duplicates > 0)
+            .map(({ bucket, average_duplicate_confidence }) => ({
+              timestamp: bucketDate(bucket),
+              duplicate_confidence: average_duplicate_confidence,
+            }))
+        );
 
-          // Calculate confidence data
-          const confidenceData = response.data.map((req) => ({
-            name: req.request_type,
-            confidence: req.confidence,
-          }));
-          setConfidenceData(confidenceData);
-          // Calculate requests per day
-          const requestsPerDay = Object.entries(
-            response.data.reduce((acc, { timestamp }) => {
-              const date = new Date(timestamp).toLocaleDateString();
-              acc[date] = (acc[date] || 0) + 1;
-              return acc;
-            }, {} as Record<string, number>)
-          ).map(([date, count]) => ({ date, count: count as number }));
-          setRequestsPerDay(requestsPerDay);
-          setDataLoaded(true);
+        if (Array.isArray(recentResponse.data)) {
+          setData(recentResponse.data);
         } else {
-          console.error("Fetched data is not an array:", response.data);
+          console.error("Fetched data is not an array:", recentResponse.data);
         }
+        setDataLoaded(true);
       } catch (error) {
         console.error("Error fetching data:", error);
       }
@@ -331,7 +360,7 @@ const Dashboard = () => {
               >
                 <AreaChart data={confidenceData}>
                   <CartesianGrid vertical={false} />
-                  {/* <XAxis dataKey="name" /> */}
+                  <XAxis dataKey="name" tickLine={false} tickMargin={10} />
                   <YAxis dataKey="confidence" />
                   <ChartTooltip content={<ChartTooltipContent />} />
                   <Area
@@ -389,7 +418,7 @@ const Dashboard = () => {
               >
                 <AreaChart data={duplicateConfidenceData}>
                   <CartesianGrid vertical={false} />
-                  {/* <XAxis dataKey="timestamp" /> */}
+                  <XAxis dataKey="timestamp" tickLine={false} tickMargin={10} />
                   <YAxis dataKey="duplicate_confidence" />
                   <ChartTooltip content={<ChartTooltipContent />} />
                   <Area
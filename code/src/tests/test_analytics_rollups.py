@@ -0,0 +1,91 @@
+"""
+Backfill resumption and failed-increment retries of AnalyticsRollups, on in-memory collections
+"""
+import asyncio
+import time
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from app.services.analytics_rollups import BACKFILL_MARKER, AnalyticsRollups
+from benchmarks.stubs import InMemoryCollection
+
+
+class RollupCollection(InMemoryCollection):
+    """Rejects a second marker like the real unique _id, and fails the next `failures` bulk writes"""
+
+    def __init__(self, name: str = "analytics_rollups"):
+        super().__init__(name)
+        self.failures = 0
+
+    async def insert_one(self, document):
+        if document.get("_id") in self.docs:
+            raise DuplicateKeyError("duplicate marker")
+        return await super().insert_one(document)
+
+    async def bulk_write(self, requests, ordered=True):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("MongoDB unavailable")
+        await super().bulk_write(requests, ordered)
+
+
+def _analytics(n: int):
+    analytics = InMemoryCollection("analytics")
+    for i in range(n):
+        # Written an hour ago, before the rollups start
+        document = {"_id": ObjectId(f"{int(time.time()) - 3600 + i:08x}{0:016x}"), "timestamp": f"2026-01-01T10:00:{i:02d}", "request_type": "Loan",
+                    "sub_request_type": "Repayment", "support_group": "Loans", "confidence": 0.5,
+                    "extracted_fields": []}
+        analytics.docs[document["_id"]] = document
+    return analytics
+
+
+def _total(rollups: RollupCollection) -> int:
+    return next(d for d in rollups.docs.values() if d.get("kind") == "totals" and d.get("period") == "all")["count"]
+
+
+def test_failed_backfill_resumes_from_its_progress(monkeypatch):
+    monkeypatch.setattr("app.services.analytics_rollups.BACKFILL_BATCH_SIZE", 2)
+
+    async def run():
+        collection = RollupCollection()
+        analytics = _analytics(5)
+        first = AnalyticsRollups(collection, analytics, InMemoryCollection("duplicate_analytics"))
+        # The first batch is counted, then MongoDB fails for the rest of the run
+        original = first._apply
+        calls = 0
+
+        async def apply_then_fail(increments):
+            nonlocal calls
+            calls += 1
+            if calls > 1:
+                raise RuntimeError("MongoDB unavailable")
+            await original(increments)
+
+        first._apply = apply_then_fail
+        await first.start()
+        await first._backfill_task
+        assert "completed_at" not in collection.docs[BACKFILL_MARKER]
+
+        second = AnalyticsRollups(collection, analytics, InMemoryCollection("duplicate_analytics"))
+        await second.start()
+        await second._backfill_task
+        assert "completed_at" in collection.docs[BACKFILL_MARKER]
+        return _total(collection)
+
+    assert asyncio.run(run()) == 5
+
+
+def test_failed_increments_are_retried_with_the_next_batch():
+    async def run():
+        collection = RollupCollection()
+        analytics = _analytics(0)
+        rollups = AnalyticsRollups(collection, analytics, InMemoryCollection("duplicate_analytics"))
+        collection.failures = 1
+        documents = list(_analytics(3).docs.values())
+        await rollups.record("analytics", documents[:2])
+        await rollups.record("analytics", documents[2:])
+        return _total(collection), rollups._pending_documents
+
+    assert asyncio.run(run()) == (3, 0)
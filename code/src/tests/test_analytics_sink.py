@@ -0,0 +1,74 @@
+"""
+Failure handling of the buffered analytics writer against an in-memory collection
+"""
+import asyncio
+
+from app.services.analytics_sink import AnalyticsSink
+
+
+class FlakyCollection:
+    """Collection whose next `failures` writes raise, and whose writes hang while `hang` is set"""
+
+    def __init__(self, name: str = "analytics", failures: int = 0):
+        self.name = name
+        self.failures = failures
+        self.hang = False
+        self.documents = {}
+
+    async def insert_many(self, documents, ordered=False):
+        if self.hang:
+            await asyncio.sleep(60)
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("MongoDB unavailable")
+        for document in documents:
+            self.documents[document["_id"]] = document
+
+
+def test_spilled_documents_are_replayed(tmp_path):
+    async def run():
+        collection = FlakyCollection(failures=1)
+        sink = AnalyticsSink(batch_size=2, flush_seconds=0.05, spill_path=str(tmp_path / "spill.ndjson"),
+                             collections=[collection])
+        await sink.start()
+        for i in range(4):
+            await sink.submit(collection, {"i": i})
+        await asyncio.sleep(0.3)
+        await sink.stop()
+        return collection
+
+    collection = asyncio.run(run())
+    assert sorted(d["i"] for d in collection.documents.values()) == [0, 1, 2, 3]
+    assert not (tmp_path / "spill.ndjson").exists()
+
+
+def test_batch_is_kept_when_spilling_fails(tmp_path):
+    async def run():
+        collection = FlakyCollection(failures=1)
+        sink = AnalyticsSink(batch_size=2, flush_seconds=0.05, spill_path=str(tmp_path / "missing" / "spill.ndjson"),
+                             collections=[collection])
+        await sink.start()
+        for i in range(2):
+            await sink.submit(collection, {"i": i})
+        await asyncio.sleep(0.3)
+        alive = not sink._worker_task.done()
+        await sink.stop()
+        return collection, alive
+
+    collection, alive = asyncio.run(run())
+    assert alive
+    assert sorted(d["i"] for d in collection.documents.values()) == [0, 1]
+
+
+def test_flush_cut_off_by_stop_is_spilled(tmp_path):
+    async def run():
+        collection = FlakyCollection()
+        collection.hang = True
+        sink = AnalyticsSink(batch_size=1, spill_path=str(tmp_path / "spill.ndjson"), collections=[collection])
+        await sink.start()
+        await sink.submit(collection, {"i": 0})
+        await asyncio.sleep(0.05)
+        await sink.stop(timeout=0.2)
+
+    asyncio.run(run())
+    assert (tmp_path / "spill.ndjson").read_text().count("\n") == 1
@@ -0,0 +1,51 @@
+import io
+import zipfile
+
+import pytest
+
+from app.services.batch_service import KIND_EML, BatchLimitError, expand_uploads
+
+
+def _zip(members, compression=zipfile.ZIP_DEFLATED):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression=compression) as archive:
+        for name, content in members:
+            archive.writestr(name, content)
+    return buffer.getvalue()
+
+
+def test_zip_members_are_expanded():
+    archive = _zip([("a.eml", b"Subject: a\n\nbody"), ("b.eml", b"Subject: b\n\nbody"), ("__MACOSX/a.eml", b"x")])
+
+    items = expand_uploads([("mail.zip", "application/zip", archive)])
+
+    assert [item.filename for item in items] == ["a.eml", "b.eml"]
+    assert all(item.kind == KIND_EML for item in items)
+
+
+def test_member_count_is_checked_before_extraction():
+    archive = _zip([(f"{i}.eml", b"x") for i in range(5)])
+
+    with pytest.raises(BatchLimitError):
+        expand_uploads([("mail.zip", "application/zip", archive)], max_files=4)
+
+
+def test_highly_compressed_member_is_rejected():
+    archive = _zip([("bomb.eml", b"\0" * (10 * 1024 * 1024))])
+
+    with pytest.raises(BatchLimitError):
+        expand_uploads([("mail.zip", "application/zip", archive)])
+
+
+def test_total_size_is_checked_before_extraction():
+    archive = _zip([(f"{i}.eml", b"x" * 1024) for i in range(4)], compression=zipfile.ZIP_STORED)
+
+    with pytest.raises(BatchLimitError):
+        expand_uploads([("mail.zip", "application/zip", archive)], max_total_bytes=3 * 1024)
+
+
+def test_oversized_member_is_rejected():
+    archive = _zip([("a.eml", b"x" * 4096)], compression=zipfile.ZIP_STORED)
+
+    with pytest.raises(BatchLimitError):
+        expand_uploads([("mail.zip", "application/zip", archive)], max_file_bytes=1024)
@@ -0,0 +1,124 @@
+"""
+Features of the duplicate cache entries, and the FeatureStore's NumPy metadata
+scores against the pair-by-pair reference in IntelligentDuplicateDetector
+"""
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+from app.services.cache_features import EntryFeatures, FeatureStore, epoch_micros, ip_address_id
+from app.services.IntelligentDuplicateDetector import IntelligentDuplicateDetector, LRUCache, MockEmbeddingProvider
+
+
+def test_ipv4_addresses_are_stored_as_their_value():
+    assert EntryFeatures.from_entry({"ip_address": "10.0.0.1"}).ip == (10 << 24) + 1
+    assert ip_address_id("192.168.1.20") != ip_address_id("192.168.1.21")
+    # Anything else is hashed as text, so it still only matches the same text
+    assert ip_address_id("2001:db8::1") == hash("2001:db8::1")
+    assert ip_address_id("unknown") == hash("unknown")
+    assert ip_address_id("10.0.0.01") == hash("10.0.0.01")
+
+
+SENDERS = ["Jane Doe <jane@bank.com>", "ops@bank.com", "JANE@bank.com", "treasury@client.com", "", None]
+RECIPIENTS = ["ops@bank.com", "ops@bank.com, loans@bank.com", "Loans <loans@bank.com>,treasury@client.com", "", None]
+IPS = ["10.0.0.1", "10.0.0.2", "2001:db8::1", "unknown", None]
+THREADS = ["<t1@bank.com>", "<t2@bank.com>", None]
+METADATA = [
+    None,
+    {},
+    {"priority": "high", "channel": "email"},
+    {"priority": "low", "channel": "email", "desk": "loans"},
+    {"desk": "loans"},
+    # Not all strings: compared with Python's ==, so 1 == 1.0 but 1 != "1"
+    {"priority": "high", "amount": 1},
+    {"priority": "high", "amount": 1.0},
+    {"amount": "1", "tags": ["a", "b"]},
+    {1: "high", "channel": "email"},
+]
+
+
+def _entries(count, seed):
+    rng = np.random.default_rng(seed)
+    pick = lambda values: values[rng.integers(len(values))]
+    return [{
+        "id": f"entry-{i}",
+        "sender": pick(SENDERS),
+        "recipient": pick(RECIPIENTS),
+        "ip_address": pick(IPS),
+        "thread_id": pick(THREADS),
+        "additional_metadata": pick(METADATA)
+    } for i in range(count)]
+
+
+def _feature_store(entries):
+    store = FeatureStore()
+    for slot, entry in enumerate(entries):
+        store.put(slot, entry["id"], EntryFeatures.from_entry(entry))
+    return store, {entry["id"]: entry for entry in entries}
+
+
+def test_metadata_similarity_matches_scalar_reference():
+    detector = IntelligentDuplicateDetector(embedding_provider=MockEmbeddingProvider(), email_cache=LRUCache(capacity=1))
+    entries = _entries(300, seed=0)
+    store, by_key = _feature_store(entries)
+    slots = np.random.default_rng(1).permutation(len(entries))
+
+    for query in _entries(60, seed=2):
+        scores = store.metadata_similarity(EntryFeatures.from_entry(query), slots, by_key)
+        reference = [
+            detector._calculate_metadata_similarity(
+                query["sender"], query["recipient"], entries[slot]["sender"], entries[slot]["recipient"],
+                query["ip_address"], entries[slot]["ip_address"], query["thread_id"], entries[slot]["thread_id"],
+                query["additional_metadata"], entries[slot]["additional_metadata"]
+            ) for slot in slots
+        ]
+        np.testing.assert_allclose(scores, reference, rtol=0, atol=1e-12)
+
+
+def test_mixed_type_metadata_falls_back_to_python_equality():
+    features = [EntryFeatures.from_entry({"additional_metadata": meta}) for meta in METADATA[2:]]
+
+    assert [f.meta_exact for f in features] == [True, True, True, False, False, False, False]
+    store, by_key = _feature_store([{"id": "int", "additional_metadata": {"priority": "high", "amount": 1}}])
+    query = EntryFeatures.from_entry({"additional_metadata": {"priority": "high", "amount": 1.0}})
+    assert store.metadata_similarity(query, np.array([0]), by_key)[0] == pytest.approx(1.0)
+    query = EntryFeatures.from_entry({"additional_metadata": {"priority": "high", "amount": "1"}})
+    assert store.metadata_similarity(query, np.array([0]), by_key)[0] == pytest.approx(0.5)
+
+
+def test_time_differences_of_aware_and_naive_receive_times():
+    received = datetime(2026, 1, 5, 8, 30)
+    dates = [
+        "2026-01-05T09:00:00",         # naive: read as UTC
+        "2026-01-05T10:00:00+02:00",   # 08:00 UTC
+        datetime(2026, 1, 5, 6, 0, tzinfo=timezone(timedelta(hours=-3))),  # 09:00 UTC
+        "yesterday",
+        None
+    ]
+    store, _ = _feature_store([{"id": str(i), "received_date": date} for i, date in enumerate(dates)])
+    slots = np.arange(len(dates))
+
+    has_time, micros = store.time_differences(epoch_micros(received), slots)
+
+    assert has_time.tolist() == [True, True, True, False, False]
+    assert (micros[:3] // 60_000_000).tolist() == [30, 30, 30]
+    assert store.columns["received_aware"][:3].tolist() == [False, True, True]
+    assert store.columns["unparseable_date"][slots].tolist() == [False, False, False, True, False]
+    # An aware time and the same instant written naive in UTC give the same value
+    assert epoch_micros(datetime(2026, 1, 5, 10, tzinfo=timezone(timedelta(hours=2)))) == epoch_micros(datetime(2026, 1, 5, 8))
+
+
+def test_expiry_is_compared_in_naive_local_time():
+    now = datetime(2026, 1, 5, 12, 0)
+    entries = [
+        {"id": "expired", "expiry": (now - timedelta(minutes=1)).isoformat()},
+        {"id": "live", "expiry": now + timedelta(minutes=1)},
+        # An aware or invalid expiry never expires
+        {"id": "aware", "expiry": "2026-01-01T00:00:00+00:00"},
+        {"id": "invalid", "expiry": "soon"},
+        {"id": "none"}
+    ]
+    store, _ = _feature_store(entries)
+
+    assert store.expired_keys(now) == ["expired"]
@@ -0,0 +1,135 @@
+"""
+Splitting email chains into messages and removing text repeated between them,
+on synthetic chains and on the chain PDFs in code/test
+"""
+from pathlib import Path
+
+from app.services import chain_segmenter
+from app.services.chain_segmenter import segment_chain
+from app.services.email_processor import EmailProcessor
+
+SAMPLES = Path(__file__).resolve().parents[2] / "test"
+
+ORIGINAL = (
+    "Please process the repayment of USD 25,000 on loan 12345 by Friday. "
+    "The funds are available in the operating account and the value date is the 14th of March."
+)
+
+
+def _quoted(text: str) -> str:
+    return "\n".join(f"> {line}" if line else ">" for line in text.splitlines())
+
+
+def _chain_text(name: str) -> str:
+    return EmailProcessor()._extract_raw_text_from_pdf((SAMPLES / name).read_bytes())
+
+
+def test_header_blocks_start_messages():
+    text = (
+        "From: Jane Doe <jane@bank.com>\n"
+        "To: ops@bank.com,\n"
+        "  loans@bank.com\n"
+        "Date: Mon, 5 Jan 2026 09:00:00 +0000\n"
+        "Subject: Repayment\n"
+        f"\n{ORIGINAL}\n\n"
+        "-----Original Message-----\n"
+        "From: Ops <ops@bank.com>\n"
+        "Sent: Monday, January 5, 2026 8:00 AM\n"
+        "Subject: Re: Repayment\n"
+        "\nWhich account should we debit?\n"
+    )
+    messages = segment_chain(text)
+
+    assert [m.sender for m in messages] == ["Jane Doe <jane@bank.com>", "Ops <ops@bank.com>"]
+    assert messages[0].recipient == "ops@bank.com, loans@bank.com"
+    assert messages[1].date == "Monday, January 5, 2026 8:00 AM"
+    assert messages[1].subject == "Re: Repayment"
+    assert messages[0].body == ORIGINAL
+    assert messages[1].body == "Which account should we debit?"
+
+
+def test_attributions_start_messages_and_quoted_copies_are_removed():
+    text = (
+        "Done, the repayment was booked today.\n\n"
+        "On Mon, Jan 5, 2026 at 9:00 AM Jane Doe\n"
+        "<jane@bank.com> wrote:\n"
+        f"{_quoted(ORIGINAL)}\n"
+    )
+    later = text + f"\nFrom: Jane Doe <jane@bank.com>\nSubject: Repayment\n\n{ORIGINAL}\n"
+
+    messages = segment_chain(text)
+    assert len(messages) == 2
+    assert messages[0].body == "Done, the repayment was booked today."
+    assert messages[1].sender == "Jane Doe <jane@bank.com>"
+    assert messages[1].date == "Mon, Jan 5, 2026 at 9:00 AM"
+    assert messages[1].body == ORIGINAL
+
+    # When the original message is also in the chain, its quoted copy is removed in its favour
+    messages = segment_chain(later)
+    assert [m.body for m in messages] == ["Done, the repayment was booked today.", "", ORIGINAL]
+    assert messages[1].removed_paragraphs == 1
+
+
+def test_unquoted_repeats_keep_the_first_copy():
+    # Re-wrapped and in different case, but the same words
+    rewrapped = ORIGINAL.upper().replace(". ", ".\n")
+    text = (
+        f"From: Jane Doe <jane@bank.com>\nSubject: Repayment\n\n{ORIGINAL}\n\n"
+        f"From: Ops <ops@bank.com>\nSubject: Fwd: Repayment\n\nForwarding this.\n\n{rewrapped}\n"
+    )
+    messages = segment_chain(text)
+
+    assert messages[0].body == ORIGINAL
+    assert messages[1].body == "Forwarding this."
+    assert messages[1].removed_paragraphs == 1
+
+
+def test_repeat_threshold(monkeypatch):
+    words = ORIGINAL.split()
+    # A change at the end alters one shingle, a change in the middle SHINGLE_WORDS of them
+    edited_end = " ".join(words[:-1] + ["15th."])
+    edited_middle = " ".join(words[:10] + ["EUR"] + words[11:])
+
+    def second_body(edited):
+        text = f"From: A <a@bank.com>\nSubject: X\n\n{ORIGINAL}\n\nFrom: B <b@bank.com>\nSubject: Y\n\n{edited}\n"
+        return segment_chain(text)[1].body
+
+    assert second_body(edited_end) == ""
+    assert second_body(edited_middle) == edited_middle
+    monkeypatch.setattr(chain_segmenter, "REPEAT_THRESHOLD", 1.0)
+    assert second_body(edited_end) == edited_end
+
+
+def test_text_without_headers_is_one_message():
+    text = f"Hi,\n\nFrom: the desk, one more thing.\n\n{ORIGINAL}"
+    messages = segment_chain(text)
+
+    assert len(messages) == 1
+    assert messages[0].headers == {}
+    assert messages[0].body.startswith("Hi,")
+
+
+def test_closing_notice_chain():
+    messages = segment_chain(_chain_text("Closing_Notice_Email_Chain.pdf"))
+
+    # The first message has only a Subject: line, which is not a header block
+    assert len(messages) == 2
+    assert messages[0].body.startswith("Subject: Inquiry on Facility Closure Procedures\nHi Team,")
+    assert messages[1].sender == "Banking Operations Team"
+    assert messages[1].subject == "RE: Inquiry on Facility Closure Procedures"
+    assert messages[1].body.startswith("Dear [Corporate Finance Manager],")
+
+
+def test_chain_with_loan_id():
+    messages = [m for m in segment_chain(_chain_text("email_chain_with_loan_id.pdf")) if m.headers]
+
+    assert [(m.sender, m.date) for m in messages] == [
+        ("client@business.com", "Wed, 26 Mar 2025 05:30:29 +0000"),
+        ("bank@service.com", "Wed, 26 Mar 2025 05:35:29 +0000"),
+        ("client@business.com", "Wed, 26 Mar 2025 05:40:29 +0000"),
+    ]
+    assert messages[0].subject == "Request for Loan Account Closure - Loan ID: 123456789"
+    assert messages[1].body.startswith("Dear John Doe,")
+    assert "reallocation fee of $200" in messages[1].body
+    assert messages[2].body.startswith("Dear Loan Servicing Team,")
+    assert all(m.removed_paragraphs == 0 for m in messages)
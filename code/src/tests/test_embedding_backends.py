@@ -0,0 +1,52 @@
+"""
+Parity of the quantized and ONNX embedding backends with the float32 torch backend
+on the sample corpus (see benchmarks/embedding_backends.py for throughput).
+
+Skipped when sentence-transformers (or, for the ONNX backends, onnxruntime) is not
+installed or the embedding model cannot be loaded.
+"""
+import pytest
+
+from app.config import get_settings
+from benchmarks.embedding_backends import MAX_PAIRWISE_DRIFT, MIN_COSINE, _normalize, corpus_texts, parity
+from benchmarks.pipeline_benchmark import DEFAULT_CORPUS
+
+pytest.importorskip("sentence_transformers")
+
+
+def _provider(backend):
+    from app.services.IntelligentDuplicateDetector import SentenceTransformerProvider
+
+    settings = get_settings()
+    try:
+        return SentenceTransformerProvider(settings.embedding_model, backend=backend,
+                                           onnx_file=settings.embedding_onnx_file)
+    except Exception as e:
+        pytest.skip(f"Embedding model could not be loaded: {e}")
+
+
+@pytest.fixture(scope="module")
+def texts():
+    return corpus_texts(DEFAULT_CORPUS)
+
+
+@pytest.fixture(scope="module")
+def reference(texts):
+    provider = _provider("torch")
+    if provider.model is None:
+        pytest.skip("sentence-transformers is not usable")
+    return _normalize(provider.get_embeddings(texts))
+
+
+@pytest.mark.parametrize("backend", ["onnx", "onnx-int8", "torch-int8"])
+def test_backend_matches_torch(backend, texts, reference):
+    if backend.startswith("onnx"):
+        pytest.importorskip("onnxruntime")
+    provider = _provider(backend)
+    if provider.backend != backend:
+        pytest.skip(f"The {backend} backend could not be loaded")
+
+    result = parity(reference, _normalize(provider.get_embeddings(texts)))
+
+    assert result["cosine_min"] >= MIN_COSINE
+    assert result["pairwise_drift"] <= MAX_PAIRWISE_DRIFT
@@ -0,0 +1,112 @@
+"""
+Block similarity kernel of the duplicate cache's EmbeddingStore against the
+pair-by-pair cosine of IntelligentDuplicateDetector, at every storage precision
+"""
+import numpy as np
+import pytest
+
+from app.services.embedding_store import BLOCK_ROWS, EmbeddingStore
+from app.services.IntelligentDuplicateDetector import IntelligentDuplicateDetector, LRUCache, MockEmbeddingProvider
+
+DIM = 64
+# float16 keeps 11 significant bits, so each stored component is within 2**-11 of its value
+FLOAT16_ERROR = 2.0 ** -11
+FLOAT32_ERROR = 1e-5
+
+
+@pytest.fixture(scope="module")
+def detector():
+    return IntelligentDuplicateDetector(embedding_provider=MockEmbeddingProvider(), email_cache=LRUCache(capacity=1))
+
+
+def _vectors(rows, seed=0):
+    # Unnormalized, with a few large components like real embeddings
+    rng = np.random.default_rng(seed)
+    vectors = rng.normal(size=(rows, DIM))
+    vectors[:, :3] *= 4
+    return vectors
+
+
+def _store(precision, vectors, capacity=None):
+    store = EmbeddingStore(precision=precision, capacity=capacity, fields=("content_embedding",))
+    for slot, vector in enumerate(vectors):
+        store.put(slot, "content_embedding", vector)
+    return store
+
+
+def _int8_bound(store, slots):
+    # Each component is rounded to within half the row's scale; with a unit query
+    # the dot product moves by at most that times the query's L1 norm (<= sqrt(DIM))
+    return np.sqrt(DIM) * store._scales["content_embedding"][slots] / 2 + FLOAT32_ERROR
+
+
+@pytest.mark.parametrize("precision", ["float32", "float16", "int8"])
+def test_block_similarities_match_scalar_cosine(precision, detector):
+    # More rows than one block, scored in a shuffled order
+    vectors = _vectors(BLOCK_ROWS + 300)
+    store = _store(precision, vectors)
+    query = _vectors(1, seed=1)[0]
+    slots = np.random.default_rng(2).permutation(len(vectors))
+
+    scores = store.similarities("content_embedding", query, slots)
+    reference = np.array([detector._calculate_embedding_similarity(query, vectors[slot]) for slot in slots])
+
+    assert scores.dtype == np.float32 and scores.shape == (len(slots),)
+    error = np.abs(scores - reference)
+    if precision == "int8":
+        assert np.all(error <= _int8_bound(store, slots))
+    else:
+        assert error.max() <= (FLOAT16_ERROR if precision == "float16" else 0) + FLOAT32_ERROR
+
+
+@pytest.mark.parametrize("precision", ["float32", "float16", "int8"])
+def test_stored_vectors_round_trip(precision):
+    vectors = _vectors(50)
+    store = _store(precision, vectors)
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    for slot, expected in enumerate(normalized):
+        error = np.abs(store.get(slot, "content_embedding") - expected).max()
+        if precision == "int8":
+            assert error <= store._scales["content_embedding"][slot] / 2 + 1e-7
+        elif precision == "float16":
+            assert error <= FLOAT16_ERROR * np.abs(expected).max()
+        else:
+            assert error <= 1e-7
+
+
+@pytest.mark.parametrize("precision", ["float32", "float16", "int8"])
+def test_zero_and_missing_rows_are_similar_to_nothing(precision, detector):
+    vectors = _vectors(4)
+    store = _store(precision, vectors)
+    store.put(1, "content_embedding", None)
+    store.put(2, "content_embedding", np.zeros(DIM))
+    store.clear(3)
+    # A vector of the wrong dimension is not stored
+    store.put(5, "content_embedding", np.ones(DIM + 1))
+    slots = np.arange(6)
+
+    scores = store.similarities("content_embedding", vectors[0], slots)
+
+    assert scores[0] == pytest.approx(1.0, abs=0.01)
+    assert np.all(scores[1:] == 0)
+    # The scalar cosine also gives 0 for a zero vector
+    assert detector._calculate_embedding_similarity(vectors[0], np.zeros(DIM)) == 0.0
+    assert np.all(store.get(store.rows + 10, "content_embedding") == 0)
+    # A missing or zero query is similar to nothing either
+    assert np.all(store.similarities("content_embedding", None, slots) == 0)
+    assert np.all(store.similarities("content_embedding", np.zeros(DIM), slots) == 0)
+
+
+def test_empty_store():
+    store = EmbeddingStore(precision="int8", fields=("content_embedding",))
+    store.put(0, "content_embedding", None)
+
+    assert store.dim is None
+    assert store.get(0, "content_embedding") is None
+    assert len(store.similarities("content_embedding", np.ones(DIM), np.arange(0))) == 0
+
+
+def test_unknown_precision_is_rejected():
+    with pytest.raises(ValueError):
+        EmbeddingStore(precision="int4")
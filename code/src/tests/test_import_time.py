@@ -0,0 +1,25 @@
+"""
+Importing the API must not load the ML and LLM provider packages, which are
+loaded on first use (see benchmarks/import_time.py for the timing report)
+"""
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+from benchmarks.import_time import HEAVY_MODULES
+
+SRC = Path(__file__).resolve().parents[1]
+
+
+def test_app_import_does_not_load_heavy_packages():
+    # A fresh interpreter, so modules imported by other tests do not count
+    script = (
+        "import json, sys\n"
+        "import app.main\n"
+        f"print(json.dumps(sorted(m for m in {HEAVY_MODULES!r} if m in sys.modules)))\n"
+    )
+    result = subprocess.run([sys.executable, "-c", script], cwd=SRC, capture_output=True, text=True, timeout=120)
+
+    assert result.returncode == 0, result.stderr
+    assert json.loads(result.stdout.strip().splitlines()[-1]) == []
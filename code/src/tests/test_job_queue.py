@@ -0,0 +1,96 @@
+"""
+Worker resilience of the persistent job queue against an in-memory collection
+"""
+import asyncio
+from datetime import datetime, timedelta
+
+from app.services import job_queue as job_queue_module
+from app.services.job_queue import KIND_EML, STATUS_COMPLETED, STATUS_QUEUED, JobQueue
+from benchmarks.stubs import InMemoryCollection
+
+
+class _Response:
+    error = None
+
+    def model_dump(self):
+        return {"ok": True}
+
+
+class _Service:
+    async def process_eml(self, eml_content, thread_id=None):
+        return _Response()
+
+
+class _Queue(JobQueue):
+    """Job queue without GridFS whose first `finish_failures` _finish calls raise"""
+
+    def __init__(self, finish_failures=0, **kwargs):
+        super().__init__(**kwargs)
+        self.finish_failures = finish_failures
+
+    async def _read_payload(self, payload_id):
+        return b""
+
+    async def _delete_payloads(self, job):
+        pass
+
+    async def _finish(self, job, status, result=None, error=None):
+        if self.finish_failures:
+            self.finish_failures -= 1
+            raise RuntimeError("MongoDB unavailable")
+        await super()._finish(job, status, result, error)
+
+
+def _queued_job(job_id, created_at):
+    return {"_id": job_id, "kind": KIND_EML, "status": STATUS_QUEUED, "payload_id": job_id, "attachments": [],
+            "attempts": 0, "created_at": created_at, "lease_expires_at": None}
+
+
+def test_worker_keeps_claiming_after_finish_fails(monkeypatch):
+    collection = InMemoryCollection("classification_jobs")
+    monkeypatch.setattr(job_queue_module, "classification_jobs_collection", collection)
+    now = datetime.now()
+    for i, job_id in enumerate(["first", "second"]):
+        collection.docs[job_id] = _queued_job(job_id, now + timedelta(seconds=i))
+
+    async def run():
+        queue = _Queue(finish_failures=1, workers=1, poll_seconds=0.05)
+        await queue.start(_Service)
+        await asyncio.sleep(0.3)
+        alive = all(not task.done() for task in queue._worker_tasks)
+        await queue.stop()
+        return alive
+
+    assert asyncio.run(run())
+    # The first job's outcome was lost, but the worker went on to the second
+    assert collection.docs["second"]["status"] == STATUS_COMPLETED
+    assert collection.docs["first"]["attempts"] == 1
+
+
+def test_lease_renewal_survives_failed_updates(monkeypatch):
+    collection = InMemoryCollection("classification_jobs")
+    monkeypatch.setattr(job_queue_module, "classification_jobs_collection", collection)
+    collection.docs["job"] = {"_id": "job", "lease_expires_at": None}
+    update_one = collection.update_one
+    calls = []
+
+    async def flaky_update_one(query, update, upsert=False):
+        calls.append(query)
+        if len(calls) == 1:
+            raise RuntimeError("MongoDB unavailable")
+        return await update_one(query, update, upsert)
+
+    monkeypatch.setattr(collection, "update_one", flaky_update_one)
+
+    async def run():
+        queue = JobQueue(lease_seconds=0.06)
+        collection.docs["job"]["worker_id"] = queue.worker_id
+        task = asyncio.create_task(queue._renew_lease("job"))
+        await asyncio.sleep(0.15)
+        alive = not task.done()
+        task.cancel()
+        return alive
+
+    assert asyncio.run(run())
+    assert len(calls) >= 2
+    assert collection.docs["job"]["lease_expires_at"] is not None
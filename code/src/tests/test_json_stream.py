@@ -0,0 +1,132 @@
+"""
+Incremental parsing of streamed JSON arrays, local repair of LLM JSON, and the
+fallbacks of stream_json_array when the streamed array is not clean
+"""
+import asyncio
+import json
+
+import pytest
+from langchain_core.language_models import FakeListChatModel
+
+from app.core.json_stream import IncrementalJsonArrayParser, ParseMetrics, repair_json, stream_json_array
+
+
+class _Stream:
+    """Stands in for LLMStream: yields fixed chunks and reports a model"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.model = "stub-model"
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+class _Handler:
+    """Minimal LLMHandler: streams fixed chunks, and answers corrective calls with `fixes`"""
+
+    def __init__(self, chunks, fixes=()):
+        self.chunks = chunks
+        self.llm = FakeListChatModel(responses=list(fixes) or ["[]"])
+
+    def astream(self, task_type, messages):
+        return _Stream(self.chunks)
+
+    def get_llm(self, task_type):
+        return self.llm
+
+
+def _feed_in_chunks(parser, text, size=3):
+    items = []
+    for i in range(0, len(text), size):
+        items.extend(parser.feed(text[i:i + size]))
+    return items
+
+
+def _collect(handler):
+    async def run():
+        return [item async for item in stream_json_array(handler, "task", [])]
+    return asyncio.run(run())
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    metrics = ParseMetrics()
+    monkeypatch.setattr("app.core.json_stream.parse_metrics", metrics)
+    return metrics
+
+
+def test_parser_returns_elements_as_they_complete():
+    parser = IncrementalJsonArrayParser()
+    assert parser.feed('Here you go:\n```json\n[{"a": 1}, {"b": "x]') == [{"a": 1}]
+    assert parser.feed('"}, {"c": [1, 2]}]\n```') == [{"b": "x]"}, {"c": [1, 2]}]
+    assert parser.finished
+    assert parser.parsed_indices == [0, 1, 2]
+    assert parser.items_skipped == 0
+
+
+def test_parser_repairs_and_skips_elements_on_their_own():
+    parser = IncrementalJsonArrayParser()
+    items = _feed_in_chunks(parser, '[{"a": True,}, {"b": 1 2}, {"c": null}]')
+    assert items == [{"a": True}, {"c": None}]
+    assert parser.items_repaired == 1
+    assert parser.items_skipped == 1
+    # The skipped element keeps its position, so the third element is still index 2
+    assert parser.parsed_indices == [0, 2]
+
+
+def test_parser_keeps_elements_before_truncation():
+    parser = IncrementalJsonArrayParser()
+    assert _feed_in_chunks(parser, '[{"a": 1}, {"b": 2}, {"c": ') == [{"a": 1}, {"b": 2}]
+    assert not parser.finished
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"a": 1}', {"a": 1}),
+    ('Sure! ```json\n[{"a": 1}]\n``` Hope that helps', [{"a": 1}]),
+    ('The answer is {"a": [1, 2,],} as requested', {"a": [1, 2]}),
+    ('{"ok": True, "none": None, "text": "True or None"}', {"ok": True, "none": None, "text": "True or None"}),
+    # A truncated element after the last complete one is dropped
+    ('[{"a": 1}, {"b": "trunc', [{"a": 1}]),
+    ('[{"a": {"b": [1, 2', [{"a": {"b": [1, 2]}}]),
+])
+def test_repair_json(text, expected):
+    assert repair_json(text) == expected
+
+
+@pytest.mark.parametrize("text", ["", "   ", "no json here", '{"a": 1 2}'])
+def test_repair_json_rejects_unrepairable_text(text):
+    with pytest.raises(ValueError):
+        repair_json(text)
+
+
+def test_clean_stream_is_recorded_clean(metrics):
+    items = _collect(_Handler(['[{"a": 1},', ' {"b": 2}]']))
+    assert items == [{"a": 1}, {"b": 2}]
+    assert metrics.counts["stub-model"]["clean"] == 1
+
+
+def test_truncated_stream_is_repaired_locally_without_duplicates(metrics):
+    items = _collect(_Handler(['[{"a": 1}, {"b": 2}, {"c": {"d": 3}}, {"e": "tr']))
+    assert items == [{"a": 1}, {"b": 2}, {"c": {"d": 3}}]
+    assert metrics.counts["stub-model"]["local_repair"] == 1
+
+
+def test_skipped_element_falls_back_to_the_fixing_parser(metrics):
+    fixed = json.dumps([{"a": 1}, {"b": 2}, {"c": 3}])
+    items = _collect(_Handler(['[{"a": 1}, {"b": 1 2}, {"c": 3}]'], fixes=[fixed]))
+    # Elements already yielded while streaming are not yielded again
+    assert items == [{"a": 1}, {"c": 3}, {"b": 2}]
+    counts = metrics.counts["stub-model"]
+    assert counts["clean"] == 0
+    assert counts["llm_repair"] == 1
+
+
+def test_failed_fix_is_recorded_failed(metrics):
+    items = _collect(_Handler(['[{"a": 1}, {"b": 1 2}]'], fixes=["still not json"]))
+    assert items == [{"a": 1}]
+    assert metrics.counts["stub-model"]["failed"] == 1
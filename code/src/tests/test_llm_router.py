@@ -0,0 +1,149 @@
+"""
+Circuit breaker transitions and hedge timing of LLMRouter against local stub LLM servers
+(benchmarks/stub_llm_server.py)
+"""
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+import uvicorn
+from langchain_core.messages import HumanMessage
+
+from app.core.llm_router import CircuitBreaker, CircuitOpenError, LLMRouter
+from benchmarks.stub_llm_server import create_app
+
+MESSAGES = [HumanMessage(content="classify")]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope="module")
+def stubs():
+    """Stub servers by name: fast, slow (400 ms) and failing"""
+    servers = {}
+    urls = {}
+    for name, options in {
+        "fast": {"latency_ms": 20},
+        "slow": {"latency_ms": 400},
+        "failing": {"failure_rate": 1.0}
+    }.items():
+        port = _free_port()
+        server = uvicorn.Server(uvicorn.Config(create_app(**options), host="127.0.0.1", port=port, log_level="error"))
+        threading.Thread(target=server.run, daemon=True).start()
+        servers[name] = server
+        urls[name] = f"http://127.0.0.1:{port}/v1"
+    deadline = time.monotonic() + 10
+    while not all(server.started for server in servers.values()):
+        assert time.monotonic() < deadline, "stub servers did not start"
+        time.sleep(0.05)
+    yield urls
+    for server in servers.values():
+        server.should_exit = True
+
+
+class StubHandler:
+    """The part of LLMHandler the router uses, building ChatOpenAI clients for the stubs"""
+
+    def __init__(self, llm_config):
+        self.llm_config = llm_config
+
+    def get_llm_for_config(self, config_name, schema=None):
+        from langchain_openai import ChatOpenAI
+
+        config = self.llm_config[config_name]
+        return ChatOpenAI(model=config["model"], base_url=config["base_url"], api_key="stub", max_retries=0)
+
+
+def _router(entries, routing):
+    return LLMRouter(StubHandler(entries), routing)
+
+
+def test_breaker_opens_probes_once_and_closes(stubs):
+    # Two entries of one provider, so the breaker can be opened by one and probed by the other
+    entries = {
+        "bad": {"model": "bad", "base_url": stubs["failing"], "provider": "stub"},
+        "good": {"model": "good", "base_url": stubs["slow"], "provider": "stub"}
+    }
+    router = _router(entries, {"circuit_breaker": {"failure_threshold": 2, "reset_timeout_s": 0.3}})
+
+    async def scenario():
+        for _ in range(2):
+            with pytest.raises(Exception):
+                await router.ainvoke("t", MESSAGES, candidates=["bad"])
+        breaker = router.breakers["stub"]
+        assert breaker.state == CircuitBreaker.OPEN
+        assert router.get_candidates("good") == ["good"]  # every circuit open: last resort
+        assert not breaker.allow()
+
+        await asyncio.sleep(0.35)
+        assert breaker.allow()
+        # Half-open: only one of two concurrent callers is let through
+        results = await asyncio.gather(
+            router.ainvoke("t", MESSAGES, candidates=["good"]),
+            router.ainvoke("t", MESSAGES, candidates=["good"]),
+            return_exceptions=True
+        )
+        assert sum(isinstance(result, CircuitOpenError) for result in results) == 1
+        assert breaker.state == CircuitBreaker.CLOSED
+        assert not breaker.probing
+
+    asyncio.run(scenario())
+
+
+def test_failed_probe_reopens(stubs):
+    entries = {"bad": {"model": "bad", "base_url": stubs["failing"]}}
+    router = _router(entries, {"circuit_breaker": {"failure_threshold": 1, "reset_timeout_s": 0.1}})
+
+    async def scenario():
+        with pytest.raises(Exception):
+            await router.ainvoke("t", MESSAGES, candidates=["bad"])
+        breaker = router._breaker("bad")
+        opened_at = breaker.opened_at
+        await asyncio.sleep(0.15)
+        with pytest.raises(Exception):
+            await router.ainvoke("t", MESSAGES, candidates=["bad"])
+        assert breaker.state == CircuitBreaker.OPEN
+        assert breaker.opened_at > opened_at
+        assert not breaker.probing
+
+    asyncio.run(scenario())
+
+
+def test_hedges_after_delay_and_records_loser_latency(stubs):
+    entries = {
+        "primary": {"model": "primary", "base_url": stubs["slow"]},
+        "secondary": {"model": "secondary", "base_url": stubs["fast"]}
+    }
+    router = _router(entries, {
+        "tasks": {"t": ["primary", "secondary"]},
+        "hedging": {"default_delay_ms": 100}
+    })
+
+    async def scenario():
+        start = time.perf_counter()
+        await router.ainvoke("t", MESSAGES)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        # Hedged at 100 ms, answered by the fast stub well before the slow one's 400 ms
+        assert 100 <= elapsed_ms < 350
+        assert len(router._tracker("secondary")) == 1
+        await asyncio.sleep(0.05)
+        # The cancelled primary is recorded with at least the time it ran
+        primary = router._tracker("primary")
+        assert len(primary) == 1 and primary.samples[0] >= 100
+
+    asyncio.run(scenario())
+
+
+def test_candidates_repeating_a_provider_and_model_are_dropped(stubs):
+    entries = {
+        "email_classification": {"model": "same", "base_url": stubs["fast"]},
+        "fallback": {"model": "same", "base_url": stubs["fast"]}
+    }
+    router = _router(entries, {"tasks": {"t": ["email_classification", "fallback"]}})
+    assert router.get_candidates("t") == ["email_classification"]
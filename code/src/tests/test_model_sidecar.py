@@ -0,0 +1,13 @@
+"""
+Failure handling of the model sidecar's embedding client
+"""
+import pytest
+
+from app.services.model_sidecar import SidecarEmbeddingProvider
+
+
+def test_unreachable_sidecar_raises_instead_of_returning_placeholders(tmp_path):
+    provider = SidecarEmbeddingProvider(str(tmp_path / "missing.sock"))
+
+    with pytest.raises(OSError):
+        provider.get_embeddings(["Please process the repayment", "Repayment"])
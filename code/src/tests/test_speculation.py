@@ -0,0 +1,76 @@
+"""
+Settling of the speculative classification stage of ClassificationService
+"""
+import asyncio
+
+from app.core.task_graph import TaskGraph
+from app.core.tracing import count, start_trace
+from app.services.classification_service import ClassificationService
+from app.services.email_processor import EmailProcessor
+
+
+def _service(classify) -> ClassificationService:
+    # Speculation and settling only need `_classify`, not the service's dependencies
+    service = ClassificationService.__new__(ClassificationService)
+    service._classify = lambda email_info, attachments, catalog: classify()
+    return service
+
+
+def test_failed_speculation_falls_back_to_classification():
+    async def run():
+        trace = start_trace()
+
+        async def failing():
+            count("email_pipeline_llm_tokens_total", 120, task="classification", model="m", direction="input")
+            raise ValueError("unparseable classification")
+
+        service = _service(failing)
+
+        async with TaskGraph() as graph:
+            graph.add("classify", lambda: service._classify_speculatively({}, [], None))
+            assert await service._settle_speculation(graph, is_duplicate=False) is None
+        return trace.counters
+
+    counters = asyncio.run(run())
+    assert counters["speculative_classifications.failed"] == 1
+    assert counters["speculative_wasted_tokens"] == 120
+    assert "speculative_classifications.used" not in counters
+
+
+def test_cancelled_speculation_records_its_tokens():
+    async def run():
+        trace = start_trace()
+        started = asyncio.Event()
+
+        async def slow():
+            count("email_pipeline_llm_cancelled_tokens_total", 80, task="classification", model="m")
+            started.set()
+            await asyncio.sleep(10)
+
+        service = _service(slow)
+
+        async with TaskGraph() as graph:
+            graph.add("classify", lambda: service._classify_speculatively({}, [], None))
+            await started.wait()
+            assert await service._settle_speculation(graph, is_duplicate=True) is None
+        return trace.counters
+
+    counters = asyncio.run(run())
+    assert counters["speculative_classifications.cancelled"] == 1
+    assert counters["speculative_wasted_tokens"] == 80
+
+
+def test_emails_needing_ocr_are_not_speculated_on():
+    async def run():
+        trace = start_trace()
+        service = ClassificationService.__new__(ClassificationService)
+        service.speculative_classification = True
+        service.email_processor = EmailProcessor()
+        with_text = {"filename": "notes.txt", "text": "Loan amount 1,000"}
+        scan = {"filename": "scan.PNG", "content": b""}
+        decisions = (service._should_speculate([with_text]), service._should_speculate([with_text, scan]))
+        return decisions, trace.counters
+
+    (plain, ocr), counters = asyncio.run(run())
+    assert plain and not ocr
+    assert counters["speculative_classifications.skipped_ocr"] == 1
@@ -0,0 +1,65 @@
+"""
+Schema validation failures of structured output against a local stub LLM server
+(benchmarks/stub_llm_server.py) that answers with JSON not matching the schema
+"""
+import asyncio
+import json
+import threading
+import time
+
+import httpx
+import pytest
+import uvicorn
+from langchain_core.messages import HumanMessage
+
+from app.core.api_manager import ApiManager
+from app.core.llm_handler import LLMHandler
+from app.core.llm_router import CircuitBreaker, StructuredOutputError
+from app.models.response_models import RequestTypeClassification
+from benchmarks.stub_llm_server import create_app
+from tests.test_llm_router import _free_port
+
+
+@pytest.fixture(scope="module")
+def invalid_stub():
+    port = _free_port()
+    app = create_app(response_text=json.dumps({"unexpected": "shape"}))
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="error"))
+    threading.Thread(target=server.run, daemon=True).start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        assert time.monotonic() < deadline, "stub server did not start"
+        time.sleep(0.05)
+    yield f"http://127.0.0.1:{port}"
+    server.should_exit = True
+
+
+@pytest.fixture
+def handler(invalid_stub, tmp_path, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY_1000_60_0", "stub")
+    config = {
+        "email_classification": {
+            "llm": "ChatOpenAI", "model": "stub-model", "temperature": 0, "api_key_name": "OPENAI_API_KEY",
+            "base_url": f"{invalid_stub}/v1", "max_retries": 0, "structured_output": "json_mode"
+        },
+        "routing": {"circuit_breaker": {"failure_threshold": 2, "reset_timeout_s": 30}}
+    }
+    path = tmp_path / "llm-config.json"
+    path.write_text(json.dumps(config))
+    return LLMHandler(ApiManager(), config_filename=str(path))
+
+
+def test_invalid_output_is_repaired_once_and_does_not_open_the_breaker(handler, invalid_stub):
+    async def scenario():
+        for _ in range(3):
+            with pytest.raises(StructuredOutputError):
+                await handler.ainvoke_structured(
+                    "email_classification", [HumanMessage(content="classify")], RequestTypeClassification
+                )
+
+    asyncio.run(scenario())
+    breaker = handler.router._breaker("email_classification")
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.consecutive_failures == 0
+    # Each call was retried once with a repair prompt
+    assert httpx.get(f"{invalid_stub}/stats").json()["requests"] == 6
@@ -0,0 +1,131 @@
+"""
+Dependency ordering, cancellation and error propagation of the per-request TaskGraph
+"""
+import asyncio
+
+import pytest
+
+from app.core.task_graph import TaskGraph
+
+
+async def _value(value, delay=0.0):
+    await asyncio.sleep(delay)
+    return value
+
+
+def test_stages_receive_dependency_results_and_overlap():
+    async def run():
+        started = []
+
+        async def stage(name, *inputs):
+            started.append(name)
+            await asyncio.sleep(0.05)
+            return f"{name}({','.join(inputs)})"
+
+        async with TaskGraph() as graph:
+            graph.add("a", lambda: stage("a"))
+            graph.add("b", lambda: stage("b"))
+            graph.add("c", lambda a, b: stage("c", a, b), "a", "b")
+            result = await graph.result("c")
+        return started, result
+
+    started, result = asyncio.run(run())
+    assert result == "c(a(),b())"
+    # a and b ran concurrently, c only once both were done
+    assert started[:2] == ["a", "b"] and started[2] == "c"
+
+
+def test_leaving_the_block_cancels_unfinished_stages():
+    async def run():
+        cancelled = asyncio.Event()
+
+        async def slow():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        async with TaskGraph() as graph:
+            fast = graph.add("fast", lambda: _value(1))
+            pending = graph.add("slow", slow)
+            assert await fast == 1
+        return cancelled.is_set(), pending
+
+    cancelled, pending = asyncio.run(run())
+    assert cancelled
+    assert pending.cancelled()
+
+
+def test_exception_in_the_block_cancels_stages_and_propagates():
+    async def run():
+        graph = TaskGraph()
+        with pytest.raises(RuntimeError, match="duplicate"):
+            async with graph:
+                task = graph.add("slow", lambda: _value(1, delay=10))
+                raise RuntimeError("duplicate")
+        return task
+
+    assert asyncio.run(run()).cancelled()
+
+
+def test_stages_added_while_the_graph_runs():
+    async def run():
+        async with TaskGraph() as graph:
+            async def parse():
+                await asyncio.sleep(0.01)
+                # Add one stage per attachment found, each depending on the header stage
+                for i in range(3):
+                    graph.add(f"attachment_{i}", lambda header, i=i: _value(f"{header}:{i}"), "header")
+                return 3
+
+            graph.add("header", lambda: _value("h", delay=0.02))
+            count = await graph.add("parse", parse)
+            return await graph.results(*(f"attachment_{i}" for i in range(count)))
+
+    assert asyncio.run(run()) == ["h:0", "h:1", "h:2"]
+
+
+def test_stage_exception_propagates_to_dependents():
+    async def run():
+        async def fail():
+            raise ValueError("bad attachment")
+
+        async with TaskGraph() as graph:
+            graph.add("extract", fail)
+            graph.add("classify", lambda text: _value(text), "extract")
+            graph.add("other", lambda: _value("ok"))
+            with pytest.raises(ValueError, match="bad attachment"):
+                await graph.result("classify")
+            with pytest.raises(ValueError, match="bad attachment"):
+                await graph.results("other", "extract")
+            return await graph.result("other")
+
+    assert asyncio.run(run()) == "ok"
+
+
+def test_unawaited_stage_exception_does_not_escape_exit():
+    async def run():
+        async def fail():
+            raise ValueError("ignored")
+
+        async with TaskGraph() as graph:
+            task = graph.add("fail", fail)
+            await asyncio.sleep(0.01)
+        return task
+
+    task = asyncio.run(run())
+    assert isinstance(task.exception(), ValueError)
+
+
+def test_duplicate_and_unknown_stages_are_rejected():
+    async def run():
+        async with TaskGraph() as graph:
+            graph.add("a", lambda: _value(1))
+            with pytest.raises(ValueError):
+                graph.add("a", lambda: _value(2))
+            with pytest.raises(KeyError):
+                graph.add("b", lambda x: _value(x), "missing")
+            assert graph.get("b") is None
+
+    asyncio.run(run())
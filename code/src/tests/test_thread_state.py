@@ -0,0 +1,91 @@
+"""
+Reply splitting and paragraph hashing for incremental thread classification, and
+the background save of thread state
+"""
+import asyncio
+
+from app.services.classification_service import ClassificationService
+from app.services.email_processor import EmailProcessor
+from app.services.thread_state import ThreadStateStore
+from benchmarks.stubs import InMemoryCollection
+
+ORIGINAL = (
+    "Please process the repayment of USD 25,000 on loan 12345 by Friday.\n"
+    "\n"
+    "The funds are available in the operating account."
+)
+
+
+def _quoted(text: str) -> str:
+    return "\n".join(f"> {line}" if line else ">" for line in text.splitlines())
+
+
+def test_split_reply_on_quote_markers():
+    processor = EmailProcessor()
+    reply = f"Any update on this?\n\nThanks\n\nOn Mon, Jan 5, 2026 at 9:00 AM Jane Doe <jane@bank.com> wrote:\n{_quoted(ORIGINAL)}"
+
+    new_text, quoted_text = processor.split_reply(reply)
+
+    assert new_text.strip() == "Any update on this?\n\nThanks"
+    assert quoted_text.startswith("On Mon, Jan 5, 2026")
+
+
+def test_split_reply_on_wrapped_attribution_and_outlook_headers():
+    processor = EmailProcessor()
+    wrapped = f"Done.\nOn Mon, Jan 5, 2026 at 9:00 AM Jane Doe\n<jane@bank.com> wrote:\n{_quoted(ORIGINAL)}"
+    outlook = f"Done.\n\nFrom: Jane Doe\nSent: Monday, January 5, 2026 9:00 AM\nSubject: Repayment\n\n{ORIGINAL}"
+
+    assert processor.split_reply(wrapped)[0] == "Done."
+    assert processor.split_reply(outlook)[0].strip() == "Done."
+
+
+def test_split_reply_without_history():
+    processor = EmailProcessor()
+
+    assert processor.split_reply(ORIGINAL) == (ORIGINAL, "")
+
+
+def test_paragraph_hashes_survive_quoting_and_rewrapping():
+    processor = EmailProcessor()
+    rewrapped = ORIGINAL.replace("USD 25,000 on loan", "USD 25,000\non LOAN")
+
+    hashes = processor.paragraph_hashes(ORIGINAL)
+
+    assert len(hashes) == 2
+    assert processor.paragraph_hashes(_quoted(ORIGINAL)) == hashes
+    assert processor.paragraph_hashes(rewrapped) == hashes
+
+
+def test_paragraph_hashes_skip_short_paragraphs_and_headers():
+    processor = EmailProcessor()
+    text = f"Hi,\n\nFrom: Jane Doe\nSubject: Repayment\n\n{ORIGINAL}\n\nThanks"
+
+    assert processor.paragraph_hashes(text) == processor.paragraph_hashes(ORIGINAL)
+
+
+def test_background_save_is_written_by_stop():
+    async def run():
+        collection = InMemoryCollection("thread_states")
+        store = ThreadStateStore(collection)
+        store.save_in_background("<thread@bank.com>", [], "Loans", [], ["abc"])
+        await store.stop()
+        return collection.docs
+
+    docs = asyncio.run(run())
+    assert docs["<thread@bank.com>"]["message_hashes"] == ["abc"]
+
+
+def test_first_message_is_found_by_its_reply():
+    async def run():
+        collection = InMemoryCollection("thread_states")
+        service = ClassificationService.__new__(ClassificationService)
+        service.thread_state_store = ThreadStateStore(collection)
+        # A thread's first message has no References/In-Reply-To, only its own Message-ID
+        first = {"message_id": "<first@bank.com>", "message_hashes": ["abc"]}
+        service._save_thread(first, None, [], [], "Loans")
+        await service.thread_state_store.stop()
+        return await service.thread_state_store.get([None, None, "<first@bank.com>"])
+
+    state = asyncio.run(run())
+    assert state.thread_id == "<first@bank.com>"
+    assert state.support_group == "Loans"